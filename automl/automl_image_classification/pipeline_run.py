@@ -1,9 +1,7 @@
 import logging
 
-from kfp.v2 import compiler
-from google.cloud import aiplatform
 
-from pipeline import pipeline
+from compile_cache import compile_if_changed
 from config.project_config import (
     PROJECT,
     REGION,
@@ -23,6 +21,9 @@ def compile_pipeline():
     None.
 
     """
+    from kfp.v2 import compiler
+    from pipeline import pipeline
+
     try:
         
         logging.info(f"Compiling training pipeline and saving file to {TEMPLATE_PATH}")
@@ -46,6 +47,8 @@ def execute_pipeline():
     None.
 
     """
+    from google.cloud import aiplatform
+
     logging.info("Creating Pipeline execution job")
     job = aiplatform.PipelineJob(
         project=PROJECT,
@@ -68,5 +71,6 @@ def execute_pipeline():
 
         
 if __name__ == "__main__":
-    compile_pipeline()
+    if not compile_if_changed(compile_pipeline, TEMPLATE_PATH):
+        logging.info(f"Pipeline sources unchanged, reusing {TEMPLATE_PATH}")
     execute_pipeline()
\ No newline at end of file
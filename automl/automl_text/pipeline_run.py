@@ -1,9 +1,7 @@
 import logging
-from google.cloud import aiplatform
-from kfp.v2 import compiler
-from pipeline import pipeline
 import os
 
+from compile_cache import compile_if_changed
 from config.project_config import (
     PROJECT,
     REGION,
@@ -19,6 +17,9 @@ def compile_pipeline():
     """
     to compile pipeline path
     """
+    from kfp.v2 import compiler
+    from pipeline import pipeline
+
     try:
         logging.info(f"Compiling training pipeline and saving file to {TEMPLATE_PATH}")
         compiler.Compiler().compile(
@@ -35,6 +36,8 @@ def execute_pipeline():
     """
     to execute pipeline on vertex pipelines
     """
+    from google.cloud import aiplatform
+
     logging.info("Creating Pipeline execution job")
     job = aiplatform.PipelineJob(
         project=PROJECT,
@@ -59,5 +62,6 @@ def execute_pipeline():
 
 
 if __name__ == "__main__":
-    compile_pipeline()
+    if not compile_if_changed(compile_pipeline, TEMPLATE_PATH):
+        logging.info(f"Pipeline sources unchanged, reusing {TEMPLATE_PATH}")
     execute_pipeline()
@@ -1,10 +1,6 @@
 import os
 
-from kfp.v2 import compiler
-from google.cloud import bigquery
-import google.cloud.aiplatform as aip
-
-from pipeline import pipeline
+from compile_cache import compile_if_changed
 from config import (
     PROJECT_ID,
     REGION,
@@ -23,6 +19,9 @@ from config import (
 def compile_pipeline():
     """Compiles the KF Pipeline and store the JSON to path
     """    
+    from kfp.v2 import compiler
+    from pipeline import pipeline
+
     try:
         compiler.Compiler().compile(pipeline_func=pipeline, package_path=TEMPLATE_PATH)
     except Exception as e:
@@ -32,6 +31,8 @@ def compile_pipeline():
 def execute_pipeline():
     """Executes the KF Pipeline on Vertex AI 
     """    
+    import google.cloud.aiplatform as aip
+
     job = aip.PipelineJob(
         display_name="bqmlautoml",
         template_path=TEMPLATE_PATH,
@@ -52,8 +53,12 @@ def execute_pipeline():
 
 
 if __name__ == "__main__":
+    import google.cloud.aiplatform as aip
+    from google.cloud import bigquery
+
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = AUTH_KEY
     aip.init(project=PROJECT_ID, location=REGION, staging_bucket=BUCKET_URI)
     bqclient = bigquery.Client()
-    compile_pipeline()
+    # reuses TEMPLATE_PATH when the pipeline sources, config and kfp versions are unchanged
+    compile_if_changed(compile_pipeline, TEMPLATE_PATH)
     execute_pipeline()
@@ -1,10 +1,6 @@
 import os
 
-from kfp.v2 import compiler
-from google.cloud import bigquery
-import google.cloud.aiplatform as aip
-
-from pipeline import pipeline
+from compile_cache import compile_if_changed
 from config import (
     PROJECT_ID,
     REGION,
@@ -26,6 +22,9 @@ from config import (
 def compile_pipeline():
     """ compile KF pipeline and store the json to file
     """
+    from kfp.v2 import compiler
+    from pipeline import pipeline
+
     try:
         compiler.Compiler().compile(pipeline_func=pipeline, package_path=TEMPLATE_PATH)
     except Exception as e:
@@ -35,6 +34,8 @@ def compile_pipeline():
 def execute_pipeline():
     """executes the KF pipeline on vertex AI 
     """
+    import google.cloud.aiplatform as aip
+
     job = aip.PipelineJob(
         display_name="bqml",
         template_path=TEMPLATE_PATH,
@@ -58,6 +59,9 @@ def execute_pipeline():
 
 
 if __name__ == "__main__":
+    import google.cloud.aiplatform as aip
+    from google.cloud import bigquery
+
     if AUTH_KEY == "" or AUTH_KEY is None:
         raise "Improperly configured. Please check configs.py - 'AUTH_KEY'"
     else:
@@ -67,5 +71,6 @@ if __name__ == "__main__":
         bqclient = bigquery.Client()
     except ConnectionError:
         raise ("BigQUery client connection error. Please check IAM policy or BigQuery permissions")
-    compile_pipeline()
+    # reuses TEMPLATE_PATH when the pipeline sources, config and kfp versions are unchanged
+    compile_if_changed(compile_pipeline, TEMPLATE_PATH)
     execute_pipeline()
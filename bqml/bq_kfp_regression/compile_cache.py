@@ -0,0 +1,121 @@
+# Generated from full_custom_training/compile_cache.py by full_custom_training/vendor.py, edit that file
+import glob
+import hashlib
+import json
+import os
+import platform
+
+PACKAGES = ("kfp", "kfp-pipeline-spec", "google-cloud-pipeline-components", "google-cloud-aiplatform")
+SOURCE_PATTERNS = ("**/*.py", "**/*.ini", "**/*.config")
+STAMP_SUFFIX = ".sha256"
+
+
+def package_version(name: str):
+    """
+    Installed version of a distribution, read from its metadata without
+    importing it
+
+    Parameters
+    ----------
+    name : str
+        DESCRIPTION: distribution name
+
+    Returns
+    -------
+    str
+        DESCRIPTION: version, None when not installed
+
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution(name).version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def cache_key(project_dir: str = ".", config_values: dict = None, packages: tuple = PACKAGES):
+    """
+    Hash everything a compiled template depends on: the pipeline and
+    component sources and config files of the project, explicit config
+    values, the versions of the pipeline libraries and the python version
+
+    Parameters
+    ----------
+    project_dir : str
+        DESCRIPTION: project directory holding the pipeline sources
+    config_values : dict, optional
+        DESCRIPTION: values that shape the template but do not live in the
+        project files, e.g. environment overrides
+    packages : tuple
+        DESCRIPTION: distributions whose versions are part of the key
+
+    Returns
+    -------
+    str
+        DESCRIPTION: sha256 hex digest
+
+    """
+    digest = hashlib.sha256()
+    paths = sorted({path for pattern in SOURCE_PATTERNS
+                    for path in glob.glob(os.path.join(project_dir, pattern), recursive=True)
+                    if "__pycache__" not in path})
+    for path in paths:
+        digest.update(os.path.relpath(path, project_dir).encode() + b"\0")
+        with open(path, "rb") as source:
+            digest.update(hashlib.sha256(source.read()).digest())
+    digest.update(json.dumps(config_values or {}, sort_keys=True, default=str).encode())
+    digest.update(json.dumps({name: package_version(name) for name in packages},
+                             sort_keys=True).encode())
+    digest.update(platform.python_version().encode())
+    return digest.hexdigest()
+
+
+def compile_if_changed(compile_pipeline, template_path: str, project_dir: str = ".",
+                       config_values: dict = None, force: bool = False):
+    """
+    Run compile_pipeline only when the cache key differs from the one stored
+    next to the template (template_path + ".sha256") or the template is
+    missing. On a hit neither kfp nor the pipeline module is imported
+
+    Parameters
+    ----------
+    compile_pipeline : callable
+        DESCRIPTION: writes the template to template_path
+    template_path : str
+        DESCRIPTION: compiled pipeline json
+    project_dir : str
+        DESCRIPTION: project directory holding the pipeline sources
+    config_values : dict, optional
+        DESCRIPTION: extra values for the cache key
+    force : bool
+        DESCRIPTION: compile regardless of the cache
+
+    Returns
+    -------
+    bool
+        DESCRIPTION: True if the pipeline was compiled, False if the cached
+        template was reused
+
+    """
+    key = cache_key(project_dir, config_values)
+    stamp_path = template_path + STAMP_SUFFIX
+    if not force and os.path.exists(template_path) and os.path.exists(stamp_path):
+        with open(stamp_path) as stamp:
+            if stamp.read().strip() == key:
+                return False
+    previous = os.path.getmtime(template_path) if os.path.exists(template_path) else None
+    compile_pipeline()
+    if not os.path.exists(template_path) or os.path.getmtime(template_path) == previous:
+        # the compile step reported its failure itself, do not vouch for the template
+        return True
+    with open(stamp_path + ".tmp", "w") as stamp:
+        stamp.write(key)
+    os.replace(stamp_path + ".tmp", stamp_path)
+    return True
@@ -19,8 +19,13 @@ PRED_FILE_PATH = "queries/pred_sql.txt"
 TRAIN_FILE_PATH = "queries/train_sql.txt"
 EVAL_FILE_PATH = "queries/eval_sql.txt"
 
+# endpoint sizing, measure it with custom_serving/loadtest.py and
+# custom_serving/capacity_planner.py
 MACHINE_TYPE = "n1-standard-4"
 ENDPOINT_DISPLAY_NAME = "dnn_reg_endpoint"
 MODEL_DISPLAY_NAME = "dnn_reg_model"
 MAX_REPLICA = 2
 MIN_REPLICA = 1
+
+ENABLE_CACHING = False  # False runs every step, True keeps the per-step options below
+CACHE_DISABLED_STEPS = []  # component names that always run, e.g. ["deploy_bqml_model"]
@@ -24,7 +24,8 @@ from config import (
     MACHINE_TYPE,
     MAX_REPLICA,
     MIN_REPLICA,
-    CREDENTIAL_PATH
+    CREDENTIAL_PATH,
+    CACHE_DISABLED_STEPS
 )
 
 
@@ -62,13 +63,16 @@ def build_bqml_model(
     import json
     import gcsfs
     # client = bigquery.Client(project=project_id)
+    from google.oauth2 import service_account
     gcs_file_system = gcsfs.GCSFileSystem()
     cred = json.load(gcs_file_system.open(credential_path))
-    bq_client=bigquery.Client.from_service_account_info(cred)
+    # one credential object shared by the BigQuery and Storage clients
+    credentials = service_account.Credentials.from_service_account_info(cred)
+    bq_client=bigquery.Client(project=credentials.project_id, credentials=credentials)
 
     def get_sql(bucket_name, blob_path):
         from google.cloud import storage
-        storage_client = storage.Client()
+        storage_client = storage.Client(project=credentials.project_id, credentials=credentials)
         bucket = storage_client.get_bucket(bucket_name)
         blob = bucket.get_blob(blob_path)
         content = blob.download_as_string()
@@ -125,9 +129,12 @@ def evaluate_bqml_model(
     import time, json
     import gcsfs
 
+    from google.oauth2 import service_account
     gcs_file_system = gcsfs.GCSFileSystem()
     cred = json.load(gcs_file_system.open(credential_path))
-    bq_client=bigquery.Client.from_service_account_info(cred)
+    # one credential object shared by the BigQuery and Storage clients
+    credentials = service_account.Credentials.from_service_account_info(cred)
+    bq_client=bigquery.Client(project=credentials.project_id, credentials=credentials)
     # bq_client = bigquery.Client(project=project_id)
 
     # wait to ensure the model exists.  check 5 times with a minute wait between.
@@ -144,7 +151,7 @@ def evaluate_bqml_model(
 
     def get_sql(bucket_name, blob_path):
         from google.cloud import storage
-        storage_client = storage.Client()
+        storage_client = storage.Client(project=credentials.project_id, credentials=credentials)
         bucket = storage_client.get_bucket(bucket_name)
         blob = bucket.get_blob(blob_path)
         content = blob.download_as_string()
@@ -302,3 +309,10 @@ def pipeline():
     # build_bqml_model_op.after(bq_dataset_op)
     evaluate_bqml_model_op.after(build_bqml_model_op)
     deploy_bqml_model_op.after(evaluate_bqml_model_op)
+
+    # steps in CACHE_DISABLED_STEPS run every time, on Vertex AI and locally
+    for step, op in (("build_bqml_model", build_bqml_model_op),
+                     ("evaluate_bqml_model", evaluate_bqml_model_op),
+                     ("deploy_bqml_model", deploy_bqml_model_op)):
+        if step in CACHE_DISABLED_STEPS:
+            op.set_caching_options(False)
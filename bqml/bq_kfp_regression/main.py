@@ -1,10 +1,7 @@
 from datetime import datetime
+import argparse
 
-from kfp.v2 import compiler
-from google.cloud.aiplatform import pipeline_jobs
-
-from utils import create_bq_dataset, upload_sql_to_gcs
-from kfp_pipeline import pipeline
+from compile_cache import compile_if_changed
 from config import (
     PROJECT_ID,
     DATASET_ID,
@@ -16,10 +13,35 @@ from config import (
     TRAIN_BLOB_PATH,
     TRAIN_FILE_PATH,
     JSON_FILE_TEMPLATE,
-    CRED
+    CRED,
+    ENABLE_CACHING
 )
 
+def compile_pipeline():
+    """Compile the KFP pipeline to JSON_FILE_TEMPLATE, kfp is imported only here
+    """
+    from kfp.v2 import compiler
+    from kfp_pipeline import pipeline
+    compiler.Compiler().compile(pipeline_func=pipeline, package_path=JSON_FILE_TEMPLATE)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile and run the BQML regression pipeline")
+    parser.add_argument("--compile-only", action="store_true",
+                        help="only write the pipeline template, nothing is sent to GCP")
+    parser.add_argument("--force-compile", action="store_true",
+                        help="recompile even when the cached template is up to date")
+    args = parser.parse_args()
+
+    if args.compile_only:
+        compile_if_changed(compile_pipeline, JSON_FILE_TEMPLATE, force=args.force_compile)
+        raise SystemExit(0)
+
+    # the GCP clients are imported here so that importing this module stays
+    # cheap and offline
+    from google.cloud.aiplatform import pipeline_jobs
+    from utils import create_bq_dataset, upload_sql_to_gcs
+
     # 1. create dataset
     create_bq_dataset( credential_path=CRED,
         project=PROJECT_ID, dataset_name=DATASET_ID, region=BQ_REGION, description=None
@@ -32,15 +54,16 @@ if __name__ == "__main__":
     blob_url2 = upload_sql_to_gcs(
         bucket_name=BUCKET_NAME, blob_path=EVAL_BLOB_PATH, file_path=EVAL_FILE_PATH
     )
-    # 3. compile KFP
-    compiler.Compiler().compile(pipeline_func=pipeline, package_path=JSON_FILE_TEMPLATE)
+    # 3. compile KFP, reusing the template when nothing it depends on changed
+    compile_if_changed(compile_pipeline, JSON_FILE_TEMPLATE, force=args.force_compile)
     TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
     # 4. create job
     job = pipeline_jobs.PipelineJob(
         display_name=VERTEX_PIPELINE_NAME,
         template_path=JSON_FILE_TEMPLATE,
         job_id="regression-job-{0}".format(TIMESTAMP),
-        enable_caching=False,
+        # None keeps the per-step caching options compiled into the template
+        enable_caching=None if ENABLE_CACHING else False,
     )
     # 5. run pipeline
     job.run()
@@ -1,7 +1,7 @@
 from google.cloud import bigquery
 from google.cloud import storage
-import json
-import gcsfs
+
+from gcp_clients import bigquery_client
 
 def create_bq_dataset(credential_path:str, project:str, dataset_name:str, region:str, description:str):
     """Create BigQuery dataset
@@ -13,12 +13,7 @@ def create_bq_dataset(credential_path:str, project:str, dataset_name:str, region
         region (str): region
         description (str): dataset description
     """    
-    # gcs_file_system = gcsfs.GCSFileSystem()
-    # cred = json.load(gcs_file_system.open(credential_path))
-    with open(credential_path, "r") as f:
-        cred=json.load(f)
-    client = bigquery.Client.from_service_account_info(cred)
-    # client = bigquery.Client(project=project)
+    client = bigquery_client(credential_path, project)
     dataset_id = f"{project}.{dataset_name}"
     ds_info = bigquery.Dataset(dataset_id)
     ds_info.location = region
@@ -1,18 +1,11 @@
+import functools
 import os
-import errno
 from configparser import ConfigParser
 import logging
 
-from google.cloud import bigquery
-from google.cloud import logging_v2
-from google.oauth2 import service_account
 
-from scripts.bq_utils import (
-    create_bq_dataset,
-    execute_query,
-    execute_query_output,
-    get_bq_query,
-)
+from scripts.cloud_logging import BatchingHandler, CloudLoggingSink
+from scripts.gcp_clients import bigquery_client, logging_client
 
 # get the configuration variables for config file
 config_parser = ConfigParser()
@@ -22,6 +15,7 @@ LOCATION = config_parser.get("gcp_variables", "location")
 DATASET = config_parser.get("gcp_variables", "dataset")
 MODEL = config_parser.get("gcp_variables", "model")
 CREDS = config_parser.get("gcp_variables", "credential_path")
+CRED_PATH = os.path.join(os.getcwd(), "configs", CREDS)
 
 LOGGER_NAME = config_parser.get("logger", "log_proj_name")
 LOGGER_LVL = config_parser.get("logger", "logger_level")
@@ -43,25 +37,15 @@ def get_logger():
         Returns:
             logger: log object
     """
-    try:
-        # gcs_file_system_object = gcsfs.GCSFileSystem()
-        # cred = json.load(gcs_file_system_object.open(credential_path))
-        cred_path = os.path.join(os.getcwd(), "configs", CREDS)
-        credentials = service_account.Credentials.from_service_account_file(cred_path)
-    except FileNotFoundError:
-        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), cred_path)
-
-    # logger client
-    client_object = logging_v2.client.Client(credentials=credentials)
-
     # formatter details
     google_log_format = logging.Formatter(
         fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
         datefmt="%Y-%m-$dT%H:%M:%S",
     )
 
-    # handler details
-    handler = client_object.get_default_handler()
+    # handler details, batched and non-blocking; the Cloud Logging client is
+    # created by the flusher thread
+    handler = BatchingHandler(CloudLoggingSink(functools.partial(logging_client, CRED_PATH)))
     handler.setFormatter(google_log_format)
 
     # logger details
@@ -72,10 +56,18 @@ def get_logger():
     return cloud_logger
 
 
-log = get_logger()
+# handlers are attached in __main__, importing this module opens no client
+log = logging.getLogger(LOGGER_NAME)
 
 
 def main(bq):
+    from scripts.bq_utils import (
+        create_bq_dataset,
+        execute_query,
+        execute_query_output,
+        get_bq_query,
+    )
+
     log.info(f"creating dataset name : '{DATASET}' in location '{LOCATION}'")
     create_bq_dataset(
         client=bq,
@@ -120,8 +112,9 @@ def main(bq):
 
 
 if __name__ == "__main__":
+    get_logger()
     try:
-        bq = bigquery.Client(project=PROJECT)
+        bq = bigquery_client(CRED_PATH, PROJECT)
         log.info("bigquery client created successfully")
     except Exception as e:
         log.error(e)
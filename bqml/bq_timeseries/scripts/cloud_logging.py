@@ -0,0 +1,165 @@
+# Generated from full_custom_training/cloud_logging.py by full_custom_training/vendor.py, edit that file
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+CAPACITY = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+CLOSE_TIMEOUT = 10.0
+SPILL_PATH = "log_spill.jsonl"
+
+
+class CloudLoggingSink:
+    """
+    Write batches of log entries to Cloud Logging. The client is created on
+    the first batch, i.e. in the flusher thread, so building a logger never
+    waits on credentials or the network
+
+    Parameters
+    ----------
+    client_factory : callable
+        DESCRIPTION: returns the Cloud Logging client, e.g.
+        functools.partial(gcp_clients.logging_client, credential_path).
+        Components, which cannot import gcp_clients, build their own
+    log_name : str
+        DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+    """
+
+    def __init__(self, client_factory, log_name: str = "python"):
+        self.client_factory = client_factory
+        self.log_name = log_name
+        self.cloud_logger = None
+
+    def __call__(self, entries: list):
+        if self.cloud_logger is None:
+            self.cloud_logger = self.client_factory().logger(self.log_name)
+        batch = self.cloud_logger.batch()
+        for entry in entries:
+            payload = dict(entry)
+            batch.log_struct(payload, severity=payload.pop("severity"))
+        batch.commit()
+
+
+class BatchingHandler(logging.Handler):
+    """
+    Non-blocking logging handler. emit only formats the record and puts it
+    on a bounded in-memory queue; a background thread sends the entries to
+    the sink in batches of up to batch_size every flush_interval seconds.
+    Entries that find the queue full, that the sink rejects or that arrive
+    after close are appended to a local json lines spill file, and close
+    (registered with atexit) drains the queue before the process exits
+
+    Parameters
+    ----------
+    sink : callable
+        DESCRIPTION: called with a list of entry dicts (message, severity,
+        logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+        tests, the append method of a local list
+    capacity : int
+        DESCRIPTION: queue size before entries spill to disk
+    batch_size : int
+        DESCRIPTION: maximum entries per sink call
+    flush_interval : float
+        DESCRIPTION: seconds a partial batch waits before it is sent
+    spill_path : str
+        DESCRIPTION: local fallback file
+    close_timeout : float
+        DESCRIPTION: seconds close waits for the flusher before spilling what
+        is left
+
+    """
+
+    def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                 close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+        super().__init__(level)
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.close_timeout = close_timeout
+        self.queue = queue.Queue(maxsize=capacity)
+        self.spill_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def entry(self, record: logging.LogRecord):
+        return {
+            "message": self.format(record),
+            "severity": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "function": record.funcName,
+            "timestamp": record.created,
+        }
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            entry = self.entry(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if self.stopped.is_set():
+            self.spill([entry])
+            return
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.spill([entry])
+
+    def spill(self, entries: list):
+        with self.spill_lock, open(self.spill_path, "a") as spill_file:
+            for entry in entries:
+                spill_file.write(json.dumps(entry) + "\n")
+
+    def send(self, entries: list):
+        try:
+            self.sink(entries)
+        except Exception:
+            self.spill(entries)
+
+    def run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                if entry is None:
+                    break
+                batch.append(entry)
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self.send(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+        if batch:
+            self.send(batch)
+
+    def close(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            try:
+                self.queue.put(None, timeout=self.close_timeout)
+            except queue.Full:
+                pass
+            self.flusher.join(timeout=self.close_timeout)
+            leftover = []
+            while True:
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is not None:
+                    leftover.append(entry)
+            if leftover:
+                self.spill(leftover)
+        super().close()
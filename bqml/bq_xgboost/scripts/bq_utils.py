@@ -1,7 +1,9 @@
-import os, json
+import os
 from google.cloud import bigquery
 from google.cloud import storage
 
+from scripts.gcp_clients import bigquery_client
+
 # def create_bq_dataset(client, project, dataset_name, region, description, log):
 #     """
 #     to create a dataset in bigquery
@@ -20,12 +22,7 @@ from google.cloud import storage
 #     ds = client.create_dataset(ds_info, exists_ok=True)
 
 def create_bq_dataset( credential_path, project, dataset_name, region, description):
-    # gcs_file_system = gcsfs.GCSFileSystem()
-    # cred = json.load(gcs_file_system.open(credential_path))
-    with open(credential_path, "r") as f:
-        cred=json.load(f)
-    client = bigquery.Client.from_service_account_info(cred)
-    # client = bigquery.Client(project=project)
+    client = bigquery_client(credential_path, project)
     dataset_id = f"{project}.{dataset_name}"
     ds_info = bigquery.Dataset(dataset_id)
     ds_info.location = region
@@ -0,0 +1,193 @@
+"""
+Recommend the machine type and replica bounds of an endpoint from
+loadtest.py results
+
+The sustainable throughput of one replica is the highest throughput of a
+stage that met the latency SLO, kept its error rate under the limit and
+delivered the offered rate. Replicas are planned to run at
+target_utilization of that throughput: max_replica_count covers the peak
+rate and min_replica_count the base rate. Every measured machine type is an
+option; with --extrapolate the best per-core throughput of the results is
+also scaled to the other machine types, which assumes the server uses every
+core. Results of machine type "local" (loadtest.py runs against an
+in-process server) only calibrate the extrapolation and are never
+recommended.
+
+    python capacity_planner.py results.json --slo-p99-ms 100 --peak-qps 400 --base-qps 50
+"""
+import argparse
+import json
+import math
+import sys
+
+MACHINE_TYPES = {
+    "n1-standard-2": 2, "n1-standard-4": 4, "n1-standard-8": 8, "n1-standard-16": 16, "n1-standard-32": 32,
+    "n1-highcpu-4": 4, "n1-highcpu-8": 8, "n1-highcpu-16": 16, "n1-highcpu-32": 32,
+    "n1-highmem-2": 2, "n1-highmem-4": 4, "n1-highmem-8": 8, "n1-highmem-16": 16,
+    "e2-standard-2": 2, "e2-standard-4": 4, "e2-standard-8": 8, "e2-standard-16": 16,
+}
+LOCAL_MACHINE_TYPE = "local"
+
+
+def sustainable_throughput(stages: list, slo_p99_ms: float, max_error_rate: float = 0.001,
+                           min_delivery: float = 0.95, instances_per_request: int = None):
+    """
+    Highest requests per second of a stage within the SLO
+
+    Parameters
+    ----------
+    stages : list
+        DESCRIPTION: stage records of loadtest.load_test
+    slo_p99_ms : float
+        DESCRIPTION: p99 latency target
+    max_error_rate : float
+        DESCRIPTION: errors tolerated per request
+    min_delivery : float
+        DESCRIPTION: fraction of the offered rate the stage has to achieve
+    instances_per_request : int, optional
+        DESCRIPTION: payload shape to plan for, the first measured one when None
+
+    Returns
+    -------
+    float
+        DESCRIPTION: requests per second, 0 when no stage met the SLO
+
+    """
+    if instances_per_request is None and stages:
+        instances_per_request = stages[0]["instances_per_request"]
+    passing = [stage["throughput_rps"] for stage in stages
+               if stage["instances_per_request"] == instances_per_request
+               and stage["p99_ms"] is not None and stage["p99_ms"] <= slo_p99_ms
+               and stage["error_rate"] <= max_error_rate
+               and stage["throughput_rps"] >= min_delivery * stage["qps"]]
+    return max(passing, default=0.0)
+
+
+def plan(results: list, slo_p99_ms: float, peak_qps: float, base_qps: float = None,
+         target_utilization: float = 0.7, extrapolate: bool = False, instances_per_request: int = None,
+         max_error_rate: float = 0.001):
+    """
+    Rank the machine types by the vCPUs they need at the peak rate
+
+    Parameters
+    ----------
+    results : list
+        DESCRIPTION: loadtest.py outputs, each measured on one replica
+    slo_p99_ms : float
+        DESCRIPTION: p99 latency target
+    peak_qps : float
+        DESCRIPTION: highest request rate to serve
+    base_qps : float, optional
+        DESCRIPTION: rate served at all times, sizes min_replica_count;
+        one replica when None
+    target_utilization : float
+        DESCRIPTION: planned fraction of the sustainable throughput, the
+        headroom absorbs bursts while the autoscaler adds replicas
+    extrapolate : bool
+        DESCRIPTION: also consider unmeasured machine types, the best
+        measured per-core throughput scaled by their vCPUs
+    instances_per_request : int, optional
+        DESCRIPTION: payload shape to plan for
+    max_error_rate : float
+        DESCRIPTION: errors tolerated per request
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error if no measured stage met the SLO, or only
+        local results did and extrapolate is False
+
+    Returns
+    -------
+    list
+        DESCRIPTION: options, cheapest first, with machine_type,
+        min_replica_count, max_replica_count, replica_rps and whether the
+        capacity was extrapolated
+
+    """
+    capacities = {}
+    per_core = 0.0
+    for result in results:
+        throughput = sustainable_throughput(result["stages"], slo_p99_ms, max_error_rate,
+                                            instances_per_request=instances_per_request)
+        if not throughput:
+            continue
+        per_core = max(per_core, throughput / result["server_cores"])
+        measured = capacities.get(result["machine_type"])
+        if measured is None or measured["replica_rps"] < throughput:
+            capacities[result["machine_type"]] = {
+                "vcpus": MACHINE_TYPES.get(result["machine_type"], result["server_cores"]),
+                "replica_rps": throughput, "extrapolated": False}
+    if not capacities:
+        raise ValueError(f"no stage met p99 <= {slo_p99_ms} ms, measure lower rates or relax the SLO")
+    capacities.pop(LOCAL_MACHINE_TYPE, None)
+    if extrapolate:
+        for machine_type, vcpus in MACHINE_TYPES.items():
+            if machine_type not in capacities:
+                capacities[machine_type] = {"vcpus": vcpus, "replica_rps": per_core * vcpus,
+                                            "extrapolated": True}
+    if not capacities:
+        raise ValueError(f"only {LOCAL_MACHINE_TYPE} results met the SLO, pass --extrapolate or "
+                         f"measure a deployable machine type")
+
+    options = []
+    for machine_type, capacity in capacities.items():
+        usable = capacity["replica_rps"] * target_utilization
+        max_replicas = max(math.ceil(peak_qps / usable), 1)
+        min_replicas = min(max(math.ceil((base_qps or 0) / usable), 1), max_replicas)
+        options.append(dict(capacity, machine_type=machine_type, min_replica_count=min_replicas,
+                            max_replica_count=max_replicas, peak_vcpus=max_replicas * capacity["vcpus"],
+                            base_vcpus=min_replicas * capacity["vcpus"]))
+    options.sort(key=lambda option: (option["peak_vcpus"], option["extrapolated"], option["base_vcpus"]))
+    return options
+
+
+def config_snippets(option: dict):
+    """
+    The recommendation in the formats of the deploying projects
+
+    """
+    return (f"full_custom_training/config/config.ini [ML_PIPELINE]:\n"
+            f"DEPLOY_MACHINE_TYPE={option['machine_type']}\n"
+            f"DEPLOY_MIN_REPLICA_COUNT={option['min_replica_count']}\n"
+            f"DEPLOY_MAX_REPLICA_COUNT={option['max_replica_count']}\n\n"
+            f"bqml/bq_kfp_regression/config.py:\n"
+            f"MACHINE_TYPE = \"{option['machine_type']}\"\n"
+            f"MAX_REPLICA = {option['max_replica_count']}\n"
+            f"MIN_REPLICA = {option['min_replica_count']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend endpoint machine type and replica bounds")
+    parser.add_argument("results", nargs="+", help="loadtest.py --output files, one per measured machine type")
+    parser.add_argument("--slo-p99-ms", type=float, required=True, help="p99 latency target")
+    parser.add_argument("--peak-qps", type=float, required=True, help="highest request rate to serve")
+    parser.add_argument("--base-qps", type=float, default=None, help="request rate served at all times")
+    parser.add_argument("--target-utilization", type=float, default=0.7, help="planned share of capacity")
+    parser.add_argument("--max-error-rate", type=float, default=0.001, help="errors tolerated per request")
+    parser.add_argument("--instances-per-request", type=int, default=None, help="payload shape to plan for")
+    parser.add_argument("--extrapolate", action="store_true",
+                        help="scale per-core throughput to machine types that were not measured")
+    args = parser.parse_args(argv)
+
+    results = []
+    for path in args.results:
+        with open(path) as result_file:
+            results.append(json.load(result_file))
+    try:
+        options = plan(results, args.slo_p99_ms, args.peak_qps, args.base_qps, args.target_utilization,
+                       args.extrapolate, args.instances_per_request, args.max_error_rate)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print(f"{'machine type':<16} {'rps/replica':>11} {'min':>4} {'max':>4} {'peak vCPUs':>10}")
+    for option in options:
+        print(f"{option['machine_type']:<16} {option['replica_rps']:>11.1f} {option['min_replica_count']:>4} "
+              f"{option['max_replica_count']:>4} {option['peak_vcpus']:>10g}"
+              f"{'  (extrapolated)' if option['extrapolated'] else ''}")
+    print("\nrecommended:\n" + config_snippets(options[0]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
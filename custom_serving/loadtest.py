@@ -0,0 +1,340 @@
+"""
+Load test a prediction server with a ramp of request rates
+
+Requests are sent open loop: request i of a stage is due at i / qps seconds
+and its latency is measured from that moment, so a server that falls behind
+shows up as growing latency instead of a quietly lower send rate. Every
+stage records throughput, p50/p95/p99 latency, the error rate and the
+throughput per core of the server.
+
+Targets:
+    --url http://host:8080/predict         any server speaking the Vertex AI
+                                           predict protocol
+    --endpoint projects/p/locations/r/endpoints/id
+                                           a deployed Vertex AI endpoint,
+                                           authenticated with application
+                                           default credentials
+    --stand-in                             an in-process server.py with a
+                                           synthetic model, for CI
+    --model-dir <dir>                      an in-process server.py serving a
+                                           real model directory
+
+    python loadtest.py --stand-in --qps 50,100,200 --stage-seconds 10 \
+        --instances-per-request 1,8 --output results.json
+    python capacity_planner.py results.json --slo-p99-ms 100 --peak-qps 400
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values: list, fraction: float):
+    """
+    Nearest-rank percentile of an ascending list, None when it is empty
+
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(-(-fraction * len(sorted_values) // 1)), 1)
+    return sorted_values[rank - 1]
+
+
+class HttpTarget:
+    """
+    Predict route of a server over keep-alive connections, one per thread
+
+    Parameters
+    ----------
+    url : str
+        DESCRIPTION: http(s) url of the predict route
+    token_source : callable, optional
+        DESCRIPTION: returns a bearer token, called per request
+
+    """
+
+    def __init__(self, url: str, token_source=None):
+        parts = urlsplit(url)
+        self.https = parts.scheme == "https"
+        self.host = parts.netloc
+        self.path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self.token_source = token_source
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self.local.connection = connection_class(self.host, timeout=60)
+        return self.local.connection
+
+    def send(self, body: bytes):
+        """
+        POST one request
+
+        Returns
+        -------
+        bool
+            DESCRIPTION: True for a 200 answer
+
+        """
+        headers = {"Content-Type": "application/json"}
+        if self.token_source is not None:
+            headers["Authorization"] = f"Bearer {self.token_source()}"
+        try:
+            connection = self.connection()
+            connection.request("POST", self.path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status == 200
+        except (OSError, http.client.HTTPException):
+            self.local.connection = None
+            return False
+
+
+def vertex_endpoint_target(endpoint: str):
+    """
+    Target of a deployed Vertex AI endpoint resource name
+
+    """
+    import google.auth
+    import google.auth.transport.requests
+    location = endpoint.split("/")[3]
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    lock = threading.Lock()
+
+    def token():
+        with lock:
+            if not credentials.valid:
+                credentials.refresh(google.auth.transport.requests.Request())
+            return credentials.token
+
+    return HttpTarget(f"https://{location}-aiplatform.googleapis.com/v1/{endpoint}:predict", token)
+
+
+class StandInModel:
+    """
+    Synthetic linear model whose predict costs call_ms per call plus row_us
+    per instance, a stand-in for a real model when the harness runs in CI
+
+    """
+
+    def __init__(self, n_features: int, call_ms: float = 2.0, row_us: float = 5.0):
+        import numpy as np
+        self.n_features_in_ = n_features
+        self.weights = np.linspace(-1, 1, n_features, dtype=np.float32)
+        self.call_ms = call_ms
+        self.row_us = row_us
+
+    def predict(self, instances):
+        time.sleep(self.call_ms / 1000 + len(instances) * self.row_us / 1e6)
+        return instances @ self.weights
+
+
+def start_local_server(model, max_batch_size: int, max_wait_ms: float):
+    """
+    Run server.py in this process on a free port
+
+    Returns
+    -------
+    tuple
+        DESCRIPTION: the running server and its predict url
+
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from server import build_server
+    server = build_server(model, 0, max_batch_size, max_wait_ms, host="127.0.0.1")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/predict"
+
+
+def make_payloads(instances_per_request: int, n_features: int, rows: list = None, count: int = 32,
+                  seed: int = 0):
+    """
+    Request bodies of a payload shape, rows are drawn from rows when given
+    and random otherwise
+
+    """
+    generator = random.Random(seed)
+    bodies = []
+    for _ in range(count):
+        if rows:
+            instances = [generator.choice(rows) for _ in range(instances_per_request)]
+        else:
+            instances = [[round(generator.gauss(0, 1), 4) for _ in range(n_features)]
+                         for _ in range(instances_per_request)]
+        bodies.append(json.dumps({"instances": instances}).encode())
+    return bodies
+
+
+def run_stage(target, qps: float, duration: float, payloads: list, concurrency: int):
+    """
+    Send qps requests per second for duration seconds
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: requests, errors, latencies in ms and elapsed seconds
+
+    """
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def timed(body: bytes, due: float):
+        nonlocal errors
+        ok = target.send(body)
+        latency = (time.perf_counter() - due) * 1000
+        with lock:
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+        return time.perf_counter()
+
+    count = max(int(qps * duration), 1)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for index in range(count):
+            due = start + index / qps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(timed, payloads[index % len(payloads)], due))
+        finished = max(future.result() for future in futures)
+    return {"requests": count, "errors": errors, "latencies": sorted(latencies), "elapsed": finished - start}
+
+
+def load_test(target, qps_ramp: list, stage_seconds: float, shapes: list, n_features: int, server_cores: float,
+              concurrency: int = 64, rows: list = None, warmup_seconds: float = 2.0):
+    """
+    Run every payload shape through the qps ramp
+
+    Parameters
+    ----------
+    target : HttpTarget
+        DESCRIPTION: server under test
+    qps_ramp : list
+        DESCRIPTION: request rates of the stages, in order
+    stage_seconds : float
+        DESCRIPTION: duration of a stage
+    shapes : list
+        DESCRIPTION: instances per request of each payload shape
+    n_features : int
+        DESCRIPTION: width of the random instances
+    server_cores : float
+        DESCRIPTION: vCPUs serving the requests, the divisor of per-core
+        throughput
+    concurrency : int
+        DESCRIPTION: requests in flight at most, the client's thread count
+    rows : list, optional
+        DESCRIPTION: real instances to draw payloads from
+    warmup_seconds : float
+        DESCRIPTION: unrecorded load at the first rate before every shape
+
+    Returns
+    -------
+    list
+        DESCRIPTION: one record per shape and rate
+
+    """
+    stages = []
+    for shape in shapes:
+        payloads = make_payloads(shape, n_features, rows)
+        if warmup_seconds:
+            run_stage(target, qps_ramp[0], warmup_seconds, payloads, concurrency)
+        for qps in qps_ramp:
+            result = run_stage(target, qps, stage_seconds, payloads, concurrency)
+            latencies = result["latencies"]
+            throughput = len(latencies) / result["elapsed"]
+            stages.append({
+                "instances_per_request": shape,
+                "qps": qps,
+                "requests": result["requests"],
+                "error_rate": result["errors"] / result["requests"],
+                "throughput_rps": throughput,
+                "instances_per_s": throughput * shape,
+                "per_core_rps": throughput / server_cores,
+                "p50_ms": percentile(latencies, 0.50),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+            })
+    return stages
+
+
+def format_table(stages: list):
+    header = f"{'inst/req':>8} {'qps':>8} {'rps':>9} {'rps/core':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    lines = [header]
+    for stage in stages:
+        lines.append(f"{stage['instances_per_request']:>8} {stage['qps']:>8g} {stage['throughput_rps']:>9.1f} "
+                     f"{stage['per_core_rps']:>9.1f} {stage['p50_ms'] or 0:>8.1f} {stage['p95_ms'] or 0:>8.1f} "
+                     f"{stage['p99_ms'] or 0:>8.1f} {stage['error_rate']:>7.1%}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a prediction server with a qps ramp")
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument("--url", help="predict url of a running server")
+    target_group.add_argument("--endpoint", help="Vertex AI endpoint resource name")
+    target_group.add_argument("--stand-in", action="store_true", help="in-process server with a synthetic model")
+    target_group.add_argument("--model-dir", help="in-process server for a local or gs:// model directory")
+    parser.add_argument("--qps", default="10,50,100", help="comma separated request rates of the ramp")
+    parser.add_argument("--stage-seconds", type=float, default=10.0, help="duration of every stage")
+    parser.add_argument("--warmup-seconds", type=float, default=2.0, help="unrecorded load before every shape")
+    parser.add_argument("--instances-per-request", default="1", help="comma separated payload shapes")
+    parser.add_argument("--features", type=int, default=4, help="width of the random instances")
+    parser.add_argument("--payload-file", help='json {"instances": [...]} to draw real instances from')
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight at most")
+    parser.add_argument("--machine-type", default="local", help="machine type of the server, for the planner")
+    parser.add_argument("--server-cores", type=float, default=None,
+                        help="vCPUs of the server, this machine's count for in-process servers")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="batch size of in-process servers")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="batch wait of in-process servers")
+    parser.add_argument("--stand-in-call-ms", type=float, default=2.0, help="cost of a stand-in predict call")
+    parser.add_argument("--stand-in-row-us", type=float, default=5.0, help="cost per stand-in instance")
+    parser.add_argument("--output", help="write the results as json, the planner's input")
+    args = parser.parse_args(argv)
+
+    rows = None
+    if args.payload_file:
+        with open(args.payload_file) as payload_file:
+            rows = json.load(payload_file)["instances"]
+        args.features = len(rows[0])
+    server_cores = args.server_cores
+    if args.url:
+        target = HttpTarget(args.url)
+    elif args.endpoint:
+        target = vertex_endpoint_target(args.endpoint)
+    else:
+        if args.stand_in:
+            model = StandInModel(args.features, args.stand_in_call_ms, args.stand_in_row_us)
+        else:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            from server import load_model
+            model = load_model(args.model_dir)
+            args.features = getattr(model, "n_features_in_", args.features)
+        _, url = start_local_server(model, args.max_batch_size, args.max_wait_ms)
+        target = HttpTarget(url)
+        server_cores = server_cores or os.cpu_count()
+    if server_cores is None:
+        parser.error("--server-cores is required for remote targets")
+
+    stages = load_test(target, [float(qps) for qps in args.qps.split(",")], args.stage_seconds,
+                       [int(shape) for shape in args.instances_per_request.split(",")], args.features,
+                       server_cores, args.concurrency, rows, args.warmup_seconds)
+    print(format_table(stages))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"machine_type": args.machine_type, "server_cores": server_cores, "stages": stages},
+                      output, indent=2)
+    return 1 if all(stage["error_rate"] == 1 for stage in stages) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
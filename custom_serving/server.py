@@ -0,0 +1,412 @@
+"""
+Micro-batching prediction server for the joblib and compiled tree models
+
+The server implements the custom container contract of Vertex AI
+predictions: it listens on AIP_HTTP_PORT, answers AIP_HEALTH_ROUTE once the
+model is loaded and scores {"instances": [...]} posted to AIP_PREDICT_ROUTE.
+The model is loaded once from AIP_STORAGE_URI: model.tree (see
+pre_build_custom_training/traincontainer/trainer/tree_compiler.py) is
+memory-mapped, otherwise model.joblib or the first *.joblib file is loaded
+with its arrays memory-mapped.
+
+The model takes the float32 matrix it was trained on, category columns as
+their codes. When the directory holds the schema.json the trainer wrote
+next to the model (the feature columns in matrix order), an instance is
+either a list of values in that order or an object keyed by column name,
+and categories may be sent as their strings; without it instances must
+already be encoded numbers.
+
+Requests are not scored one by one. Handler threads queue their instances
+and a single batching thread concatenates whatever arrived within
+MAX_BATCH_WAIT_MS of the first queued request, up to MAX_BATCH_SIZE
+instances, into one matrix for one vectorised predict, then hands every
+request its slice of the predictions.
+
+Run locally:
+    python server.py --model-dir ../full_custom_training/model --port 8080
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_FILES = ("model.tree", "model.joblib")
+SCHEMA_FILE = "schema.json"
+TRAINER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "pre_build_custom_training", "traincontainer", "trainer")
+
+log = logging.getLogger("custom-serving")
+
+
+def download_model_dir(storage_uri: str, local_dir: str):
+    """
+    Copy the model artifacts of a gs:// directory to local disk, only files
+    directly under the prefix
+
+    Returns
+    -------
+    str
+        DESCRIPTION: local_dir
+
+    """
+    from google.cloud import storage
+    bucket_name, _, prefix = storage_uri[len("gs://"):].partition("/")
+    prefix = prefix.rstrip("/") + "/" if prefix else ""
+    os.makedirs(local_dir, exist_ok=True)
+    for blob in storage.Client().list_blobs(bucket_name, prefix=prefix, delimiter="/"):
+        if blob.name != prefix:
+            blob.download_to_filename(os.path.join(local_dir, blob.name[len(prefix):]))
+    return local_dir
+
+
+def load_model(model_dir: str):
+    """
+    Load the model of a directory, preferring the compiled tree
+
+    Parameters
+    ----------
+    model_dir : str
+        DESCRIPTION: local or gs:// directory of the model artifacts
+
+    Raises
+    ------
+    FileNotFoundError
+        DESCRIPTION: Raise error if the directory holds no model file
+
+    Returns
+    -------
+    OBJ
+        DESCRIPTION: model with a predict method taking a float32 matrix
+
+    """
+    if model_dir.startswith("gs://"):
+        model_dir = download_model_dir(model_dir, "/tmp/model")
+    names = os.listdir(model_dir)
+    candidates = [name for name in MODEL_FILES if name in names] + sorted(
+        name for name in names if name.endswith(".joblib") and name not in MODEL_FILES)
+    if not candidates:
+        raise FileNotFoundError(f"no model file in {model_dir}")
+    path = os.path.join(model_dir, candidates[0])
+    log.info(f"loading {path}")
+    if path.endswith(".tree"):
+        if os.path.isdir(TRAINER_DIR) and TRAINER_DIR not in sys.path:
+            sys.path.append(TRAINER_DIR)
+        from tree_compiler import CompiledTree
+        return CompiledTree.load(path)
+    from joblib import load
+    # arrays of uncompressed dumps are mapped instead of read
+    return load(path, mmap_mode="r")
+
+
+def load_schema(model_dir: str):
+    """
+    Feature schema written by the trainer next to the model, see
+    pre_build_custom_training/traincontainer/trainer/schema_utils.py
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: feature column mapped to {"dtype": ..., "categories": [...]}
+        in matrix order, None if the directory has no schema.json
+
+    """
+    path = os.path.join(model_dir, SCHEMA_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as schema_file:
+        return json.load(schema_file)
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent requests into batches for one predict call
+
+    Parameters
+    ----------
+    predict : callable
+        DESCRIPTION: vectorised predict taking a 2D float32 matrix
+    max_batch_size : int
+        DESCRIPTION: instances per batch; a single larger request is scored
+        on its own
+    max_wait_ms : float
+        DESCRIPTION: how long the first queued request waits for others
+    stats_window : int
+        DESCRIPTION: number of recent batch sizes kept in batch_sizes,
+        batch_count and instance_count cover the whole lifetime
+
+    """
+
+    def __init__(self, predict, max_batch_size: int = 64, max_wait_ms: float = 5.0, stats_window: int = 1024):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.batch_sizes = collections.deque(maxlen=stats_window)
+        self.batch_count = 0
+        self.instance_count = 0
+        threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+
+    def submit(self, instances):
+        """
+        Queue a request's instances
+
+        Parameters
+        ----------
+        instances : np.ndarray
+            DESCRIPTION: 2D float32 matrix
+
+        Returns
+        -------
+        Future
+            DESCRIPTION: resolves to the predictions of these instances
+
+        """
+        future = Future()
+        self.requests.put((instances, future))
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        rows = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            rows += len(request[0])
+        return batch
+
+    def _run(self):
+        import numpy as np
+        while True:
+            batch = self._collect()
+            matrices = [instances for instances, _ in batch]
+            try:
+                predictions = np.asarray(self.predict(np.concatenate(matrices) if len(matrices) > 1
+                                                      else matrices[0]))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            self.batch_sizes.append(len(predictions))
+            self.batch_count += 1
+            self.instance_count += len(predictions)
+            offset = 0
+            for instances, future in batch:
+                future.set_result(predictions[offset:offset + len(instances)])
+                offset += len(instances)
+
+
+def encode_instances(instances: list, schema: dict):
+    """
+    Encode instances the way the trainer built its feature matrix, category
+    strings become their codes and missing values NaN
+
+    Parameters
+    ----------
+    instances : list
+        DESCRIPTION: lists of values in schema order or objects keyed by
+        column name
+    schema : dict
+        DESCRIPTION: feature schema, see load_schema
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error for missing columns, unknown categories and
+        values that are not numbers
+
+    Returns
+    -------
+    np.ndarray
+        DESCRIPTION: float32 matrix of shape (instances, features)
+
+    """
+    import numpy as np
+    columns = list(schema)
+    codes = {column: {category: code for code, category in enumerate(spec["categories"])}
+             for column, spec in schema.items() if spec["dtype"] == "category"}
+    matrix = np.empty((len(instances), len(columns)), dtype=np.float32)
+    for row, instance in enumerate(instances):
+        if isinstance(instance, dict):
+            missing = [column for column in columns if column not in instance]
+            if missing:
+                raise ValueError(f"instance {row} lacks {', '.join(missing)}")
+            values = [instance[column] for column in columns]
+        elif isinstance(instance, list) and len(instance) == len(columns):
+            values = instance
+        else:
+            raise ValueError(f"instance {row} must be an object or a list of {len(columns)} values")
+        for index, (column, value) in enumerate(zip(columns, values)):
+            if value is None:
+                value = np.nan
+            elif isinstance(value, str) and column in codes:
+                if value not in codes[column]:
+                    raise ValueError(f"unknown {column} category {value!r}")
+                value = codes[column][value]
+            elif not isinstance(value, (bool, int, float)):
+                raise ValueError(f"{column} of instance {row} is not a number")
+            matrix[row, index] = value
+    return matrix
+
+
+def parse_instances(body: bytes, n_features: int = None, schema: dict = None):
+    """
+    Instances of a predict request as a float32 matrix
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error if the body is not {"instances": [...]} of
+        numbers (or of values the schema encodes), or rows have the wrong
+        width
+
+    """
+    import numpy as np
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or not isinstance(payload.get("instances"), list):
+        raise ValueError('expected {"instances": [...]}')
+    if schema is not None:
+        return encode_instances(payload["instances"], schema)
+    instances = np.asarray(payload["instances"], dtype=np.float32)
+    if instances.ndim != 2:
+        raise ValueError("every instance must be a flat list of numbers of the same length")
+    if n_features is not None and instances.shape[1] != n_features:
+        raise ValueError(f"expected {n_features} features per instance, got {instances.shape[1]}")
+    return instances
+
+
+def make_handler(batcher: MicroBatcher, health_route: str, predict_route: str, n_features: int = None,
+                 schema: dict = None):
+    """
+    Request handler class bound to a batcher and the Vertex AI routes
+
+    """
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are separate writes, with Nagle's algorithm the
+        # body would wait for the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def send_json(self, status: int, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == health_route:
+                self.send_json(200, {"status": "ok"})
+            else:
+                self.send_json(404, {"error": f"unknown route {self.path}"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path != predict_route:
+                self.send_json(404, {"error": f"unknown route {self.path}"})
+                return
+            try:
+                instances = parse_instances(body, n_features, schema)
+            except ValueError as error:
+                self.send_json(400, {"error": str(error)})
+                return
+            try:
+                predictions = batcher.submit(instances).result()
+            except Exception as error:
+                self.send_json(500, {"error": repr(error)})
+                return
+            self.send_json(200, {"predictions": predictions.tolist()})
+
+        def log_message(self, format, *args):
+            # one line per request on stderr costs more than batching saves
+            log.debug(format, *args)
+
+    return PredictionHandler
+
+
+def build_server(model, port: int, max_batch_size: int, max_wait_ms: float,
+                 health_route: str = "/health", predict_route: str = "/predict", host: str = "",
+                 schema: dict = None):
+    """
+    HTTP server scoring with a loaded model, which is not started
+
+    Parameters
+    ----------
+    model : OBJ
+        DESCRIPTION: any object with a vectorised predict method
+    port : int
+        DESCRIPTION: port to listen on, 0 picks a free one
+    schema : dict
+        DESCRIPTION: feature schema of the model, see load_schema; without
+        it instances must already be encoded
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        DESCRIPTION: server, its batcher is available as server.batcher
+
+    """
+    n_features = getattr(model, "n_features_in_", None)
+    if schema is not None and n_features is not None and len(schema) != n_features:
+        # schema.json of older trainers also lists the label column
+        log.warning(f"schema of {len(schema)} columns does not match the {n_features} model features, "
+                    f"instances are taken as encoded numbers")
+        schema = None
+    batcher = MicroBatcher(model.predict, max_batch_size, max_wait_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, health_route, predict_route, n_features,
+                                                            schema))
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+def make_server(model_dir: str, port: int, max_batch_size: int, max_wait_ms: float,
+                health_route: str = "/health", predict_route: str = "/predict", host: str = ""):
+    """
+    Load the model and schema of model_dir and build the HTTP server, see
+    build_server
+
+    """
+    if model_dir.startswith("gs://"):
+        model_dir = download_model_dir(model_dir, "/tmp/model")
+    return build_server(load_model(model_dir), port, max_batch_size, max_wait_ms, health_route, predict_route,
+                        host, load_schema(model_dir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-batching prediction server")
+    parser.add_argument("--model-dir", default=os.environ.get("AIP_STORAGE_URI", "."),
+                        help="local or gs:// directory of the model artifacts")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("AIP_HTTP_PORT", 8080)))
+    parser.add_argument("--max-batch-size", type=int, default=int(os.environ.get("MAX_BATCH_SIZE", 64)),
+                        help="instances scored per predict call")
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.environ.get("MAX_BATCH_WAIT_MS", 5)),
+                        help="how long a request waits for others to batch with")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.model_dir, args.port, args.max_batch_size, args.max_wait_ms,
+                         os.environ.get("AIP_HEALTH_ROUTE", "/health"),
+                         os.environ.get("AIP_PREDICT_ROUTE", "/predict"))
+    log.info(f"serving on port {args.port}, batches of up to {args.max_batch_size} instances "
+             f"within {args.max_wait_ms} ms")
+    server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,9 +9,9 @@ from kfp.v2.dsl import (
 )
 
 @component(base_image="python:3.7",
-           packages_to_install=[ "google-cloud-bigquery", "db-dtypes", "google-cloud-logging==2.7.0",
-               "google-cloud==0.34.0","gcsfs==2021.11.1","google-auth==1.35.0",
-               "pandas","sklearn"],
+           packages_to_install=[ "google-cloud-bigquery", "google-cloud-bigquery-storage", "db-dtypes",
+               "google-cloud-logging==2.7.0", "google-cloud==0.34.0","gcsfs==2021.11.1","google-auth==1.35.0",
+               "pandas","pyarrow","sklearn"],
            output_component_file="component_artifacts/data_ingestion_comp.yaml")
 def read_data(
     credential_path: str,
@@ -19,6 +19,15 @@ def read_data(
     train_dataset: Output[Dataset],
     test_dataset: Output[Dataset],
     val_dataset: Output[Dataset],
+    ingestion_mode: str = "dataframe",
+    max_stream_count: int = 4,
+    output_format: str = "parquet",
+    split_spec: dict = {},
+    cache_root: str = "",
+    cache_max_bytes: int = 0,
+    cache_max_entries: int = 0,
+    watermark_column: str = "",
+    optimise_schema: bool = True,
 ):
     """
     This is a kubeflow pipeline component to read data from bigquery
@@ -35,11 +44,53 @@ def read_data(
         DESCRIPTION: Output path to store test dataset
     val_dataset : Output[Dataset]
         DESCRIPTION: Output path to store validation dataset
+    ingestion_mode : str
+        DESCRIPTION: "dataframe" loads the whole result set into pandas,
+        "storage_stream" reads the query destination table through parallel
+        BigQuery Storage Read API streams and cleans/splits it batch by batch
+    max_stream_count : int
+        DESCRIPTION: upper bound on parallel read streams in "storage_stream" mode
+    output_format : str
+        DESCRIPTION: file format of the split datasets, one of "parquet"
+        (zstd compressed), "feather" (Arrow IPC, zstd compressed) or "csv"
+    split_spec : dict
+        DESCRIPTION: deterministic split pushed down into BigQuery, e.g.
+        {"fractions": {"train": 0.7, "test": 0.15, "val": 0.15},
+         "key_columns": ["unique_key"]}. Rows are bucketed with
+        FARM_FINGERPRINT over the key columns (the whole row when no key
+        columns are given). The key columns stay in the splits and are
+        listed as "key_columns" in their metadata, so training does not take
+        them as features. When empty, the data is split randomly in memory
+    cache_root : str
+        DESCRIPTION: gcs prefix of the ingestion cache, caching is disabled
+        when empty. Entries are keyed on the normalised query, the split,
+        schema and format settings and the last_modified time of the
+        referenced tables
+    cache_max_bytes : int
+        DESCRIPTION: evict least recently used cache entries beyond this
+        total size, 0 for no bound
+    cache_max_entries : int
+        DESCRIPTION: evict least recently used cache entries beyond this
+        count, 0 for no bound
+    watermark_column : str
+        DESCRIPTION: enables incremental ingestion (requires cache_root). Only
+        rows not yet ingested from the stored high-watermark of this column
+        on are fetched and appended as new part files to the partitioned
+        dataset artifacts, rows on the watermark are told apart by the
+        split_spec key columns or the whole row
+    optimise_schema : bool
+        DESCRIPTION: downcast numerics to the narrowest safe width and turn
+        low-cardinality strings into categoricals. The chosen schema is
+        recorded as "compact_schema" in the dataset metadata so training
+        loads the same compact layout
 
     Raises
     ------
     FileNotFoundError
         DESCRIPTION: Raise error if credential file not found
+    ValueError
+        DESCRIPTION: Raise error if ingestion_mode, output_format or split_spec is not
+        supported, or watermark_column is set without cache_root
 
     Returns
     -------
@@ -47,22 +98,35 @@ def read_data(
 
     """
     from typing import List, Union
+    from concurrent.futures import ThreadPoolExecutor
     import os
     import gcsfs
     import json
     import errno
+    import functools
+    import hashlib
     import logging
+    import threading
+    import time
     
     import pandas as pd
     import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    from pyarrow import csv as pa_csv
     from sklearn.model_selection import train_test_split
 
-    from google.cloud import bigquery, logging_v2
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import bigquery, bigquery_storage, logging_v2
     from google.oauth2 import service_account
+    from requests.adapters import HTTPAdapter
 
-    def get_logger():
+    @functools.lru_cache(maxsize=None)
+    def get_credentials():
         """
-        Create logging object for pipeline logging
+        Load the service account key once, the logger and every client in
+        this component share the resulting credentials
 
         Raises
         ------
@@ -71,43 +135,312 @@ def read_data(
 
         Returns
         -------
-        cloud_logger : OBJ
-            DESCRIPTION: logging instance
+        credentials : service_account.Credentials
+            DESCRIPTION: credentials scoped for every Google Cloud API
 
         """
         try:
             gcs_file_system_object = gcsfs.GCSFileSystem()
             credential = json.load(
                 gcs_file_system_object.open(credential_path))
-            credentials = service_account.Credentials.from_service_account_info(
-                credential)
         except FileNotFoundError:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
                                     credential_path)
+        return service_account.Credentials.from_service_account_info(
+            credential, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # BEGIN VENDORED cloud_logging.py
+    import atexit
+    import queue
+
+    CAPACITY = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+    CLOSE_TIMEOUT = 10.0
+    SPILL_PATH = "log_spill.jsonl"
+
+
+    class CloudLoggingSink:
+        """
+        Write batches of log entries to Cloud Logging. The client is created on
+        the first batch, i.e. in the flusher thread, so building a logger never
+        waits on credentials or the network
+
+        Parameters
+        ----------
+        client_factory : callable
+            DESCRIPTION: returns the Cloud Logging client, e.g.
+            functools.partial(gcp_clients.logging_client, credential_path).
+            Components, which cannot import gcp_clients, build their own
+        log_name : str
+            DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+        """
+
+        def __init__(self, client_factory, log_name: str = "python"):
+            self.client_factory = client_factory
+            self.log_name = log_name
+            self.cloud_logger = None
+
+        def __call__(self, entries: list):
+            if self.cloud_logger is None:
+                self.cloud_logger = self.client_factory().logger(self.log_name)
+            batch = self.cloud_logger.batch()
+            for entry in entries:
+                payload = dict(entry)
+                batch.log_struct(payload, severity=payload.pop("severity"))
+            batch.commit()
+
+
+    class BatchingHandler(logging.Handler):
+        """
+        Non-blocking logging handler. emit only formats the record and puts it
+        on a bounded in-memory queue; a background thread sends the entries to
+        the sink in batches of up to batch_size every flush_interval seconds.
+        Entries that find the queue full, that the sink rejects or that arrive
+        after close are appended to a local json lines spill file, and close
+        (registered with atexit) drains the queue before the process exits
+
+        Parameters
+        ----------
+        sink : callable
+            DESCRIPTION: called with a list of entry dicts (message, severity,
+            logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+            tests, the append method of a local list
+        capacity : int
+            DESCRIPTION: queue size before entries spill to disk
+        batch_size : int
+            DESCRIPTION: maximum entries per sink call
+        flush_interval : float
+            DESCRIPTION: seconds a partial batch waits before it is sent
+        spill_path : str
+            DESCRIPTION: local fallback file
+        close_timeout : float
+            DESCRIPTION: seconds close waits for the flusher before spilling what
+            is left
+
+        """
+
+        def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                     flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                     close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+            super().__init__(level)
+            self.sink = sink
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.spill_path = spill_path
+            self.close_timeout = close_timeout
+            self.queue = queue.Queue(maxsize=capacity)
+            self.spill_lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
+
+        def entry(self, record: logging.LogRecord):
+            return {
+                "message": self.format(record),
+                "severity": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "function": record.funcName,
+                "timestamp": record.created,
+            }
+
+        def emit(self, record: logging.LogRecord):
+            try:
+                entry = self.entry(record)
+            except Exception:
+                self.handleError(record)
+                return
+            if self.stopped.is_set():
+                self.spill([entry])
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.spill([entry])
+
+        def spill(self, entries: list):
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for entry in entries:
+                    spill_file.write(json.dumps(entry) + "\n")
+
+        def send(self, entries: list):
+            try:
+                self.sink(entries)
+            except Exception:
+                self.spill(entries)
+
+        def run(self):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    if entry is None:
+                        break
+                    batch.append(entry)
+                except queue.Empty:
+                    pass
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self.send(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self.send(batch)
+
+        def close(self):
+            if not self.stopped.is_set():
+                self.stopped.set()
+                try:
+                    self.queue.put(None, timeout=self.close_timeout)
+                except queue.Full:
+                    pass
+                self.flusher.join(timeout=self.close_timeout)
+                leftover = []
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        leftover.append(entry)
+                if leftover:
+                    self.spill(leftover)
+            super().close()
+    # END VENDORED cloud_logging.py
+
+    def get_logger():
+        """
+        Create logging object for pipeline logging. Records go to a
+        cloud_logging.BatchingHandler, whose flusher thread creates the
+        Cloud Logging client on the first batch
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        cloud_logger : OBJ
+            DESCRIPTION: logging instance
 
-        client_object = logging_v2.client.Client(credentials=credentials)
+        """
         google_log_format = logging.Formatter(
             fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
             datefmt="%Y-%m-$dT%H:%M:%S")
-        handler = client_object.get_default_handler()
+        handler = BatchingHandler(CloudLoggingSink(
+            lambda: logging_v2.client.Client(credentials=get_credentials())))
         handler.setFormatter(google_log_format)
 
         cloud_logger = logging.getLogger("data-ingestion")
         cloud_logger.setLevel("INFO")
+        # a process running several components keeps only the latest handler
+        for previous in cloud_logger.handlers[:]:
+            cloud_logger.removeHandler(previous)
+            previous.close()
         cloud_logger.addHandler(handler)
 
         return cloud_logger
 
     log = get_logger()
 
-    def load_raw_data(path: str, bq_query: str):
+    file_extensions = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+    if output_format not in file_extensions:
+        raise ValueError(f"unsupported output_format: {output_format}")
+    file_extension = file_extensions[output_format]
+
+    def open_writer(sink, schema: pa.Schema):
+        """
+        Open an incremental Arrow writer for the configured output format
+
+        Parameters
+        ----------
+        sink : file object
+            DESCRIPTION: writable file handle of the output artifact
+        schema : pa.Schema
+            DESCRIPTION: schema of the record batches to be written
+
+        Returns
+        -------
+        writer : OBJ
+            DESCRIPTION: writer exposing write_table() and close()
+
+        """
+        if output_format == "parquet":
+            return pq.ParquetWriter(sink, schema, compression="zstd")
+        if output_format == "feather":
+            return pa.ipc.new_file(
+                sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        return pa_csv.CSVWriter(sink, schema)
+
+    def write_frame(df: pd.DataFrame, artifact: Output[Dataset]):
+        """
+        Write a pandas split to its Dataset artifact in the configured format
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DESCRIPTION: split dataframe
+        artifact : Output[Dataset]
+            DESCRIPTION: output dataset artifact
+
+        Returns
+        -------
+        None
+
+        """
+        # written through gcsfs like the streamed splits, not pandas' own gs:// handling
+        with gcsfs.GCSFileSystem().open(f"{artifact.uri}{file_extension}", "wb") as sink:
+            if output_format == "parquet":
+                df.to_parquet(sink, compression="zstd", index=False)
+            elif output_format == "feather":
+                df.reset_index(drop=True).to_feather(sink, compression="zstd")
+            else:
+                df.to_csv(sink, index=False)
+
+    @functools.lru_cache(maxsize=None)
+    def get_bq_clients():
+        """
+        Create BigQuery and BigQuery Storage read clients once, on the shared
+        credentials. The BigQuery client runs on an authorized session with
+        a connection pool sized for the concurrent stream readers
+
+        Returns
+        -------
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client
+        read_client : bigquery_storage.BigQueryReadClient
+            DESCRIPTION: Storage Read API client
+
+        """
+        credentials = get_credentials()
+        session = AuthorizedSession(credentials)
+        pool_size = max(max_stream_count, 10)
+        session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        client = bigquery.Client(project=credentials.project_id, credentials=credentials,
+                                 _http=session)
+        read_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+        return client, read_client
+
+    def query_config(query_parameters: list = None):
+        return bigquery.QueryJobConfig(query_parameters=query_parameters) if query_parameters else None
+
+    def load_raw_data(client: bigquery.Client, bq_query: str, query_parameters: list = None):
         """
         Read dara from bigquery
 
         Parameters
         ----------
-        path : str
-            DESCRIPTION: credential file path
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client
+        bq_query : str
+            DESCRIPTION: Query string
+        query_parameters : list, optional
+            DESCRIPTION: parameters referenced by the query
 
         Returns
         -------
@@ -115,11 +448,7 @@ def read_data(
             DESCRIPTION: returns pandas dataframe based on the 
 
         """
-        
-        gcs_file_system = gcsfs.GCSFileSystem()
-        cred = json.load(gcs_file_system.open(path))
-        client = bigquery.Client.from_service_account_info(cred)
-        job = client.query(bq_query)
+        job = client.query(bq_query, job_config=query_config(query_parameters))
         df = job.result().to_dataframe()
         return df
 
@@ -145,28 +474,869 @@ def read_data(
         train_data, data_eval = train_test_split(df, test_size=0.3, random_state=42)
         val_data, test_data = train_test_split(data_eval, test_size=0.5, random_state=42)
         return train_data, test_data, val_data
-    
-    dataframe = load_raw_data(credential_path, bq_query)
-    dataframe.replace([np.inf, -np.inf], np.nan, inplace=True)
-    dataframe.dropna(inplace = True)
-    log.info("dataframe shape: ", dataframe.shape)
-    log.info("cols= ", dataframe.columns)
-    
-    train_data, test_data, val_data = pre_processing(
-        df= dataframe, 
-    )
-    log.info("train_data shape:", train_data.shape)
-    log.info("test_data shape:", test_data.shape)
-    log.info("val_data shape:", val_data.shape)
-
-    train_data.to_csv(f"{train_dataset.uri}.csv", index=False)
-    train_dataset.metadata["name"] = "train_data"
-    train_dataset.metadata["processed_data_path"] = train_dataset.uri
-
-    test_data.to_csv(f"{test_dataset.uri}.csv", index=False)
-    test_dataset.metadata["name"] = "test_data"
-    test_dataset.metadata["processed_data_path"] = test_dataset.uri
-
-    val_data.to_csv(f"{val_dataset.uri}.csv", index=False)
-    val_dataset.metadata["name"] = "val_data"
-    val_dataset.metadata["processed_data_path"] = val_dataset.uri
\ No newline at end of file
+
+    def clean_frame(df: pd.DataFrame):
+        """
+        Drop rows holding nulls, NaN or +/-inf in any column of a dataframe
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DESCRIPTION: Input dataframe
+
+        Returns
+        -------
+        pd.DataFrame
+            DESCRIPTION: dataframe without incomplete rows
+
+        """
+        df.replace([np.inf, -np.inf], np.nan, inplace=True)
+        df.dropna(inplace = True)
+        return df
+
+    def clean_batch(batch: pa.RecordBatch):
+        """
+        Drop rows holding nulls, NaN or +/-inf in any column of an Arrow batch
+
+        Parameters
+        ----------
+        batch : pa.RecordBatch
+            DESCRIPTION: record batch read from a storage stream
+
+        Returns
+        -------
+        pa.RecordBatch
+            DESCRIPTION: batch without incomplete rows
+
+        """
+        mask = None
+        for column in batch.columns:
+            valid = pc.is_valid(column)
+            if pa.types.is_floating(column.type):
+                valid = pc.and_(valid, pc.is_finite(column))
+            mask = valid if mask is None else pc.and_(mask, valid)
+        if mask is None:
+            return batch
+        return batch.filter(mask)
+
+    def split_batch(batch: pa.RecordBatch, rng: np.random.Generator):
+        """
+        Assign every row of a batch to train (70%), test (15%) or validation (15%)
+
+        Parameters
+        ----------
+        batch : pa.RecordBatch
+            DESCRIPTION: cleaned record batch
+        rng : np.random.Generator
+            DESCRIPTION: random generator owned by the calling stream
+
+        Returns
+        -------
+        dict
+            DESCRIPTION: split name mapped to its share of the batch
+
+        """
+        draw = rng.random(batch.num_rows)
+        return {
+            "train": batch.filter(pa.array(draw < 0.7)),
+            "val": batch.filter(pa.array((draw >= 0.7) & (draw < 0.85))),
+            "test": batch.filter(pa.array(draw >= 0.85)),
+        }
+
+    def run_query(client: bigquery.Client, bq_query: str, query_parameters: list = None):
+        """
+        Run a query to completion and return its destination table
+
+        Parameters
+        ----------
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client
+        bq_query : str
+            DESCRIPTION: Query string
+        query_parameters : list, optional
+            DESCRIPTION: parameters referenced by the query
+
+        Returns
+        -------
+        bigquery.TableReference
+            DESCRIPTION: (temporary) table holding the query result
+
+        """
+        job = client.query(bq_query, job_config=query_config(query_parameters))
+        job.result()
+        log.info(f"query processed {job.total_bytes_processed} bytes")
+        return job.destination
+
+    def open_session(client: bigquery.Client, read_client, table,
+                     row_restriction: str = "", selected_fields: list = None):
+        """
+        Open a Storage Read API session delivering Arrow record batches
+
+        Parameters
+        ----------
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client, used for the billing project
+        read_client : bigquery_storage.BigQueryReadClient
+            DESCRIPTION: Storage Read API client
+        table : bigquery.TableReference
+            DESCRIPTION: table to read
+        row_restriction : str, optional
+            DESCRIPTION: SQL predicate evaluated server side
+        selected_fields : list, optional
+            DESCRIPTION: columns to read, all columns when None
+
+        Returns
+        -------
+        session : bigquery_storage.types.ReadSession
+            DESCRIPTION: read session with up to max_stream_count streams
+
+        """
+        read_options = bigquery_storage.types.ReadSession.TableReadOptions(
+            row_restriction=row_restriction,
+            selected_fields=selected_fields or [],
+        )
+        session = read_client.create_read_session(
+            parent=f"projects/{client.project}",
+            read_session=bigquery_storage.types.ReadSession(
+                table=f"projects/{table.project}/datasets/{table.dataset_id}/tables/{table.table_id}",
+                data_format=bigquery_storage.types.DataFormat.ARROW,
+                read_options=read_options,
+            ),
+            max_stream_count=max_stream_count,
+        )
+        log.info(f"read session {session.name} opened with {len(session.streams)} streams")
+        return session
+
+    def session_schema(session):
+        return pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+
+    def read_session(read_client, session, handle_batch):
+        """
+        Read all streams of a session in parallel, handing every cleaned
+        record batch to a callback as it arrives so memory is bounded by
+        batch size
+
+        Parameters
+        ----------
+        read_client : bigquery_storage.BigQueryReadClient
+            DESCRIPTION: Storage Read API client
+        session : bigquery_storage.types.ReadSession
+            DESCRIPTION: session opened by open_session
+        handle_batch : callable
+            DESCRIPTION: called as handle_batch(batch, stream_index) from the
+            reader threads
+
+        Returns
+        -------
+        None
+
+        """
+        def read_stream(stream_index: int):
+            reader = read_client.read_rows(session.streams[stream_index].name)
+            for page in reader.rows(session).pages:
+                handle_batch(clean_batch(page.to_arrow()), stream_index)
+
+        if session.streams:
+            with ThreadPoolExecutor(max_workers=len(session.streams)) as executor:
+                list(executor.map(read_stream, range(len(session.streams))))
+
+    max_categories = 1000
+    category_ratio = 0.5
+
+    def profile_frame(df: pd.DataFrame):
+        """
+        Collect the statistics needed to pick a compact dtype per column
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DESCRIPTION: cleaned dataframe or record batch converted to pandas
+
+        Returns
+        -------
+        profile : dict
+            DESCRIPTION: column name mapped to its statistics
+
+        """
+        profile = {}
+        for column, series in df.items():
+            if pd.api.types.is_bool_dtype(series):
+                profile[column] = {"kind": "other", "dtype": "bool"}
+            elif pd.api.types.is_integer_dtype(series):
+                profile[column] = {"kind": "int",
+                                   "min": int(series.min()) if len(series) else 0,
+                                   "max": int(series.max()) if len(series) else 0}
+            elif pd.api.types.is_float_dtype(series):
+                values = series.to_numpy(dtype=np.float64)
+                # float32 only when every value round-trips exactly
+                with np.errstate(over="ignore", invalid="ignore"):
+                    narrowed = values.astype(np.float32).astype(np.float64)
+                float32_ok = bool(np.array_equal(narrowed, values, equal_nan=True))
+                profile[column] = {"kind": "float", "float32_ok": float32_ok}
+            elif (isinstance(series.dtype, pd.CategoricalDtype)
+                  or pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty")):
+                values = series.dropna().unique()
+                profile[column] = {"kind": "string", "rows": len(series),
+                                   "values": set(map(str, values))
+                                   if len(values) <= max_categories else None}
+            else:
+                profile[column] = {"kind": "other", "dtype": str(series.dtype)}
+        return profile
+
+    def profile_batch(batch: pa.RecordBatch):
+        """
+        Collect the statistics of profile_frame from the Arrow arrays of a
+        cleaned record batch, without converting it to pandas
+
+        Parameters
+        ----------
+        batch : pa.RecordBatch
+            DESCRIPTION: batch without nulls, NaN or +/-inf, see clean_batch
+
+        Returns
+        -------
+        profile : dict
+            DESCRIPTION: column name mapped to its statistics
+
+        """
+        profile = {}
+        for field, array in zip(batch.schema, batch.columns):
+            if pa.types.is_dictionary(field.type):
+                array = array.dictionary_decode()
+            if pa.types.is_boolean(array.type):
+                profile[field.name] = {"kind": "other", "dtype": "bool"}
+            elif pa.types.is_integer(array.type):
+                bounds = pc.min_max(array)
+                profile[field.name] = {"kind": "int", "min": bounds["min"].as_py() or 0,
+                                       "max": bounds["max"].as_py() or 0}
+            elif pa.types.is_floating(array.type):
+                # float32 only when every value round-trips exactly
+                narrowed = pc.cast(pc.cast(array, pa.float32(), safe=False), array.type)
+                profile[field.name] = {"kind": "float",
+                                       "float32_ok": pc.all(pc.equal(narrowed, array)).as_py() is not False}
+            elif pa.types.is_string(array.type) or pa.types.is_large_string(array.type) \
+                    or pa.types.is_null(array.type):
+                values = pc.unique(array)
+                profile[field.name] = {"kind": "string", "rows": len(array),
+                                       "values": set(values.drop_null().to_pylist())
+                                       if len(values) <= max_categories else None}
+            else:
+                profile[field.name] = {"kind": "other", "dtype": str(array.slice(0, 0).to_pandas().dtype)}
+        return profile
+
+    def merge_profiles(left: dict, right: dict):
+        """
+        Combine the profiles of two batches of the same table
+
+        Parameters
+        ----------
+        left : dict
+            DESCRIPTION: profile of the rows seen so far, may be empty
+        right : dict
+            DESCRIPTION: profile of the next batch
+
+        Returns
+        -------
+        merged : dict
+            DESCRIPTION: profile covering both inputs
+
+        """
+        merged = dict(left)
+        for column, stats in right.items():
+            seen = merged.get(column)
+            if seen is None:
+                merged[column] = stats
+            elif seen["kind"] == "int":
+                merged[column] = {"kind": "int", "min": min(seen["min"], stats["min"]),
+                                  "max": max(seen["max"], stats["max"])}
+            elif seen["kind"] == "float":
+                merged[column] = {"kind": "float",
+                                  "float32_ok": seen["float32_ok"] and stats["float32_ok"]}
+            elif seen["kind"] == "string":
+                values = None
+                if seen["values"] is not None and stats["values"] is not None:
+                    values = seen["values"] | stats["values"]
+                    if len(values) > max_categories:
+                        values = None
+                merged[column] = {"kind": "string", "rows": seen["rows"] + stats["rows"],
+                                  "values": values}
+        return merged
+
+    def compact_schema(profile: dict):
+        """
+        Narrowest safe dtype per column: smallest integer width holding the
+        observed range, float32 where every value survives the round trip
+        exactly, categoricals for low-cardinality strings
+
+        Parameters
+        ----------
+        profile : dict
+            DESCRIPTION: profile from profile_frame/merge_profiles
+
+        Returns
+        -------
+        schema : dict
+            DESCRIPTION: column name mapped to {"dtype": ..., "categories": [...]}
+
+        """
+        schema = {}
+        for column, stats in profile.items():
+            if stats["kind"] == "int":
+                dtype = next(candidate for candidate in ("int8", "int16", "int32", "int64")
+                             if np.iinfo(candidate).min <= stats["min"]
+                             and stats["max"] <= np.iinfo(candidate).max)
+                schema[column] = {"dtype": dtype}
+            elif stats["kind"] == "float":
+                schema[column] = {"dtype": "float32" if stats["float32_ok"] else "float64"}
+            elif stats["kind"] == "string":
+                values = stats["values"]
+                if values is not None and len(values) <= category_ratio * max(stats["rows"], 1):
+                    schema[column] = {"dtype": "category", "categories": sorted(values)}
+                else:
+                    schema[column] = {"dtype": "object"}
+            else:
+                schema[column] = {"dtype": stats["dtype"]}
+        return schema
+
+    def widen_schema(left: dict, right: dict):
+        """
+        Smallest schema able to hold data written under either input schema
+
+        Parameters
+        ----------
+        left : dict
+            DESCRIPTION: compact schema of earlier parts, may be empty
+        right : dict
+            DESCRIPTION: compact schema of the newest part
+
+        Returns
+        -------
+        widened : dict
+            DESCRIPTION: compact schema covering both
+
+        """
+        widened = dict(left)
+        for column, spec in right.items():
+            seen = widened.get(column)
+            if seen is None or seen == spec:
+                widened[column] = spec
+            elif seen["dtype"] == "category" and spec["dtype"] == "category":
+                categories = sorted(set(seen["categories"]) | set(spec["categories"]))
+                widened[column] = ({"dtype": "category", "categories": categories}
+                                   if len(categories) <= max_categories else {"dtype": "object"})
+            else:
+                try:
+                    widened[column] = {"dtype": str(np.promote_types(seen["dtype"], spec["dtype"]))}
+                except TypeError:
+                    widened[column] = {"dtype": "object"}
+        return widened
+
+    def apply_schema(df: pd.DataFrame, schema: dict):
+        """
+        Cast a dataframe to a compact schema
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DESCRIPTION: Input dataframe
+        schema : dict
+            DESCRIPTION: schema from compact_schema
+
+        Returns
+        -------
+        pd.DataFrame
+            DESCRIPTION: dataframe using the compact dtypes
+
+        """
+        dtypes = {column: pd.CategoricalDtype(spec["categories"]) if spec["dtype"] == "category"
+                  else spec["dtype"]
+                  for column, spec in schema.items() if column in df.columns}
+        return df.astype(dtypes)
+
+    class SplitWriters:
+        """
+        Thread-safe incremental writers for the split Dataset artifacts
+        """
+
+        def __init__(self, outputs: dict, schema: pa.Schema):
+            self.gcs_file_system = gcsfs.GCSFileSystem()
+            self.sinks = {}
+            self.writers = {}
+            self.locks = {}
+            self.rows = {}
+            # one profile per reader thread, merged once reading is done, so
+            # streams do not serialise on a shared profile
+            self.profiles = {}
+            for name, artifact in outputs.items():
+                self.sinks[name] = self.gcs_file_system.open(
+                    f"{artifact.uri}{file_extension}", "wb")
+                self.writers[name] = open_writer(self.sinks[name], schema)
+                self.locks[name] = threading.Lock()
+                self.rows[name] = 0
+
+        def write(self, name: str, batch: pa.RecordBatch):
+            if batch.num_rows == 0:
+                return
+            if optimise_schema:
+                thread = threading.get_ident()
+                self.profiles[thread] = merge_profiles(self.profiles.get(thread, {}), profile_batch(batch))
+            with self.locks[name]:
+                self.writers[name].write_table(pa.Table.from_batches([batch]))
+                self.rows[name] += batch.num_rows
+
+        @property
+        def profile(self):
+            return functools.reduce(merge_profiles, self.profiles.values(), {})
+
+        def close(self):
+            for name in self.writers:
+                self.writers[name].close()
+                self.sinks[name].close()
+
+    split_column = "_split_bucket"
+    split_buckets = 1000
+
+    def split_ranges():
+        """
+        Translate split_spec fractions into contiguous hash-bucket ranges
+
+        Raises
+        ------
+        ValueError
+            DESCRIPTION: Raise error if the fractions are invalid
+
+        Returns
+        -------
+        dict
+            DESCRIPTION: split name mapped to its [lower, upper) bucket range
+
+        """
+        fractions = split_spec.get("fractions", {})
+        unknown = set(fractions) - {"train", "test", "val"}
+        if unknown:
+            raise ValueError(f"unknown splits in split_spec: {sorted(unknown)}")
+        if abs(sum(fractions.values()) - 1.0) > 1e-6:
+            raise ValueError("split_spec fractions must sum to 1")
+        ranges, cumulative, lower = {}, 0.0, 0
+        for name in ("train", "test", "val"):
+            cumulative += fractions.get(name, 0.0)
+            upper = int(round(cumulative * split_buckets))
+            ranges[name] = (lower, upper)
+            lower = upper
+        return ranges
+
+    def row_key():
+        """
+        SQL expression identifying a row of the source query aliased as
+        source: the split_spec key columns, the whole row when there are none
+
+        """
+        key_columns = split_spec.get("key_columns", [])
+        if key_columns:
+            return "CONCAT(" + ", '|', ".join(
+                f"IFNULL(CAST(`{column}` AS STRING), '')" for column in key_columns) + ")"
+        return "TO_JSON_STRING(source)"
+
+    def bucketed_query(bq_query: str):
+        """
+        Wrap the user query so every row carries a deterministic hash bucket
+
+        Parameters
+        ----------
+        bq_query : str
+            DESCRIPTION: Query string
+
+        Returns
+        -------
+        str
+            DESCRIPTION: query adding the split bucket column
+
+        """
+        return (f"SELECT source.*, MOD(ABS(FARM_FINGERPRINT({row_key()})), {split_buckets}) "
+                f"AS {split_column} FROM ({bq_query}) AS source")
+
+    def bucket_predicate(bounds: tuple):
+        return f"{split_column} >= {bounds[0]} AND {split_column} < {bounds[1]}"
+
+    def ingest(query: str, query_parameters: list = None):
+        """
+        Query BigQuery and write the train, test and validation splits to
+        the output artifacts
+
+        Parameters
+        ----------
+        query : str
+            DESCRIPTION: Query string
+        query_parameters : list, optional
+            DESCRIPTION: parameters referenced by the query
+
+        Returns
+        -------
+        columns : dict
+            DESCRIPTION: column name mapped to its data type as read
+        schema : dict
+            DESCRIPTION: compact schema for training to load the data with,
+            empty when optimise_schema is disabled
+
+        """
+        profile = {}
+        if split_spec:
+            # hash-bucket split pushed down into BigQuery, each split is read
+            # straight into its own artifact
+            ranges = split_ranges()
+            table = run_query(client, bucketed_query(query), query_parameters)
+            if ingestion_mode == "storage_stream":
+                fields = [field.name for field in client.get_table(table).schema
+                          if field.name != split_column]
+                sessions = {name: open_session(client, read_client, table,
+                                               row_restriction=bucket_predicate(bounds),
+                                               selected_fields=fields)
+                            for name, bounds in ranges.items()}
+                schema = session_schema(sessions["train"])
+                writers = SplitWriters(outputs, schema)
+                try:
+                    for name, session in sessions.items():
+                        read_session(read_client, session,
+                                     lambda batch, _, name=name: writers.write(name, batch))
+                finally:
+                    writers.close()
+                rows = writers.rows
+                profile = writers.profile
+                columns = {field.name: str(field.type) for field in schema}
+            else:
+                rows = {}
+                for name, bounds in ranges.items():
+                    split_df = clean_frame(load_raw_data(
+                        client,
+                        f"SELECT * EXCEPT({split_column}) "
+                        f"FROM `{table.project}.{table.dataset_id}.{table.table_id}` "
+                        f"WHERE {bucket_predicate(bounds)}"))
+                    columns = {column: str(dtype) for column, dtype in split_df.dtypes.items()}
+                    if optimise_schema:
+                        split_profile = profile_frame(split_df)
+                        split_df = apply_schema(split_df, compact_schema(split_profile))
+                        profile = merge_profiles(profile, split_profile)
+                    write_frame(split_df, outputs[name])
+                    rows[name] = len(split_df)
+            for name, count in rows.items():
+                log.info(f"{name}_data rows: {count}")
+        elif ingestion_mode == "storage_stream":
+            session = open_session(client, read_client, run_query(client, query, query_parameters))
+            schema = session_schema(session)
+            writers = SplitWriters(outputs, schema)
+            rngs = {}
+
+            def split_and_write(batch: pa.RecordBatch, stream_index: int):
+                rng = rngs.setdefault(stream_index, np.random.default_rng(42 + stream_index))
+                for name, part in split_batch(batch, rng).items():
+                    writers.write(name, part)
+
+            try:
+                read_session(read_client, session, split_and_write)
+            finally:
+                writers.close()
+            for name, count in writers.rows.items():
+                log.info(f"{name}_data rows: {count}")
+            profile = writers.profile
+            columns = {field.name: str(field.type) for field in schema}
+        else:
+            dataframe = clean_frame(load_raw_data(client, query, query_parameters))
+            columns = {column: str(dtype) for column, dtype in dataframe.dtypes.items()}
+            if optimise_schema:
+                memory_before = dataframe.memory_usage(deep=True).sum()
+                profile = profile_frame(dataframe)
+                dataframe = apply_schema(dataframe, compact_schema(profile))
+                log.info(f"compact schema: {memory_before} -> "
+                         f"{dataframe.memory_usage(deep=True).sum()} bytes in memory")
+            log.info(f"dataframe shape: {dataframe.shape}")
+            log.info(f"cols= {dataframe.columns}")
+
+            train_data, test_data, val_data = pre_processing(
+                df= dataframe, 
+            )
+            log.info(f"train_data shape:{train_data.shape}")
+            log.info(f"test_data shape:{test_data.shape}")
+            log.info(f"val_data shape:{val_data.shape}")
+
+            write_frame(train_data, train_dataset)
+            write_frame(test_data, test_dataset)
+            write_frame(val_data, val_dataset)
+        return columns, compact_schema(profile)
+
+    # bump whenever what an entry holds changes for the same settings, so
+    # entries written by earlier versions of this component are not reused
+    cache_version = 2
+
+    def cache_key(client: bigquery.Client, bq_query: str, table_versions: bool = True):
+        """
+        Fingerprint of everything that determines the materialised splits:
+        normalised query text, split, schema and format settings, the cache
+        version and the last_modified timestamp of every table the query
+        references
+
+        Parameters
+        ----------
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client
+        bq_query : str
+            DESCRIPTION: Query string
+        table_versions : bool, optional
+            DESCRIPTION: include table versions, left out for incremental
+            datasets which must keep their key while the sources grow
+
+        Returns
+        -------
+        str
+            DESCRIPTION: sha256 hex digest
+
+        """
+        versions = []
+        if table_versions:
+            dry_run = client.query(
+                bq_query, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+            versions = sorted(
+                f"{ref.project}.{ref.dataset_id}.{ref.table_id}@{client.get_table(ref).modified.isoformat()}"
+                for ref in dry_run.referenced_tables)
+        payload = json.dumps({
+            "version": cache_version,
+            "query": " ".join(bq_query.split()),
+            "split_spec": split_spec,
+            "ingestion_mode": ingestion_mode,
+            "output_format": output_format,
+            "watermark_column": watermark_column,
+            "optimise_schema": optimise_schema,
+            "tables": versions,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def evict_cache(gcs_file_system, keep: str):
+        """
+        Drop least recently used cache entries until the cache fits into
+        cache_max_bytes and cache_max_entries (0 disables a bound).
+        Incremental entries (watermark_column) hold the only copy of the rows
+        below their watermark, they are never evicted nor counted
+
+        Parameters
+        ----------
+        gcs_file_system : gcsfs.GCSFileSystem
+            DESCRIPTION: GCS file system
+        keep : str
+            DESCRIPTION: cache entry that must not be evicted
+
+        Returns
+        -------
+        None
+
+        """
+        manifests = []
+        for path in gcs_file_system.glob(f"{cache_root.rstrip('/')}/*/manifest.json"):
+            with gcs_file_system.open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if "watermark" not in manifest:
+                manifests.append(manifest)
+        manifests.sort(key=lambda manifest: manifest["last_access"])
+        total_bytes = sum(manifest["size_bytes"] for manifest in manifests)
+        total_entries = len(manifests)
+        for manifest in manifests:
+            over_bytes = cache_max_bytes and total_bytes > cache_max_bytes
+            over_entries = cache_max_entries and total_entries > cache_max_entries
+            if not (over_bytes or over_entries):
+                break
+            if manifest["entry"] == keep:
+                continue
+            log.info(f"evicting ingestion cache entry {manifest['entry']}")
+            gcs_file_system.rm(manifest["entry"], recursive=True)
+            total_bytes -= manifest["size_bytes"]
+            total_entries -= 1
+
+    def query_watermark(client: bigquery.Client, bq_query: str):
+        """
+        Current high-watermark of the source query
+
+        Parameters
+        ----------
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client
+        bq_query : str
+            DESCRIPTION: Query string
+
+        Returns
+        -------
+        dict
+            DESCRIPTION: {"type": BigQuery type, "value": value as string},
+            None when the query returns no watermark value
+
+        """
+        result = client.query(
+            f"SELECT MAX(`{watermark_column}`) AS watermark FROM ({bq_query}) AS source"
+        ).result()
+        value = list(result)[0]["watermark"]
+        if value is None:
+            return None
+        field_type = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL"}.get(
+            result.schema[0].field_type, result.schema[0].field_type)
+        text = value.isoformat() if hasattr(value, "isoformat") else str(value)
+        return {"type": field_type, "value": text}
+
+    def watermark_literal(watermark: dict):
+        value = watermark["value"].replace("'", "\\'")
+        return f"CAST('{value}' AS {watermark['type']})"
+
+    def boundary_keys(client: bigquery.Client, bq_query: str, watermark: dict):
+        """
+        Fingerprints of the rows sitting exactly on a watermark value, later
+        appends may still add rows with the same value
+
+        Parameters
+        ----------
+        client : bigquery.Client
+            DESCRIPTION: BigQuery client
+        bq_query : str
+            DESCRIPTION: Query string
+        watermark : dict
+            DESCRIPTION: watermark from query_watermark
+
+        Returns
+        -------
+        list
+            DESCRIPTION: FARM_FINGERPRINT of row_key for every such row
+
+        """
+        result = client.query(
+            f"SELECT FARM_FINGERPRINT({row_key()}) AS fingerprint FROM ({bq_query}) AS source "
+            f"WHERE `{watermark_column}` = {watermark_literal(watermark)}"
+        ).result()
+        return [row["fingerprint"] for row in result]
+
+    def incremental_query(bq_query: str, lower: dict, upper: dict, seen_keys: list = None):
+        """
+        Restrict the source query to rows in [lower, upper] of the watermark
+        column, leaving out the rows on lower that earlier runs ingested
+
+        Parameters
+        ----------
+        bq_query : str
+            DESCRIPTION: Query string
+        lower : dict
+            DESCRIPTION: previous watermark, None on the first run
+        upper : dict
+            DESCRIPTION: current watermark
+        seen_keys : list, optional
+            DESCRIPTION: boundary_keys of lower, passed as the @seen_keys
+            query parameter when not empty. None for manifests written
+            before the keys were recorded, which read (lower, upper]
+
+        Returns
+        -------
+        str
+            DESCRIPTION: incremental query string
+
+        """
+        predicate = f"`{watermark_column}` <= {watermark_literal(upper)}"
+        if lower is not None and seen_keys is None:
+            predicate = f"`{watermark_column}` > {watermark_literal(lower)} AND {predicate}"
+        elif lower is not None:
+            predicate = f"`{watermark_column}` >= {watermark_literal(lower)} AND {predicate}"
+            if seen_keys:
+                predicate += (f" AND NOT (`{watermark_column}` = {watermark_literal(lower)} "
+                              f"AND FARM_FINGERPRINT({row_key()}) IN UNNEST(@seen_keys))")
+        return f"SELECT * FROM ({bq_query}) AS source WHERE {predicate}"
+
+    outputs = {"train": train_dataset, "test": test_dataset, "val": val_dataset}
+    if ingestion_mode not in ("dataframe", "storage_stream"):
+        raise ValueError(f"unsupported ingestion_mode: {ingestion_mode}")
+
+    client, read_client = get_bq_clients()
+
+    if watermark_column:
+        if not cache_root:
+            raise ValueError("watermark_column requires cache_root")
+        # history lives under a cache entry keyed without table versions;
+        # each run appends one part file per split holding the rows in
+        # [previous watermark, current watermark] not ingested before. The
+        # keys of the rows on the watermark are recorded, rows appended
+        # later with the same value are picked up by the next run
+        gcs_file_system = gcsfs.GCSFileSystem()
+        entry = f"{cache_root.rstrip('/')}/{cache_key(client, bq_query, table_versions=False)}"
+        manifest_path = f"{entry}/manifest.json"
+        manifest = {"entry": entry, "created": time.time(), "watermark": None,
+                    "parts": [], "columns": {}}
+        if gcs_file_system.exists(manifest_path):
+            with gcs_file_system.open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        upper = query_watermark(client, bq_query)
+        # keys are read before the rows, a row appended in between is
+        # ingested again by the next run rather than lost
+        upper_keys = [] if upper is None else boundary_keys(client, bq_query, upper)
+        if upper is not None and (upper != manifest["watermark"]
+                                  or len(upper_keys) != manifest.get("boundary_rows", len(upper_keys))):
+            part = f"part-{time.strftime('%Y%m%d%H%M%S')}"
+            seen_keys = manifest.get("boundary_keys") if manifest["watermark"] is not None else []
+            log.info(f"ingesting {watermark_column} in [{manifest['watermark']}, {upper}] without "
+                     f"{len(seen_keys or [])} rows already ingested as {part}")
+            for name, artifact in outputs.items():
+                artifact.uri = f"{entry}/{name}_dataset/{part}"
+            manifest["columns"], part_schema = ingest(
+                incremental_query(bq_query, manifest["watermark"], upper, seen_keys),
+                [bigquery.ArrayQueryParameter("seen_keys", "INT64", seen_keys)] if seen_keys else None)
+            manifest["compact_schema"] = widen_schema(
+                manifest.get("compact_schema", {}), part_schema)
+            manifest["parts"].append(part)
+            manifest["watermark"] = upper
+            manifest["boundary_keys"] = sorted(set(upper_keys))
+            manifest["boundary_rows"] = len(upper_keys)
+        else:
+            log.info(f"no rows beyond watermark {manifest['watermark']}")
+        if not manifest["parts"]:
+            raise ValueError(f"query returned no rows with a {watermark_column} value")
+        for name, artifact in outputs.items():
+            artifact.uri = f"{entry}/{name}_dataset"
+        columns = manifest["columns"]
+        schema = manifest.get("compact_schema", {})
+        manifest["size_bytes"] = gcs_file_system.du(entry)
+    elif cache_root:
+        gcs_file_system = gcsfs.GCSFileSystem()
+        entry = f"{cache_root.rstrip('/')}/{cache_key(client, bq_query)}"
+        manifest_path = f"{entry}/manifest.json"
+        # artifacts point at the cache entry, so a hit reuses the stored
+        # splits and a miss materialises them there directly
+        for name, artifact in outputs.items():
+            artifact.uri = f"{entry}/{name}_dataset"
+        if gcs_file_system.exists(manifest_path):
+            log.info(f"ingestion cache hit: {entry}")
+            with gcs_file_system.open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            columns = manifest["columns"]
+            schema = manifest.get("compact_schema", {})
+        else:
+            log.info(f"ingestion cache miss: {entry}")
+            columns, schema = ingest(bq_query)
+            manifest = {
+                "entry": entry,
+                "created": time.time(),
+                "columns": columns,
+                "compact_schema": schema,
+                "size_bytes": gcs_file_system.du(entry),
+            }
+    else:
+        columns, schema = ingest(bq_query)
+
+    if cache_root:
+        manifest["last_access"] = time.time()
+        with gcs_file_system.open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        evict_cache(gcs_file_system, keep=entry)
+
+    for name, artifact in outputs.items():
+        artifact.metadata["name"] = f"{name}_data"
+        artifact.metadata["processed_data_path"] = artifact.uri
+        artifact.metadata["format"] = output_format
+        artifact.metadata["file_extension"] = file_extension
+        artifact.metadata["columns"] = columns
+        artifact.metadata["compact_schema"] = schema
+        artifact.metadata["key_columns"] = split_spec.get("key_columns", [])
+        artifact.metadata["layout"] = "partitioned" if watermark_column else "single_file"
+        if watermark_column:
+            # parts of a run that died before its manifest was written are
+            # not listed, consumers read exactly these
+            artifact.metadata["parts"] = manifest["parts"]
@@ -9,7 +9,7 @@ from kfp.v2.dsl import (
 )
 
 @component(
-    packages_to_install=["google-cloud-aiplatform==1.10.0",
+    packages_to_install=["google-cloud-aiplatform==1.14.0",
         "google-cloud-logging==2.7.0", "gcsfs==2021.11.1"],
     base_image="python:3.9",
     output_component_file="component_artifacts/model_deploy_comp.yaml")
@@ -21,6 +21,9 @@ def deploy_model(
     serving_img: str,
     vertex_endpoint: Output[Artifact],
     vertex_model: Output[Model],
+    machine_type: str = "n1-standard-4",
+    min_replica_count: int = 1,
+    max_replica_count: int = 2,
 ):
     """
     Model deployment on Vertex AI.
@@ -41,6 +44,13 @@ def deploy_model(
         DESCRIPTION.
     vertex_model : Output[Model]
         DESCRIPTION: model id deployed on endpoint
+    machine_type : str, optional
+        DESCRIPTION: machine type of the endpoint replicas, see
+        custom_serving/capacity_planner.py
+    min_replica_count : int, optional
+        DESCRIPTION: replicas serving at all times
+    max_replica_count : int, optional
+        DESCRIPTION: upper bound of the autoscaler
 
     Raises
     ------
@@ -55,6 +65,8 @@ def deploy_model(
     
     from google.cloud import aiplatform
     import errno
+    import functools
+    import hashlib
     import json
     import logging
     import os
@@ -63,9 +75,11 @@ def deploy_model(
     from google.cloud import bigquery, logging_v2
     from google.oauth2 import service_account
 
-    def get_logger():
+    @functools.lru_cache(maxsize=None)
+    def get_credentials():
         """
-        Initialize cloud logger
+        Load the service account key once, the logger and every client in
+        this component share the resulting credentials
 
         Raises
         ------
@@ -74,60 +88,317 @@ def deploy_model(
 
         Returns
         -------
-        cloud_logger : TYPE
-            DESCRIPTION: Logging instance
+        credentials : service_account.Credentials
+            DESCRIPTION: credentials scoped for every Google Cloud API
 
         """
         try:
             gcs_file_system_object = gcsfs.GCSFileSystem()
             credential = json.load(
                 gcs_file_system_object.open(credential_path))
-            credentials = service_account.Credentials.from_service_account_info(
-                credential)
         except FileNotFoundError:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
                                     credential_path)
+        return service_account.Credentials.from_service_account_info(
+            credential, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # BEGIN VENDORED cloud_logging.py
+    import atexit
+    import queue
+    import threading
+    import time
+
+    CAPACITY = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+    CLOSE_TIMEOUT = 10.0
+    SPILL_PATH = "log_spill.jsonl"
+
+
+    class CloudLoggingSink:
+        """
+        Write batches of log entries to Cloud Logging. The client is created on
+        the first batch, i.e. in the flusher thread, so building a logger never
+        waits on credentials or the network
+
+        Parameters
+        ----------
+        client_factory : callable
+            DESCRIPTION: returns the Cloud Logging client, e.g.
+            functools.partial(gcp_clients.logging_client, credential_path).
+            Components, which cannot import gcp_clients, build their own
+        log_name : str
+            DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+        """
+
+        def __init__(self, client_factory, log_name: str = "python"):
+            self.client_factory = client_factory
+            self.log_name = log_name
+            self.cloud_logger = None
+
+        def __call__(self, entries: list):
+            if self.cloud_logger is None:
+                self.cloud_logger = self.client_factory().logger(self.log_name)
+            batch = self.cloud_logger.batch()
+            for entry in entries:
+                payload = dict(entry)
+                batch.log_struct(payload, severity=payload.pop("severity"))
+            batch.commit()
+
+
+    class BatchingHandler(logging.Handler):
+        """
+        Non-blocking logging handler. emit only formats the record and puts it
+        on a bounded in-memory queue; a background thread sends the entries to
+        the sink in batches of up to batch_size every flush_interval seconds.
+        Entries that find the queue full, that the sink rejects or that arrive
+        after close are appended to a local json lines spill file, and close
+        (registered with atexit) drains the queue before the process exits
+
+        Parameters
+        ----------
+        sink : callable
+            DESCRIPTION: called with a list of entry dicts (message, severity,
+            logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+            tests, the append method of a local list
+        capacity : int
+            DESCRIPTION: queue size before entries spill to disk
+        batch_size : int
+            DESCRIPTION: maximum entries per sink call
+        flush_interval : float
+            DESCRIPTION: seconds a partial batch waits before it is sent
+        spill_path : str
+            DESCRIPTION: local fallback file
+        close_timeout : float
+            DESCRIPTION: seconds close waits for the flusher before spilling what
+            is left
+
+        """
+
+        def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                     flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                     close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+            super().__init__(level)
+            self.sink = sink
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.spill_path = spill_path
+            self.close_timeout = close_timeout
+            self.queue = queue.Queue(maxsize=capacity)
+            self.spill_lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
+
+        def entry(self, record: logging.LogRecord):
+            return {
+                "message": self.format(record),
+                "severity": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "function": record.funcName,
+                "timestamp": record.created,
+            }
+
+        def emit(self, record: logging.LogRecord):
+            try:
+                entry = self.entry(record)
+            except Exception:
+                self.handleError(record)
+                return
+            if self.stopped.is_set():
+                self.spill([entry])
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.spill([entry])
+
+        def spill(self, entries: list):
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for entry in entries:
+                    spill_file.write(json.dumps(entry) + "\n")
+
+        def send(self, entries: list):
+            try:
+                self.sink(entries)
+            except Exception:
+                self.spill(entries)
+
+        def run(self):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    if entry is None:
+                        break
+                    batch.append(entry)
+                except queue.Empty:
+                    pass
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self.send(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self.send(batch)
+
+        def close(self):
+            if not self.stopped.is_set():
+                self.stopped.set()
+                try:
+                    self.queue.put(None, timeout=self.close_timeout)
+                except queue.Full:
+                    pass
+                self.flusher.join(timeout=self.close_timeout)
+                leftover = []
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        leftover.append(entry)
+                if leftover:
+                    self.spill(leftover)
+            super().close()
+    # END VENDORED cloud_logging.py
+
+    def get_logger():
+        """
+        Initialize cloud logger. Records go to a
+        cloud_logging.BatchingHandler, whose flusher thread creates the
+        Cloud Logging client on the first batch
 
-        client_object = logging_v2.client.Client(credentials=credentials)
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        cloud_logger : TYPE
+            DESCRIPTION: Logging instance
+
+        """
         google_log_format = logging.Formatter(
             fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
             datefmt="%Y-%m-$dT%H:%M:%S")
-        handler = client_object.get_default_handler()
+        handler = BatchingHandler(CloudLoggingSink(
+            lambda: logging_v2.client.Client(credentials=get_credentials())))
         handler.setFormatter(google_log_format)
 
         cloud_logger = logging.getLogger("data-ingestion")
         cloud_logger.setLevel("INFO")
+        # a process running several components keeps only the latest handler
+        for previous in cloud_logger.handlers[:]:
+            cloud_logger.removeHandler(previous)
+            previous.close()
         cloud_logger.addHandler(handler)
 
         return cloud_logger
 
     log = get_logger()
     
-    gcs_file_system = gcsfs.GCSFileSystem()
-    cred = json.load(gcs_file_system.open(credential_path))
-    credentials = service_account.Credentials.from_service_account_info(cred)
-    aiplatform.init(project=project, location=region, credentials=credentials)
+    aiplatform.init(project=project, location=region, credentials=get_credentials())
     URI = str(model.uri)
-    log.info("artifact_uri= ", URI)
-    log.info("upload model to vertex model registry")
-    deployed_model = aiplatform.Model.upload(
-        display_name="custom-chicago-regression-model",
-        artifact_uri=URI.replace("model",""),
-        serving_container_image_uri=serving_img,
-    )
-    log.info("creating model endpoint")
-    endpoint = aiplatform.Endpoint.create(
-        display_name="chicago-taxi-prediction", project=project, location=region,
-    )
-
-    log.info("endpoint.display_name=", endpoint.display_name)
-    log.info("endpoint.resource_name=", endpoint.resource_name)
-
-    log.info("creating endpoint and deploying model to endpoint")
-    endpoint = deployed_model.deploy(
-        endpoint=endpoint,
-        machine_type="n1-standard-4", min_replica_count=1, max_replica_count=2
-    )
+    log.info(f"artifact_uri= {URI}")
+
+    def artifact_sha256():
+        """
+        Content hash recorded by the training step, computed from the model
+        file for artifacts without one
+
+        Returns
+        -------
+        str
+            DESCRIPTION: hex sha256 of model.joblib
+
+        """
+        recorded = model.metadata.get("sha256") or model.metadata.get("model_info", {}).get("sha256")
+        if recorded:
+            return recorded
+        digest = hashlib.sha256()
+        with open(f"{model.path}.joblib", "rb") as model_file:
+            for block in iter(lambda: model_file.read(8 * 1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    sha256 = artifact_sha256()
+    # label values are limited to 63 characters, the image uri is hashed to fit
+    labels = {"artifact_sha256": sha256[:63],
+              "serving_image_sha256": hashlib.sha256(serving_img.encode()).hexdigest()[:63]}
+    display_name = "custom-chicago-regression-model"
+    registered = aiplatform.Model.list(
+        filter=" AND ".join([f'display_name="{display_name}"']
+                            + [f'labels.{key}="{value}"' for key, value in labels.items()]),
+        order_by="create_time desc")
+    if registered:
+        deployed_model = registered[0]
+        log.info(f"model sha256 {sha256} with {serving_img} already registered as "
+                 f"{deployed_model.resource_name}, registry upload skipped")
+    else:
+        log.info("upload model to vertex model registry")
+        deployed_model = aiplatform.Model.upload(
+            display_name=display_name,
+            artifact_uri=URI.replace("model",""),
+            serving_container_image_uri=serving_img,
+            labels=labels,
+        )
+
+    def deployments():
+        """
+        Endpoints serving deployed_model with the replicas of each deployment
+
+        Returns
+        -------
+        list
+            DESCRIPTION: (endpoint, deployed model id, (machine_type,
+            min_replica_count, max_replica_count)) tuples
+
+        """
+        found = []
+        for reference in deployed_model.gca_resource.deployed_models:
+            served = aiplatform.Endpoint(reference.endpoint)
+            for deployed in served.list_models():
+                if deployed.id == reference.deployed_model_id:
+                    resources = deployed.dedicated_resources
+                    found.append((served, deployed.id, (resources.machine_spec.machine_type,
+                                                        resources.min_replica_count, resources.max_replica_count)))
+        return found
+
+    # the model of an earlier run may already be serving: its endpoint is
+    # reused as it is when the replicas match the request, else the model is
+    # redeployed there with the requested ones and the old deployment removed
+    requested = (machine_type, min_replica_count, max_replica_count)
+    served = deployments() if registered else []
+    matching = [endpoint for endpoint, _, resources in served if resources == requested]
+    if matching:
+        endpoint = matching[0]
+        log.info(f"model already deployed to {endpoint.resource_name} with {requested}, deployment skipped")
+    else:
+        if served:
+            endpoint, outdated, resources = served[0]
+            log.info(f"model deployed to {endpoint.resource_name} with {resources}, redeploying with {requested}")
+        else:
+            log.info("creating model endpoint")
+            endpoint = aiplatform.Endpoint.create(
+                display_name="chicago-taxi-prediction", project=project, location=region,
+            )
+
+            log.info(f"endpoint.display_name={endpoint.display_name}")
+            log.info(f"endpoint.resource_name={endpoint.resource_name}")
+
+        log.info("deploying model to endpoint")
+        endpoint = deployed_model.deploy(
+            endpoint=endpoint, traffic_percentage=100,
+            machine_type=machine_type, min_replica_count=min_replica_count, max_replica_count=max_replica_count
+        )
+        if served:
+            endpoint.undeploy(deployed_model_id=outdated)
     log.info("Save data to the output params")
     vertex_endpoint.uri = endpoint.resource_name
     vertex_model.uri = deployed_model.resource_name
\ No newline at end of file
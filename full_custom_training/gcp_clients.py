@@ -0,0 +1,189 @@
+import errno
+import functools
+import json
+import os
+
+SCOPES = ("https://www.googleapis.com/auth/cloud-platform", )
+POOL_SIZE = 32
+
+
+@functools.lru_cache(maxsize=None)
+def get_credentials(credential_path: str):
+    """
+    Load service account credentials once per process, the key file is read
+    from GCS for gs:// paths and from local disk otherwise
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+
+    Raises
+    ------
+    FileNotFoundError
+        DESCRIPTION: Raise error if credential file not found
+
+    Returns
+    -------
+    credentials : service_account.Credentials
+        DESCRIPTION: credentials scoped for every Google Cloud API
+
+    """
+    from google.oauth2 import service_account
+    try:
+        if credential_path.startswith("gs://"):
+            import gcsfs
+            with gcsfs.GCSFileSystem().open(credential_path) as key_file:
+                credential = json.load(key_file)
+        else:
+            with open(credential_path) as key_file:
+                credential = json.load(key_file)
+    except FileNotFoundError:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                credential_path)
+    return service_account.Credentials.from_service_account_info(credential, scopes=SCOPES)
+
+
+@functools.lru_cache(maxsize=None)
+def get_session(credential_path: str):
+    """
+    Authorized HTTP session with a connection pool, shared by every REST
+    client built for the same credentials
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+
+    Returns
+    -------
+    session : AuthorizedSession
+        DESCRIPTION: pooled session
+
+    """
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+    session = AuthorizedSession(get_credentials(credential_path))
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    return session
+
+
+@functools.lru_cache(maxsize=None)
+def bigquery_client(credential_path: str, project: str = None):
+    """
+    Memoised BigQuery client
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    project : str, optional
+        DESCRIPTION: billing project, the key's project when None
+
+    Returns
+    -------
+    bigquery.Client
+        DESCRIPTION: BigQuery client on the pooled session
+
+    """
+    from google.cloud import bigquery
+    credentials = get_credentials(credential_path)
+    return bigquery.Client(project=project or credentials.project_id, credentials=credentials,
+                           _http=get_session(credential_path))
+
+
+@functools.lru_cache(maxsize=None)
+def bigquery_read_client(credential_path: str):
+    """
+    Memoised BigQuery Storage Read API client, gRPC keeps its own channel
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+
+    Returns
+    -------
+    bigquery_storage.BigQueryReadClient
+        DESCRIPTION: Storage Read API client
+
+    """
+    from google.cloud import bigquery_storage
+    return bigquery_storage.BigQueryReadClient(credentials=get_credentials(credential_path))
+
+
+@functools.lru_cache(maxsize=None)
+def storage_client(credential_path: str, project: str = None):
+    """
+    Memoised Cloud Storage client
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    project : str, optional
+        DESCRIPTION: project, the key's project when None
+
+    Returns
+    -------
+    storage.Client
+        DESCRIPTION: Cloud Storage client on the pooled session
+
+    """
+    from google.cloud import storage
+    credentials = get_credentials(credential_path)
+    return storage.Client(project=project or credentials.project_id, credentials=credentials,
+                          _http=get_session(credential_path))
+
+
+@functools.lru_cache(maxsize=None)
+def logging_client(credential_path: str, project: str = None):
+    """
+    Memoised Cloud Logging client
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    project : str, optional
+        DESCRIPTION: project, the key's project when None
+
+    Returns
+    -------
+    logging_v2.client.Client
+        DESCRIPTION: Cloud Logging client on the pooled session
+
+    """
+    from google.cloud import logging_v2
+    credentials = get_credentials(credential_path)
+    return logging_v2.client.Client(project=project or credentials.project_id,
+                                    credentials=credentials, _http=get_session(credential_path))
+
+
+@functools.lru_cache(maxsize=None)
+def init_aiplatform(credential_path: str, project: str, location: str, experiment: str = None):
+    """
+    Initialise the aiplatform SDK once per project, location and experiment
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    project : str
+        DESCRIPTION: GCP project id
+    location : str
+        DESCRIPTION: GCP region
+    experiment : str, optional
+        DESCRIPTION: Vertex AI experiment name
+
+    Returns
+    -------
+    module
+        DESCRIPTION: the initialised google.cloud.aiplatform module
+
+    """
+    from google.cloud import aiplatform
+    aiplatform.init(project=project, location=location, experiment=experiment,
+                    credentials=get_credentials(credential_path))
+    return aiplatform
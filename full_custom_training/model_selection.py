@@ -0,0 +1,615 @@
+from typing import NamedTuple
+from kfp.v2.dsl import (
+    Input,
+    Output,
+    component,
+    Model
+)
+
+@component(
+    base_image="python:3.7",
+    packages_to_install=[
+        "google-cloud-logging==2.7.0", "gcsfs==2021.11.1", "google-auth==1.35.0"
+    ],
+    output_component_file="component_artifacts/register_candidate.yaml")
+def register_candidate(
+    credential_path: str,
+    model: Input[Model],
+    model_metadata: str,
+    evaluation_status: str,
+    config_name: str,
+    sweep_root: str,
+    run_id: str,
+):
+    """
+    Record the outcome of one fan-out training configuration so that the
+    selection step can compare all of them after the parallel-for
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: gcs path for GCP service account credential key 
+    model : Input[Model]
+        DESCRIPTION: model trained for this configuration
+    model_metadata : str
+        DESCRIPTION: model metadata json written by the training component
+    evaluation_status : str
+        DESCRIPTION: "True" if the model passed validation, "False" otherwise
+    config_name : str
+        DESCRIPTION: name of the training configuration
+    sweep_root : str
+        DESCRIPTION: gcs prefix collecting the candidates of all runs
+    run_id : str
+        DESCRIPTION: pipeline run identifier, candidates are grouped per run
+
+    Raises
+    ------
+    FileNotFoundError
+        DESCRIPTION: Raise error if credential file not found
+
+    Returns
+    -------
+    None
+
+    """
+    import errno
+    import functools
+    import json
+    import logging
+    import os
+
+    import gcsfs
+    from google.cloud import logging_v2
+    from google.oauth2 import service_account
+
+    @functools.lru_cache(maxsize=None)
+    def get_credentials():
+        """
+        Load the service account key once, the logger and every client in
+        this component share the resulting credentials
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        credentials : service_account.Credentials
+            DESCRIPTION: credentials scoped for every Google Cloud API
+
+        """
+        try:
+            gcs_file_system_object = gcsfs.GCSFileSystem()
+            credential = json.load(
+                gcs_file_system_object.open(credential_path))
+        except FileNotFoundError:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    credential_path)
+        return service_account.Credentials.from_service_account_info(
+            credential, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # BEGIN VENDORED cloud_logging.py
+    import atexit
+    import queue
+    import threading
+    import time
+
+    CAPACITY = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+    CLOSE_TIMEOUT = 10.0
+    SPILL_PATH = "log_spill.jsonl"
+
+
+    class CloudLoggingSink:
+        """
+        Write batches of log entries to Cloud Logging. The client is created on
+        the first batch, i.e. in the flusher thread, so building a logger never
+        waits on credentials or the network
+
+        Parameters
+        ----------
+        client_factory : callable
+            DESCRIPTION: returns the Cloud Logging client, e.g.
+            functools.partial(gcp_clients.logging_client, credential_path).
+            Components, which cannot import gcp_clients, build their own
+        log_name : str
+            DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+        """
+
+        def __init__(self, client_factory, log_name: str = "python"):
+            self.client_factory = client_factory
+            self.log_name = log_name
+            self.cloud_logger = None
+
+        def __call__(self, entries: list):
+            if self.cloud_logger is None:
+                self.cloud_logger = self.client_factory().logger(self.log_name)
+            batch = self.cloud_logger.batch()
+            for entry in entries:
+                payload = dict(entry)
+                batch.log_struct(payload, severity=payload.pop("severity"))
+            batch.commit()
+
+
+    class BatchingHandler(logging.Handler):
+        """
+        Non-blocking logging handler. emit only formats the record and puts it
+        on a bounded in-memory queue; a background thread sends the entries to
+        the sink in batches of up to batch_size every flush_interval seconds.
+        Entries that find the queue full, that the sink rejects or that arrive
+        after close are appended to a local json lines spill file, and close
+        (registered with atexit) drains the queue before the process exits
+
+        Parameters
+        ----------
+        sink : callable
+            DESCRIPTION: called with a list of entry dicts (message, severity,
+            logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+            tests, the append method of a local list
+        capacity : int
+            DESCRIPTION: queue size before entries spill to disk
+        batch_size : int
+            DESCRIPTION: maximum entries per sink call
+        flush_interval : float
+            DESCRIPTION: seconds a partial batch waits before it is sent
+        spill_path : str
+            DESCRIPTION: local fallback file
+        close_timeout : float
+            DESCRIPTION: seconds close waits for the flusher before spilling what
+            is left
+
+        """
+
+        def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                     flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                     close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+            super().__init__(level)
+            self.sink = sink
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.spill_path = spill_path
+            self.close_timeout = close_timeout
+            self.queue = queue.Queue(maxsize=capacity)
+            self.spill_lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
+
+        def entry(self, record: logging.LogRecord):
+            return {
+                "message": self.format(record),
+                "severity": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "function": record.funcName,
+                "timestamp": record.created,
+            }
+
+        def emit(self, record: logging.LogRecord):
+            try:
+                entry = self.entry(record)
+            except Exception:
+                self.handleError(record)
+                return
+            if self.stopped.is_set():
+                self.spill([entry])
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.spill([entry])
+
+        def spill(self, entries: list):
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for entry in entries:
+                    spill_file.write(json.dumps(entry) + "\n")
+
+        def send(self, entries: list):
+            try:
+                self.sink(entries)
+            except Exception:
+                self.spill(entries)
+
+        def run(self):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    if entry is None:
+                        break
+                    batch.append(entry)
+                except queue.Empty:
+                    pass
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self.send(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self.send(batch)
+
+        def close(self):
+            if not self.stopped.is_set():
+                self.stopped.set()
+                try:
+                    self.queue.put(None, timeout=self.close_timeout)
+                except queue.Full:
+                    pass
+                self.flusher.join(timeout=self.close_timeout)
+                leftover = []
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        leftover.append(entry)
+                if leftover:
+                    self.spill(leftover)
+            super().close()
+    # END VENDORED cloud_logging.py
+
+    def get_logger():
+        """
+        Create logging object for pipeline logging. Records go to a
+        cloud_logging.BatchingHandler, whose flusher thread creates the
+        Cloud Logging client on the first batch
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        cloud_logger : OBJ
+            DESCRIPTION: logging instance
+
+        """
+        google_log_format = logging.Formatter(
+            fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
+            datefmt="%Y-%m-$dT%H:%M:%S")
+        handler = BatchingHandler(CloudLoggingSink(
+            lambda: logging_v2.client.Client(credentials=get_credentials())))
+        handler.setFormatter(google_log_format)
+
+        cloud_logger = logging.getLogger("data-ingestion")
+        cloud_logger.setLevel("INFO")
+        # a process running several components keeps only the latest handler
+        for previous in cloud_logger.handlers[:]:
+            cloud_logger.removeHandler(previous)
+            previous.close()
+        cloud_logger.addHandler(handler)
+
+        return cloud_logger
+
+    log = get_logger()
+
+    record = {
+        "name": config_name,
+        "model_uri": model.uri,
+        "model_metadata": json.loads(model_metadata),
+        "evaluation_status": evaluation_status,
+    }
+    record_path = f"{sweep_root.rstrip('/')}/{run_id}/{config_name}.json"
+    log.info(f"registering candidate {config_name} at {record_path}")
+    gcs_file_system = gcsfs.GCSFileSystem()
+    with gcs_file_system.open(record_path, "w") as record_file:
+        json.dump(record, record_file)
+
+
+@component(
+    base_image="python:3.7",
+    packages_to_install=[
+        "google-cloud-logging==2.7.0", "gcsfs==2021.11.1", "google-auth==1.35.0"
+    ],
+    output_component_file="component_artifacts/select_model.yaml")
+def select_model(
+    credential_path: str,
+    sweep_root: str,
+    run_id: str,
+    selection_metric: str,
+    model: Output[Model],
+) -> NamedTuple("Outputs", [("evaluation_status", str), ("best_config", str)]):
+    """
+    Pick the winning fan-out configuration: the validated candidate with the
+    lowest selection metric
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: gcs path for GCP service account credential key 
+    sweep_root : str
+        DESCRIPTION: gcs prefix collecting the candidates of all runs
+    run_id : str
+        DESCRIPTION: pipeline run identifier
+    selection_metric : str
+        DESCRIPTION: metric to minimise, e.g. "RMSE"
+    model : Output[Model]
+        DESCRIPTION: points at the model artifact of the winner
+
+    Raises
+    ------
+    FileNotFoundError
+        DESCRIPTION: Raise error if credential file not found
+    ValueError
+        DESCRIPTION: Raise error if no candidate was registered for the run
+
+    Returns
+    -------
+    NamedTuple("Outputs", [("evaluation_status", str), ("best_config", str)]): "True"
+    if at least one candidate passed validation, and the winning configuration name
+
+    """
+    import errno
+    import functools
+    import json
+    import logging
+    import os
+
+    import gcsfs
+    from google.cloud import logging_v2
+    from google.oauth2 import service_account
+
+    @functools.lru_cache(maxsize=None)
+    def get_credentials():
+        """
+        Load the service account key once, the logger and every client in
+        this component share the resulting credentials
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        credentials : service_account.Credentials
+            DESCRIPTION: credentials scoped for every Google Cloud API
+
+        """
+        try:
+            gcs_file_system_object = gcsfs.GCSFileSystem()
+            credential = json.load(
+                gcs_file_system_object.open(credential_path))
+        except FileNotFoundError:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    credential_path)
+        return service_account.Credentials.from_service_account_info(
+            credential, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # BEGIN VENDORED cloud_logging.py
+    import atexit
+    import queue
+    import threading
+    import time
+
+    CAPACITY = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+    CLOSE_TIMEOUT = 10.0
+    SPILL_PATH = "log_spill.jsonl"
+
+
+    class CloudLoggingSink:
+        """
+        Write batches of log entries to Cloud Logging. The client is created on
+        the first batch, i.e. in the flusher thread, so building a logger never
+        waits on credentials or the network
+
+        Parameters
+        ----------
+        client_factory : callable
+            DESCRIPTION: returns the Cloud Logging client, e.g.
+            functools.partial(gcp_clients.logging_client, credential_path).
+            Components, which cannot import gcp_clients, build their own
+        log_name : str
+            DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+        """
+
+        def __init__(self, client_factory, log_name: str = "python"):
+            self.client_factory = client_factory
+            self.log_name = log_name
+            self.cloud_logger = None
+
+        def __call__(self, entries: list):
+            if self.cloud_logger is None:
+                self.cloud_logger = self.client_factory().logger(self.log_name)
+            batch = self.cloud_logger.batch()
+            for entry in entries:
+                payload = dict(entry)
+                batch.log_struct(payload, severity=payload.pop("severity"))
+            batch.commit()
+
+
+    class BatchingHandler(logging.Handler):
+        """
+        Non-blocking logging handler. emit only formats the record and puts it
+        on a bounded in-memory queue; a background thread sends the entries to
+        the sink in batches of up to batch_size every flush_interval seconds.
+        Entries that find the queue full, that the sink rejects or that arrive
+        after close are appended to a local json lines spill file, and close
+        (registered with atexit) drains the queue before the process exits
+
+        Parameters
+        ----------
+        sink : callable
+            DESCRIPTION: called with a list of entry dicts (message, severity,
+            logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+            tests, the append method of a local list
+        capacity : int
+            DESCRIPTION: queue size before entries spill to disk
+        batch_size : int
+            DESCRIPTION: maximum entries per sink call
+        flush_interval : float
+            DESCRIPTION: seconds a partial batch waits before it is sent
+        spill_path : str
+            DESCRIPTION: local fallback file
+        close_timeout : float
+            DESCRIPTION: seconds close waits for the flusher before spilling what
+            is left
+
+        """
+
+        def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                     flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                     close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+            super().__init__(level)
+            self.sink = sink
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.spill_path = spill_path
+            self.close_timeout = close_timeout
+            self.queue = queue.Queue(maxsize=capacity)
+            self.spill_lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
+
+        def entry(self, record: logging.LogRecord):
+            return {
+                "message": self.format(record),
+                "severity": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "function": record.funcName,
+                "timestamp": record.created,
+            }
+
+        def emit(self, record: logging.LogRecord):
+            try:
+                entry = self.entry(record)
+            except Exception:
+                self.handleError(record)
+                return
+            if self.stopped.is_set():
+                self.spill([entry])
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.spill([entry])
+
+        def spill(self, entries: list):
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for entry in entries:
+                    spill_file.write(json.dumps(entry) + "\n")
+
+        def send(self, entries: list):
+            try:
+                self.sink(entries)
+            except Exception:
+                self.spill(entries)
+
+        def run(self):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    if entry is None:
+                        break
+                    batch.append(entry)
+                except queue.Empty:
+                    pass
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self.send(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self.send(batch)
+
+        def close(self):
+            if not self.stopped.is_set():
+                self.stopped.set()
+                try:
+                    self.queue.put(None, timeout=self.close_timeout)
+                except queue.Full:
+                    pass
+                self.flusher.join(timeout=self.close_timeout)
+                leftover = []
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        leftover.append(entry)
+                if leftover:
+                    self.spill(leftover)
+            super().close()
+    # END VENDORED cloud_logging.py
+
+    def get_logger():
+        """
+        Create logging object for pipeline logging. Records go to a
+        cloud_logging.BatchingHandler, whose flusher thread creates the
+        Cloud Logging client on the first batch
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        cloud_logger : OBJ
+            DESCRIPTION: logging instance
+
+        """
+        google_log_format = logging.Formatter(
+            fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
+            datefmt="%Y-%m-$dT%H:%M:%S")
+        handler = BatchingHandler(CloudLoggingSink(
+            lambda: logging_v2.client.Client(credentials=get_credentials())))
+        handler.setFormatter(google_log_format)
+
+        cloud_logger = logging.getLogger("data-ingestion")
+        cloud_logger.setLevel("INFO")
+        # a process running several components keeps only the latest handler
+        for previous in cloud_logger.handlers[:]:
+            cloud_logger.removeHandler(previous)
+            previous.close()
+        cloud_logger.addHandler(handler)
+
+        return cloud_logger
+
+    log = get_logger()
+
+    gcs_file_system = gcsfs.GCSFileSystem()
+    records = []
+    for path in gcs_file_system.glob(f"{sweep_root.rstrip('/')}/{run_id}/*.json"):
+        with gcs_file_system.open(path) as record_file:
+            records.append(json.load(record_file))
+    if not records:
+        raise ValueError(f"no candidates registered for run {run_id}")
+
+    records.sort(key=lambda record: record["model_metadata"]["model_metrics"][selection_metric])
+    for record in records:
+        log.info(f"{record['name']}: {selection_metric}="
+                 f"{record['model_metadata']['model_metrics'][selection_metric]} "
+                 f"validated={record['evaluation_status']}")
+    validated = [record for record in records if record["evaluation_status"] == "True"]
+    best = validated[0] if validated else records[0]
+    evaluation_status = "True" if validated else "False"
+
+    model.uri = best["model_uri"]
+    model.metadata["model_info"] = best["model_metadata"]
+    model.metadata["name"] = "model"
+    if "sha256" in best["model_metadata"]:
+        model.metadata["sha256"] = best["model_metadata"]["sha256"]
+    model.metadata["leaderboard"] = [
+        {"name": record["name"],
+         "model_metrics": record["model_metadata"]["model_metrics"],
+         "evaluation_status": record["evaluation_status"]}
+        for record in records
+    ]
+    return (evaluation_status, best["name"])
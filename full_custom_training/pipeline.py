@@ -1,4 +1,5 @@
 import configparser
+import json
 import os
 from os.path import  join
 from kfp.v2 import dsl
@@ -8,6 +9,7 @@ from kfp.v2.dsl import (
 
 from data_ingestion import read_data
 from deploy import deploy_model
+from model_selection import register_candidate, select_model
 from training import training
 from validation import model_validation
 
@@ -24,13 +26,118 @@ PIPELINE_ROOT = config["ML_PIPELINE"]["PIPELINE_ROOT"]
 SERVING_IMAGE = config["ML_PIPELINE"]["SERVING_IMAGE"]
 BQ_QUERY = config["ML_PIPELINE"]["BQ_QUERY"]
 THRESHOLD_DICT= eval(config["ML_PIPELINE"]["THRESHOLD_DICT"])
-MACHINE_TYPE = "n1-standard-4"
+INGESTION_MODE = config["ML_PIPELINE"].get("INGESTION_MODE", "dataframe")
+MAX_STREAM_COUNT = config["ML_PIPELINE"].getint("MAX_STREAM_COUNT", 4)
+DATASET_FORMAT = config["ML_PIPELINE"].get("DATASET_FORMAT", "parquet")
+FEATURE_COLUMNS = json.loads(config["ML_PIPELINE"].get("FEATURE_COLUMNS", "[]"))
+SPLIT_SPEC = json.loads(config["ML_PIPELINE"].get("SPLIT_SPEC", "{}"))
+INGESTION_CACHE_ROOT = config["ML_PIPELINE"].get("INGESTION_CACHE_ROOT", "")
+INGESTION_CACHE_MAX_BYTES = config["ML_PIPELINE"].getint("INGESTION_CACHE_MAX_BYTES", 0)
+INGESTION_CACHE_MAX_ENTRIES = config["ML_PIPELINE"].getint("INGESTION_CACHE_MAX_ENTRIES", 0)
+WATERMARK_COLUMN = config["ML_PIPELINE"].get("WATERMARK_COLUMN", "")
+OPTIMISE_SCHEMA = config["ML_PIPELINE"].getboolean("OPTIMISE_SCHEMA", True)
+TRAINING_MODE = config["ML_PIPELINE"].get("TRAINING_MODE", "batch")
+CHUNK_SIZE = config["ML_PIPELINE"].getint("CHUNK_SIZE", 100000)
+INCREMENTAL_ESTIMATOR = config["ML_PIPELINE"].get("INCREMENTAL_ESTIMATOR", "SGDRegressor")
+EPOCHS = config["ML_PIPELINE"].getint("EPOCHS", 1)
+CANDIDATES = json.loads(config["ML_PIPELINE"].get("CANDIDATES", "[]"))
+SELECTION_METRIC = config["ML_PIPELINE"].get("SELECTION_METRIC", "RMSE")
+MAX_WORKERS = config["ML_PIPELINE"].getint("MAX_WORKERS", 0)
+BOOTSTRAP_SAMPLES = config["ML_PIPELINE"].getint("BOOTSTRAP_SAMPLES", 200)
+CONFIDENCE_LEVEL = config["ML_PIPELINE"].getfloat("CONFIDENCE_LEVEL", 0.95)
+RESERVOIR_SIZE = config["ML_PIPELINE"].getint("RESERVOIR_SIZE", 10000)
+SWEEP_ROOT = config["ML_PIPELINE"].get("SWEEP_ROOT", "") or f"{PIPELINE_ROOT.rstrip('/')}/sweeps"
+CACHE_DISABLED_STEPS = json.loads(config["ML_PIPELINE"].get("CACHE_DISABLED_STEPS", "[]"))
+DEPLOY_MACHINE_TYPE = config["ML_PIPELINE"].get("DEPLOY_MACHINE_TYPE", "n1-standard-4")
+DEPLOY_MIN_REPLICA_COUNT = config["ML_PIPELINE"].getint("DEPLOY_MIN_REPLICA_COUNT", 1)
+DEPLOY_MAX_REPLICA_COUNT = config["ML_PIPELINE"].getint("DEPLOY_MAX_REPLICA_COUNT", 2)
+
+# training settings a TRAINING_CONFIGS entry may override, with the global defaults
+TRAINING_PARAMETERS = {
+    "feature_columns": FEATURE_COLUMNS,
+    "training_mode": TRAINING_MODE,
+    "chunk_size": CHUNK_SIZE,
+    "incremental_estimator": INCREMENTAL_ESTIMATOR,
+    "epochs": EPOCHS,
+    "candidates": CANDIDATES,
+    "selection_metric": SELECTION_METRIC,
+    "max_workers": MAX_WORKERS,
+    "bootstrap_samples": BOOTSTRAP_SAMPLES,
+    "confidence_level": CONFIDENCE_LEVEL,
+    "reservoir_size": RESERVOIR_SIZE,
+}
+
+def training_configs(configs: list):
+    """
+    Complete the TRAINING_CONFIGS entries with the global training settings.
+    The parallel-for resolves every field of an item, so each item must
+    carry all of TRAINING_PARAMETERS. The name moves to "config_name", a
+    "name" field would replace the name of the loop argument itself
+
+    Parameters
+    ----------
+    configs : list
+        DESCRIPTION: entries holding a unique "name" and any of the keys of
+        TRAINING_PARAMETERS
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error if an entry has no name, a duplicate name or
+        an unknown key
+
+    Returns
+    -------
+    list
+        DESCRIPTION: parallel-for items, complete training configurations
+        with their config_name
+
+    """
+    names = [entry.get("name") for entry in configs]
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError("every TRAINING_CONFIGS entry needs a unique name")
+    for entry in configs:
+        unknown = set(entry) - set(TRAINING_PARAMETERS) - {"name"}
+        if unknown:
+            raise ValueError(f"unknown keys in TRAINING_CONFIGS entry {entry['name']}: {sorted(unknown)}")
+    items = []
+    for entry in configs:
+        settings = {key: value for key, value in entry.items() if key != "name"}
+        items.append(dict(TRAINING_PARAMETERS, config_name=entry["name"], **settings))
+    return items
+
+TRAINING_CONFIGS = training_configs(json.loads(config["ML_PIPELINE"].get("TRAINING_CONFIGS", "[]")))
+
+def set_step_caching(ops):
+    """
+    Disable caching for the steps listed in CACHE_DISABLED_STEPS. The option
+    is compiled into the template, so Vertex AI and tools/local_runner.py
+    both run these steps every time
+
+    Parameters
+    ----------
+    ops : dict
+        DESCRIPTION: component function name to pipeline task
+
+    Returns
+    -------
+    None.
+
+    """
+    for step, op in ops.items():
+        if step in CACHE_DISABLED_STEPS:
+            op.set_caching_options(False)
 
 @pipeline(name=PIPELINE_NAME, pipeline_root=PIPELINE_ROOT, description="pipeline")
 def pipeline():
     """
     Create pipeline object which calls all the components and merge them together
 
+    With TRAINING_CONFIGS set, the single read_data output fans out to one
+    training and validation per config in a parallel-for, and select_model
+    picks the winner for deploy_model once every branch has registered. The
+    candidates of a run are grouped under its pipeline job id
+
     Returns
     -------
     None.
@@ -40,30 +147,88 @@ def pipeline():
     read_op = read_data(
         credential_path=CREDENTIAL_PATH,
         bq_query=BQ_QUERY,
+        ingestion_mode=INGESTION_MODE,
+        max_stream_count=MAX_STREAM_COUNT,
+        output_format=DATASET_FORMAT,
+        split_spec=SPLIT_SPEC,
+        cache_root=INGESTION_CACHE_ROOT,
+        cache_max_bytes=INGESTION_CACHE_MAX_BYTES,
+        cache_max_entries=INGESTION_CACHE_MAX_ENTRIES,
+        watermark_column=WATERMARK_COLUMN,
+        optimise_schema=OPTIMISE_SCHEMA,
     )
 
-    # training machine learning model
-    training_op = training(
-        credential_path=CREDENTIAL_PATH,
-        train_dataset = read_op.outputs["train_dataset"],
-        test_dataset = read_op.outputs["test_dataset"],
-    )
+    if TRAINING_CONFIGS:
+        # one training and validation per config, all reading the same split
+        with dsl.ParallelFor(TRAINING_CONFIGS) as training_config:
+            training_op = training(
+                credential_path=CREDENTIAL_PATH,
+                train_dataset = read_op.outputs["train_dataset"],
+                test_dataset = read_op.outputs["test_dataset"],
+                **{name: getattr(training_config, name) for name in TRAINING_PARAMETERS},
+            )
 
-    # validation machine learning model
-    validation_op=model_validation(
-        credential_path=CREDENTIAL_PATH,
-        threshold_dict=THRESHOLD_DICT, 
-        model_metadata_path=training_op.outputs["model_metadata_path"]
-    )
+            validation_op=model_validation(
+                credential_path=CREDENTIAL_PATH,
+                threshold_dict=THRESHOLD_DICT,
+                model_metadata_path=training_op.outputs["model_metadata_path"]
+            )
+
+            register_op = register_candidate(
+                credential_path=CREDENTIAL_PATH,
+                model=training_op.outputs["model"],
+                model_metadata=training_op.outputs["model_metadata_path"],
+                evaluation_status=validation_op.outputs["evaluation_status"],
+                config_name=training_config.config_name,
+                sweep_root=SWEEP_ROOT,
+                run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            )
+            set_step_caching({"training": training_op, "model_validation": validation_op,
+                              "register_candidate": register_op})
+
+        # aggregation waits for every branch of the parallel-for
+        select_op = select_model(
+            credential_path=CREDENTIAL_PATH,
+            sweep_root=SWEEP_ROOT,
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            selection_metric=SELECTION_METRIC,
+        ).after(register_op)
+        set_step_caching({"select_model": select_op})
 
-    condition1 = validation_op.outputs["evaluation_status"] == "True"
+        model = select_op.outputs["model"]
+        condition1 = select_op.outputs["evaluation_status"] == "True"
+    else:
+        # training machine learning model
+        training_op = training(
+            credential_path=CREDENTIAL_PATH,
+            train_dataset = read_op.outputs["train_dataset"],
+            test_dataset = read_op.outputs["test_dataset"],
+            **TRAINING_PARAMETERS,
+        )
+
+        # validation machine learning model
+        validation_op=model_validation(
+            credential_path=CREDENTIAL_PATH,
+            threshold_dict=THRESHOLD_DICT, 
+            model_metadata_path=training_op.outputs["model_metadata_path"]
+        )
+
+        set_step_caching({"training": training_op, "model_validation": validation_op})
+
+        model = training_op.outputs["model"]
+        condition1 = validation_op.outputs["evaluation_status"] == "True"
+
+    set_step_caching({"read_data": read_op})
 
     with dsl.Condition(condition1, name="deploy_model"):
-        _ = deploy_model(
+        deploy_op = deploy_model(
             credential_path=CREDENTIAL_PATH,
-            model=training_op.outputs["model"],
+            model=model,
             project=PROJECT_ID,
             region=REGION,
-            serving_img=SERVING_IMAGE
+            serving_img=SERVING_IMAGE,
+            machine_type=DEPLOY_MACHINE_TYPE,
+            min_replica_count=DEPLOY_MIN_REPLICA_COUNT,
+            max_replica_count=DEPLOY_MAX_REPLICA_COUNT
         )
-
+        set_step_caching({"deploy_model": deploy_op})
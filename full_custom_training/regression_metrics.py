@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.99)
+SEED = 42
+# rows below which a batch is not split across threads
+THREAD_ROWS = 8192
+# the bootstrap resamples blocks of up to MAX_BLOCK_ROWS consecutive rows,
+# batches keep at least MIN_BLOCKS blocks so small test sets stay per-row
+MAX_BLOCK_ROWS = 64
+MIN_BLOCKS = 1000
+# blocks weighted per draw of Poisson variates, bounds the weight matrix
+DRAW_BLOCKS = 8192
+
+
+class RegressionMetrics:
+    """
+    Mergeable single-pass accumulator for regression metrics. Every update
+    reduces a batch of predictions to the per row stats [1, |e|, e^2, y,
+    y^2] in one vectorised pass. The bootstrap works on sufficient
+    statistics: rows are summed into blocks and every replicate keeps the
+    Poisson weighted sum of the block stats, so a batch of N rows costs
+    bootstrap_samples x N / block variates instead of one per row and
+    replicate. A bottom-k sample of the absolute errors serves the
+    quantiles, so accumulators built over disjoint batches merge exactly
+
+    Parameters
+    ----------
+    bootstrap_samples : int
+        DESCRIPTION: bootstrap replicates behind the confidence intervals, 0
+        disables them
+    confidence_level : float
+        DESCRIPTION: coverage of the bootstrap confidence intervals
+    reservoir_size : int
+        DESCRIPTION: absolute errors kept for the error quantiles
+    seed : int or np.random.SeedSequence
+        DESCRIPTION: seed of the bootstrap weights and the reservoir keys,
+        fixed by default so equal predictions give equal intervals
+
+    """
+
+    def __init__(self, bootstrap_samples: int = 200, confidence_level: float = 0.95,
+                 reservoir_size: int = 10000, seed=SEED):
+        self.bootstrap_samples = bootstrap_samples
+        self.confidence_level = confidence_level
+        self.reservoir_size = reservoir_size
+        self.seed_sequence = (seed if isinstance(seed, np.random.SeedSequence)
+                              else np.random.SeedSequence(seed))
+        self.rng = np.random.default_rng(self.seed_sequence)
+        self.sums = np.zeros(5)
+        self.max_error = 0.0
+        self.replicates = np.zeros((bootstrap_samples, 5))
+        self.keys = np.empty(0)
+        self.errors = np.empty(0)
+
+    def settings(self):
+        return {"bootstrap_samples": self.bootstrap_samples, "confidence_level": self.confidence_level,
+                "reservoir_size": self.reservoir_size}
+
+    def spawn(self, count: int):
+        """
+        Empty accumulators with the same settings and independent random
+        streams, e.g. one per thread
+        """
+        return [RegressionMetrics(seed=child, **self.settings()) for child in self.seed_sequence.spawn(count)]
+
+    def keep(self, keys, errors):
+        if len(keys) > self.reservoir_size:
+            index = np.argpartition(keys, self.reservoir_size)[:self.reservoir_size]
+            keys, errors = keys[index], errors[index]
+        self.keys, self.errors = keys, errors
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=np.float64).ravel()
+        residual = y_true - np.asarray(y_pred, dtype=np.float64).ravel()
+        if not len(residual):
+            return self
+        abs_error = np.abs(residual)
+        stats = np.column_stack([np.ones_like(abs_error), abs_error, np.square(residual),
+                                 y_true, np.square(y_true)])
+        self.sums += stats.sum(axis=0)
+        self.max_error = max(self.max_error, float(abs_error.max()))
+        if self.bootstrap_samples:
+            block = max(1, min(MAX_BLOCK_ROWS, len(stats) // MIN_BLOCKS))
+            block_stats = np.add.reduceat(stats, np.arange(0, len(stats), block), axis=0)
+            for offset in range(0, len(block_stats), DRAW_BLOCKS):
+                part = block_stats[offset:offset + DRAW_BLOCKS]
+                weights = self.rng.poisson(1.0, (self.bootstrap_samples, len(part)))
+                self.replicates += weights.astype(np.float64) @ part
+        self.keep(np.concatenate([self.keys, self.rng.random(len(abs_error))]),
+                  np.concatenate([self.errors, abs_error]))
+        return self
+
+    def evaluate(self, y_true, y_pred, workers: int = 0):
+        """
+        Accumulate a batch of predictions, the rows are split across threads
+        with independent random streams and the partial accumulators merged
+
+        Parameters
+        ----------
+        y_true, y_pred : array-like
+            DESCRIPTION: targets and predictions
+        workers : int
+            DESCRIPTION: threads, 0 uses all cores
+
+        Returns
+        -------
+        RegressionMetrics
+            DESCRIPTION: this accumulator
+
+        """
+        y_true = np.asarray(y_true, dtype=np.float64)
+        y_pred = np.asarray(y_pred, dtype=np.float64)
+        workers = max(1, min(workers or os.cpu_count() or 1, len(y_true) // THREAD_ROWS))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(
+                lambda args: args[0].update(args[1], args[2]),
+                zip(self.spawn(workers), np.array_split(y_true, workers), np.array_split(y_pred, workers))))
+        for part in parts:
+            self.merge(part)
+        return self
+
+    def merge(self, other):
+        self.sums += other.sums
+        self.max_error = max(self.max_error, other.max_error)
+        self.replicates += other.replicates
+        self.keep(np.concatenate([self.keys, other.keys]),
+                  np.concatenate([self.errors, other.errors]))
+        return self
+
+    def state(self):
+        return dict(self.settings(), sums=self.sums, max_error=self.max_error,
+                    replicates=self.replicates, keys=self.keys, errors=self.errors)
+
+    @classmethod
+    def from_state(cls, state: dict):
+        metrics = cls(bootstrap_samples=state["bootstrap_samples"], confidence_level=state["confidence_level"],
+                      reservoir_size=state["reservoir_size"])
+        metrics.sums = np.asarray(state["sums"], dtype=np.float64)
+        metrics.max_error = float(state["max_error"])
+        metrics.replicates = np.asarray(state["replicates"], dtype=np.float64)
+        metrics.keys = np.asarray(state["keys"], dtype=np.float64)
+        metrics.errors = np.asarray(state["errors"], dtype=np.float64)
+        return metrics
+
+    @staticmethod
+    def point_metrics(sums):
+        count = np.maximum(sums[..., 0], 1.0)
+        mse = sums[..., 2] / count
+        variance = sums[..., 4] / count - np.square(sums[..., 3] / count)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2 = np.where(variance > 0, 1.0 - mse / variance, 0.0)
+        return {"MAE": sums[..., 1] / count, "MSE": mse, "RMSE": np.sqrt(mse), "R2": r2}
+
+    def summary(self):
+        if not self.sums[0]:
+            raise ValueError("no predictions were evaluated")
+        metrics = {name: float(value) for name, value in self.point_metrics(self.sums).items()}
+        metrics["MaxError"] = self.max_error
+        for quantile in QUANTILES:
+            metrics[f"AE_P{quantile * 100:g}"] = float(np.quantile(self.errors, quantile))
+        if self.bootstrap_samples:
+            alpha = (1.0 - self.confidence_level) / 2
+            for name, values in self.point_metrics(self.replicates).items():
+                metrics[f"{name}_CI"] = [float(np.quantile(values, alpha)),
+                                         float(np.quantile(values, 1.0 - alpha))]
+        return metrics
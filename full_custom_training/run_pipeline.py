@@ -1,19 +1,14 @@
+import argparse
 import configparser
-import errno
-import json
+import functools
 import logging
 import os
 from os.path import join
 from datetime import datetime
 
-
-from kfp.v2 import compiler
-from google.cloud import aiplatform
-import gcsfs
-from google.cloud import logging_v2
-from google.oauth2 import service_account
-
-from pipeline import pipeline
+from cloud_logging import BatchingHandler, CloudLoggingSink
+from gcp_clients import logging_client
+from compile_cache import compile_if_changed
 
 config = configparser.ConfigParser()
 current_dir = os.getcwd()
@@ -29,12 +24,8 @@ CACHE = eval(config["ML_PIPELINE"]["CACHE"])
 
 def get_logger(credential_path=CREDENTIAL_PATH):
     """
-    Create logging object for pipeline logging
-
-    Raises
-    ------
-    FileNotFoundError
-        DESCRIPTION: Raise error if credential file not found
+    Create logging object for pipeline logging. Records are queued and
+    sent in batches by a background thread, see cloud_logging.BatchingHandler
 
     Returns
     -------
@@ -42,21 +33,11 @@ def get_logger(credential_path=CREDENTIAL_PATH):
         DESCRIPTION: logging instance
 
     """
-    try:
-        gcs_file_system_object = gcsfs.GCSFileSystem()
-        credential = json.load(
-            gcs_file_system_object.open(credential_path))
-        credentials = service_account.Credentials.from_service_account_info(
-            credential)
-    except FileNotFoundError:
-        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
-                                credential_path)
-
-    client_object = logging_v2.client.Client(credentials=credentials)
     google_log_format = logging.Formatter(
         fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
         datefmt="%Y-%m-$dT%H:%M:%S")
-    handler = client_object.get_default_handler()
+    # batched and non-blocking, the Cloud Logging client is created by the flusher thread
+    handler = BatchingHandler(CloudLoggingSink(functools.partial(logging_client, credential_path)))
     handler.setFormatter(google_log_format)
 
     cloud_logger = logging.getLogger("data-ingestion")
@@ -65,22 +46,63 @@ def get_logger(credential_path=CREDENTIAL_PATH):
 
     return cloud_logger
 
-log = get_logger()
+def compile_pipeline():
+    """
+    Compile the pipeline to TEMPLATE, kfp and the components are imported
+    only here so importing this module stays cheap
 
-if __name__=="__main__":
+    Returns
+    -------
+    None.
+
+    """
+    from kfp.v2 import compiler
+    from pipeline import pipeline
     compiler.Compiler().compile(pipeline_func=pipeline, package_path=TEMPLATE)
+
+
+def submit_pipeline(log):
+    """
+    Submit the compiled TEMPLATE to Vertex AI Pipelines
+
+    Parameters
+    ----------
+    log : OBJ
+        DESCRIPTION: logging instance
+
+    Returns
+    -------
+    None.
+
+    """
+    from gcp_clients import init_aiplatform
+
     # initialise the aiplatform project
     log.info("initialise the aiplatform project")
-    aiplatform.init(project=PROJECT_ID, location=REGION, experiment=EXPERIMENT_NAME)
+    aiplatform = init_aiplatform(CREDENTIAL_PATH, PROJECT_ID, REGION, EXPERIMENT_NAME)
 
     TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
- 
+    JOB_ID = f"pipeline-{TIMESTAMP}"
+
     # start the job
     log.info("start the pipeline job")
     run1 = aiplatform.PipelineJob(
         display_name=PIPELINE_DISPLAY_NAME,
         template_path=TEMPLATE,
-        job_id=f"pipeline-{TIMESTAMP}",
-        enable_caching=CACHE,
+        job_id=JOB_ID,
+        # None keeps the per-step caching options compiled into the template
+        enable_caching=None if CACHE else False,
     )
-    run1.submit()
\ No newline at end of file
+    run1.submit()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compile and submit the full custom training pipeline")
+    parser.add_argument("--compile-only", action="store_true",
+                        help="only write the pipeline template, nothing is sent to GCP")
+    parser.add_argument("--force-compile", action="store_true",
+                        help="recompile even when the cached template is up to date")
+    args = parser.parse_args()
+    compile_if_changed(compile_pipeline, TEMPLATE, force=args.force_compile)
+    if not args.compile_only:
+        submit_pipeline(get_logger())
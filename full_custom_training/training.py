@@ -9,14 +9,25 @@ from kfp.v2.dsl import (
 
 @component(base_image="python:3.7",
            packages_to_install=[ "google-cloud==0.34.0", "gcsfs==2021.11.1", "google-cloud-aiplatform",
-               "google-auth==1.35.0", "pandas", "sklearn", "google-cloud-logging==2.7.0"],
+               "google-auth==1.35.0", "pandas", "pyarrow", "sklearn", "google-cloud-logging==2.7.0"],
            output_component_file="component_artifacts/training_model.yaml")
 def training(
     credential_path:str,
     train_dataset: Input[Dataset],
     test_dataset: Input[Dataset],
     model: Output[Model],
-    model_metadata_path: OutputPath(str)
+    model_metadata_path: OutputPath(str),
+    feature_columns: list = [],
+    training_mode: str = "batch",
+    chunk_size: int = 100000,
+    incremental_estimator: str = "SGDRegressor",
+    epochs: int = 1,
+    candidates: list = [],
+    selection_metric: str = "RMSE",
+    max_workers: int = 0,
+    bootstrap_samples: int = 200,
+    confidence_level: float = 0.95,
+    reservoir_size: int = 10000,
 ):
     """
     Create training component for kubeflow pipeline
@@ -33,11 +44,48 @@ def training(
         DESCRIPTION: model artifact path for trained model
     model_metadata_path : OutputPath(str)
         DESCRIPTION: metadata path for trained model artifact
+    feature_columns : list
+        DESCRIPTION: columns to project from the datasets besides the target,
+        all columns but the split key columns are read when empty
+    training_mode : str
+        DESCRIPTION: "batch" loads the training data into memory and fits a
+        LinearRegression, "incremental" streams the datasets in chunks and
+        fits incremental_estimator with partial_fit (out-of-core)
+    chunk_size : int
+        DESCRIPTION: rows per chunk in "incremental" mode, trades memory for
+        throughput
+    incremental_estimator : str
+        DESCRIPTION: partial_fit-capable regressor used in "incremental" mode,
+        one of "SGDRegressor", "PassiveAggressiveRegressor", "MLPRegressor"
+    epochs : int
+        DESCRIPTION: passes over the training data in "incremental" mode
+    candidates : list
+        DESCRIPTION: "batch" mode candidate sweep, e.g.
+        [{"name": "ridge", "estimator": "sklearn.linear_model.Ridge",
+          "params": {"alpha": 1.0}}]. Candidates are trained concurrently in
+        worker processes sharing memory-mapped training arrays; the best one
+        is saved as model. A single LinearRegression is trained when empty
+    selection_metric : str
+        DESCRIPTION: metric the best candidate minimises ("MAE", "MSE" or "RMSE")
+    max_workers : int
+        DESCRIPTION: worker processes for the candidate sweep, 0 uses all cores
+    bootstrap_samples : int
+        DESCRIPTION: Poisson bootstrap replicates behind the metric confidence
+        intervals, drawn over blocks of rows (see regression_metrics.py), 0
+        disables them
+    confidence_level : float
+        DESCRIPTION: coverage of the bootstrap confidence intervals
+    reservoir_size : int
+        DESCRIPTION: absolute errors kept in the mergeable sample used for the
+        error quantiles
 
     Raises
     ------
     FileNotFoundError
         DESCRIPTION: Raise error if credential file not found
+    ValueError
+        DESCRIPTION: Raise error if training_mode, incremental_estimator or the
+        candidate sweep settings are not supported
 
     Returns
     -------
@@ -46,22 +94,38 @@ def training(
     """
 
     import errno
+    import functools
+    import hashlib
+    import importlib
     import json
     import logging
+    import multiprocessing
     import os
+    import queue
+    import shutil
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
     
     import joblib
+    import numpy as np
     import pandas as pd
-    from sklearn.linear_model import LinearRegression
-    from sklearn.metrics import mean_absolute_error,mean_squared_error
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from sklearn.linear_model import (LinearRegression, PassiveAggressiveRegressor,
+                                      SGDRegressor)
+    from sklearn.neural_network import MLPRegressor
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
 
     import gcsfs
     from google.cloud import logging_v2
     from google.oauth2 import service_account
 
-    def get_logger():
+    @functools.lru_cache(maxsize=None)
+    def get_credentials():
         """
-        Create logging object for pipeline logging
+        Load the service account key once, the logger and every client in
+        this component share the resulting credentials
 
         Raises
         ------
@@ -70,73 +134,753 @@ def training(
 
         Returns
         -------
-        cloud_logger : OBJ
-            DESCRIPTION: logging instance
+        credentials : service_account.Credentials
+            DESCRIPTION: credentials scoped for every Google Cloud API
 
         """
         try:
             gcs_file_system_object = gcsfs.GCSFileSystem()
             credential = json.load(
                 gcs_file_system_object.open(credential_path))
-            credentials = service_account.Credentials.from_service_account_info(
-                credential)
         except FileNotFoundError:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
                                     credential_path)
+        return service_account.Credentials.from_service_account_info(
+            credential, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # BEGIN VENDORED cloud_logging.py
+    import atexit
+    import threading
+    import time
+
+    CAPACITY = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+    CLOSE_TIMEOUT = 10.0
+    SPILL_PATH = "log_spill.jsonl"
+
+
+    class CloudLoggingSink:
+        """
+        Write batches of log entries to Cloud Logging. The client is created on
+        the first batch, i.e. in the flusher thread, so building a logger never
+        waits on credentials or the network
+
+        Parameters
+        ----------
+        client_factory : callable
+            DESCRIPTION: returns the Cloud Logging client, e.g.
+            functools.partial(gcp_clients.logging_client, credential_path).
+            Components, which cannot import gcp_clients, build their own
+        log_name : str
+            DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+        """
+
+        def __init__(self, client_factory, log_name: str = "python"):
+            self.client_factory = client_factory
+            self.log_name = log_name
+            self.cloud_logger = None
+
+        def __call__(self, entries: list):
+            if self.cloud_logger is None:
+                self.cloud_logger = self.client_factory().logger(self.log_name)
+            batch = self.cloud_logger.batch()
+            for entry in entries:
+                payload = dict(entry)
+                batch.log_struct(payload, severity=payload.pop("severity"))
+            batch.commit()
+
+
+    class BatchingHandler(logging.Handler):
+        """
+        Non-blocking logging handler. emit only formats the record and puts it
+        on a bounded in-memory queue; a background thread sends the entries to
+        the sink in batches of up to batch_size every flush_interval seconds.
+        Entries that find the queue full, that the sink rejects or that arrive
+        after close are appended to a local json lines spill file, and close
+        (registered with atexit) drains the queue before the process exits
+
+        Parameters
+        ----------
+        sink : callable
+            DESCRIPTION: called with a list of entry dicts (message, severity,
+            logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+            tests, the append method of a local list
+        capacity : int
+            DESCRIPTION: queue size before entries spill to disk
+        batch_size : int
+            DESCRIPTION: maximum entries per sink call
+        flush_interval : float
+            DESCRIPTION: seconds a partial batch waits before it is sent
+        spill_path : str
+            DESCRIPTION: local fallback file
+        close_timeout : float
+            DESCRIPTION: seconds close waits for the flusher before spilling what
+            is left
+
+        """
+
+        def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                     flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                     close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+            super().__init__(level)
+            self.sink = sink
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.spill_path = spill_path
+            self.close_timeout = close_timeout
+            self.queue = queue.Queue(maxsize=capacity)
+            self.spill_lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
+
+        def entry(self, record: logging.LogRecord):
+            return {
+                "message": self.format(record),
+                "severity": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "function": record.funcName,
+                "timestamp": record.created,
+            }
+
+        def emit(self, record: logging.LogRecord):
+            try:
+                entry = self.entry(record)
+            except Exception:
+                self.handleError(record)
+                return
+            if self.stopped.is_set():
+                self.spill([entry])
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.spill([entry])
+
+        def spill(self, entries: list):
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for entry in entries:
+                    spill_file.write(json.dumps(entry) + "\n")
+
+        def send(self, entries: list):
+            try:
+                self.sink(entries)
+            except Exception:
+                self.spill(entries)
+
+        def run(self):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    if entry is None:
+                        break
+                    batch.append(entry)
+                except queue.Empty:
+                    pass
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self.send(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self.send(batch)
+
+        def close(self):
+            if not self.stopped.is_set():
+                self.stopped.set()
+                try:
+                    self.queue.put(None, timeout=self.close_timeout)
+                except queue.Full:
+                    pass
+                self.flusher.join(timeout=self.close_timeout)
+                leftover = []
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        leftover.append(entry)
+                if leftover:
+                    self.spill(leftover)
+            super().close()
+    # END VENDORED cloud_logging.py
+
+    def get_logger():
+        """
+        Create logging object for pipeline logging. Records go to a
+        cloud_logging.BatchingHandler, whose flusher thread creates the
+        Cloud Logging client on the first batch
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
 
-        client_object = logging_v2.client.Client(credentials=credentials)
+        Returns
+        -------
+        cloud_logger : OBJ
+            DESCRIPTION: logging instance
+
+        """
         google_log_format = logging.Formatter(
             fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
             datefmt="%Y-%m-$dT%H:%M:%S")
-        handler = client_object.get_default_handler()
+        handler = BatchingHandler(CloudLoggingSink(
+            lambda: logging_v2.client.Client(credentials=get_credentials())))
         handler.setFormatter(google_log_format)
 
         cloud_logger = logging.getLogger("data-ingestion")
         cloud_logger.setLevel("INFO")
+        # a process running several components keeps only the latest handler
+        for previous in cloud_logger.handlers[:]:
+            cloud_logger.removeHandler(previous)
+            previous.close()
         cloud_logger.addHandler(handler)
 
         return cloud_logger
 
     log = get_logger()
-        
+
+    def dataset_files(dataset: Input[Dataset]):
+        """
+        Files holding a dataset artifact: a single file, or the part files
+        appended by incremental ingestion as listed in the "parts" metadata,
+        which leaves out parts of ingestion runs that never committed
+
+        Parameters
+        ----------
+        dataset : Input[Dataset]
+            DESCRIPTION: dataset artifact
+
+        Returns
+        -------
+        list
+            DESCRIPTION: file paths in write order
+
+        """
+        file_extension = dataset.metadata.get("file_extension", ".csv")
+        if dataset.metadata.get("layout") == "partitioned":
+            return [f"{dataset.uri}/{part}{file_extension}" for part in dataset.metadata["parts"]]
+        return [f"{dataset.uri}{file_extension}"]
+
+    def apply_schema(df: pd.DataFrame, dataset: Input[Dataset]):
+        """
+        Cast a dataframe to the compact schema chosen at ingestion
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DESCRIPTION: dataframe read from the dataset
+        dataset : Input[Dataset]
+            DESCRIPTION: dataset artifact carrying "compact_schema" metadata
+
+        Returns
+        -------
+        pd.DataFrame
+            DESCRIPTION: dataframe in the compact schema
+
+        """
+        schema = dataset.metadata.get("compact_schema", {})
+        dtypes = {column: pd.CategoricalDtype(spec["categories"]) if spec["dtype"] == "category"
+                  else spec["dtype"]
+                  for column, spec in schema.items() if column in df.columns}
+        return df.astype(dtypes)
+
+    def load_dataset(dataset: Input[Dataset], columns: list = None):
+        """
+        Read a dataset artifact written by the data ingestion component
+
+        Parameters
+        ----------
+        dataset : Input[Dataset]
+            DESCRIPTION: dataset artifact, its metadata carries the file
+            format, layout (a single file or a directory of part files) and
+            the compact schema chosen at ingestion
+        columns : list, optional
+            DESCRIPTION: columns to project, all columns when None
+
+        Returns
+        -------
+        pd.DataFrame
+            DESCRIPTION: dataset as pandas dataframe in the compact schema
+
+        """
+        output_format = dataset.metadata.get("format", "csv")
+        gcs_file_system = gcsfs.GCSFileSystem()
+
+        def read_file(path: str):
+            with gcs_file_system.open(path, "rb") as source:
+                if output_format == "parquet":
+                    return pd.read_parquet(source, columns=columns)
+                if output_format == "feather":
+                    return pd.read_feather(source, columns=columns)
+                return pd.read_csv(source, usecols=columns)
+
+        df = pd.concat([read_file(path) for path in dataset_files(dataset)], ignore_index=True)
+        return apply_schema(df, dataset)
+
+    def iter_chunks(dataset: Input[Dataset], columns: list = None):
+        """
+        Stream a dataset artifact in chunks of at most chunk_size rows
+
+        Parameters
+        ----------
+        dataset : Input[Dataset]
+            DESCRIPTION: dataset artifact
+        columns : list, optional
+            DESCRIPTION: columns to project, all columns when None
+
+        Yields
+        ------
+        pd.DataFrame
+            DESCRIPTION: chunk in the compact schema
+
+        """
+        output_format = dataset.metadata.get("format", "csv")
+        gcs_file_system = gcsfs.GCSFileSystem()
+        for path in dataset_files(dataset):
+            with gcs_file_system.open(path, "rb") as source:
+                if output_format == "csv":
+                    for chunk in pd.read_csv(source, usecols=columns, chunksize=chunk_size):
+                        yield apply_schema(chunk, dataset)
+                    continue
+                if output_format == "parquet":
+                    batches = pq.ParquetFile(source).iter_batches(
+                        batch_size=chunk_size, columns=columns)
+                else:
+                    reader = pa.ipc.open_file(source)
+                    batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+                for batch in batches:
+                    table = pa.Table.from_batches([batch])
+                    if columns is not None:
+                        table = table.select(columns)
+                    for offset in range(0, table.num_rows, chunk_size):
+                        yield apply_schema(table.slice(offset, chunk_size).to_pandas(), dataset)
+
+    def to_features(df: pd.DataFrame):
+        """
+        Replace categorical columns by their codes, the categories are fixed
+        by the compact schema so codes agree across datasets
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DESCRIPTION: feature dataframe
+
+        Returns
+        -------
+        pd.DataFrame
+            DESCRIPTION: numeric feature dataframe
+
+        """
+        for column in df.select_dtypes("category").columns:
+            df[column] = df[column].cat.codes
+        return df
+
+    # BEGIN VENDORED regression_metrics.py
+
+
+    QUANTILES = (0.5, 0.9, 0.99)
+    SEED = 42
+    # rows below which a batch is not split across threads
+    THREAD_ROWS = 8192
+    # the bootstrap resamples blocks of up to MAX_BLOCK_ROWS consecutive rows,
+    # batches keep at least MIN_BLOCKS blocks so small test sets stay per-row
+    MAX_BLOCK_ROWS = 64
+    MIN_BLOCKS = 1000
+    # blocks weighted per draw of Poisson variates, bounds the weight matrix
+    DRAW_BLOCKS = 8192
+
+
+    class RegressionMetrics:
+        """
+        Mergeable single-pass accumulator for regression metrics. Every update
+        reduces a batch of predictions to the per row stats [1, |e|, e^2, y,
+        y^2] in one vectorised pass. The bootstrap works on sufficient
+        statistics: rows are summed into blocks and every replicate keeps the
+        Poisson weighted sum of the block stats, so a batch of N rows costs
+        bootstrap_samples x N / block variates instead of one per row and
+        replicate. A bottom-k sample of the absolute errors serves the
+        quantiles, so accumulators built over disjoint batches merge exactly
+
+        Parameters
+        ----------
+        bootstrap_samples : int
+            DESCRIPTION: bootstrap replicates behind the confidence intervals, 0
+            disables them
+        confidence_level : float
+            DESCRIPTION: coverage of the bootstrap confidence intervals
+        reservoir_size : int
+            DESCRIPTION: absolute errors kept for the error quantiles
+        seed : int or np.random.SeedSequence
+            DESCRIPTION: seed of the bootstrap weights and the reservoir keys,
+            fixed by default so equal predictions give equal intervals
+
+        """
+
+        def __init__(self, bootstrap_samples: int = 200, confidence_level: float = 0.95,
+                     reservoir_size: int = 10000, seed=SEED):
+            self.bootstrap_samples = bootstrap_samples
+            self.confidence_level = confidence_level
+            self.reservoir_size = reservoir_size
+            self.seed_sequence = (seed if isinstance(seed, np.random.SeedSequence)
+                                  else np.random.SeedSequence(seed))
+            self.rng = np.random.default_rng(self.seed_sequence)
+            self.sums = np.zeros(5)
+            self.max_error = 0.0
+            self.replicates = np.zeros((bootstrap_samples, 5))
+            self.keys = np.empty(0)
+            self.errors = np.empty(0)
+
+        def settings(self):
+            return {"bootstrap_samples": self.bootstrap_samples, "confidence_level": self.confidence_level,
+                    "reservoir_size": self.reservoir_size}
+
+        def spawn(self, count: int):
+            """
+            Empty accumulators with the same settings and independent random
+            streams, e.g. one per thread
+            """
+            return [RegressionMetrics(seed=child, **self.settings()) for child in self.seed_sequence.spawn(count)]
+
+        def keep(self, keys, errors):
+            if len(keys) > self.reservoir_size:
+                index = np.argpartition(keys, self.reservoir_size)[:self.reservoir_size]
+                keys, errors = keys[index], errors[index]
+            self.keys, self.errors = keys, errors
+
+        def update(self, y_true, y_pred):
+            y_true = np.asarray(y_true, dtype=np.float64).ravel()
+            residual = y_true - np.asarray(y_pred, dtype=np.float64).ravel()
+            if not len(residual):
+                return self
+            abs_error = np.abs(residual)
+            stats = np.column_stack([np.ones_like(abs_error), abs_error, np.square(residual),
+                                     y_true, np.square(y_true)])
+            self.sums += stats.sum(axis=0)
+            self.max_error = max(self.max_error, float(abs_error.max()))
+            if self.bootstrap_samples:
+                block = max(1, min(MAX_BLOCK_ROWS, len(stats) // MIN_BLOCKS))
+                block_stats = np.add.reduceat(stats, np.arange(0, len(stats), block), axis=0)
+                for offset in range(0, len(block_stats), DRAW_BLOCKS):
+                    part = block_stats[offset:offset + DRAW_BLOCKS]
+                    weights = self.rng.poisson(1.0, (self.bootstrap_samples, len(part)))
+                    self.replicates += weights.astype(np.float64) @ part
+            self.keep(np.concatenate([self.keys, self.rng.random(len(abs_error))]),
+                      np.concatenate([self.errors, abs_error]))
+            return self
+
+        def evaluate(self, y_true, y_pred, workers: int = 0):
+            """
+            Accumulate a batch of predictions, the rows are split across threads
+            with independent random streams and the partial accumulators merged
+
+            Parameters
+            ----------
+            y_true, y_pred : array-like
+                DESCRIPTION: targets and predictions
+            workers : int
+                DESCRIPTION: threads, 0 uses all cores
+
+            Returns
+            -------
+            RegressionMetrics
+                DESCRIPTION: this accumulator
+
+            """
+            y_true = np.asarray(y_true, dtype=np.float64)
+            y_pred = np.asarray(y_pred, dtype=np.float64)
+            workers = max(1, min(workers or os.cpu_count() or 1, len(y_true) // THREAD_ROWS))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(
+                    lambda args: args[0].update(args[1], args[2]),
+                    zip(self.spawn(workers), np.array_split(y_true, workers), np.array_split(y_pred, workers))))
+            for part in parts:
+                self.merge(part)
+            return self
+
+        def merge(self, other):
+            self.sums += other.sums
+            self.max_error = max(self.max_error, other.max_error)
+            self.replicates += other.replicates
+            self.keep(np.concatenate([self.keys, other.keys]),
+                      np.concatenate([self.errors, other.errors]))
+            return self
+
+        def state(self):
+            return dict(self.settings(), sums=self.sums, max_error=self.max_error,
+                        replicates=self.replicates, keys=self.keys, errors=self.errors)
+
+        @classmethod
+        def from_state(cls, state: dict):
+            metrics = cls(bootstrap_samples=state["bootstrap_samples"], confidence_level=state["confidence_level"],
+                          reservoir_size=state["reservoir_size"])
+            metrics.sums = np.asarray(state["sums"], dtype=np.float64)
+            metrics.max_error = float(state["max_error"])
+            metrics.replicates = np.asarray(state["replicates"], dtype=np.float64)
+            metrics.keys = np.asarray(state["keys"], dtype=np.float64)
+            metrics.errors = np.asarray(state["errors"], dtype=np.float64)
+            return metrics
+
+        @staticmethod
+        def point_metrics(sums):
+            count = np.maximum(sums[..., 0], 1.0)
+            mse = sums[..., 2] / count
+            variance = sums[..., 4] / count - np.square(sums[..., 3] / count)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r2 = np.where(variance > 0, 1.0 - mse / variance, 0.0)
+            return {"MAE": sums[..., 1] / count, "MSE": mse, "RMSE": np.sqrt(mse), "R2": r2}
+
+        def summary(self):
+            if not self.sums[0]:
+                raise ValueError("no predictions were evaluated")
+            metrics = {name: float(value) for name, value in self.point_metrics(self.sums).items()}
+            metrics["MaxError"] = self.max_error
+            for quantile in QUANTILES:
+                metrics[f"AE_P{quantile * 100:g}"] = float(np.quantile(self.errors, quantile))
+            if self.bootstrap_samples:
+                alpha = (1.0 - self.confidence_level) / 2
+                for name, values in self.point_metrics(self.replicates).items():
+                    metrics[f"{name}_CI"] = [float(np.quantile(values, alpha)),
+                                             float(np.quantile(values, 1.0 - alpha))]
+            return metrics
+    # END VENDORED regression_metrics.py
+
+    metric_settings = {"bootstrap_samples": bootstrap_samples, "confidence_level": confidence_level,
+                       "reservoir_size": reservoir_size}
+
+    def train_incremental():
+        """
+        Out-of-core training: one chunked pass fits the feature scaler, then
+        every epoch streams the training chunks into partial_fit and the
+        test set is evaluated chunk by chunk
+
+        Returns
+        -------
+        regr : Pipeline
+            DESCRIPTION: fitted scaler + regressor
+        metrics : dict
+            DESCRIPTION: test metrics
+
+        """
+        estimators = {
+            "SGDRegressor": lambda: SGDRegressor(random_state=42),
+            "PassiveAggressiveRegressor": lambda: PassiveAggressiveRegressor(random_state=42),
+            "MLPRegressor": lambda: MLPRegressor(random_state=42),
+        }
+        if incremental_estimator not in estimators:
+            raise ValueError(f"unsupported incremental_estimator: {incremental_estimator}")
+
+        scaler = StandardScaler()
+        for chunk in iter_chunks(train_dataset, columns):
+            scaler.partial_fit(to_features(chunk.drop(target, axis=1)))
+
+        regressor = estimators[incremental_estimator]()
+        for epoch in range(epochs):
+            rows = 0
+            for chunk in iter_chunks(train_dataset, columns):
+                X_chunk = scaler.transform(to_features(chunk.drop(target, axis=1)))
+                regressor.partial_fit(X_chunk, chunk[target].to_numpy())
+                rows += len(chunk)
+            log.info(f"epoch {epoch + 1}/{epochs}: {rows} training rows")
+
+        regr = Pipeline([("scaler", scaler), ("regressor", regressor)])
+        metrics = RegressionMetrics(**metric_settings)
+        for chunk in iter_chunks(test_dataset, columns):
+            y_pred = regr.predict(to_features(chunk.drop(target, axis=1)))
+            metrics.evaluate(chunk[target].to_numpy(), y_pred)
+        return regr, metrics.summary()
+
+    def sweep_candidates(X_train, y_train, X_test, y_test):
+        """
+        Train every candidate in its own worker process. The training and
+        test matrices are written once to .npy files and memory-mapped
+        read-only by the workers instead of being pickled to each of them
+
+        Parameters
+        ----------
+        X_train, y_train, X_test, y_test : np.ndarray
+            DESCRIPTION: training and test data
+
+        Returns
+        -------
+        regr : OBJ
+            DESCRIPTION: best fitted estimator
+        leaderboard : list
+            DESCRIPTION: per candidate name, estimator, params and metrics (or
+            error), best first
+
+        """
+        if selection_metric not in ("MAE", "MSE", "RMSE"):
+            raise ValueError(f"unsupported selection_metric: {selection_metric}")
+        names = [candidate["name"] for candidate in candidates]
+        if len(set(names)) != len(names):
+            raise ValueError("candidate names must be unique")
+        for candidate in candidates:
+            if not candidate["estimator"].startswith("sklearn."):
+                raise ValueError(f"unsupported estimator: {candidate['estimator']}")
+
+        workdir = tempfile.mkdtemp(prefix="candidates-")
+        running = {}
+        try:
+            arrays = {"X_train": X_train, "y_train": y_train, "X_test": X_test, "y_test": y_test}
+            for array_name, array in arrays.items():
+                np.save(os.path.join(workdir, f"{array_name}.npy"), np.ascontiguousarray(array))
+
+            def fit_candidate(candidate: dict, results):
+                try:
+                    shared = {array_name: np.load(os.path.join(workdir, f"{array_name}.npy"), mmap_mode="r")
+                              for array_name in arrays}
+                    module_name, class_name = candidate["estimator"].rsplit(".", 1)
+                    estimator = getattr(importlib.import_module(module_name), class_name)(
+                        **candidate.get("params", {}))
+                    estimator.fit(shared["X_train"], shared["y_train"])
+                    y_pred = estimator.predict(shared["X_test"])
+                    metrics = RegressionMetrics(**metric_settings).evaluate(
+                        shared["y_test"], y_pred, workers=1).state()
+                    model_file = os.path.join(workdir, f"{candidate['name']}.joblib")
+                    joblib.dump(estimator, model_file)
+                    results.put({"name": candidate["name"], "metrics": metrics, "model_file": model_file})
+                except Exception as error:
+                    results.put({"name": candidate["name"], "error": repr(error)})
+
+            # fork keeps the nested worker function usable without pickling it.
+            # A child gets the locks of the log-flusher thread and the logging
+            # handler as they are at fork time, possibly held, so what is
+            # queued is shipped and the handler stopped until every worker
+            # has exited
+            for handler in log.handlers[:]:
+                log.removeHandler(handler)
+                handler.close()
+            context = multiprocessing.get_context("fork")
+            results = context.Queue()
+            workers = min(max_workers or os.cpu_count() or 1, len(candidates))
+            pending = list(candidates)
+            finished = {}
+            while pending or running:
+                while pending and len(running) < workers:
+                    candidate = pending.pop(0)
+                    process = context.Process(target=fit_candidate, args=(candidate, results))
+                    process.start()
+                    running[candidate["name"]] = process
+                try:
+                    result = results.get(timeout=5)
+                except queue.Empty:
+                    for name, process in list(running.items()):
+                        if not process.is_alive() and name not in finished:
+                            finished[name] = {"name": name, "error": f"exit code {process.exitcode}"}
+                            running.pop(name)
+                    continue
+                finished[result["name"]] = result
+                # a worker whose result arrives late was already reaped
+                process = running.pop(result["name"], None)
+                if process is not None:
+                    process.join()
+            get_logger()
+
+            leaderboard = []
+            for candidate in candidates:
+                result = finished[candidate["name"]]
+                entry = {"name": candidate["name"], "estimator": candidate["estimator"],
+                         "params": candidate.get("params", {})}
+                if "error" in result:
+                    log.info(f"candidate {candidate['name']} failed: {result['error']}")
+                    entry["error"] = result["error"]
+                else:
+                    entry["metrics"] = RegressionMetrics.from_state(result["metrics"]).summary()
+                    entry["model_file"] = result["model_file"]
+                leaderboard.append(entry)
+            leaderboard.sort(key=lambda entry: entry["metrics"][selection_metric]
+                             if "metrics" in entry else float("inf"))
+            if "metrics" not in leaderboard[0]:
+                raise RuntimeError("every candidate failed to train")
+            regr = joblib.load(leaderboard[0]["model_file"])
+            for entry in leaderboard:
+                entry.pop("model_file", None)
+            return regr, leaderboard
+        finally:
+            # stop workers left behind by an error and drop the shared arrays
+            # and candidate models
+            for process in running.values():
+                process.terminate()
+            shutil.rmtree(workdir, ignore_errors=True)
+            if not log.handlers:
+                get_logger()
+
     target = 'fare' 
-    train_df = pd.read_csv(f"{train_dataset.uri}.csv")
-    X_train = train_df.drop(target, axis=1)
-    y_train = train_df[target]
-
-    test_df = pd.read_csv(f"{test_dataset.uri}.csv")
-    X_test = test_df.drop(target, axis=1)
-    y_test = test_df[target]
-
-    regr = LinearRegression()
-    regr.fit(X_train, y_train)
-    y_pred = regr.predict(X_test)
-    mae = mean_absolute_error(y_true=y_test,y_pred=y_pred)
-    mse = mean_squared_error(y_true=y_test,y_pred=y_pred) 
-    rmse = mean_squared_error(y_true=y_test,y_pred=y_pred,squared=False)
-
-    log.info("MAE : ",mae)
-    log.info("MSE : ",mse)
-    log.info("RMSE : ",rmse)
-    
-    model_metrics = {
-        "MAE":mae,
-        "MSE":mse,
-        "RMSE":rmse
-    }
+    if feature_columns:
+        columns = feature_columns + [target]
+    else:
+        # split keys identify rows, e.g. unique_key, they are not features
+        key_columns = train_dataset.metadata.get("key_columns", [])
+        columns = ([column for column in train_dataset.metadata["columns"] if column not in key_columns]
+                   if key_columns else None)
+
+    leaderboard = []
+    if candidates and training_mode != "batch":
+        raise ValueError("candidate sweeps are supported in batch training_mode only")
+
+    if training_mode == "incremental":
+        regr, model_metrics = train_incremental()
+        model_name = f"{incremental_estimator}_model"
+    elif training_mode == "batch":
+        train_df = load_dataset(train_dataset, columns)
+        X_train = to_features(train_df.drop(target, axis=1))
+        y_train = train_df[target]
+
+        test_df = load_dataset(test_dataset, columns)
+        X_test = to_features(test_df.drop(target, axis=1))
+        y_test = test_df[target]
+
+        if candidates:
+            regr, leaderboard = sweep_candidates(
+                X_train.to_numpy(dtype=np.float64), y_train.to_numpy(dtype=np.float64),
+                X_test.to_numpy(dtype=np.float64), y_test.to_numpy(dtype=np.float64))
+            model_metrics = leaderboard[0]["metrics"]
+            model_name = f"{leaderboard[0]['name']}_model"
+            log.info(f"best candidate by {selection_metric}: {leaderboard[0]['name']}")
+        else:
+            regr = LinearRegression()
+            regr.fit(X_train, y_train)
+            y_pred = regr.predict(X_test)
+            model_metrics = RegressionMetrics(**metric_settings).evaluate(y_test, y_pred).summary()
+            model_name = "LinearRegressionClf_model"
+    else:
+        raise ValueError(f"unsupported training_mode: {training_mode}")
+
+    for metric, value in model_metrics.items():
+        log.info(f"{metric} : {value}")
 
     log.info("saving model (joblib)")
     joblib.dump(regr, f"{model.path}.joblib")
+    # content hash of the artifact, deploy_model reuses a registered model
+    # with the same hash instead of uploading it again
+    digest = hashlib.sha256()
+    with open(f"{model.path}.joblib", "rb") as model_file:
+        for block in iter(lambda: model_file.read(8 * 1024 * 1024), b""):
+            digest.update(block)
     
     metadata = {
-        "name": "LinearRegressionClf_model",
+        "name": model_name,
         "version": model.VERSION,
         "model_path": model.path,
+        "sha256": digest.hexdigest(),
         "model_metrics": model_metrics,
         "model_framework": "scikit learn"
     }
+    if leaderboard:
+        metadata["selection_metric"] = selection_metric
+        metadata["leaderboard"] = leaderboard
     model.metadata["model_info"] = metadata #json.dumps(metadata)
     model.metadata["name"] = "model"
+    model.metadata["sha256"] = metadata["sha256"]
     
     with open(model_metadata_path, "w") as file_out:
         json.dump(metadata, file_out)
\ No newline at end of file
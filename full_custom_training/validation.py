@@ -28,7 +28,10 @@ def model_validation(
     metrics : Output[ClassificationMetrics]
         DESCRIPTION: path to model performace matrices
     threshold_dict : dict
-        DESCRIPTION: dictionary of threshold values for model performance matrices (user input)
+        DESCRIPTION: dictionary of threshold values for model performance matrices (user input).
+        Keys name any metric written by the training component, error metrics must stay
+        below and "R2" above their threshold. A "_lower" or "_upper" suffix, e.g.
+        "RMSE_upper", gates on that bound of the metric's bootstrap confidence interval
     model_metadata_path: str
         DESCRIPTION: GCS Path of model metadata
     val_dataset : Output[Dataset]
@@ -38,6 +41,8 @@ def model_validation(
     ------
     FileNotFoundError
         DESCRIPTION: Raise error if credential file not found
+    ValueError
+        DESCRIPTION: Raise error if a threshold names a metric the model metadata lacks
 
     Returns
     -------
@@ -46,6 +51,7 @@ def model_validation(
     """
     
     import errno
+    import functools
     import json
     import logging
     import os
@@ -54,9 +60,11 @@ def model_validation(
     from google.cloud import logging_v2
     from google.oauth2 import service_account
 
-    def get_logger():
+    @functools.lru_cache(maxsize=None)
+    def get_credentials():
         """
-        Create logging object for pipeline logging
+        Load the service account key once, the logger and every client in
+        this component share the resulting credentials
 
         Raises
         ------
@@ -65,40 +73,241 @@ def model_validation(
 
         Returns
         -------
-        cloud_logger : OBJ
-            DESCRIPTION: logging instance
+        credentials : service_account.Credentials
+            DESCRIPTION: credentials scoped for every Google Cloud API
 
         """
         try:
             gcs_file_system_object = gcsfs.GCSFileSystem()
             credential = json.load(
                 gcs_file_system_object.open(credential_path))
-            credentials = service_account.Credentials.from_service_account_info(
-                credential)
         except FileNotFoundError:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
                                     credential_path)
+        return service_account.Credentials.from_service_account_info(
+            credential, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+    # BEGIN VENDORED cloud_logging.py
+    import atexit
+    import queue
+    import threading
+    import time
+
+    CAPACITY = 10000
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+    CLOSE_TIMEOUT = 10.0
+    SPILL_PATH = "log_spill.jsonl"
+
+
+    class CloudLoggingSink:
+        """
+        Write batches of log entries to Cloud Logging. The client is created on
+        the first batch, i.e. in the flusher thread, so building a logger never
+        waits on credentials or the network
+
+        Parameters
+        ----------
+        client_factory : callable
+            DESCRIPTION: returns the Cloud Logging client, e.g.
+            functools.partial(gcp_clients.logging_client, credential_path).
+            Components, which cannot import gcp_clients, build their own
+        log_name : str
+            DESCRIPTION: Cloud Logging log name, "python" like the default handler
+
+        """
+
+        def __init__(self, client_factory, log_name: str = "python"):
+            self.client_factory = client_factory
+            self.log_name = log_name
+            self.cloud_logger = None
+
+        def __call__(self, entries: list):
+            if self.cloud_logger is None:
+                self.cloud_logger = self.client_factory().logger(self.log_name)
+            batch = self.cloud_logger.batch()
+            for entry in entries:
+                payload = dict(entry)
+                batch.log_struct(payload, severity=payload.pop("severity"))
+            batch.commit()
+
+
+    class BatchingHandler(logging.Handler):
+        """
+        Non-blocking logging handler. emit only formats the record and puts it
+        on a bounded in-memory queue; a background thread sends the entries to
+        the sink in batches of up to batch_size every flush_interval seconds.
+        Entries that find the queue full, that the sink rejects or that arrive
+        after close are appended to a local json lines spill file, and close
+        (registered with atexit) drains the queue before the process exits
+
+        Parameters
+        ----------
+        sink : callable
+            DESCRIPTION: called with a list of entry dicts (message, severity,
+            logger, module, function, timestamp), e.g. a CloudLoggingSink or, in
+            tests, the append method of a local list
+        capacity : int
+            DESCRIPTION: queue size before entries spill to disk
+        batch_size : int
+            DESCRIPTION: maximum entries per sink call
+        flush_interval : float
+            DESCRIPTION: seconds a partial batch waits before it is sent
+        spill_path : str
+            DESCRIPTION: local fallback file
+        close_timeout : float
+            DESCRIPTION: seconds close waits for the flusher before spilling what
+            is left
+
+        """
+
+        def __init__(self, sink, capacity: int = CAPACITY, batch_size: int = BATCH_SIZE,
+                     flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                     close_timeout: float = CLOSE_TIMEOUT, level=logging.NOTSET):
+            super().__init__(level)
+            self.sink = sink
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.spill_path = spill_path
+            self.close_timeout = close_timeout
+            self.queue = queue.Queue(maxsize=capacity)
+            self.spill_lock = threading.Lock()
+            self.stopped = threading.Event()
+            self.flusher = threading.Thread(target=self.run, name="log-flusher", daemon=True)
+            self.flusher.start()
+            atexit.register(self.close)
+
+        def entry(self, record: logging.LogRecord):
+            return {
+                "message": self.format(record),
+                "severity": record.levelname,
+                "logger": record.name,
+                "module": record.module,
+                "function": record.funcName,
+                "timestamp": record.created,
+            }
 
-        client_object = logging_v2.client.Client(credentials=credentials)
+        def emit(self, record: logging.LogRecord):
+            try:
+                entry = self.entry(record)
+            except Exception:
+                self.handleError(record)
+                return
+            if self.stopped.is_set():
+                self.spill([entry])
+                return
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.spill([entry])
+
+        def spill(self, entries: list):
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for entry in entries:
+                    spill_file.write(json.dumps(entry) + "\n")
+
+        def send(self, entries: list):
+            try:
+                self.sink(entries)
+            except Exception:
+                self.spill(entries)
+
+        def run(self):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                    if entry is None:
+                        break
+                    batch.append(entry)
+                except queue.Empty:
+                    pass
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self.send(batch)
+                        batch = []
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self.send(batch)
+
+        def close(self):
+            if not self.stopped.is_set():
+                self.stopped.set()
+                try:
+                    self.queue.put(None, timeout=self.close_timeout)
+                except queue.Full:
+                    pass
+                self.flusher.join(timeout=self.close_timeout)
+                leftover = []
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        leftover.append(entry)
+                if leftover:
+                    self.spill(leftover)
+            super().close()
+    # END VENDORED cloud_logging.py
+
+    def get_logger():
+        """
+        Create logging object for pipeline logging. Records go to a
+        cloud_logging.BatchingHandler, whose flusher thread creates the
+        Cloud Logging client on the first batch
+
+        Raises
+        ------
+        FileNotFoundError
+            DESCRIPTION: Raise error if credential file not found
+
+        Returns
+        -------
+        cloud_logger : OBJ
+            DESCRIPTION: logging instance
+
+        """
         google_log_format = logging.Formatter(
             fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
             datefmt="%Y-%m-$dT%H:%M:%S")
-        handler = client_object.get_default_handler()
+        handler = BatchingHandler(CloudLoggingSink(
+            lambda: logging_v2.client.Client(credentials=get_credentials())))
         handler.setFormatter(google_log_format)
 
         cloud_logger = logging.getLogger("data-ingestion")
         cloud_logger.setLevel("INFO")
+        # a process running several components keeps only the latest handler
+        for previous in cloud_logger.handlers[:]:
+            cloud_logger.removeHandler(previous)
+            previous.close()
         cloud_logger.addHandler(handler)
+
         return cloud_logger
 
     log = get_logger()
 
     model_metadata = json.loads(model_metadata_path)
-    log.info("model_metadata= ", model_metadata)
-    condition1 = model_metadata["model_metrics"]["MAE"] < threshold_dict["MAE"]
-    condition2 = model_metadata["model_metrics"]["MSE"] < threshold_dict["MSE"]
-    condition3 = model_metadata["model_metrics"]["RMSE"] < threshold_dict["RMSE"]
-    if condition1 and condition2 and condition3:
+    log.info(f"model_metadata= {model_metadata}")
+    model_metrics = model_metadata["model_metrics"]
+    higher_is_better = ("R2", )
+    conditions = []
+    for key, threshold in threshold_dict.items():
+        metric, _, bound = key.rpartition("_")
+        if bound in ("lower", "upper"):
+            if f"{metric}_CI" not in model_metrics:
+                raise ValueError(f"no confidence interval for {metric} in model metadata")
+            value = model_metrics[f"{metric}_CI"][0 if bound == "lower" else 1]
+        else:
+            metric = key
+            if metric not in model_metrics:
+                raise ValueError(f"no metric {metric} in model metadata")
+            value = model_metrics[metric]
+        passed = value > threshold if metric in higher_is_better else value < threshold
+        log.info(f"{key}: {value} against threshold {threshold}, passed={passed}")
+        conditions.append(passed)
+    if all(conditions):
         evaluation_status = "True"
     else:
         evaluation_status= "False"
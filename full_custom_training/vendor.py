@@ -0,0 +1,196 @@
+"""
+Copy helper modules of this directory into the components that use them
+
+A KFP python function component is self-contained: only the function source
+reaches the container, so it cannot import a module of this directory. A
+component marks where a helper module goes with a pair of comments
+
+    # BEGIN VENDORED <module>.py
+    # END VENDORED <module>.py
+
+and this script replaces everything between them with the module source,
+indented like the markers. Imports the component already made are not
+repeated. Other projects using a helper module get a generated copy of the
+whole file, listed in COPIES. Edit the module, never a copy.
+
+Usage
+-----
+    python vendor.py            # regenerate the vendored blocks and copies
+    python vendor.py --check    # list out of date files, exit 1 if any
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(DIRECTORY)
+BEGIN = re.compile(r"^( *)# BEGIN VENDORED (\w+\.py)$")
+IMPORT = re.compile(r"^(import|from) \S")
+# helper modules of this directory copied into other projects, directories
+# relative to the repository root
+COPIES = {
+    "compile_cache.py": ["pre_build_custom_training", "automl/automl_image_classification", "automl/automl_tabular",
+                         "automl/automl_text", "bqml/bq_kfp_automl", "bqml/bq_kfp_classification",
+                         "bqml/bq_kfp_regression"],
+    "cloud_logging.py": ["pre_build_custom_training/traincontainer/trainer", "bqml/bq_regression_dnn/scripts",
+                         "bqml/bq_timeseries/scripts", "bqml/bq_xgboost/scripts"],
+    "gcp_clients.py": ["pre_build_custom_training/traincontainer/trainer", "bqml/bq_kfp_regression",
+                       "bqml/bq_regression_dnn/scripts", "bqml/bq_timeseries/scripts", "bqml/bq_xgboost/scripts"],
+}
+HEADER = "# Generated from full_custom_training/{module} by full_custom_training/vendor.py, edit that file\n"
+
+
+def vendored(source: str, directory: str = DIRECTORY):
+    """
+    Source of a component file with every vendored block regenerated,
+    leaving out the module imports the enclosing function already has
+
+    Parameters
+    ----------
+    source : str
+        DESCRIPTION: component file source
+    directory : str, optional
+        DESCRIPTION: directory of the helper modules
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error if a block has no end marker
+
+    Returns
+    -------
+    str
+        DESCRIPTION: regenerated source
+
+    """
+    lines = source.splitlines(keepends=True)
+    result = []
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        result.append(line)
+        index += 1
+        match = BEGIN.match(line.rstrip("\n"))
+        if match is None:
+            continue
+        indent, module = match.groups()
+        end = f"{indent}# END VENDORED {module}"
+        while index < len(lines) and lines[index].rstrip("\n") != end:
+            index += 1
+        if index == len(lines):
+            raise ValueError(f"vendored {module} has no end marker")
+        with open(os.path.join(directory, module)) as module_file:
+            module_lines = module_file.read().splitlines(keepends=True)
+        imported = enclosing_imports(result[:-1], indent)
+        result.extend(indent + module_line if module_line.strip() else module_line
+                      for module_line in module_lines
+                      if not (IMPORT.match(module_line) and module_line.strip() in imported))
+        result.append(lines[index])
+        index += 1
+    return "".join(result)
+
+
+def enclosing_imports(lines: list, indent: str):
+    """
+    Import statements at the level of a vendored block, from the block back
+    to the start of the function holding it
+
+    Parameters
+    ----------
+    lines : list
+        DESCRIPTION: source lines before the block
+    indent : str
+        DESCRIPTION: indentation of the block markers
+
+    Returns
+    -------
+    set
+        DESCRIPTION: stripped import lines
+
+    """
+    imported = set()
+    for line in reversed(lines):
+        if not line.strip():
+            continue
+        if not line.startswith(indent):
+            break
+        if not line[len(indent)].isspace() and IMPORT.match(line[len(indent):]):
+            imported.add(line.strip())
+    return imported
+
+
+def copies(directory: str = DIRECTORY, root: str = REPO_ROOT):
+    """
+    Generated copies of the helper modules listed in COPIES
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: path of every copy mapped to its expected source
+
+    """
+    expected = {}
+    for module, targets in COPIES.items():
+        with open(os.path.join(directory, module)) as module_file:
+            source = HEADER.format(module=module) + module_file.read()
+        for target in targets:
+            expected[os.path.join(root, target, module)] = source
+    return expected
+
+
+def stale(directory: str = DIRECTORY, write: bool = False, root: str = REPO_ROOT):
+    """
+    Component files whose vendored blocks, and copies whose source, differ
+    from the helper modules
+
+    Parameters
+    ----------
+    directory : str, optional
+        DESCRIPTION: directory of the components and helper modules
+    write : bool, optional
+        DESCRIPTION: regenerate the stale files
+    root : str, optional
+        DESCRIPTION: repository root the COPIES directories are relative to
+
+    Returns
+    -------
+    list
+        DESCRIPTION: paths of the stale files
+
+    """
+    paths = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        if os.path.abspath(path) == os.path.abspath(__file__):
+            continue
+        with open(path) as source_file:
+            source = source_file.read()
+        updated = vendored(source, directory)
+        if updated != source:
+            paths.append(path)
+            if write:
+                with open(path, "w") as source_file:
+                    source_file.write(updated)
+    for path, source in sorted(copies(directory, root).items()):
+        current = None
+        if os.path.exists(path):
+            with open(path) as copy_file:
+                current = copy_file.read()
+        if current != source:
+            paths.append(path)
+            if write:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as copy_file:
+                    copy_file.write(source)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy helper modules into the components and projects using them")
+    parser.add_argument("--check", action="store_true", help="only report out of date copies")
+    args = parser.parse_args()
+    paths = stale(write=not args.check)
+    for path in paths:
+        print(f"{'out of date' if args.check else 'updated'}: {os.path.relpath(path)}")
+    sys.exit(1 if args.check and paths else 0)
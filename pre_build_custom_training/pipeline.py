@@ -1,13 +1,14 @@
-from datetime import datetime
 import configparser
 import os
 from os.path import join
 
-from kfp.v2 import compiler
-from kfp.v2.dsl import pipeline
+from kfp.v2.components import importer_node
+from kfp.v2.dsl import PIPELINE_JOB_ID_PLACEHOLDER, pipeline
 
-from google.cloud import aiplatform
 from google_cloud_pipeline_components import aiplatform as gcc_aip
+from google_cloud_pipeline_components.types import artifact_types
+
+from register import register_model
 
 
 config = configparser.ConfigParser()
@@ -21,7 +22,8 @@ PIPELINE_ROOT = config["PIPELINE_PARAMS"]["PIPELINE_ROOT"]
 credential_path = config["PIPELINE_PARAMS"]["CREDNTIAL_PATH"]
 service_account = config["PIPELINE_PARAMS"]["SERVICE_ACCOUNT"]
 bq_source = config["PIPELINE_PARAMS"]["BQ_SOURCE"]
-TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
+# base output directory of the training job, its AIP_MODEL_DIR is <dir>/model/
+TRAINING_OUTPUT_DIR = f"{PIPELINE_ROOT}/{PIPELINE_JOB_ID_PLACEHOLDER}/training"
 
 
 @pipeline(
@@ -36,7 +38,9 @@ def custom_pipeline(
     bq_dest: str = "",
     container_uri: str = "",
     batch_destination: str = "",
-    service_account: str = ""
+    service_account: str = "",
+    replica_count: int = 1,
+    serving_container_uri: str = "us-docker.pkg.dev/vertex-ai/prediction/sklearn-cpu.0-24:latest"
 ):
     """
     
@@ -59,6 +63,15 @@ def custom_pipeline(
         DESCRIPTION: Batch prediction output artifact path. The default is "".
     service_account : str, optional
         DESCRIPTION: Service account email. The default is "".
+    replica_count : int, optional
+        DESCRIPTION: Training replicas, above 1 the container trains in
+        distributed mode (see traincontainer/trainer/distributed.py). The
+        default is 1.
+    serving_container_uri : str, optional
+        DESCRIPTION: Serving image of the trained model, e.g. the
+        micro-batching server of custom_serving. The default is the
+        pre-built sklearn 0.24 image. A model with the same content and
+        serving image registered by an earlier run is reused.
 
     Returns
     -------
@@ -83,53 +96,34 @@ def custom_pipeline(
         validation_fraction_split=0.1,
         test_fraction_split=0.1,
         bigquery_destination=bq_dest,
-        model_serving_container_image_uri="us-docker.pkg.dev/vertex-ai/prediction/sklearn-cpu.0-24:latest",
-        model_display_name="scikit-chicago-model-pipeline",
+        base_output_dir=TRAINING_OUTPUT_DIR,
         machine_type="n1-standard-4",
+        replica_count=replica_count,
         service_account = service_account
     )
 
+    # the training job uploads no model, register_model skips the upload
+    # when the published content is registered with this serving image
+    register_op = register_model(
+        project=project,
+        location=gcp_region,
+        model_dir=f"{TRAINING_OUTPUT_DIR}/model",
+        serving_container_uri=serving_container_uri,
+    ).after(training_op)
+
+    model_importer = importer_node.importer(
+        artifact_uri=register_op.outputs["model_uri"],
+        artifact_class=artifact_types.VertexModel,
+        metadata={"resourceName": register_op.outputs["resource_name"]},
+    )
+
     batch_predict_op = gcc_aip.ModelBatchPredictOp(
         project=project,
         location=gcp_region,
         job_display_name="chicago-batch-predict",
-        model=training_op.outputs["model"],
+        model=model_importer.outputs["artifact"],
         gcs_source_uris=["{0}/batch_pred_sample.csv".format(BUCKET_NAME)],
         instances_format="csv",
         gcs_destination_output_uri_prefix=batch_destination,
         machine_type="n1-standard-4"
     )
-
-
-compiler.Compiler().compile(
-    pipeline_func=custom_pipeline, package_path="custom_train_pipeline.json"
-)
-
-
-pipeline_job = aiplatform.PipelineJob(
-    display_name="custom-train-pipeline",
-    template_path="custom_train_pipeline.json",
-    job_id="custom-train-pipeline-{0}".format(TIMESTAMP),
-    parameter_values={
-        "project": PROJECT_ID,
-        "bucket": BUCKET_NAME,
-        "bq_dest": "bq://{0}".format(PROJECT_ID),
-        "container_uri": "gcr.io/{0}/scikit:v2".format(PROJECT_ID),
-        "batch_destination": "{0}/batchpredresults".format(BUCKET_NAME),
-        "service_account": service_account
-    },
-    enable_caching=True,
-)
-
-pipeline_job.submit(service_account = service_account)
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,71 @@
+from typing import NamedTuple
+
+from kfp.v2.dsl import component
+
+
+@component(
+    base_image="python:3.9",
+    packages_to_install=["google-cloud-aiplatform", "gcsfs"],
+)
+def register_model(
+    project: str,
+    location: str,
+    model_dir: str,
+    serving_container_uri: str,
+    display_name: str = "scikit-chicago-model-pipeline",
+) -> NamedTuple("Outputs", [("resource_name", str), ("model_uri", str)]):
+    """
+    Register the model the training container published, unless a model
+    with the same content and serving image is registered already
+
+    Parameters
+    ----------
+    project : str
+        DESCRIPTION: GCP Project ID
+    location : str
+        DESCRIPTION: GCP Project Region
+    model_dir : str
+        DESCRIPTION: AIP_MODEL_DIR of the training job, holding the
+        published.json that traincontainer/trainer/train.py writes
+    serving_container_uri : str
+        DESCRIPTION: serving image of the model
+    display_name : str, optional
+        DESCRIPTION: Model Registry display name, also part of the lookup
+
+    Returns
+    -------
+    NamedTuple
+        DESCRIPTION: resource name of the registered model and its
+        aiplatform API uri, the artifact uri of a google.VertexModel
+
+    """
+    import hashlib
+    import json
+    from collections import namedtuple
+
+    import gcsfs
+    from google.cloud import aiplatform
+
+    with gcsfs.GCSFileSystem(project=project).open(f"{model_dir.rstrip('/')}/published.json") as published_file:
+        published = json.load(published_file)
+    # label values are limited to 63 characters, the image uri is hashed to fit
+    labels = {"artifact_sha256": published["sha256"][:63],
+              "serving_image_sha256": hashlib.sha256(serving_container_uri.encode()).hexdigest()[:63]}
+    aiplatform.init(project=project, location=location)
+    registered = aiplatform.Model.list(
+        filter=" AND ".join([f'display_name="{display_name}"']
+                            + [f'labels.{key}="{value}"' for key, value in labels.items()]),
+        order_by="create_time desc")
+    if registered:
+        model = registered[0]
+        print(f"{published['artifact_uri']} already registered as {model.resource_name}, upload skipped")
+    else:
+        model = aiplatform.Model.upload(
+            display_name=display_name,
+            artifact_uri=published["artifact_uri"],
+            serving_container_image_uri=serving_container_uri,
+            labels=labels,
+        )
+    outputs = namedtuple("Outputs", ["resource_name", "model_uri"])
+    return outputs(model.resource_name,
+                   f"https://{location}-aiplatform.googleapis.com/v1/{model.resource_name}")
@@ -0,0 +1,80 @@
+from datetime import datetime
+import argparse
+import configparser
+import os
+from os.path import join
+
+from compile_cache import compile_if_changed
+
+config = configparser.ConfigParser()
+current_dir = os.getcwd()
+config.read(join(current_dir, "pipeline_config.ini"))
+
+BUCKET_NAME = config["PIPELINE_PARAMS"]["BUCKET_NAME"]
+PROJECT_ID  = config["PIPELINE_PARAMS"]["PROJECT_ID"]
+service_account = config["PIPELINE_PARAMS"]["SERVICE_ACCOUNT"]
+REPLICA_COUNT = config["PIPELINE_PARAMS"].getint("REPLICA_COUNT", 1)
+SERVING_IMAGE = config["PIPELINE_PARAMS"].get(
+    "SERVING_IMAGE", "us-docker.pkg.dev/vertex-ai/prediction/sklearn-cpu.0-24:latest")
+TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
+
+TEMPLATE_PATH = "custom_train_pipeline.json"
+
+
+def compile_pipeline():
+    """
+    Compile the pipeline to TEMPLATE_PATH, kfp and the pipeline definition
+    are imported only here so importing this module stays cheap
+
+    Returns
+    -------
+    None.
+
+    """
+    from kfp.v2 import compiler
+    from pipeline import custom_pipeline
+    compiler.Compiler().compile(
+        pipeline_func=custom_pipeline, package_path=TEMPLATE_PATH
+    )
+
+
+def submit_pipeline():
+    """
+    Submit the compiled pipeline to Vertex AI Pipelines
+
+    Returns
+    -------
+    None.
+
+    """
+    from google.cloud import aiplatform
+    pipeline_job = aiplatform.PipelineJob(
+        display_name="custom-train-pipeline",
+        template_path=TEMPLATE_PATH,
+        job_id="custom-train-pipeline-{0}".format(TIMESTAMP),
+        parameter_values={
+            "project": PROJECT_ID,
+            "bucket": BUCKET_NAME,
+            "bq_dest": "bq://{0}".format(PROJECT_ID),
+            "container_uri": "gcr.io/{0}/scikit:v2".format(PROJECT_ID),
+            "batch_destination": "{0}/batchpredresults".format(BUCKET_NAME),
+            "service_account": service_account,
+            "replica_count": REPLICA_COUNT,
+            "serving_container_uri": SERVING_IMAGE
+        },
+        enable_caching=True,
+    )
+
+    pipeline_job.submit(service_account = service_account)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile and submit the custom training pipeline")
+    parser.add_argument("--compile-only", action="store_true",
+                        help="only write the pipeline template, nothing is sent to GCP")
+    parser.add_argument("--force-compile", action="store_true",
+                        help="recompile even when the cached template is up to date")
+    args = parser.parse_args()
+    compile_if_changed(compile_pipeline, TEMPLATE_PATH, force=args.force_compile)
+    if not args.compile_only:
+        submit_pipeline()
@@ -0,0 +1,151 @@
+"""
+Publish model artifacts to GCS. Files larger than config.UPLOAD_CHUNK_SIZE
+are uploaded as parallel chunks that are composed into the final object,
+and the sha256 of the content is recorded in the object metadata, so an
+object already holding the same bytes is not uploaded again. The files of
+one model are published together under a directory named by the hash of
+their content, which every run producing the same files finds again
+"""
+import hashlib
+import math
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+HASH_METADATA_KEY = "sha256"
+MAX_COMPOSE_SOURCES = 32  # GCS limit of source objects per compose request
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+PUBLISHED_FILE = "published.json"  # written to AIP_MODEL_DIR, read by register.py of the pipeline
+
+
+def sha256_file(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def upload_composite(blob, local_path: str, chunk_size: int, max_workers: int):
+    """
+    Parallel composite upload: every chunk is uploaded as a temporary object
+    by its own thread, then the chunks are composed into blob server side.
+    The chunks uploaded so far are deleted whether the uploads, the compose
+    or neither failed
+
+    Parameters
+    ----------
+    blob : storage.Blob
+        DESCRIPTION: destination, its metadata is kept by the compose
+    local_path : str
+        DESCRIPTION: file to upload
+    chunk_size : int
+        DESCRIPTION: bytes per chunk, raised so that there are at most
+        MAX_COMPOSE_SOURCES chunks
+    max_workers : int
+        DESCRIPTION: concurrent chunk uploads
+
+    Returns
+    -------
+    None
+
+    """
+    size = os.path.getsize(local_path)
+    chunk_size = max(chunk_size, math.ceil(size / MAX_COMPOSE_SOURCES))
+    prefix = f"{blob.name}.parts-{uuid.uuid4().hex}"
+    uploaded = []
+
+    def upload_chunk(index: int):
+        offset = index * chunk_size
+        part = blob.bucket.blob(f"{prefix}/{index:02d}")
+        with open(local_path, "rb") as source:
+            source.seek(offset)
+            part.upload_from_file(source, size=min(chunk_size, size - offset), checksum="crc32c")
+        uploaded.append(part)
+        return part
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(executor.map(upload_chunk, range(math.ceil(size / chunk_size))))
+        blob.compose(parts)
+    finally:
+        # leaving the executor waited for the uploads in flight, uploaded is complete
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda part: part.delete(), uploaded))
+
+
+def publish(storage_client, local_path: str, gcs_uri: str, chunk_size: int = None, max_workers: int = None,
+            digest: str = None):
+    """
+    Upload a file unless the destination already holds the same content
+
+    Parameters
+    ----------
+    storage_client : storage.Client
+        DESCRIPTION: GCS client, see gcp_clients.storage_client
+    local_path : str
+        DESCRIPTION: file to publish
+    gcs_uri : str
+        DESCRIPTION: gs:// destination
+    chunk_size : int, optional
+        DESCRIPTION: files above this size are uploaded in parallel chunks,
+        config.UPLOAD_CHUNK_SIZE by default
+    max_workers : int, optional
+        DESCRIPTION: concurrent chunk uploads, config.UPLOAD_WORKERS by default
+    digest : str, optional
+        DESCRIPTION: sha256 of the file when already known
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: uri, sha256 of the content and whether it was uploaded
+
+    """
+    from google.cloud import storage
+    chunk_size = chunk_size or config.UPLOAD_CHUNK_SIZE
+    max_workers = max_workers or config.UPLOAD_WORKERS
+    digest = digest or sha256_file(local_path)
+    blob = storage.blob.Blob.from_string(gcs_uri, client=storage_client)
+    existing = blob.bucket.get_blob(blob.name)
+    if existing is not None and (existing.metadata or {}).get(HASH_METADATA_KEY) == digest:
+        return {"uri": gcs_uri, "sha256": digest, "uploaded": False}
+    blob.metadata = {HASH_METADATA_KEY: digest}
+    if os.path.getsize(local_path) > chunk_size:
+        upload_composite(blob, local_path, chunk_size, max_workers)
+    else:
+        blob.upload_from_filename(local_path)
+    return {"uri": gcs_uri, "sha256": digest, "uploaded": True}
+
+
+def publish_content(storage_client, local_paths: list, artifacts_root: str, **options):
+    """
+    Publish files to <artifacts_root>/<sha256>/, the sha256 covering the
+    name and content of every file. A later run with the same files finds
+    them there and uploads nothing
+
+    Parameters
+    ----------
+    storage_client : storage.Client
+        DESCRIPTION: GCS client, see gcp_clients.storage_client
+    local_paths : list
+        DESCRIPTION: files to publish, their names are kept
+    artifacts_root : str
+        DESCRIPTION: gs:// prefix of the content addressed directories
+    **options
+        DESCRIPTION: chunk_size and max_workers of publish
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: uri of the directory, its sha256 and the files uploaded
+        by this call
+
+    """
+    digests = {os.path.basename(path): sha256_file(path) for path in local_paths}
+    content = hashlib.sha256("".join(f"{name} {digests[name]}\n" for name in sorted(digests)).encode())
+    directory = f"{artifacts_root.rstrip('/')}/{content.hexdigest()}/"
+    uploaded = [name for name, path in zip(digests, local_paths)
+                if publish(storage_client, path, directory + name, digest=digests[name], **options)["uploaded"]]
+    return {"uri": directory, "sha256": content.hexdigest(), "uploaded": uploaded}
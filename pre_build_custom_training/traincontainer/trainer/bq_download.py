@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import gcp_clients
+
+BQ_PREFIX = "bq://"
+MAX_STREAM_COUNT = 8
+
+
+def table_path(bq_table_uri: str):
+    """
+    Storage Read API path of a table
+
+    Parameters
+    ----------
+    bq_table_uri : str
+        DESCRIPTION: bq://project.dataset.table or project.dataset.table
+
+    Returns
+    -------
+    str
+        DESCRIPTION: projects/<project>/datasets/<dataset>/tables/<table>
+
+    """
+    if bq_table_uri.startswith(BQ_PREFIX):
+        bq_table_uri = bq_table_uri[len(BQ_PREFIX):]
+    project, dataset, table = bq_table_uri.split(".", 2)
+    return f"projects/{project}/datasets/{dataset}/tables/{table}"
+
+
+def open_session(credential_path: str, bq_table_uri: str, max_stream_count: int = MAX_STREAM_COUNT,
+                 selected_fields: list = None):
+    """
+    Open a Storage Read API session delivering Arrow record batches, billed
+    to the project of the service account
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    bq_table_uri : str
+        DESCRIPTION: table to read
+    max_stream_count : int
+        DESCRIPTION: upper bound of parallel streams, BigQuery may create
+        fewer for small tables
+    selected_fields : list, optional
+        DESCRIPTION: columns to read, all columns when None
+
+    Returns
+    -------
+    session : bigquery_storage.types.ReadSession
+        DESCRIPTION: read session
+
+    """
+    from google.cloud import bigquery_storage
+    read_client = gcp_clients.bigquery_read_client(credential_path)
+    project = gcp_clients.get_credentials(credential_path).project_id
+    return read_client.create_read_session(
+        parent=f"projects/{project}",
+        read_session=bigquery_storage.types.ReadSession(
+            table=table_path(bq_table_uri),
+            data_format=bigquery_storage.types.DataFormat.ARROW,
+            read_options=bigquery_storage.types.ReadSession.TableReadOptions(
+                selected_fields=selected_fields or []),
+        ),
+        max_stream_count=max_stream_count,
+    )
+
+
+def session_schema(session):
+    import pyarrow as pa
+    return pa.ipc.read_schema(pa.py_buffer(session.arrow_schema.serialized_schema))
+
+
+def read_streams(credential_path: str, session, stream_indices: list = None, checkpoint=None):
+    """
+    Read streams of a session concurrently, one thread per stream, into a
+    single Arrow table. The record batches are referenced as chunks of the
+    table, not copied, and kept in stream order so the row order does not
+    depend on which stream finished first
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    session : bigquery_storage.types.ReadSession
+        DESCRIPTION: session opened by open_session
+    stream_indices : list, optional
+        DESCRIPTION: streams to read, all streams when None
+    checkpoint : checkpoint.StreamCheckpoint, optional
+        DESCRIPTION: cursor of the session's streams, checkpointed rows are
+        restored and every stream continues at its checkpointed offset
+
+    Returns
+    -------
+    pyarrow.Table
+        DESCRIPTION: rows of the selected streams
+
+    """
+    import pyarrow as pa
+    read_client = gcp_clients.bigquery_read_client(credential_path)
+    if stream_indices is None:
+        stream_indices = range(len(session.streams))
+
+    def read_stream(stream_index: int):
+        if checkpoint is None:
+            reader = read_client.read_rows(session.streams[stream_index].name)
+            return [page.to_arrow() for page in reader.rows(session).pages]
+        batches, offset, done = checkpoint.restore(stream_index)
+        if done:
+            return batches
+        reader = read_client.read_rows(session.streams[stream_index].name, offset=offset)
+        pending, pending_rows = [], 0
+        for page in reader.rows(session).pages:
+            batch = page.to_arrow()
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= checkpoint.segment_rows:
+                checkpoint.save_segment(stream_index, offset, pending, done=False)
+                batches.extend(pending)
+                offset += pending_rows
+                pending, pending_rows = [], 0
+        checkpoint.save_segment(stream_index, offset, pending, done=True)
+        return batches + pending
+
+    stream_indices = list(stream_indices)
+    if not stream_indices:
+        return session_schema(session).empty_table()
+    with ThreadPoolExecutor(max_workers=len(stream_indices)) as executor:
+        batches = [batch for stream in executor.map(read_stream, stream_indices) for batch in stream]
+    return pa.Table.from_batches(batches, schema=session_schema(session))
+
+
+def download_table(credential_path: str, bq_table_uri: str, max_stream_count: int = MAX_STREAM_COUNT):
+    """
+    Download a table with the Storage Read API, reading up to
+    max_stream_count streams in parallel
+
+    Parameters
+    ----------
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    bq_table_uri : str
+        DESCRIPTION: Bigquery table URI
+
+    Returns
+    -------
+    pyarrow.Table
+        DESCRIPTION: bq table as Arrow table
+
+    """
+    session = open_session(credential_path, bq_table_uri, max_stream_count)
+    return read_streams(credential_path, session)
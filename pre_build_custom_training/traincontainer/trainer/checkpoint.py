@@ -0,0 +1,232 @@
+"""
+Checkpoints of a training run, so a preempted or timed out job resumes
+instead of starting over
+
+State lives under AIP_CHECKPOINT_DIR (set by Vertex AI for custom jobs with
+a base output directory) or config.CHECKPOINT_DIR, and is mirrored in
+config.LOCAL_CACHE_DIR:
+    sessions/<split>.pb        Storage Read session, reused while it is valid
+    <split>/cursor.json        rows read and segments written per stream
+    <split>/stream-*.arrow     downloaded rows as Arrow IPC files
+    model/model.joblib         fitted model and the data it was fitted on
+"""
+import json
+import os
+import threading
+import time
+
+import config
+from file_io import copy_file, exists, read_bytes, write_bytes
+
+SESSION_MARGIN = 600
+
+
+def session_alive(session, margin: float = SESSION_MARGIN):
+    """
+    Whether a read session stays valid for at least margin more seconds,
+    streams of an expired session can no longer be read
+
+    """
+    return session.expire_time.timestamp() - margin > time.time()
+
+
+class Checkpoint:
+    """
+    Checkpoint prefix of one replica with its local cache
+
+    Parameters
+    ----------
+    prefix : str
+        DESCRIPTION: gs:// or local directory holding the durable state
+    local_dir : str
+        DESCRIPTION: local cache of the checkpointed files
+
+    """
+
+    def __init__(self, prefix: str, local_dir: str):
+        self.prefix = prefix.rstrip("/")
+        self.local_dir = local_dir
+
+    @classmethod
+    def from_env(cls, rank: int = 0, world_size: int = 1, environ=os.environ):
+        """
+        Checkpoint of this replica, None when neither AIP_CHECKPOINT_DIR nor
+        config.CHECKPOINT_DIR is set
+
+        """
+        prefix = environ.get("AIP_CHECKPOINT_DIR") or config.CHECKPOINT_DIR
+        if not prefix:
+            return None
+        replica = f"rank-{rank}" if world_size > 1 else "single"
+        return cls(f"{prefix.rstrip('/')}/trainer/{replica}", os.path.join(config.LOCAL_CACHE_DIR, replica))
+
+    def remote(self, name: str):
+        return f"{self.prefix}/{name}"
+
+    def local(self, name: str):
+        return os.path.join(self.local_dir, *name.split("/"))
+
+    def load_json(self, name: str):
+        path = self.remote(name)
+        return json.loads(read_bytes(path)) if exists(path) else None
+
+    def save_json(self, name: str, value):
+        write_bytes(self.remote(name), json.dumps(value).encode())
+
+    def save_file(self, name: str):
+        copy_file(self.local(name), self.remote(name))
+
+    def fetch_file(self, name: str):
+        """
+        Local path of a checkpointed file, downloaded when the local cache
+        does not have it, e.g. after the job moved to a new machine
+
+        """
+        path = self.local(name)
+        if not os.path.exists(path):
+            copy_file(self.remote(name), path)
+        return path
+
+    def session(self, name: str, open_session):
+        """
+        Read session of a split: the checkpointed one while it is valid, so
+        that its stream cursors still apply, a new one otherwise
+
+        Parameters
+        ----------
+        name : str
+            DESCRIPTION: split name
+        open_session : callable
+            DESCRIPTION: opens a new session
+
+        Returns
+        -------
+        bigquery_storage.types.ReadSession
+            DESCRIPTION: read session
+
+        """
+        from google.cloud import bigquery_storage
+        path = self.remote(f"sessions/{name}.pb")
+        if exists(path):
+            session = bigquery_storage.types.ReadSession.deserialize(read_bytes(path))
+            if session_alive(session):
+                return session
+        session = open_session()
+        write_bytes(path, bigquery_storage.types.ReadSession.serialize(session))
+        return session
+
+    def streams(self, name: str, session):
+        return StreamCheckpoint(self, name, session)
+
+    def load_model(self, fingerprint: str):
+        """
+        Model checkpointed for the same training data, None otherwise
+
+        """
+        state = self.load_json("model/state.json")
+        if not state or state["fingerprint"] != fingerprint:
+            return None
+        from joblib import load
+        return load(self.fetch_file("model/model.joblib"))
+
+    def save_model(self, model, fingerprint: str):
+        from joblib import dump
+        path = self.local("model/model.joblib")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dump(model, path)
+        self.save_file("model/model.joblib")
+        self.save_json("model/state.json", {"fingerprint": fingerprint})
+
+
+class StreamCheckpoint:
+    """
+    Cursor of the Storage Read streams of one split. Rows are written to
+    Arrow IPC segment files of about config.CHECKPOINT_ROWS rows in the local
+    cache, and every segment is copied to the checkpoint before the cursor of
+    its stream moves past it, so a resumed job re-reads only what was not
+    checkpointed. A cursor of another session is discarded
+
+    Parameters
+    ----------
+    checkpoint : Checkpoint
+        DESCRIPTION: checkpoint of the replica
+    name : str
+        DESCRIPTION: split name
+    session : bigquery_storage.types.ReadSession
+        DESCRIPTION: session the cursor belongs to
+
+    """
+
+    def __init__(self, checkpoint: Checkpoint, name: str, session):
+        from bq_download import session_schema
+        self.checkpoint = checkpoint
+        self.name = name
+        self.schema = session_schema(session)
+        self.segment_rows = config.CHECKPOINT_ROWS
+        self.lock = threading.Lock()
+        cursor = checkpoint.load_json(f"{name}/cursor.json")
+        if not cursor or cursor["session"] != session.name:
+            cursor = {"session": session.name, "streams": {}}
+        self.cursor = cursor
+
+    def state(self, stream_index: int):
+        with self.lock:
+            return dict(self.cursor["streams"].get(str(stream_index),
+                                                   {"rows": 0, "segments": [], "done": False}))
+
+    def restore(self, stream_index: int):
+        """
+        Checkpointed rows of a stream
+
+        Returns
+        -------
+        tuple
+            DESCRIPTION: record batches memory-mapped from the local cache,
+            row offset to continue reading from and whether the stream is
+            finished
+
+        """
+        import pyarrow as pa
+        state = self.state(stream_index)
+        batches = []
+        for segment in state["segments"]:
+            batches.extend(pa.ipc.open_file(pa.memory_map(self.checkpoint.fetch_file(segment))).read_all()
+                           .to_batches())
+        return batches, state["rows"], state["done"]
+
+    def save_segment(self, stream_index: int, offset: int, batches: list, done: bool):
+        """
+        Checkpoint the rows read from offset on and advance the cursor
+
+        Parameters
+        ----------
+        stream_index : int
+            DESCRIPTION: stream of the session
+        offset : int
+            DESCRIPTION: stream offset of the first row in batches
+        batches : list
+            DESCRIPTION: record batches, may be empty
+        done : bool
+            DESCRIPTION: True once the stream is exhausted
+
+        Returns
+        -------
+        None
+
+        """
+        import pyarrow as pa
+        state = self.state(stream_index)
+        rows = sum(batch.num_rows for batch in batches)
+        if rows:
+            segment = f"{self.name}/stream-{stream_index:04d}-{offset:012d}.arrow"
+            path = self.checkpoint.local(segment)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, self.schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+            self.checkpoint.save_file(segment)
+            state["segments"] = state["segments"] + [segment]
+        with self.lock:
+            self.cursor["streams"][str(stream_index)] = {"rows": offset + rows, "segments": state["segments"],
+                                                        "done": done}
+            self.checkpoint.save_json(f"{self.name}/cursor.json", self.cursor)
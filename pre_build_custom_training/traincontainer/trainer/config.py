@@ -1,2 +1,10 @@
 credential_path = "gs://vertex-training-poc/hackathon1-183523-af931896c67f.json"
 BUCKET = "vertex-training-poc"
+MAX_STREAM_COUNT = 8  # parallel Storage Read streams per table
+SYNC_TIMEOUT = 3600  # seconds a replica waits for the others in distributed mode
+SYNC_POLL_INTERVAL = 5  # seconds between checks of the coordination directory
+CHECKPOINT_DIR = ""  # gs:// prefix for checkpoints when AIP_CHECKPOINT_DIR is not set, empty disables them
+LOCAL_CACHE_DIR = "/tmp/trainer_cache"  # local copy of checkpointed rows, as Arrow IPC files
+CHECKPOINT_ROWS = 1000000  # rows per stream between checkpoints of the download
+UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024  # bytes, larger artifacts are uploaded as parallel composed chunks
+UPLOAD_WORKERS = 8  # concurrent chunk uploads
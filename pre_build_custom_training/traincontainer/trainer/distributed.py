@@ -0,0 +1,288 @@
+"""
+Multi-worker training across the replicas of a Vertex AI custom job
+
+Vertex AI describes the job to every replica in the CLUSTER_SPEC environment
+variable (TF_CONFIG is accepted as well). The replicas of workerpool0 and
+workerpool1 (chief and workers) are numbered into ranks, rank 0 being the
+chief; reduction servers and evaluators take no part. Replicas coordinate
+through files under a shared directory (DISTRIBUTED_DIR, by default
+AIP_CHECKPOINT_DIR/distributed): the chief opens the Storage Read sessions
+and publishes them, every rank reads a disjoint set of streams, and the
+ranks exchange small json payloads such as schemas and label sets.
+
+Run locally with a synthetic cluster spec:
+    python distributed.py --workers 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import config
+from file_io import exists, read_bytes, write_bytes
+
+TRAINING_POOLS = ("workerpool0", "workerpool1")
+TF_TRAINING_ROLES = ("chief", "master", "worker")
+
+Cluster = namedtuple("Cluster", ["rank", "world_size"])
+
+
+def cluster_from_env(environ=os.environ):
+    """
+    Rank of this replica and number of training replicas
+
+    Parameters
+    ----------
+    environ : dict
+        DESCRIPTION: environment holding CLUSTER_SPEC or TF_CONFIG
+
+    Returns
+    -------
+    Cluster
+        DESCRIPTION: rank (0 is the chief) and world_size, (0, 1) when the
+        job runs on a single replica
+
+    """
+    if environ.get("CLUSTER_SPEC"):
+        spec, roles = json.loads(environ["CLUSTER_SPEC"]), TRAINING_POOLS
+    elif environ.get("TF_CONFIG"):
+        spec, roles = json.loads(environ["TF_CONFIG"]), TF_TRAINING_ROLES
+    else:
+        return Cluster(0, 1)
+    cluster, task = spec.get("cluster", {}), spec.get("task", {})
+    if task.get("type") not in roles:
+        raise ValueError(f"replica type {task.get('type')} does not train")
+    offsets, world_size = {}, 0
+    for role in roles:
+        offsets[role] = world_size
+        world_size += len(cluster.get(role, []))
+    return Cluster(offsets[task["type"]] + int(task.get("index", 0)), max(world_size, 1))
+
+
+def coordination_dir(environ=os.environ):
+    """
+    Shared directory of the replicas, a gs:// prefix on Vertex AI
+
+    Raises
+    ------
+    KeyError
+        DESCRIPTION: Raise error if neither DISTRIBUTED_DIR nor
+        AIP_CHECKPOINT_DIR is set
+
+    """
+    if environ.get("DISTRIBUTED_DIR"):
+        return environ["DISTRIBUTED_DIR"].rstrip("/")
+    return environ["AIP_CHECKPOINT_DIR"].rstrip("/") + "/distributed"
+
+
+def wait_for(paths: list, timeout: float = None, poll_interval: float = None):
+    """
+    Block until every path exists
+
+    Raises
+    ------
+    TimeoutError
+        DESCRIPTION: Raise error if a path is still missing after timeout
+        seconds, e.g. because a replica failed
+
+    """
+    timeout = config.SYNC_TIMEOUT if timeout is None else timeout
+    poll_interval = config.SYNC_POLL_INTERVAL if poll_interval is None else poll_interval
+    deadline = time.monotonic() + timeout
+    missing = list(paths)
+    while missing:
+        missing = [path for path in missing if not exists(path)]
+        if not missing:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"still waiting for {missing}")
+        time.sleep(poll_interval)
+
+
+def exchange(cluster: Cluster, directory: str, name: str, payload):
+    """
+    All-gather of json payloads: every rank publishes its own and waits for
+    the others
+
+    Parameters
+    ----------
+    cluster : Cluster
+        DESCRIPTION: rank and world size
+    directory : str
+        DESCRIPTION: coordination directory
+    name : str
+        DESCRIPTION: name of the round, unique within the job
+    payload : OBJ
+        DESCRIPTION: json serialisable value of this rank
+
+    Returns
+    -------
+    list
+        DESCRIPTION: payloads of all ranks, in rank order
+
+    """
+    paths = [f"{directory}/{name}/rank-{rank}.json" for rank in range(cluster.world_size)]
+    write_bytes(paths[cluster.rank], json.dumps(payload).encode())
+    wait_for(paths)
+    return [json.loads(read_bytes(path)) for path in paths]
+
+
+def shared_sessions(cluster: Cluster, directory: str, credential_path: str, table_uris: dict,
+                    max_stream_count: int):
+    """
+    Read sessions opened once by the chief, with max_stream_count streams per
+    rank, and handed to the other ranks serialised
+
+    Parameters
+    ----------
+    cluster : Cluster
+        DESCRIPTION: rank and world size
+    directory : str
+        DESCRIPTION: coordination directory
+    credential_path : str
+        DESCRIPTION: path of the service account json key
+    table_uris : dict
+        DESCRIPTION: session name to bq:// table uri
+    max_stream_count : int
+        DESCRIPTION: streams per rank
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: session name to bigquery_storage.types.ReadSession
+
+    """
+    from google.cloud import bigquery_storage
+    from bq_download import open_session
+    from checkpoint import session_alive
+
+    def live_session(path: str):
+        if not exists(path):
+            return None
+        session = bigquery_storage.types.ReadSession.deserialize(read_bytes(path))
+        return session if session_alive(session) else None
+
+    paths = {name: f"{directory}/sessions/{name}.pb" for name in table_uris}
+    if cluster.rank == 0:
+        for name, uri in table_uris.items():
+            # a restarted job keeps the sessions of its previous attempt, and
+            # with them the checkpointed stream cursors, while they are valid
+            if live_session(paths[name]) is None:
+                session = open_session(credential_path, uri, max_stream_count * cluster.world_size)
+                write_bytes(paths[name], bigquery_storage.types.ReadSession.serialize(session))
+    sessions = {}
+    deadline = time.monotonic() + config.SYNC_TIMEOUT
+    for name, path in paths.items():
+        # an expired file left by an earlier attempt is replaced by the chief
+        sessions[name] = live_session(path)
+        while sessions[name] is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no valid read session at {path}")
+            time.sleep(config.SYNC_POLL_INTERVAL)
+            sessions[name] = live_session(path)
+    return sessions
+
+
+def shard(session, cluster: Cluster):
+    """
+    Stream indices of this rank: round robin over the session's streams
+
+    """
+    return list(range(cluster.rank, len(session.streams), cluster.world_size))
+
+
+def model_path(directory: str, rank: int):
+    return f"{directory}/models/part-{rank}.joblib"
+
+
+def publish_model(cluster: Cluster, directory: str, model):
+    import io
+    from joblib import dump
+    buffer = io.BytesIO()
+    dump(model, buffer)
+    write_bytes(model_path(directory, cluster.rank), buffer.getvalue())
+
+
+def gather_models(directory: str, ranks: list):
+    import io
+    from joblib import load
+    paths = [model_path(directory, rank) for rank in ranks]
+    wait_for(paths)
+    return [load(io.BytesIO(read_bytes(path))) for path in paths]
+
+
+def voting_ensemble(models: list, classes):
+    """
+    Combine trees trained on different shards into a hard-voting
+    VotingClassifier. The trees must have been fitted on label indices into
+    classes, the shared label set of all shards, which is how VotingClassifier
+    fits its own estimators; the result is a plain sklearn model the
+    prebuilt sklearn serving container can load
+
+    Parameters
+    ----------
+    models : list
+        DESCRIPTION: fitted classifiers, one per shard
+    classes : array-like
+        DESCRIPTION: sorted labels of all shards
+
+    Returns
+    -------
+    VotingClassifier
+        DESCRIPTION: fitted ensemble predicting the original labels
+
+    """
+    from sklearn.ensemble import VotingClassifier
+    from sklearn.preprocessing import LabelEncoder
+    ensemble = VotingClassifier(estimators=[(f"shard-{index}", model) for index, model in enumerate(models)],
+                                voting="hard")
+    ensemble.estimators_ = list(models)
+    ensemble.named_estimators_ = dict(ensemble.estimators)
+    ensemble.le_ = LabelEncoder().fit(classes)
+    ensemble.classes_ = ensemble.le_.classes_
+    return ensemble
+
+
+def launch_local(workers: int, directory: str = "", argv: list = None):
+    """
+    Run train.py as a local cluster of worker processes with a synthetic
+    CLUSTER_SPEC, the AIP_* variables are inherited from this process
+
+    Parameters
+    ----------
+    workers : int
+        DESCRIPTION: number of replicas, rank 0 is the chief
+    directory : str
+        DESCRIPTION: coordination directory, a new temporary one when empty
+    argv : list, optional
+        DESCRIPTION: command of a replica, python train.py by default
+
+    Returns
+    -------
+    int
+        DESCRIPTION: highest exit code of the replicas
+
+    """
+    directory = directory or tempfile.mkdtemp(prefix="distributed-")
+    argv = argv or [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")]
+    hosts = [f"localhost:{2222 + rank}" for rank in range(workers)]
+    cluster = {"workerpool0": hosts[:1], "workerpool1": hosts[1:]}
+    replicas = []
+    for rank in range(workers):
+        task = {"type": "workerpool0", "index": 0} if rank == 0 else {"type": "workerpool1", "index": rank - 1}
+        env = dict(os.environ, DISTRIBUTED_DIR=directory,
+                   CLUSTER_SPEC=json.dumps({"cluster": cluster, "task": task, "environment": "local"}))
+        replicas.append(subprocess.Popen(argv, env=env))
+    return max(replica.wait() for replica in replicas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run train.py as a local multi-worker cluster")
+    parser.add_argument("--workers", type=int, default=2, help="number of replicas")
+    parser.add_argument("--dir", default="", help="coordination directory")
+    args = parser.parse_args()
+    sys.exit(launch_local(args.workers, args.dir))
@@ -0,0 +1,81 @@
+import functools
+import os
+import shutil
+
+import config
+import gcp_clients
+
+
+@functools.lru_cache(maxsize=None)
+def gcs_filesystem():
+    import gcsfs
+    return gcsfs.GCSFileSystem(token=gcp_clients.get_credentials(config.credential_path))
+
+
+def write_bytes(path: str, data: bytes):
+    """
+    Write a gs:// or local file so that readers never see it half written:
+    GCS objects appear on completion and local files are renamed into place
+
+    Parameters
+    ----------
+    path : str
+        DESCRIPTION: gs:// or local path
+    data : bytes
+        DESCRIPTION: file content
+
+    Returns
+    -------
+    None
+
+    """
+    if path.startswith("gs://"):
+        gcs_filesystem().pipe(path, data)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as partial:
+        partial.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def read_bytes(path: str):
+    if path.startswith("gs://"):
+        return gcs_filesystem().cat(path)
+    with open(path, "rb") as source:
+        return source.read()
+
+
+def exists(path: str):
+    if path.startswith("gs://"):
+        # listings are cached by gcsfs, polling must see new objects
+        gcs_filesystem().invalidate_cache(path)
+        return gcs_filesystem().exists(path)
+    return os.path.exists(path)
+
+
+def copy_file(source: str, destination: str):
+    """
+    Copy a file between a local path and a gs:// or local path, either way,
+    without reading it into memory
+
+    Parameters
+    ----------
+    source : str
+        DESCRIPTION: file to copy
+    destination : str
+        DESCRIPTION: target path, parent directories are created
+
+    Returns
+    -------
+    None
+
+    """
+    if destination.startswith("gs://"):
+        gcs_filesystem().put(source, destination)
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    if source.startswith("gs://"):
+        gcs_filesystem().get(source, destination + ".tmp")
+    else:
+        shutil.copyfile(source, destination + ".tmp")
+    os.replace(destination + ".tmp", destination)
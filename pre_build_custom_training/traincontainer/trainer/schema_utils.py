@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+
+MAX_CATEGORIES = 1000
+CATEGORY_RATIO = 0.5
+
+
+def _fits_float32(series: pd.Series):
+    """
+    Check whether every value of a float column survives a float32 round
+    trip exactly
+
+    Parameters
+    ----------
+    series : pd.Series
+        DESCRIPTION: float column
+
+    Returns
+    -------
+    bool
+        DESCRIPTION: True if float32 is safe for the column
+
+    """
+    values = series.to_numpy(dtype=np.float64)
+    # missing and infinite values survive the round trip, the rows are dropped later anyway
+    values = values[np.isfinite(values)]
+    with np.errstate(over="ignore", invalid="ignore"):
+        narrowed = values.astype(np.float32).astype(np.float64)
+    return bool(np.array_equal(narrowed, values))
+
+
+def compact_schema(frames: list):
+    """
+    Pick the narrowest safe dtype per column over a set of frames sharing
+    the same columns: smallest integer width holding the observed range,
+    float32 where the round trip is exact and
+    categoricals for low-cardinality strings
+
+    Parameters
+    ----------
+    frames : list
+        DESCRIPTION: pandas dataframes, e.g. the training and test data
+
+    Returns
+    -------
+    schema : dict
+        DESCRIPTION: column name mapped to {"dtype": ..., "categories": [...]}
+
+    """
+    schema = {}
+    for column in frames[0].columns:
+        parts = [frame[column] for frame in frames if column in frame.columns]
+        if pd.api.types.is_bool_dtype(parts[0]):
+            schema[column] = {"dtype": "bool"}
+        elif pd.api.types.is_integer_dtype(parts[0]):
+            low = min(int(part.min()) for part in parts if len(part))
+            high = max(int(part.max()) for part in parts if len(part))
+            dtype = next(candidate for candidate in ("int8", "int16", "int32", "int64")
+                         if np.iinfo(candidate).min <= low and high <= np.iinfo(candidate).max)
+            schema[column] = {"dtype": dtype}
+        elif pd.api.types.is_float_dtype(parts[0]):
+            float32_ok = all(_fits_float32(part) for part in parts)
+            schema[column] = {"dtype": "float32" if float32_ok else "float64"}
+        elif pd.api.types.infer_dtype(parts[0], skipna=True) == "string":
+            values = set()
+            for part in parts:
+                values.update(part.dropna().unique())
+                if len(values) > MAX_CATEGORIES:
+                    break
+            rows = sum(len(part) for part in parts)
+            if len(values) <= MAX_CATEGORIES and len(values) <= CATEGORY_RATIO * max(rows, 1):
+                schema[column] = {"dtype": "category", "categories": sorted(values)}
+            else:
+                schema[column] = {"dtype": "object"}
+        else:
+            schema[column] = {"dtype": str(parts[0].dtype)}
+    return schema
+
+
+def merge_schemas(schemas: list):
+    """
+    Combine compact schemas computed on different shards of the same table
+    into one every shard can be cast to: the widest numeric dtype and the
+    union of the categories, falling back to object beyond MAX_CATEGORIES
+
+    Parameters
+    ----------
+    schemas : list
+        DESCRIPTION: schemas from compact_schema
+
+    Returns
+    -------
+    schema : dict
+        DESCRIPTION: column name mapped to {"dtype": ..., "categories": [...]}
+
+    """
+    merged = {}
+    for column in schemas[0]:
+        specs = [schema[column] for schema in schemas if column in schema]
+        dtypes = {spec["dtype"] for spec in specs}
+        if dtypes == {"category"}:
+            categories = sorted(set().union(*(spec["categories"] for spec in specs)))
+            merged[column] = ({"dtype": "category", "categories": categories}
+                              if len(categories) <= MAX_CATEGORIES else {"dtype": "object"})
+        elif dtypes & {"category", "object"}:
+            merged[column] = {"dtype": "object"}
+        else:
+            merged[column] = {"dtype": str(np.result_type(*[np.dtype(dtype) for dtype in sorted(dtypes)]))}
+    return merged
+
+
+def apply_schema(df: pd.DataFrame, schema: dict):
+    """
+    Cast a dataframe to a compact schema
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DESCRIPTION: Input dataframe
+    schema : dict
+        DESCRIPTION: schema from compact_schema
+
+    Returns
+    -------
+    pd.DataFrame
+        DESCRIPTION: dataframe using the compact dtypes
+
+    """
+    dtypes = {column: pd.CategoricalDtype(spec["categories"]) if spec["dtype"] == "category"
+              else spec["dtype"]
+              for column, spec in schema.items() if column in df.columns}
+    # columns already in their compact dtype are not copied
+    return df.astype(dtypes, copy=False)
+
+
+def _column_values(series: pd.Series):
+    """
+    NumPy view of a column and the mask of its usable rows
+
+    Parameters
+    ----------
+    series : pd.Series
+        DESCRIPTION: numeric, boolean or categorical column
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error for columns an estimator cannot take, e.g.
+        high-cardinality strings
+
+    Returns
+    -------
+    tuple
+        DESCRIPTION: values (category codes for categoricals) and a boolean
+        mask of finite, non-missing rows, None when every row is usable
+
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        return codes, codes >= 0
+    if not pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        raise ValueError(f"column {series.name} of dtype {series.dtype} is not numeric")
+    values = series.to_numpy()
+    if values.dtype.kind == "O":
+        # nullable extension dtypes with missing values
+        values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if values.dtype.kind == "f":
+        return values, np.isfinite(values)
+    return values, None
+
+
+def feature_arrays(df: pd.DataFrame, label_column: str):
+    """
+    Feature matrix and labels for an estimator, without going through Python
+    lists: every column is read as a NumPy view of its buffer (category codes
+    for categoricals) and written once into a Fortran-ordered float32 matrix,
+    the layout and dtype the sklearn trees work on, so fit does not convert
+    again. Rows with a missing or infinite value are left out
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DESCRIPTION: dataframe using the compact dtypes
+    label_column : str
+        DESCRIPTION: target column
+
+    Returns
+    -------
+    tuple
+        DESCRIPTION: float32 matrix of shape (rows, features) and label array
+
+    """
+    features = [column for column in df.columns if column != label_column]
+    labels, valid = _column_values(df[label_column])
+    valid = np.ones(len(df), dtype=bool) if valid is None else valid.copy()
+    columns = []
+    for column in features:
+        values, mask = _column_values(df[column])
+        if mask is not None:
+            valid &= mask
+        columns.append(values)
+    every_row = bool(valid.all())
+    matrix = np.empty((int(valid.sum()), len(features)), dtype=np.float32, order="F")
+    for index, values in enumerate(columns):
+        matrix[:, index] = values if every_row else values[valid]
+    return matrix, labels if every_row else labels[valid]
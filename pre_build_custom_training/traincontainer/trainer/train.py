@@ -1,29 +1,19 @@
-from sklearn.tree import DecisionTreeClassifier
-from google.cloud import bigquery, logging_v2
-from google.cloud import storage
-from google.oauth2 import service_account
-from joblib import dump
-import gcsfs
+import functools
 import json
-
-import config
-import errno
 import logging
-
 import os
-import numpy as np
-
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
+import config
+from cloud_logging import BatchingHandler, CloudLoggingSink
+from gcp_clients import logging_client
 
 
 def get_logger(credential_path):
     """
-    Create logging object for pipeline logging
-
-    Raises
-    ------
-    FileNotFoundError
-        DESCRIPTION: Raise error if credential file not found
+    Create logging object for pipeline logging. Records are queued and
+    sent in batches by a background thread, see cloud_logging.BatchingHandler
 
     Returns
     -------
@@ -31,21 +21,11 @@ def get_logger(credential_path):
         DESCRIPTION: logging instance
 
     """
-    try:
-        gcs_file_system_object = gcsfs.GCSFileSystem()
-        credential = json.load(
-            gcs_file_system_object.open(credential_path))
-        credentials = service_account.Credentials.from_service_account_info(
-            credential)
-    except FileNotFoundError:
-        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
-                                credential_path)
-
-    client_object = logging_v2.client.Client(credentials=credentials)
     google_log_format = logging.Formatter(
         fmt="%(name)s | %(module)s | %(funcName)s | %(message)s",
         datefmt="%Y-%m-$dT%H:%M:%S")
-    handler = client_object.get_default_handler()
+    # batched and non-blocking, the Cloud Logging client is created by the flusher thread
+    handler = BatchingHandler(CloudLoggingSink(functools.partial(logging_client, credential_path)))
     handler.setFormatter(google_log_format)
 
     cloud_logger = logging.getLogger("data-ingestion")
@@ -55,94 +35,220 @@ def get_logger(credential_path):
     return cloud_logger
 
 
-def service_credentials(credential_path: str):
+def peak_rss_mb():
     """
-    Create service account credential object from json key
-
-    Parameters
-    ----------
-    credential_path : str
-        DESCRIPTION: Service account json key file path
+    Peak resident set size of the process so far
 
     Returns
     -------
-    cred : OBJ
-        DESCRIPTION: google auth credential object
+    float
+        DESCRIPTION: MiB, ru_maxrss is reported in KiB on Linux
 
     """
-    gcs_file_system = gcsfs.GCSFileSystem()
-    cred = json.load(gcs_file_system.open(credential_path))
-    return cred
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
 
-log = get_logger(credential_path = config.credential_path)
-cred = service_credentials(credential_path = config.credential_path)
-bqclient = bigquery.Client.from_service_account_info(cred)
-storage_client = storage.Client.from_service_account_info(cred)
+def read_splits(cluster, directory: str, training_data_uri: str, test_data_uri: str, checkpoint=None):
+    """
+    Download the training and test splits concurrently, each over parallel
+    Storage Read streams. With several replicas the chief opens the
+    sessions, every rank reads its shard of the training streams and only
+    the chief reads the test split. With a checkpoint, sessions and stream
+    cursors of a previous attempt are resumed and the rows it downloaded are
+    read from the local Arrow cache
+
+    Parameters
+    ----------
+    cluster : distributed.Cluster
+        DESCRIPTION: rank and world size
+    directory : str
+        DESCRIPTION: coordination directory, unused on a single replica
+    training_data_uri : str
+        DESCRIPTION: bq:// uri of the training split
+    test_data_uri : str
+        DESCRIPTION: bq:// uri of the test split
+    checkpoint : checkpoint.Checkpoint, optional
+        DESCRIPTION: checkpoint of this replica
 
+    Returns
+    -------
+    tuple
+        DESCRIPTION: training and test pandas dataframes, and the id of the
+        training read session, which identifies the training data
 
-def download_table(bq_table_uri: str):
     """
-    Download table from bigquery
+    from functools import partial
+    from bq_download import open_session, read_streams
+    from distributed import shard, shared_sessions
+
+    table_uris = {"train": training_data_uri, "test": test_data_uri}
+    if cluster.world_size > 1:
+        sessions = shared_sessions(cluster, directory, config.credential_path, table_uris,
+                                   config.MAX_STREAM_COUNT)
+        stream_indices = {"train": shard(sessions["train"], cluster), "test": None if cluster.rank == 0 else []}
+    else:
+        sessions = {}
+        for name, uri in table_uris.items():
+            opener = partial(open_session, config.credential_path, uri, config.MAX_STREAM_COUNT)
+            sessions[name] = opener() if checkpoint is None else checkpoint.session(name, opener)
+        stream_indices = {"train": None, "test": None}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {name: executor.submit(read_streams, config.credential_path, session, stream_indices[name],
+                                         None if checkpoint is None else checkpoint.streams(name, session))
+                   for name, session in sessions.items()}
+        # self_destruct frees each Arrow column once pandas owns it
+        return (futures["train"].result().to_pandas(split_blocks=True, self_destruct=True),
+                futures["test"].result().to_pandas(split_blocks=True, self_destruct=True),
+                sessions["train"].name.rsplit("/", 1)[-1])
+
+
+def train_shard(cluster, directory: str, data, labels):
+    """
+    Fit a tree on the shard of this rank and, on the chief, combine the
+    trees of every rank into a voting ensemble. Labels are encoded against
+    the label set of all shards so that the votes of the trees agree. A tree
+    this rank already published, before a restart, is not fitted again
 
     Parameters
     ----------
-    bq_table_uri : str
-        DESCRIPTION: Bigquery table URI
+    cluster : distributed.Cluster
+        DESCRIPTION: rank and world size
+    directory : str
+        DESCRIPTION: coordination directory of the training data
+    data : np.ndarray
+        DESCRIPTION: feature matrix of the shard
+    labels : np.ndarray
+        DESCRIPTION: labels of the shard
+
+    Returns
+    -------
+    VotingClassifier
+        DESCRIPTION: ensemble on the chief, None on the other ranks
+
+    """
+    import numpy as np
+    from sklearn.tree import DecisionTreeClassifier
+    from distributed import exchange, gather_models, model_path, publish_model, voting_ensemble
+    from file_io import exists
+
+    shard_labels = exchange(cluster, directory, "labels", np.unique(labels).tolist())
+    classes = np.unique(np.concatenate([np.asarray(values, dtype=labels.dtype) for values in shard_labels]))
+    if len(labels) and not exists(model_path(directory, cluster.rank)):
+        publish_model(cluster, directory,
+                      DecisionTreeClassifier().fit(data, np.searchsorted(classes, labels)))
+    if cluster.rank != 0:
+        return None
+    # ranks whose shard came out empty publish no tree
+    ranks = [rank for rank, values in enumerate(shard_labels) if values]
+    return voting_ensemble(gather_models(directory, ranks), classes)
+
+
+def main():
+    """
+    Train the model on the Vertex AI managed dataset splits and upload it to
+    AIP_MODEL_DIR. Clients, imports of the heavy libraries and the logger are
+    created here rather than at import time
 
     Returns
     -------
-    pandas.DataFrame
-        DESCRIPTION: bq table as pandas dataframe
+    None
 
     """
-    prefix = "bq://"
-    if bq_table_uri.startswith(prefix):
-        bq_table_uri = bq_table_uri[len(prefix):]
-
-    table = bigquery.TableReference.from_string(bq_table_uri)
-    rows = bqclient.list_rows(
-        table,
-    )
-    return rows.to_dataframe(create_bqstorage_client=False)
-
-log.info("START : custom training")
-# These environment variables are from Vertex AI managed datasets
-training_data_uri = os.environ["AIP_TRAINING_DATA_URI"]
-test_data_uri = os.environ["AIP_TEST_DATA_URI"]
-log.info("Training data read initiated")
-# Download data into Pandas DataFrames, split into train / test
-df = download_table(training_data_uri)
-df.replace([np.inf, -np.inf], np.nan, inplace=True)
-df.dropna(inplace = True)
-log.info("Training data read complete")
-log.info("Test data read initiated")
-test_df = download_table(test_data_uri)
-test_df.replace([np.inf, -np.inf], np.nan, inplace=True)
-test_df.dropna(inplace = True)
-labels = df.pop("fare").tolist()
-data = df.values.tolist()
-test_labels = test_df.pop("fare").tolist()
-test_data = test_df.values.tolist()
-log.info("Test data read complete")
-
-log.info("Training Decision tree initiated")
-# Define and train the Scikit model
-skmodel = DecisionTreeClassifier()
-skmodel.fit(data, labels)
-log.info("Training Decision tree completed")
-score = skmodel.score(test_data, test_labels)
-log.info('Accuracy is:',score)
-
-# Save the model to a local file
-dump(skmodel, "model.joblib")
-
-log.info("Model upload initiated")
-# Upload the saved model file to GCS
-bucket = storage_client.get_bucket(config.BUCKET)
-model_directory = os.environ["AIP_MODEL_DIR"]
-storage_path = os.path.join(model_directory, "model.joblib")
-blob = storage.blob.Blob.from_string(storage_path, client=storage_client)
-blob.upload_from_filename("model.joblib")
-log.info("Model upload completed")
-log.info("FINISH : custom training")
\ No newline at end of file
+    from joblib import dump
+    from sklearn.tree import DecisionTreeClassifier
+
+    import gcp_clients
+    from artifact_publisher import PUBLISHED_FILE, publish_content
+    from checkpoint import Checkpoint
+    from distributed import cluster_from_env, coordination_dir, exchange
+    from file_io import write_bytes
+    from schema_utils import apply_schema, compact_schema, feature_arrays, merge_schemas
+    from tree_compiler import CompiledTree
+
+    log = get_logger(credential_path = config.credential_path)
+    storage_client = gcp_clients.storage_client(config.credential_path)
+
+    log.info("START : custom training")
+    # These environment variables are from Vertex AI managed datasets
+    training_data_uri = os.environ["AIP_TRAINING_DATA_URI"]
+    test_data_uri = os.environ["AIP_TEST_DATA_URI"]
+    cluster = cluster_from_env()
+    directory = coordination_dir() if cluster.world_size > 1 else ""
+    if cluster.world_size > 1:
+        log.info(f"distributed training: rank {cluster.rank} of {cluster.world_size}, "
+                 f"coordination directory {directory}")
+    checkpoint = Checkpoint.from_env(cluster.rank, cluster.world_size)
+    if checkpoint is not None:
+        log.info(f"checkpointing to {checkpoint.prefix}")
+    log.info("Training and test data read initiated")
+    df, test_df, data_id = read_splits(cluster, directory, training_data_uri, test_data_uri, checkpoint)
+    # rounds of a previous attempt on other data must not be mistaken for this one's
+    directory = f"{directory}/{data_id}"
+    log.info(f"Training and test data read complete ({len(df)} training rows), "
+             f"peak RSS {peak_rss_mb():.0f} MiB")
+    memory_before = df.memory_usage(deep=True).sum() + test_df.memory_usage(deep=True).sum()
+    frames = [frame for frame in (df, test_df) if len(frame)]
+    schema = compact_schema(frames) if frames else {}
+    if cluster.world_size > 1:
+        # every shard has to be cast to the same dtypes and categories
+        schema = merge_schemas([shard_schema for shard_schema in exchange(cluster, directory, "schema", schema)
+                                if shard_schema])
+    df = apply_schema(df, schema)
+    test_df = apply_schema(test_df, schema)
+    log.info(f"compact schema: {memory_before} -> "
+             f"{df.memory_usage(deep=True).sum() + test_df.memory_usage(deep=True).sum()} bytes in memory")
+    # float32 matrices filled straight from the column buffers, rows with
+    # missing or infinite values dropped on the way
+    data, labels = feature_arrays(df, "fare")
+    test_data, test_labels = feature_arrays(test_df, "fare")
+    del df, test_df
+    log.info(f"feature matrices: train {data.shape}, test {test_data.shape}, "
+             f"peak RSS {peak_rss_mb():.0f} MiB")
+
+    log.info("Training Decision tree initiated")
+    if cluster.world_size == 1:
+        skmodel = None if checkpoint is None else checkpoint.load_model(data_id)
+        if skmodel is not None:
+            log.info("Decision tree restored from the checkpoint")
+        else:
+            # Define and train the Scikit model
+            skmodel = DecisionTreeClassifier()
+            skmodel.fit(data, labels)
+            if checkpoint is not None:
+                checkpoint.save_model(skmodel, data_id)
+    else:
+        skmodel = train_shard(cluster, directory, data, labels)
+        if skmodel is None:
+            log.info(f"FINISH : shard {cluster.rank} trained, the chief publishes the model")
+            return
+    log.info(f"Training Decision tree completed, peak RSS {peak_rss_mb():.0f} MiB")
+    score = skmodel.score(test_data, test_labels)
+    log.info('Accuracy is:',score)
+
+    # Save the model and the schema of its features in matrix order, which
+    # custom_serving/server.py encodes requests with, plus the flat-array
+    # form of the trees for custom predictors (tree_compiler)
+    dump(skmodel, "model.joblib")
+    CompiledTree.from_sklearn(skmodel).save("model.tree")
+    with open("schema.json", "w") as schema_file:
+        json.dump({column: spec for column, spec in schema.items() if column != "fare"}, schema_file)
+
+    log.info("Model upload initiated")
+    # Upload the saved files to gs://<bucket of AIP_MODEL_DIR>/artifacts/<sha256>/,
+    # files an earlier run published there are skipped. The register step of
+    # the pipeline finds the directory in AIP_MODEL_DIR/published.json
+    model_directory = os.environ["AIP_MODEL_DIR"]
+    artifacts_root = f"gs://{urlparse(model_directory).netloc}/artifacts"
+    published = publish_content(storage_client, ["model.joblib", "model.tree", "schema.json"], artifacts_root)
+    log.info(f"{published['uri']} sha256 {published['sha256']}: uploaded {', '.join(published['uploaded'])}"
+             if published["uploaded"] else f"{published['uri']}: identical content already published")
+    write_bytes(os.path.join(model_directory, PUBLISHED_FILE),
+                json.dumps({"artifact_uri": published["uri"], "sha256": published["sha256"]}).encode())
+    log.info("Model upload completed")
+    log.info("FINISH : custom training")
+
+
+if __name__ == "__main__":
+    main()
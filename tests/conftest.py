@@ -0,0 +1,122 @@
+import configparser
+import importlib
+import logging
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def project(monkeypatch):
+    """
+    Import a module of one project directory, e.g.
+    project("tools", "step_cache"). The directory goes first on sys.path and
+    the repository modules imported meanwhile are dropped afterwards, so
+    projects holding modules of the same name (config, gcp_clients,
+    compile_cache) do not see each other
+
+    """
+    def load(directory: str, name: str):
+        monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, directory))
+        __import__(name)
+        return sys.modules[name]
+
+    before = set(sys.modules)
+    yield load
+    for name in set(sys.modules) - before:
+        if (getattr(sys.modules[name], "__file__", None) or "").startswith(REPO_ROOT):
+            del sys.modules[name]
+
+
+@pytest.fixture
+def full_custom_training(project, monkeypatch, tmp_path):
+    """
+    Compile the full_custom_training pipeline with config.ini overrides to a
+    template under tmp_path, from where the component specs are written too
+
+    """
+    def compile_pipeline(**overrides):
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read(os.path.join(REPO_ROOT, "full_custom_training", "config", "config.ini"))
+        for key, value in overrides.items():
+            section = "GCP_PROJECT" if key in config["GCP_PROJECT"] else "ML_PIPELINE"
+            config[section][key] = str(value)
+        os.makedirs(tmp_path / "config", exist_ok=True)
+        os.makedirs(tmp_path / "component_artifacts", exist_ok=True)
+        with open(tmp_path / "config" / "config.ini", "w") as config_file:
+            config.write(config_file)
+        monkeypatch.chdir(tmp_path)
+        from kfp.v2 import compiler
+        pipeline = project("full_custom_training", "pipeline")
+        template = str(tmp_path / "pipeline.json")
+        compiler.Compiler().compile(pipeline_func=pipeline.pipeline, package_path=template)
+        return template
+
+    return compile_pipeline
+
+
+@pytest.fixture
+def fakes(project, monkeypatch, tmp_path):
+    """
+    tools/local_fakes.py installed in the test process with its root at
+    tmp_path/local and a service account key at gs://local-bucket/key.json.
+    The stand-in modules, the fsspec registrations and the kfp artifact path
+    are restored afterwards
+
+    """
+    pytest.importorskip("kfp")
+    pytest.importorskip("fsspec")
+    from kfp.v2.dsl import Artifact
+    local_fakes = project("tools", "local_fakes")
+    monkeypatch.setattr(Artifact, "path", Artifact.path)
+    registry = importlib.import_module("fsspec.registry")._registry
+    protocols = dict(registry)
+    modules = dict(sys.modules)
+    local_fakes.install(str(tmp_path / "local"))
+    key_path = tmp_path / "local" / "gcs" / "local-bucket" / "key.json"
+    os.makedirs(key_path.parent)
+    key_path.write_text('{"project_id": "local-project"}')
+    yield local_fakes
+    for name, stand_in in list(sys.modules.items()):
+        if stand_in is modules.get(name) or getattr(stand_in, "__file__", None) is not None:
+            continue
+        parent_name, _, child = name.rpartition(".")
+        parent = sys.modules.get(parent_name)
+        if name in modules:
+            sys.modules[name] = modules[name]
+            if parent is not None:
+                setattr(parent, child, modules[name])
+        else:
+            del sys.modules[name]
+            if parent is not None and getattr(parent, child, None) is stand_in:
+                delattr(parent, child)
+    registry.clear()
+    registry.update(protocols)
+    local_fakes.tables.clear()
+    local_fakes.models.clear()
+    local_fakes.endpoints.clear()
+
+
+@pytest.fixture
+def component(project, monkeypatch, tmp_path):
+    """
+    Import a component module of full_custom_training, its spec is written
+    to tmp_path/component_artifacts. Call <module>.<component>.python_func
+    to run it in the test process. The log handler the components attach is
+    closed afterwards, while tmp_path still holds its spill file
+
+    """
+    def load(name: str):
+        os.makedirs(tmp_path / "component_artifacts", exist_ok=True)
+        monkeypatch.chdir(tmp_path)
+        return project("full_custom_training", name)
+
+    yield load
+    cloud_logger = logging.getLogger("data-ingestion")
+    for handler in cloud_logger.handlers[:]:
+        cloud_logger.removeHandler(handler)
+        handler.close()
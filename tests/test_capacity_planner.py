@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def capacity_planner(project):
+    return project("custom_serving", "capacity_planner")
+
+
+def stage(qps: float, p99_ms: float, throughput_rps: float = None, error_rate: float = 0.0,
+          instances_per_request: int = 1):
+    return {"qps": qps, "p99_ms": p99_ms, "throughput_rps": qps if throughput_rps is None else throughput_rps,
+            "error_rate": error_rate, "instances_per_request": instances_per_request}
+
+
+def result(machine_type: str, server_cores: int, stages: list):
+    return {"machine_type": machine_type, "server_cores": server_cores, "stages": stages}
+
+
+def test_sustainable_throughput_skips_failing_stages(capacity_planner):
+    stages = [stage(100, 20), stage(200, 40), stage(400, 150), stage(300, 50, error_rate=0.01),
+              stage(250, 60, throughput_rps=200), stage(1000, 10, instances_per_request=16)]
+
+    assert capacity_planner.sustainable_throughput(stages, 100) == 200
+    assert capacity_planner.sustainable_throughput(stages, 100, instances_per_request=16) == 1000
+    assert capacity_planner.sustainable_throughput(stages, 10) == 0.0
+
+
+def test_replicas_cover_peak_and_base_at_target_utilization(capacity_planner):
+    results = [result("n1-standard-4", 4, [stage(100, 20), stage(200, 80)]),
+               result("n1-standard-8", 8, [stage(300, 20), stage(600, 200)])]
+
+    options = capacity_planner.plan(results, 100, peak_qps=700, base_qps=100)
+
+    assert [option["machine_type"] for option in options] == ["n1-standard-4", "n1-standard-8"]
+    assert (options[0]["min_replica_count"], options[0]["max_replica_count"]) == (1, 5)
+    assert (options[1]["min_replica_count"], options[1]["max_replica_count"]) == (1, 4)
+    assert not any(option["extrapolated"] for option in options)
+
+
+def test_local_results_alone_need_extrapolation(capacity_planner, tmp_path, capsys):
+    results = [result("local", 4, [stage(400, 20)])]
+
+    with pytest.raises(ValueError, match="--extrapolate"):
+        capacity_planner.plan(results, 100, peak_qps=1000)
+    options = capacity_planner.plan(results, 100, peak_qps=1000, extrapolate=True)
+    assert "local" not in [option["machine_type"] for option in options]
+    assert all(option["extrapolated"] for option in options)
+
+    path = tmp_path / "local.json"
+    path.write_text(json.dumps(results[0]))
+    assert capacity_planner.main([str(path), "--slo-p99-ms", "100", "--peak-qps", "1000"]) == 1
+    assert "--extrapolate" in capsys.readouterr().err
+    assert capacity_planner.main([str(path), "--slo-p99-ms", "100", "--peak-qps", "1000", "--extrapolate"]) == 0
+    assert "DEPLOY_MACHINE_TYPE=local" not in capsys.readouterr().out
+
+
+def test_extrapolation_uses_the_best_per_core_rate(capacity_planner):
+    # 25 rps per core on n1-standard-4, 50 on the local machine, in either order
+    results = [result("n1-standard-4", 4, [stage(100, 20)]), result("local", 2, [stage(100, 20)])]
+
+    for ordered in (results, results[::-1]):
+        options = {option["machine_type"]: option
+                   for option in capacity_planner.plan(ordered, 100, peak_qps=500, extrapolate=True)}
+        assert "local" not in options
+        assert options["n1-standard-4"]["replica_rps"] == 100
+        assert not options["n1-standard-4"]["extrapolated"]
+        assert options["n1-standard-8"]["replica_rps"] == 400
+        assert options["n1-standard-8"]["extrapolated"]
+
+
+def test_no_passing_stage_is_an_error(capacity_planner):
+    with pytest.raises(ValueError, match="no stage met"):
+        capacity_planner.plan([result("n1-standard-4", 4, [stage(100, 500)])], 100, peak_qps=100)
@@ -0,0 +1,101 @@
+import json
+import logging
+import threading
+
+import pytest
+
+
+def entries(path):
+    with open(path) as spill_file:
+        return [json.loads(line) for line in spill_file]
+
+
+def record(message: str):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, None, None)
+
+
+def test_full_queue_spills_to_the_file(project, tmp_path):
+    cloud_logging = project("full_custom_training", "cloud_logging")
+    release = threading.Event()
+    sent = []
+
+    def sink(batch):
+        release.wait(5)
+        sent.extend(batch)
+
+    spill_path = tmp_path / "spill.jsonl"
+    handler = cloud_logging.BatchingHandler(sink, capacity=2, batch_size=1, flush_interval=0.01,
+                                            spill_path=str(spill_path))
+    for index in range(20):
+        handler.emit(record(f"message {index}"))
+    release.set()
+    handler.close()
+
+    spilled = [entry["message"] for entry in entries(spill_path)]
+    assert spilled
+    assert sorted(spilled + [entry["message"] for entry in sent]) == sorted(f"message {index}" for index in range(20))
+
+
+def test_rejected_batches_spill_to_the_file(project, tmp_path):
+    cloud_logging = project("full_custom_training", "cloud_logging")
+
+    def sink(batch):
+        raise ConnectionError("Cloud Logging unavailable")
+
+    spill_path = tmp_path / "spill.jsonl"
+    handler = cloud_logging.BatchingHandler(sink, spill_path=str(spill_path))
+    handler.emit(record("lost connection"))
+    handler.close()
+
+    assert [entry["message"] for entry in entries(spill_path)] == ["lost connection"]
+
+
+def test_sink_creates_the_client_in_the_flusher_thread(project, tmp_path):
+    cloud_logging = project("full_custom_training", "cloud_logging")
+    threads = []
+    committed = []
+
+    class Batch:
+        def log_struct(self, payload, severity):
+            committed.append((payload["message"], severity))
+
+        def commit(self):
+            pass
+
+    class Client:
+        def __init__(self):
+            threads.append(threading.current_thread().name)
+
+        def logger(self, name):
+            return type("Logger", (), {"batch": lambda self: Batch()})()
+
+    handler = cloud_logging.BatchingHandler(cloud_logging.CloudLoggingSink(client_factory=Client),
+                                            spill_path=str(tmp_path / "spill.jsonl"))
+    assert threads == []
+    handler.emit(record("first"))
+    handler.emit(record("second"))
+    handler.close()
+
+    assert threads == ["log-flusher"]
+    assert committed == [("first", "INFO"), ("second", "INFO")]
+    assert not (tmp_path / "spill.jsonl").exists()
+
+
+def test_component_logs_reach_cloud_logging(component, fakes, tmp_path):
+    pytest.importorskip("kfp")
+    validation = component("validation")
+    metadata = json.dumps({"model_metrics": {"RMSE": 1.0}})
+
+    status = validation.model_validation.python_func(
+        credential_path="gs://local-bucket/key.json", metrics=None, threshold_dict={"RMSE": 2.0},
+        model_metadata_path=metadata)
+    cloud_logger = logging.getLogger("data-ingestion")
+    [handler] = cloud_logger.handlers
+    cloud_logger.removeHandler(handler)
+    handler.close()
+
+    assert status == ("True", )
+    logged = entries(tmp_path / "local" / "logs" / "cloud_logging.jsonl")
+    assert any("passed=True" in entry["jsonPayload"]["message"] for entry in logged)
+    assert all(entry["jsonPayload"]["logger"] == "data-ingestion" for entry in logged)
+    assert not (tmp_path / "log_spill.jsonl").exists()
@@ -0,0 +1,110 @@
+import configparser
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_ROOT
+
+
+@pytest.fixture
+def compile_cache(project):
+    return project("full_custom_training", "compile_cache")
+
+
+def fake_compile(template, calls):
+    def compile_pipeline():
+        calls.append(template)
+        template.write_text(f"template {len(calls)}")
+
+    return compile_pipeline
+
+
+def test_template_is_reused_until_a_dependency_changes(compile_cache, tmp_path):
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "pipeline.py").write_text("STEPS = 1\n")
+    (project_dir / "config.ini").write_text("[ML_PIPELINE]\nCACHE=True\n")
+    template = tmp_path / "pipeline.json"
+    calls = []
+    compile_pipeline = fake_compile(template, calls)
+
+    def run(**options):
+        return compile_cache.compile_if_changed(compile_pipeline, str(template), str(project_dir), **options)
+
+    assert run() is True
+    assert run() is False
+    assert calls == [template]
+
+    (project_dir / "pipeline.py").write_text("STEPS = 2\n")
+    assert run() is True
+    assert run() is False
+    (project_dir / "config.ini").write_text("[ML_PIPELINE]\nCACHE=False\n")
+    assert run() is True
+    assert run(config_values={"region": "europe-west4"}) is True
+    assert run(config_values={"region": "europe-west4"}) is False
+    assert run(config_values={"region": "europe-west4"}, force=True) is True
+    template.unlink()
+    assert run(config_values={"region": "europe-west4"}) is True
+    assert len(calls) == 6
+
+
+def test_failed_compile_is_not_stamped(compile_cache, tmp_path):
+    template = tmp_path / "pipeline.json"
+    calls = []
+
+    assert compile_cache.compile_if_changed(lambda: calls.append(1), str(template), str(tmp_path)) is True
+    assert compile_cache.compile_if_changed(lambda: calls.append(1), str(template), str(tmp_path)) is True
+    assert calls == [1, 1]
+    assert not os.path.exists(str(template) + compile_cache.STAMP_SUFFIX)
+
+
+def test_library_versions_are_part_of_the_key(compile_cache, tmp_path, monkeypatch):
+    key = compile_cache.cache_key(str(tmp_path))
+    monkeypatch.setattr(compile_cache, "package_version", lambda name: "0.0.1")
+    assert compile_cache.cache_key(str(tmp_path)) != key
+
+
+def test_launcher_skips_kfp_when_the_template_is_current(tmp_path):
+    pytest.importorskip("kfp")
+    from test_local_runner import smoke_config
+    project_dir = tmp_path / "full_custom_training"
+    shutil.copytree(os.path.join(REPO_ROOT, "full_custom_training"), project_dir,
+                    ignore=shutil.ignore_patterns("__pycache__", "component_artifacts"))
+    os.makedirs(project_dir / "component_artifacts")
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(project_dir / "config" / "config.ini")
+    for key, value in smoke_config(TEMPLATE=str(tmp_path / "pipeline.json")).items():
+        section = "GCP_PROJECT" if key in config["GCP_PROJECT"] else "ML_PIPELINE"
+        config[section][key] = str(value)
+    with open(project_dir / "config" / "config.ini", "w") as config_file:
+        config.write(config_file)
+    # the second launch fails on any import of kfp
+    launch = ("import runpy, sys\n"
+              "if sys.argv[1] == 'cached':\n"
+              "    sys.modules['kfp'] = None\n"
+              "sys.argv = ['run_pipeline.py', '--compile-only']\n"
+              "runpy.run_path('run_pipeline.py', run_name='__main__')\n")
+
+    for mode in ("compile", "cached"):
+        completed = subprocess.run([sys.executable, "-c", launch, mode], cwd=str(project_dir),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        assert completed.returncode == 0, completed.stderr
+    assert (tmp_path / "pipeline.json").is_file()
+    assert (tmp_path / "pipeline.json.sha256").is_file()
+
+
+def test_every_launcher_copy_is_generated(project):
+    vendor = project("full_custom_training", "vendor")
+    launchers = {os.path.relpath(directory, REPO_ROOT) for directory, _, files in os.walk(REPO_ROOT)
+                 if "compile_cache.py" in files and directory != vendor.DIRECTORY}
+
+    assert launchers == set(vendor.COPIES["compile_cache.py"])
+    with open(os.path.join(vendor.DIRECTORY, "compile_cache.py")) as source_file:
+        source = source_file.read()
+    for launcher in launchers:
+        with open(os.path.join(REPO_ROOT, launcher, "compile_cache.py")) as copy_file:
+            assert copy_file.read().endswith(source)
@@ -0,0 +1,299 @@
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+
+from test_local_runner import BUCKET, rides
+
+
+class Warehouse:
+    """
+    Answers the query shapes read_data sends on top of the bundled BigQuery
+    fake, which returns the source rows for any SQL: the hash-bucket split
+    and its per-split reads, the watermark and the incremental queries
+
+    """
+
+    def __init__(self, fakes, monkeypatch, source: str):
+        self.fakes = fakes
+        self.source = source
+        self.dry_runs = []
+        fakes.state["query_result"] = source
+        monkeypatch.setattr(fakes.BigQueryClient, "query", self.query)
+
+    def answer(self, query: str, frame, job_config):
+        from datetime import datetime, timezone
+        fakes = self.fakes
+        reference = fakes.TableReference(fakes.LOCAL_PROJECT, fakes.FAKE_DATASET, f"anon{next(fakes.table_ids)}")
+        table = fakes.tables[reference.path] = fakes.Table(reference, frame, datetime.now(timezone.utc))
+        return fakes.QueryJob(query, table, getattr(job_config, "dry_run", False))
+
+    @staticmethod
+    def fingerprints(frame, key: str):
+        import hashlib
+        import re
+        # no key columns hashes the whole row, TO_JSON_STRING(source)
+        key_columns = re.findall(r"CAST\(`(\w+)` AS STRING\)", key) or list(frame.columns)
+        keys = frame[key_columns].astype(str).agg("|".join, axis=1)
+        return keys.map(lambda key: int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big", signed=True))
+
+    def query(self, query: str, job_config=None, **kwargs):
+        import re
+        self.dry_runs.append(getattr(job_config, "dry_run", False))
+        frame = pd.read_parquet(self.source)
+        literal = r"CAST\('([^']*)' AS \w+\)"
+        keys = re.match(rf"SELECT FARM_FINGERPRINT\((.*)\) AS fingerprint FROM .* WHERE `(\w+)` = {literal}$", query,
+                        re.DOTALL)
+        bucketed = re.search(r"FARM_FINGERPRINT\((.*)\)\), (\d+)\) AS (\w+)", query)
+        split_read = re.search(r"EXCEPT\((\w+)\) FROM `([^`]+)` WHERE \w+ >= (\d+) AND \w+ < (\d+)", query)
+        maximum = re.match(r"SELECT MAX\(`(\w+)`\) AS watermark", query)
+        window = re.search(rf"WHERE (?:`(\w+)` (>=?) {literal} AND )?`(\w+)` <= {literal}"
+                           rf"(?: AND NOT \(`\w+` = {literal} AND FARM_FINGERPRINT\((.*)\) IN UNNEST\(@seen_keys\)\))?$",
+                           query)
+        if keys:
+            key, column, value = keys.groups()
+            rows = frame[frame[column] == frame[column].dtype.type(value)]
+            frame = pd.DataFrame({"fingerprint": self.fingerprints(rows, key).to_numpy(dtype="int64")})
+        elif bucketed:
+            frame[bucketed.group(3)] = self.fingerprints(frame, bucketed.group(1)).abs() % int(bucketed.group(2))
+        elif split_read:
+            column, table, lower, upper = split_read.groups()
+            project, dataset_id, table_id = table.split(".")
+            bucketed = self.fakes.tables[self.fakes.TableReference(project, dataset_id, table_id).path].frame
+            frame = bucketed[(bucketed[column] >= int(lower)) & (bucketed[column] < int(upper))].drop(columns=column)
+        elif maximum:
+            frame = pd.DataFrame({"watermark": [frame[maximum.group(1)].max()]})
+        elif window:
+            column, operator, lower, upper_column, upper, _, seen_key = window.groups()
+            if column is not None:
+                lower = frame[column].dtype.type(lower)
+                frame = frame[frame[column] > lower if operator == ">" else frame[column] >= lower]
+            frame = frame[frame[upper_column] <= frame[upper_column].dtype.type(upper)]
+            if seen_key is not None:
+                [seen] = job_config.query_parameters
+                frame = frame[~((frame[column] == lower) & self.fingerprints(frame, seen_key).isin(seen.values))]
+        return self.answer(query, frame.reset_index(drop=True), job_config)
+
+
+def read_data(component, fakes, run: str = "run", **options):
+    """
+    Run read_data in this process, returns the split artifacts
+    """
+    from kfp.v2.dsl import Dataset
+    data_ingestion = component("data_ingestion")
+    outputs = {name: Dataset(uri=f"{BUCKET}/{run}/read-data/{name}_dataset") for name in ("train", "test", "val")}
+    options.setdefault("bq_query", "SELECT * FROM `local-project.taxi.rides`")
+    data_ingestion.read_data.python_func(credential_path=f"{BUCKET}/key.json",
+                                         train_dataset=outputs["train"], test_dataset=outputs["test"],
+                                         val_dataset=outputs["val"], **options)
+    return outputs
+
+
+def load(artifact):
+    path = artifact.path + artifact.metadata["file_extension"]
+    return {"parquet": pd.read_parquet, "feather": pd.read_feather, "csv": pd.read_csv}[artifact.metadata["format"]](path)
+
+
+def test_storage_stream_cleans_and_splits_every_batch(component, fakes, monkeypatch, tmp_path):
+    frame = pd.read_parquet(rides(tmp_path / "rides.parquet", rows=2000))
+    frame.loc[[3, 500, 1700], "trip_miles"] = [np.nan, np.inf, -np.inf]
+    frame.to_parquet(tmp_path / "dirty.parquet")
+    fakes.state["query_result"] = str(tmp_path / "dirty.parquet")
+    monkeypatch.setattr(fakes, "PAGE_ROWS", 128)
+
+    outputs = read_data(component, fakes, ingestion_mode="storage_stream", max_stream_count=3,
+                        optimise_schema=False)
+
+    splits = {name: load(artifact) for name, artifact in outputs.items()}
+    keys = pd.concat([split["unique_key"] for split in splits.values()])
+    assert len(keys) == len(frame) - 3
+    assert keys.is_unique
+    assert not set(keys) & {"ride-3", "ride-500", "ride-1700"}
+    assert all(np.isfinite(split["trip_miles"]).all() for split in splits.values())
+    assert 0.6 < len(splits["train"]) / len(keys) < 0.8
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "feather", "csv"])
+def test_splits_are_written_in_the_configured_format(component, fakes, tmp_path, output_format):
+    fakes.state["query_result"] = rides(tmp_path / "rides.parquet")
+
+    outputs = read_data(component, fakes, output_format=output_format, optimise_schema=False)
+
+    for artifact in outputs.values():
+        assert artifact.metadata["format"] == output_format
+        assert artifact.metadata["file_extension"] == f".{output_format}"
+        split = load(artifact)
+        assert list(split.columns) == ["unique_key", "trip_seconds", "trip_miles", "payment_type", "fare"]
+        assert pd.api.types.is_integer_dtype(split["trip_seconds"])
+    if output_format != "csv":
+        # the schema travels with the file, no inference on the way back
+        assert str(load(outputs["train"])["trip_seconds"].dtype) == "int64"
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        metadata = pq.ParquetFile(outputs["train"].path + ".parquet").metadata
+        assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+
+def test_split_spec_assigns_rows_to_splits_by_key(component, fakes, monkeypatch, tmp_path):
+    source = tmp_path / "rides.parquet"
+    Warehouse(fakes, monkeypatch, rides(source, rows=600))
+    split_spec = {"fractions": {"train": 0.8, "test": 0.1, "val": 0.1}, "key_columns": ["unique_key"]}
+
+    first = read_data(component, fakes, run="first", split_spec=split_spec, optimise_schema=False)
+    keys = {name: set(load(artifact)["unique_key"]) for name, artifact in first.items()}
+    assert set.union(*keys.values()) == {f"ride-{index}" for index in range(600)}
+    assert sum(map(len, keys.values())) == 600
+    assert 0.7 < len(keys["train"]) / 600 < 0.9
+
+    # a grown source keeps every earlier row in its split
+    rides(source, rows=900, seed=1)
+    second = read_data(component, fakes, run="second", split_spec=split_spec, optimise_schema=False)
+    for name, artifact in second.items():
+        assert keys[name] <= set(load(artifact)["unique_key"])
+
+
+def test_split_spec_fractions_must_add_up(component, fakes, monkeypatch, tmp_path):
+    Warehouse(fakes, monkeypatch, rides(tmp_path / "rides.parquet"))
+    with pytest.raises(ValueError, match="sum to 1"):
+        read_data(component, fakes, split_spec={"fractions": {"train": 0.8, "test": 0.1}})
+
+
+def test_ingestion_cache_serves_equal_settings_and_keys_on_the_schema(component, fakes, monkeypatch, tmp_path):
+    warehouse = Warehouse(fakes, monkeypatch, rides(tmp_path / "rides.parquet"))
+    queries = warehouse.dry_runs
+    cache_root = f"{BUCKET}/ingestion-cache"
+
+    first = read_data(component, fakes, run="first", cache_root=cache_root)
+    assert queries == [True, False]
+    second = read_data(component, fakes, run="second", cache_root=cache_root)
+    # a hit only costs the dry run resolving the table versions
+    assert queries == [True, False, True]
+    assert second["train"].uri == first["train"].uri
+    assert second["train"].metadata["compact_schema"] == first["train"].metadata["compact_schema"]
+
+    plain = read_data(component, fakes, run="plain", cache_root=cache_root, optimise_schema=False)
+    assert queries[-1] is False
+    assert plain["train"].uri != first["train"].uri
+    assert plain["train"].metadata["compact_schema"] == {}
+
+
+def numbered_rides(path, rows: int):
+    # a longer table keeps the rows of a shorter one, as appends do
+    frame = pd.read_parquet(rides(path, rows=1000)).head(rows)
+    frame["ride_number"] = np.arange(rows)
+    frame.to_parquet(path)
+    return str(path)
+
+
+def test_watermark_ingestion_appends_only_new_rows(component, fakes, monkeypatch, tmp_path):
+    source = tmp_path / "rides.parquet"
+    Warehouse(fakes, monkeypatch, numbered_rides(source, rows=400))
+    options = dict(cache_root=f"{BUCKET}/ingestion-cache", watermark_column="ride_number")
+
+    first = read_data(component, fakes, run="first", **options)
+    assert len(first["train"].metadata["parts"]) == 1
+    numbered_rides(source, rows=700)
+    # part names carry the second they were written at
+    monkeypatch.setattr("time.strftime", lambda *args: "20260102030405")
+    second = read_data(component, fakes, run="second", **options)
+    third = read_data(component, fakes, run="third", **options)
+
+    parts = second["train"].metadata["parts"]
+    assert parts[0] == first["train"].metadata["parts"][0] and parts[1] == "part-20260102030405"
+    assert third["train"].metadata["parts"] == parts
+    assert second["train"].metadata["layout"] == "partitioned"
+    numbers = []
+    for part in parts:
+        rows = pd.concat(pd.read_parquet(f"{artifact.path}/{part}.parquet") for artifact in second.values())
+        numbers.append(set(rows["ride_number"]))
+    assert numbers == [set(range(400)), set(range(400, 700))]
+
+
+def test_compact_schema_downcasts_only_exact_floats(component, fakes, tmp_path):
+    frame = pd.read_parquet(rides(tmp_path / "rides.parquet"))
+    # multiples of 1/4 are exact in float32, 0.01 steps are not
+    frame["tip"] = np.arange(len(frame)) * 0.25
+    frame["toll"] = 1.0 + 1e-7
+    frame.to_parquet(tmp_path / "rides.parquet")
+    fakes.state["query_result"] = str(tmp_path / "rides.parquet")
+
+    outputs = read_data(component, fakes)
+
+    schema = outputs["train"].metadata["compact_schema"]
+    assert schema["tip"] == {"dtype": "float32"}
+    assert schema["trip_miles"] == {"dtype": "float64"}
+    assert schema["toll"] == {"dtype": "float64"}
+    assert schema["trip_seconds"] == {"dtype": "int16"}
+    assert schema["payment_type"] == {"dtype": "category", "categories": ["Cash", "Credit Card", "Mobile"]}
+    train = load(outputs["train"])
+    assert (train["trip_miles"] == frame.set_index("unique_key").loc[train["unique_key"], "trip_miles"].values).all()
+
+
+def test_storage_stream_profiles_batches_like_the_dataframe_path(component, fakes, monkeypatch, tmp_path):
+    frame = pd.read_parquet(rides(tmp_path / "rides.parquet", rows=2000))
+    frame["tip"] = np.arange(len(frame)) * 0.25
+    frame["passengers"] = np.arange(len(frame)) % 5
+    frame["shared"] = frame["passengers"] > 2
+    frame.to_parquet(tmp_path / "rides.parquet")
+    fakes.state["query_result"] = str(tmp_path / "rides.parquet")
+    monkeypatch.setattr(fakes, "PAGE_ROWS", 128)
+
+    streamed = read_data(component, fakes, run="streamed", ingestion_mode="storage_stream", max_stream_count=3)
+    loaded = read_data(component, fakes, run="loaded")
+
+    schema = streamed["train"].metadata["compact_schema"]
+    assert schema == loaded["train"].metadata["compact_schema"]
+    assert schema["tip"] == {"dtype": "float32"} and schema["trip_miles"] == {"dtype": "float64"}
+    assert schema["passengers"] == {"dtype": "int8"} and schema["shared"] == {"dtype": "bool"}
+    assert schema["unique_key"] == {"dtype": "object"}
+    assert schema["payment_type"] == {"dtype": "category", "categories": ["Cash", "Credit Card", "Mobile"]}
+
+
+def test_eviction_keeps_incremental_history(component, fakes, monkeypatch, tmp_path):
+    source = tmp_path / "rides.parquet"
+    Warehouse(fakes, monkeypatch, numbered_rides(source, rows=400))
+    cache_root = f"{BUCKET}/ingestion-cache"
+
+    history = read_data(component, fakes, run="history", cache_root=cache_root, watermark_column="ride_number")
+    for run in ("first", "second"):
+        read_data(component, fakes, run=run, bq_query=f"SELECT * FROM `local-project.taxi.rides` -- {run}",
+                  cache_root=cache_root, cache_max_entries=1)
+
+    entries = {path.name for path in (tmp_path / "local" / "gcs" / "local-bucket" / "ingestion-cache").iterdir()}
+    assert len(entries) == 2
+    assert history["train"].uri.split("/")[-2] in entries
+    numbered_rides(source, rows=500)
+    again = read_data(component, fakes, run="again", cache_root=cache_root, watermark_column="ride_number")
+    assert again["train"].metadata["parts"][0] == history["train"].metadata["parts"][0]
+    assert len(again["train"].metadata["parts"]) == 2
+
+
+def test_watermark_ingestion_keeps_rows_appended_on_the_watermark(component, fakes, monkeypatch, tmp_path):
+    source = tmp_path / "rides.parquet"
+    Warehouse(fakes, monkeypatch, str(source))
+    options = dict(cache_root=f"{BUCKET}/ingestion-cache", watermark_column="pickup_day")
+
+    def append(rows: int):
+        frame = pd.read_parquet(numbered_rides(source, rows=rows))
+        # 100 rides a day, a day is appended over several loads
+        frame["pickup_day"] = frame["ride_number"] // 100
+        frame.to_parquet(source)
+
+    runs = []
+    for rows in (350, 380, 380, 500):
+        append(rows)
+        monkeypatch.setattr("time.strftime", lambda *args, rows=rows: f"2026010100{rows:04d}")
+        runs.append(read_data(component, fakes, run=f"rows-{rows}", **options))
+
+    parts = runs[-1]["train"].metadata["parts"]
+    assert parts == ["part-20260101000350", "part-20260101000380", "part-20260101000500"]
+    assert runs[2]["train"].metadata["parts"] == parts[:2]
+    numbers = []
+    for part in parts:
+        rows = pd.concat(pd.read_parquet(f"{artifact.path}/{part}.parquet") for artifact in runs[-1].values())
+        numbers.append(sorted(rows["ride_number"]))
+    assert numbers == [list(range(350)), list(range(350, 380)), list(range(380, 500))]
@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+
+
+def deploy(component, sha256: str, serving_img: str = "serving-image", **resources):
+    from kfp.v2.dsl import Artifact, Model
+    deploy_module = component("deploy")
+    model = Model(uri="gs://local-bucket/run/training/model", metadata={"sha256": sha256})
+    vertex_endpoint, vertex_model = Artifact(), Model()
+    deploy_module.deploy_model.python_func(
+        model=model, credential_path="gs://local-bucket/key.json", project="local-project",
+        region="us-central1", serving_img=serving_img, vertex_endpoint=vertex_endpoint,
+        vertex_model=vertex_model, **resources)
+    return vertex_endpoint.uri, vertex_model.uri
+
+
+def test_redeploying_the_same_model_reuses_its_endpoint(component, fakes):
+    first = deploy(component, "ab" * 32)
+    second = deploy(component, "ab" * 32)
+
+    assert second == first
+    assert len(fakes.models) == 1
+    assert list(fakes.endpoints) == [first[0]]
+    assert len(fakes.endpoints[first[0]].models) == 1
+
+
+def test_a_new_model_gets_its_own_endpoint(component, fakes):
+    first = deploy(component, "ab" * 32)
+    second = deploy(component, "cd" * 32)
+
+    assert second[1] != first[1]
+    assert len(fakes.endpoints) == 2
+    assert fakes.models[1].labels["artifact_sha256"] == ("cd" * 32)[:63]
+
+
+def test_a_new_serving_image_is_registered_again(component, fakes):
+    first = deploy(component, "ab" * 32)
+    second = deploy(component, "ab" * 32, serving_img="other-serving-image")
+
+    assert second[1] != first[1]
+    assert len(fakes.models) == 2
+    assert fakes.models[0].labels["serving_image_sha256"] != fakes.models[1].labels["serving_image_sha256"]
+
+
+def test_models_of_other_pipelines_are_not_reused(component, fakes):
+    first = deploy(component, "ab" * 32)
+    fakes.models[0].display_name = "another-model"
+    second = deploy(component, "ab" * 32)
+
+    assert second[1] != first[1]
+
+
+def test_other_replicas_redeploy_on_the_same_endpoint(component, fakes):
+    first = deploy(component, "ab" * 32)
+    second = deploy(component, "ab" * 32, machine_type="n1-standard-8", max_replica_count=4)
+
+    assert second == first
+    assert len(fakes.models) == 1
+    (deployed, ) = fakes.endpoints[first[0]].models
+    resources = deployed.dedicated_resources
+    assert (resources.machine_spec.machine_type, resources.min_replica_count,
+            resources.max_replica_count) == ("n1-standard-8", 1, 4)
+    assert [reference.deployed_model_id for reference in fakes.models[0].gca_resource.deployed_models] == [deployed.id]
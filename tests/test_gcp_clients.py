@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("fsspec")
+pytest.importorskip("google.auth")
+pytest.importorskip("requests")
+
+
+@pytest.fixture
+def key_loads(fakes, monkeypatch):
+    loads = []
+    from_info = fakes.Credentials.from_service_account_info.__func__
+    monkeypatch.setattr(fakes.Credentials, "from_service_account_info",
+                        classmethod(lambda cls, info, **kwargs: loads.append(info) or from_info(cls, info, **kwargs)))
+    return loads
+
+
+def test_clients_are_memoised_on_credentials_loaded_once(project, key_loads):
+    gcp_clients = project("full_custom_training", "gcp_clients")
+    key = "gs://local-bucket/key.json"
+
+    client = gcp_clients.bigquery_client(key)
+    assert gcp_clients.bigquery_client(key) is client
+    assert gcp_clients.bigquery_read_client(key) is gcp_clients.bigquery_read_client(key)
+    assert gcp_clients.logging_client(key) is gcp_clients.logging_client(key)
+    assert client.project == "local-project"
+    assert len(key_loads) == 1
+
+
+def test_missing_key_raises_file_not_found(project, fakes):
+    gcp_clients = project("full_custom_training", "gcp_clients")
+    with pytest.raises(FileNotFoundError):
+        gcp_clients.get_credentials("gs://local-bucket/missing.json")
+
+
+def test_a_component_loads_its_key_once(component, fakes, key_loads, tmp_path):
+    pytest.importorskip("kfp")
+    pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("sklearn")
+    from test_data_ingestion import read_data
+    from test_local_runner import rides
+    fakes.state["query_result"] = rides(tmp_path / "rides.parquet")
+
+    # logger, BigQuery and Storage Read clients share one credentials object
+    read_data(component, fakes, ingestion_mode="storage_stream")
+
+    assert len(key_loads) == 1
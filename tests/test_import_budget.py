@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def check_import_budget(project):
+    return project("tools", "check_import_budget")
+
+
+def test_entry_points_import_offline_within_budget(check_import_budget):
+    for entry_point in check_import_budget.ENTRY_POINTS:
+        result = check_import_budget.measure(entry_point)
+        assert result["error"] is None, (entry_point, result["error"])
+        assert result["network"] == [], entry_point
+        assert result["elapsed"] <= check_import_budget.DEFAULT_BUDGET, entry_point
+
+
+def test_network_access_at_import_fails_the_check(check_import_budget, tmp_path, capsys):
+    chatty = tmp_path / "chatty.py"
+    chatty.write_text("import socket\n"
+                      "try:\n"
+                      "    socket.getaddrinfo('logging.googleapis.com', 443)\n"
+                      "except OSError:\n"
+                      "    pass\n")
+
+    result = check_import_budget.measure(str(chatty))
+    assert result["error"] is None
+    assert result["network"] == ["socket.getaddrinfo('logging.googleapis.com', 443)"]
+    assert check_import_budget.main([str(chatty)]) == 1
+    assert "FAIL" in capsys.readouterr().out
+
+
+def test_import_error_fails_the_check(check_import_budget, tmp_path):
+    broken = tmp_path / "broken.py"
+    broken.write_text("import module_that_does_not_exist\n")
+
+    result = check_import_budget.measure(str(broken))
+    assert "module_that_does_not_exist" in result["error"]
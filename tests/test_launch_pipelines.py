@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def launch_pipelines(project):
+    return project("tools", "launch_pipelines")
+
+
+def launch(launch_pipelines, entries, service, **options):
+    options.setdefault("poll_interval", 0.01)
+    options.setdefault("max_poll_interval", 0.05)
+    return asyncio.run(launch_pipelines.launch(entries, service, **options))
+
+
+def test_submissions_stay_within_max_concurrency(launch_pipelines):
+    class SlowSubmits(launch_pipelines.FakePipelineService):
+        def __init__(self):
+            super().__init__(default_duration=0.02)
+            self.lock = threading.Lock()
+            self.in_flight = 0
+            self.peak = 0
+
+        def submit(self, entry, labels):
+            with self.lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_flight -= 1
+                return super().submit(entry, labels)
+
+    service = SlowSubmits()
+    entries = [{"name": f"pipeline-{index}", "template_path": "pipeline.json"} for index in range(8)]
+    records = launch(launch_pipelines, entries, service, max_concurrency=3)
+
+    assert [record["name"] for record in records] == [entry["name"] for entry in entries]
+    assert all(record["state"] == "SUCCEEDED" for record in records)
+    assert service.submit_calls == 8
+    assert service.peak == 3
+
+
+def test_one_list_call_per_round_with_backoff(launch_pipelines):
+    service = launch_pipelines.FakePipelineService(
+        durations={"slow": 0.3}, outcomes={"broken": "FAILED"}, default_duration=0.0)
+    entries = [{"name": name, "template_path": "pipeline.json"} for name in ("fast", "broken", "slow")]
+    records = launch(launch_pipelines, entries, service, max_poll_interval=1.0)
+
+    assert {record["name"]: record["state"] for record in records} == {
+        "fast": "SUCCEEDED", "broken": "FAILED", "slow": "SUCCEEDED"}
+    assert records[2]["duration"] == 0.3
+    # polling every 10ms without backoff would take about 30 rounds
+    assert service.list_calls <= 8
+
+
+def test_failed_submission_is_reported(launch_pipelines):
+    class RejectingService(launch_pipelines.FakePipelineService):
+        def submit(self, entry, labels):
+            if entry["name"] == "rejected":
+                raise PermissionError("caller lacks aiplatform.pipelineJobs.create")
+            return super().submit(entry, labels)
+
+    entries = [{"name": name, "template_path": "pipeline.json"} for name in ("accepted", "rejected")]
+    records = launch(launch_pipelines, entries, RejectingService(default_duration=0.0))
+
+    assert records[0]["state"] == "SUCCEEDED"
+    assert records[1]["state"] == "SUBMIT_FAILED"
+    assert "pipelineJobs.create" in records[1]["error"]
+    assert "SUBMIT_FAILED" in launch_pipelines.format_table(records)
+
+
+class FlakyListing:
+    def __init__(self, service, failures: int):
+        self.service = service
+        self.failures = failures
+        self.list_calls = 0
+
+    def submit(self, entry, labels):
+        return self.service.submit(entry, labels)
+
+    def list_jobs(self, batch_id):
+        self.list_calls += 1
+        if self.list_calls <= self.failures:
+            raise ConnectionError("503 Service Unavailable")
+        return self.service.list_jobs(batch_id)
+
+
+def test_list_errors_are_retried(launch_pipelines):
+    service = FlakyListing(launch_pipelines.FakePipelineService(default_duration=0.0), failures=3)
+    entries = [{"name": name, "template_path": "pipeline.json"} for name in ("first", "second")]
+    records = launch(launch_pipelines, entries, service)
+
+    assert [record["state"] for record in records] == ["SUCCEEDED", "SUCCEEDED"]
+    assert service.list_calls == 4
+
+
+def test_persistent_list_errors_still_report_the_jobs(launch_pipelines):
+    service = FlakyListing(launch_pipelines.FakePipelineService(default_duration=0.0), failures=100)
+    entries = [{"name": name, "template_path": "pipeline.json"} for name in ("first", "second")]
+    records = launch(launch_pipelines, entries, service, max_list_failures=3)
+
+    assert service.list_calls == 3
+    assert [record["state"] for record in records] == ["UNKNOWN", "UNKNOWN"]
+    assert all(record["resource_name"] and "503" in record["error"] for record in records)
+    assert "UNKNOWN" in launch_pipelines.format_table(records)
+
+
+def test_duplicate_names_are_rejected(launch_pipelines):
+    entries = [{"name": "same", "template_path": "pipeline.json"}] * 2
+    with pytest.raises(ValueError):
+        launch(launch_pipelines, entries, launch_pipelines.FakePipelineService())
+
+
+def test_fake_manifest_prints_the_status_table(launch_pipelines, tmp_path, capsys):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({
+        "project": "local-project", "location": "us-central1", "max_concurrency": 2,
+        "pipelines": [{"name": name, "template_path": f"{name}/pipeline.json", "parameter_values": {}}
+                      for name in ("full-custom-training", "bq-xgboost")]}))
+
+    assert launch_pipelines.main([str(manifest), "--fake", "--poll-interval", "0.01"]) == 0
+    table = capsys.readouterr().out.splitlines()
+    assert table[0].split() == ["PIPELINE", "STATE", "DURATION", "JOB"]
+    assert [line.split()[:2] for line in table[1:]] == [["full-custom-training", "SUCCEEDED"],
+                                                        ["bq-xgboost", "SUCCEEDED"]]
@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+
+BUCKET = "gs://local-bucket"
+
+
+def rides(path, rows: int = 600, seed: int = 0):
+    generator = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "unique_key": [f"ride-{index}" for index in range(rows)],
+        "trip_seconds": generator.integers(60, 3600, rows),
+        "trip_miles": generator.uniform(0.1, 30, rows).round(2),
+        "payment_type": generator.choice(["Cash", "Credit Card", "Mobile"], rows),
+    })
+    frame["fare"] = (3.25 + 2.25 * frame["trip_miles"] + 0.002 * frame["trip_seconds"]
+                     + generator.normal(0, 0.5, rows))
+    frame.to_parquet(path)
+    return str(path)
+
+
+def run_local(project, template: str, root, query_result: str, run_id: str = "", **options):
+    local_runner = project("tools", "local_runner")
+    key_path = os.path.join(root, "gcs", "local-bucket", "key.json")
+    os.makedirs(os.path.dirname(key_path), exist_ok=True)
+    with open(key_path, "w") as key_file:
+        json.dump({"project_id": "local-project"}, key_file)
+    runner = local_runner.LocalRunner(template, str(root), workers=2, fakes=True, query_result=query_result,
+                                      **options)
+    records = runner.run(run_id=run_id)
+    return runner, {record["task"]: record["state"] for record in records}
+
+
+def smoke_config(**overrides):
+    config = dict(PROJECT_ID="local-project", REGION="us-central1", CREDENTIAL_PATH=f"{BUCKET}/key.json",
+                  BUCKET_NAME="local-bucket", PIPELINE_ROOT=f"{BUCKET}/pipeline-root",
+                  BQ_QUERY="SELECT * FROM `local-project.taxi.rides`", SPLIT_SPEC="{}",
+                  INGESTION_CACHE_ROOT="", BOOTSTRAP_SAMPLES=20,
+                  FEATURE_COLUMNS='["trip_seconds", "trip_miles", "payment_type"]',
+                  # nothing passes validation, deploying needs Vertex AI
+                  THRESHOLD_DICT='{"RMSE": 0.0}')
+    config.update(overrides)
+    return config
+
+
+def test_compiled_pipeline_runs_on_the_fakes(project, full_custom_training, tmp_path):
+    template = full_custom_training(**smoke_config())
+    root = tmp_path / "local"
+    runner, states = run_local(project, template, root, rides(tmp_path / "rides.parquet"))
+
+    assert runner.error is None, runner.error
+    assert states["read-data"] == "SUCCEEDED"
+    assert states["training"] == "SUCCEEDED"
+    assert states["model-validation"] == "SUCCEEDED"
+    assert states["condition-deploy-model-1"] == "SKIPPED"
+    artifacts = root / "gcs" / "local-bucket" / "pipeline-root" / runner.run_id
+    assert (artifacts / "read-data" / "train_dataset.parquet").is_file()
+    assert (artifacts / "training" / "model.joblib").is_file()
+    assert (root / "logs" / "cloud_logging.jsonl").is_file()
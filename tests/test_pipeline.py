@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+
+from test_local_runner import BUCKET, rides, run_local, smoke_config
+
+
+def test_training_configs_vary_training_settings_per_branch(project, full_custom_training, tmp_path):
+    configs = [{"name": "streamed", "training_mode": "incremental", "chunk_size": 128, "epochs": 3},
+               {"name": "linear"}]
+    template = full_custom_training(**smoke_config(TRAINING_CONFIGS=json.dumps(configs)))
+    with open(template) as template_file:
+        assert "run_id" not in json.load(template_file)["pipelineSpec"]["root"].get("inputDefinitions", {}).get(
+            "parameters", {})
+    root = tmp_path / "local"
+
+    runner, states = run_local(project, template, root, rides(tmp_path / "rides.parquet"), run_id="fanout")
+
+    assert runner.error is None, runner.error
+    assert states["select-model"] == "SUCCEEDED"
+    sweep = root / "gcs" / "local-bucket" / "pipeline-root" / "sweeps" / "fanout"
+    records = {path.stem: json.loads(path.read_text()) for path in sweep.glob("*.json")}
+    assert records["streamed"]["model_metadata"]["name"] == "SGDRegressor_model"
+    assert records["linear"]["model_metadata"]["name"] == "LinearRegressionClf_model"
+
+
+@pytest.mark.parametrize("configs, message", [
+    ([{"name": "a", "learning_rate": 0.1}], "unknown keys"),
+    ([{"name": "a"}, {"name": "a"}], "unique name"),
+    ([{"training_mode": "batch"}], "unique name"),
+])
+def test_training_configs_are_checked_at_compile_time(full_custom_training, configs, message):
+    with pytest.raises(ValueError, match=message):
+        full_custom_training(**smoke_config(TRAINING_CONFIGS=json.dumps(configs)))
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+
+
+def register(project, tmp_path, sha256: str, serving_img: str = "serving-image"):
+    register_module = project("pre_build_custom_training", "register")
+    model_dir = tmp_path / "local" / "gcs" / "local-bucket" / "run" / "training" / "model"
+    model_dir.mkdir(parents=True, exist_ok=True)
+    (model_dir / "published.json").write_text(json.dumps(
+        {"artifact_uri": f"gs://local-bucket/artifacts/{sha256}/", "sha256": sha256}))
+    return register_module.register_model.python_func(
+        project="local-project", location="us-central1", model_dir="gs://local-bucket/run/training/model/",
+        serving_container_uri=serving_img)
+
+
+def test_published_content_is_registered_once(project, fakes, tmp_path):
+    first = register(project, tmp_path, "ab" * 32)
+    second = register(project, tmp_path, "ab" * 32)
+
+    assert second == first
+    assert first.model_uri == f"https://us-central1-aiplatform.googleapis.com/v1/{first.resource_name}"
+    assert len(fakes.models) == 1
+    assert fakes.models[0].artifact_uri == f"gs://local-bucket/artifacts/{'ab' * 32}/"
+
+
+def test_new_content_or_serving_image_is_registered(project, fakes, tmp_path):
+    first = register(project, tmp_path, "ab" * 32)
+    other_content = register(project, tmp_path, "cd" * 32)
+    other_image = register(project, tmp_path, "ab" * 32, serving_img="other-serving-image")
+
+    assert len({first.resource_name, other_content.resource_name, other_image.resource_name}) == 3
+    assert len(fakes.models) == 3
@@ -0,0 +1,95 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+sklearn_metrics = pytest.importorskip("sklearn.metrics")
+
+
+def predictions(rows: int, seed: int = 0):
+    generator = np.random.default_rng(seed)
+    y_true = generator.normal(10, 3, rows)
+    return y_true, y_true + generator.normal(0, 1, rows)
+
+
+def test_point_metrics_match_sklearn(project):
+    regression_metrics = project("full_custom_training", "regression_metrics")
+    y_true, y_pred = predictions(50000)
+
+    summary = regression_metrics.RegressionMetrics(reservoir_size=50000).evaluate(y_true, y_pred, workers=4).summary()
+
+    assert summary["MAE"] == pytest.approx(sklearn_metrics.mean_absolute_error(y_true, y_pred))
+    assert summary["MSE"] == pytest.approx(sklearn_metrics.mean_squared_error(y_true, y_pred))
+    assert summary["R2"] == pytest.approx(sklearn_metrics.r2_score(y_true, y_pred))
+    assert summary["MaxError"] == pytest.approx(sklearn_metrics.max_error(y_true, y_pred))
+    assert summary["AE_P50"] == pytest.approx(np.median(np.abs(y_true - y_pred)))
+    assert summary["RMSE_CI"][0] < summary["RMSE"] < summary["RMSE_CI"][1]
+
+
+def test_bootstrap_draws_one_weight_per_block_and_replicate(project):
+    regression_metrics = project("full_custom_training", "regression_metrics")
+    metrics = regression_metrics.RegressionMetrics(bootstrap_samples=100)
+    draws = []
+    rng = metrics.rng
+
+    class CountingGenerator:
+        def poisson(self, lam, size):
+            draws.append(size)
+            return rng.poisson(lam, size)
+
+        def random(self, size):
+            return rng.random(size)
+
+    metrics.rng = CountingGenerator()
+    metrics.update(*predictions(640000))
+
+    assert sum(size[1] for size in draws) == 640000 // regression_metrics.MAX_BLOCK_ROWS
+    assert all(size[0] == 100 for size in draws)
+    # small test sets keep one block per row
+    draws.clear()
+    metrics.update(*predictions(900))
+    assert sum(size[1] for size in draws) == 900
+
+
+def test_intervals_are_reproducible_and_merge_exactly(project):
+    regression_metrics = project("full_custom_training", "regression_metrics")
+    y_true, y_pred = predictions(30000)
+
+    first = regression_metrics.RegressionMetrics().evaluate(y_true, y_pred, workers=3).summary()
+    second = regression_metrics.RegressionMetrics().evaluate(y_true, y_pred, workers=3).summary()
+    assert first == second
+
+    whole = regression_metrics.RegressionMetrics(seed=1).update(y_true, y_pred)
+    halves = regression_metrics.RegressionMetrics(seed=2).update(y_true[:10000], y_pred[:10000])
+    halves.merge(regression_metrics.RegressionMetrics.from_state(
+        regression_metrics.RegressionMetrics(seed=3).update(y_true[10000:], y_pred[10000:]).state()))
+    np.testing.assert_allclose(halves.sums, whole.sums)
+    assert halves.summary()["MAE"] == pytest.approx(whole.summary()["MAE"])
+    assert halves.summary()["RMSE_CI"] == pytest.approx(whole.summary()["RMSE_CI"], rel=0.05)
+
+
+def test_vendored_copies_are_up_to_date(project):
+    vendor = project("full_custom_training", "vendor")
+    assert vendor.stale() == []
+
+
+def test_vendored_blocks_skip_imports_the_component_has(project):
+    vendor = project("full_custom_training", "vendor")
+    with open(f"{vendor.DIRECTORY}/validation.py") as source_file:
+        source = source_file.read()
+    block = source.split("# BEGIN VENDORED cloud_logging.py")[1].split("# END VENDORED cloud_logging.py")[0]
+
+    assert "    import atexit\n" in block
+    assert "    import logging\n" not in block and "    import json\n" not in block
+    assert "from gcp_clients import" not in block
+
+
+def test_copies_in_other_projects_are_checked(project, tmp_path):
+    vendor = project("full_custom_training", "vendor")
+    copies = vendor.copies(root=str(tmp_path))
+    assert len(copies) == sum(len(targets) for targets in vendor.COPIES.values())
+
+    stale = vendor.stale(write=True, root=str(tmp_path))
+    assert sorted(stale) == sorted(copies)
+    assert vendor.stale(root=str(tmp_path)) == []
+    path = tmp_path / "bqml/bq_xgboost/scripts/cloud_logging.py"
+    path.write_text(path.read_text() + "# local edit\n")
+    assert vendor.stale(root=str(tmp_path)) == [str(path)]
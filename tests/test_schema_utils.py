@@ -0,0 +1,19 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+TRAINER = "pre_build_custom_training/traincontainer/trainer"
+
+
+def test_float32_only_for_columns_that_round_trip_exactly(project):
+    schema_utils = project(TRAINER, "schema_utils")
+    frame = pd.DataFrame({"exact": [0.5, 1.25, np.inf], "close": [1.0 + 1e-7, 2.0, 3.0],
+                          "cents": [0.01, 0.02, 0.03], "count": [1, 2, 300]})
+
+    schema = schema_utils.compact_schema([frame])
+
+    assert schema["exact"] == {"dtype": "float32"}
+    assert schema["close"] == {"dtype": "float64"}
+    assert schema["cents"] == {"dtype": "float64"}
+    assert schema["count"] == {"dtype": "int16"}
@@ -0,0 +1,133 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+TRAINER = "pre_build_custom_training/traincontainer/trainer"
+
+
+@pytest.fixture
+def server(project):
+    return project("custom_serving", "server")
+
+
+def post(url: str, payload):
+    request = urllib.request.Request(url, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def serve(server, model, **options):
+    http_server = server.build_server(model, 0, 64, 50, host="127.0.0.1", **options)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server, f"http://127.0.0.1:{http_server.server_address[1]}/predict"
+
+
+def test_concurrent_requests_share_one_predict(server):
+    calls = []
+
+    def predict(instances):
+        calls.append(len(instances))
+        return instances.sum(axis=1)
+
+    batcher = server.MicroBatcher(predict, max_batch_size=64, max_wait_ms=200)
+    requests = [np.full((rows, 2), rows, dtype=np.float32) for rows in (1, 2, 3)]
+    futures = [batcher.submit(instances) for instances in requests]
+
+    for rows, future in zip((1, 2, 3), futures):
+        np.testing.assert_array_equal(future.result(5), np.full(rows, 2 * rows))
+    assert calls == [6]
+    assert list(batcher.batch_sizes) == [6]
+
+
+def test_batches_stop_at_the_size_limit_and_stats_stay_bounded(server):
+    release = threading.Event()
+    calls = []
+
+    def predict(instances):
+        release.wait(5)
+        calls.append(len(instances))
+        return instances[:, 0]
+
+    batcher = server.MicroBatcher(predict, max_batch_size=4, max_wait_ms=1000, stats_window=3)
+    futures = [batcher.submit(np.full((2, 1), index, dtype=np.float32)) for index in range(10)]
+    release.set()
+
+    for index, future in enumerate(futures):
+        np.testing.assert_array_equal(future.result(5), [index, index])
+    assert calls == [4] * 5
+    assert list(batcher.batch_sizes) == [4] * 3
+    assert (batcher.batch_count, batcher.instance_count) == (5, 20)
+
+
+def test_predict_errors_fail_only_their_batch(server):
+    def predict(instances):
+        if (instances < 0).any():
+            raise ValueError("negative feature")
+        return instances[:, 0]
+
+    batcher = server.MicroBatcher(predict, max_wait_ms=0)
+    with pytest.raises(ValueError):
+        batcher.submit(np.full((1, 1), -1, dtype=np.float32)).result(5)
+    np.testing.assert_array_equal(batcher.submit(np.ones((1, 1), dtype=np.float32)).result(5), [1])
+
+
+def test_server_encodes_instances_with_the_trained_schema(server, project, tmp_path):
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("sklearn")
+    from joblib import dump
+    from sklearn.tree import DecisionTreeClassifier
+    schema_utils = project(TRAINER, "schema_utils")
+    generator = np.random.default_rng(0)
+    frame = pd.DataFrame({"trip_seconds": generator.integers(60, 3600, 500),
+                          "trip_miles": generator.uniform(0.1, 30, 500).round(2),
+                          "payment_type": generator.choice(["Cash", "Credit Card", "Mobile"], 500)})
+    frame["fare"] = (frame["trip_miles"] // 5 + (frame["payment_type"] == "Cash")).astype("int64")
+    schema = schema_utils.compact_schema([frame])
+    data, labels = schema_utils.feature_arrays(schema_utils.apply_schema(frame, schema), "fare")
+    model = DecisionTreeClassifier(random_state=0).fit(data, labels)
+    dump(model, tmp_path / "model.joblib")
+    features = {column: spec for column, spec in schema.items() if column != "fare"}
+    (tmp_path / "schema.json").write_text(json.dumps(features))
+
+    http_server = server.make_server(str(tmp_path), 0, 64, 5, host="127.0.0.1")
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{http_server.server_address[1]}/predict"
+    instances = json.loads(frame.head(20).drop(columns="fare").to_json(orient="records"))
+    # positional lists take category strings too
+    instances[1] = [instances[1][column] for column in features]
+
+    status, payload = post(url, {"instances": instances})
+    assert status == 200
+    np.testing.assert_array_equal(payload["predictions"], model.predict(data[:20]))
+
+    status, payload = post(url, {"instances": [dict(instances[0], payment_type="Crypto")]})
+    assert status == 400 and "Crypto" in payload["error"]
+    status, payload = post(url, {"instances": [{"trip_seconds": 60}]})
+    assert status == 400 and "trip_miles" in payload["error"]
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def test_schema_with_the_label_is_ignored(server):
+    class Model:
+        n_features_in_ = 2
+
+        def predict(self, instances):
+            return instances.sum(axis=1)
+
+    schema = {"trip_miles": {"dtype": "float32"}, "payment_type": {"dtype": "category", "categories": ["Cash"]},
+              "fare": {"dtype": "int64"}}
+    http_server, url = serve(server, Model(), schema=schema)
+
+    assert post(url, {"instances": [[1.5, 2.0]]}) == (200, {"predictions": [3.5]})
+    assert post(url, {"instances": [[1.5, 2.0, 3.0]]})[0] == 400
+    http_server.shutdown()
+    http_server.server_close()
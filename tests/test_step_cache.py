@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from test_local_runner import rides, run_local, smoke_config
+
+
+def write(path, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as handle:
+        handle.write(content)
+
+
+def test_artifact_digest_hashes_the_files_written_next_to_the_path(project, tmp_path):
+    step_cache = project("tools", "step_cache")
+    mount_root = str(tmp_path)
+    dataset = {"uri": "gs://bucket/run-1/read-data/train_dataset",
+               "metadata": {"file_extension": ".parquet",
+                            "processed_data_path": "gs://bucket/run-1/read-data/train_dataset"}}
+    model = {"uri": "gs://bucket/run-1/training/model", "metadata": {}}
+    write(tmp_path / "bucket/run-1/read-data/train_dataset.parquet", b"rows")
+    write(tmp_path / "bucket/run-1/training/model.joblib", b"weights")
+
+    assert step_cache.artifact_files(dataset, mount_root) == [str(tmp_path / "bucket/run-1/read-data/train_dataset.parquet")]
+    assert step_cache.artifact_files(model, mount_root) == [str(tmp_path / "bucket/run-1/training/model.joblib")]
+    before = step_cache.artifact_digest(dataset, mount_root)
+    write(tmp_path / "bucket/run-1/read-data/train_dataset.parquet", b"other rows")
+    assert step_cache.artifact_digest(dataset, mount_root) != before
+
+    # the same content written by another run hashes the same
+    rerun = {"uri": "gs://bucket/run-2/read-data/train_dataset",
+             "metadata": {"file_extension": ".parquet",
+                          "processed_data_path": "gs://bucket/run-2/read-data/train_dataset"}}
+    write(tmp_path / "bucket/run-2/read-data/train_dataset.parquet", b"other rows")
+    assert step_cache.artifact_digest(rerun, mount_root) == step_cache.artifact_digest(dataset, mount_root)
+
+
+def test_lookup_misses_once_an_output_file_is_gone(project, tmp_path):
+    step_cache = project("tools", "step_cache")
+    write(tmp_path / "gcs/bucket/run-1/training/model.joblib", b"weights")
+    cache = step_cache.StepCache(str(tmp_path), str(tmp_path / "gcs"))
+    outputs = {"parameters": {}, "artifacts": {"model": {"uri": "gs://bucket/run-1/training/model", "metadata": {}}}}
+    cache.store("key", "training", outputs, "run-1")
+
+    assert cache.lookup("key") == outputs
+    os.remove(tmp_path / "gcs/bucket/run-1/training/model.joblib")
+    assert cache.lookup("key") is None
+    cache.close()
+
+
+def test_second_run_of_the_same_pipeline_is_served_from_the_cache(project, full_custom_training, tmp_path):
+    template = full_custom_training(**smoke_config())
+    root = tmp_path / "local"
+    query_result = rides(tmp_path / "rides.parquet")
+    runner, first = run_local(project, template, root, query_result, run_id="first")
+    assert runner.error is None, runner.error
+    runner, second = run_local(project, template, root, query_result, run_id="second")
+
+    assert runner.error is None, runner.error
+    assert first["training"] == "SUCCEEDED"
+    assert second["read-data"] == "CACHED"
+    assert second["training"] == "CACHED"
+    assert second["model-validation"] == "CACHED"
+    assert second["condition-deploy-model-1"] == "SKIPPED"
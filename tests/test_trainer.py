@@ -0,0 +1,353 @@
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+
+TRAINER = "pre_build_custom_training/traincontainer/trainer"
+KEY = "gs://local-bucket/key.json"
+
+
+@pytest.fixture
+def trainer(project, fakes, monkeypatch):
+    """
+    Import a module of the prebuilt training container, which reads the
+    service account key of the fakes
+
+    """
+    def load(name: str):
+        monkeypatch.setattr(project(TRAINER, "config"), "credential_path", KEY)
+        return project(TRAINER, name)
+
+    return load
+
+
+def bq_table(fakes, uri: str, frame):
+    """
+    Make frame readable as the BigQuery table bq://<project>.<dataset>.<table>
+
+    """
+    reference = fakes.TableReference(*uri[len("bq://"):].split("."))
+    fakes.tables[reference.path] = fakes.Table(reference, frame, datetime.now(timezone.utc))
+    return uri
+
+
+def taxi_rides(rows: int, seed: int = 0):
+    generator = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "trip_seconds": generator.integers(60, 3600, rows),
+        "trip_miles": generator.uniform(0.1, 30, rows).round(2),
+        "payment_type": generator.choice(["Cash", "Credit Card", "Mobile"], rows),
+    })
+    frame["fare"] = (frame["trip_miles"] // 5).astype("int64")
+    return frame
+
+
+def test_download_reads_every_stream_in_order(trainer, fakes):
+    bq_download = trainer("bq_download")
+    frame = taxi_rides(25000)
+    uri = bq_table(fakes, "bq://local-project.taxi.train", frame)
+
+    session = bq_download.open_session(KEY, uri, max_stream_count=4)
+    table = bq_download.read_streams(KEY, session)
+
+    assert len(session.streams) == 4
+    # every record batch becomes a chunk of the table, one page per stream here
+    assert table.column("trip_miles").num_chunks == 4
+    pd.testing.assert_frame_equal(table.to_pandas(), frame)
+    shard = bq_download.read_streams(KEY, session, stream_indices=[1, 3])
+    pd.testing.assert_frame_equal(shard.to_pandas(), pd.concat([frame[6250:12500], frame[18750:]]).reset_index(drop=True))
+    assert bq_download.read_streams(KEY, session, stream_indices=[]).schema == table.schema
+
+
+def test_training_and_test_splits_download_concurrently(trainer, fakes, monkeypatch):
+    bq_download = trainer("bq_download")
+    train = trainer("train")
+    distributed = trainer("distributed")
+    frames = {"train": taxi_rides(3000, seed=1), "test": taxi_rides(1000, seed=2)}
+    uris = {name: bq_table(fakes, f"bq://local-project.taxi.{name}", frame) for name, frame in frames.items()}
+    both_reading = threading.Barrier(2, timeout=10)
+    read_streams = bq_download.read_streams
+
+    def meet_then_read(*args, **kwargs):
+        # a sequential download never gets the second reader to the barrier
+        both_reading.wait()
+        return read_streams(*args, **kwargs)
+
+    monkeypatch.setattr(bq_download, "read_streams", meet_then_read)
+    df, test_df, data_id = train.read_splits(distributed.Cluster(0, 1), "", uris["train"], uris["test"])
+
+    pd.testing.assert_frame_equal(df, frames["train"])
+    pd.testing.assert_frame_equal(test_df, frames["test"])
+    assert data_id
+
+
+def test_feature_arrays_fill_a_float32_matrix_without_incomplete_rows(trainer):
+    schema_utils = trainer("schema_utils")
+    from sklearn.utils import check_array
+    frame = taxi_rides(200)
+    frame.loc[3, "trip_miles"] = np.nan
+    frame.loc[5, "trip_miles"] = np.inf
+    frame.loc[7, "payment_type"] = None
+    schema = schema_utils.compact_schema([frame])
+    compact = schema_utils.apply_schema(frame, schema)
+
+    data, labels = schema_utils.feature_arrays(compact, "fare")
+
+    kept = frame.drop(index=[3, 5, 7])
+    assert data.dtype == np.float32 and data.flags.f_contiguous
+    assert data.shape == (197, 3)
+    np.testing.assert_array_equal(data[:, 0], kept["trip_seconds"].to_numpy(np.float32))
+    np.testing.assert_array_equal(data[:, 1], kept["trip_miles"].to_numpy(np.float32))
+    categories = schema["payment_type"]["categories"]
+    np.testing.assert_array_equal(data[:, 2], [categories.index(value) for value in kept["payment_type"]])
+    np.testing.assert_array_equal(labels, kept["fare"].to_numpy())
+    # the tree takes the matrix as it is
+    assert np.shares_memory(check_array(data, dtype=np.float32), data)
+
+
+def test_apply_schema_keeps_columns_already_compact(trainer):
+    schema_utils = trainer("schema_utils")
+    frame = taxi_rides(100)
+    schema = schema_utils.compact_schema([frame])
+    compact = schema_utils.apply_schema(frame, schema)
+
+    again = schema_utils.apply_schema(compact, schema)
+    for column in ("trip_seconds", "trip_miles", "fare"):
+        assert np.shares_memory(again[column].to_numpy(), compact[column].to_numpy())
+    assert schema["trip_seconds"]["dtype"] == "int16"
+    assert schema["payment_type"]["dtype"] == "category"
+
+
+def test_cluster_spec_numbers_the_training_replicas(trainer):
+    distributed = trainer("distributed")
+    cluster = {"workerpool0": ["chief:2222"], "workerpool1": ["worker-0:2222", "worker-1:2222"],
+               "workerpool2": ["reduction-server:2222"]}
+
+    def spec(task_type, index):
+        return {"CLUSTER_SPEC": json.dumps({"cluster": cluster, "task": {"type": task_type, "index": index}})}
+
+    assert distributed.cluster_from_env({}) == (0, 1)
+    assert distributed.cluster_from_env(spec("workerpool0", 0)) == (0, 3)
+    assert distributed.cluster_from_env(spec("workerpool1", 1)) == (2, 3)
+    with pytest.raises(ValueError):
+        distributed.cluster_from_env(spec("workerpool2", 0))
+    tf_config = {"cluster": {"chief": ["chief:2222"], "worker": ["worker-0:2222"], "ps": ["ps-0:2222"]},
+                 "task": {"type": "worker", "index": 0}}
+    assert distributed.cluster_from_env({"TF_CONFIG": json.dumps(tf_config)}) == (1, 2)
+
+
+def run_ranks(world_size: int, work):
+    with ThreadPoolExecutor(max_workers=world_size) as executor:
+        return list(executor.map(work, range(world_size)))
+
+
+def test_ranks_read_disjoint_shards_of_the_chief_sessions(trainer, fakes, monkeypatch, tmp_path):
+    train = trainer("train")
+    distributed = trainer("distributed")
+    config = trainer("config")
+    monkeypatch.setattr(config, "SYNC_POLL_INTERVAL", 0.01)
+    frames = {"train": taxi_rides(3000, seed=1), "test": taxi_rides(1000, seed=2)}
+    uris = {name: bq_table(fakes, f"bq://local-project.taxi.{name}", frame) for name, frame in frames.items()}
+    directory = str(tmp_path / "distributed")
+
+    splits = run_ranks(2, lambda rank: train.read_splits(
+        distributed.Cluster(rank, 2), directory, uris["train"], uris["test"]))
+
+    (chief_train, chief_test, chief_id), (worker_train, worker_test, worker_id) = splits
+    # one session per split, with MAX_STREAM_COUNT streams per rank
+    assert chief_id == worker_id
+    assert len(chief_train) + len(worker_train) == 3000
+    pd.testing.assert_frame_equal(
+        pd.concat([chief_train, worker_train]).sort_values(["trip_seconds", "trip_miles"]).reset_index(drop=True),
+        frames["train"].sort_values(["trip_seconds", "trip_miles"]).reset_index(drop=True))
+    pd.testing.assert_frame_equal(chief_test, frames["test"])
+    assert len(worker_test) == 0
+
+
+def test_chief_merges_the_shard_trees_into_a_voting_ensemble(trainer, monkeypatch, tmp_path):
+    train = trainer("train")
+    distributed = trainer("distributed")
+    monkeypatch.setattr(trainer("config"), "SYNC_POLL_INTERVAL", 0.01)
+    generator = np.random.default_rng(0)
+    data = generator.uniform(0, 4, (400, 2)).astype(np.float32)
+    labels = np.floor(data[:, 0]).astype(np.int64) * 10
+    # the shards see different label sets, 0-20 and 10-30
+    shards = [np.flatnonzero(labels <= 20), np.flatnonzero(labels >= 10)]
+    directory = str(tmp_path / "distributed")
+
+    chief, worker = run_ranks(2, lambda rank: train.train_shard(
+        distributed.Cluster(rank, 2), directory, data[shards[rank]], labels[shards[rank]]))
+
+    assert worker is None
+    assert chief.classes_.tolist() == [0, 10, 20, 30]
+    assert len(chief.estimators_) == 2
+    # the trees vote in indices of the shared label set
+    assert sorted(np.unique(chief.estimators_[1].predict(data)).tolist()) == [1, 2, 3]
+    both = (labels == 10) | (labels == 20)
+    np.testing.assert_array_equal(chief.predict(data[both]), labels[both])
+
+
+
+class Preempted(Exception):
+    pass
+
+
+def test_download_resumes_from_the_checkpointed_cursor(trainer, fakes, monkeypatch, tmp_path):
+    train = trainer("train")
+    distributed = trainer("distributed")
+    config = trainer("config")
+    checkpoint = trainer("checkpoint")
+    monkeypatch.setattr(fakes, "PAGE_ROWS", 250)
+    monkeypatch.setattr(config, "MAX_STREAM_COUNT", 2)
+    monkeypatch.setattr(config, "CHECKPOINT_ROWS", 500)
+    monkeypatch.setattr(config, "LOCAL_CACHE_DIR", str(tmp_path / "cache"))
+    frames = {"train": taxi_rides(4000, seed=1), "test": taxi_rides(1000, seed=2)}
+    uris = {name: bq_table(fakes, f"bq://local-project.taxi.{name}", frame) for name, frame in frames.items()}
+    environ = {"AIP_CHECKPOINT_DIR": str(tmp_path / "checkpoints")}
+    read_rows = fakes.BigQueryReadClient.read_rows
+    reads = []
+    # a failing stream cancels the streams not yet started, both must be running
+    both_streams = threading.Barrier(2, timeout=10)
+
+    def recorded(preempt_after: int = None):
+        def read(client, name, offset=0, **kwargs):
+            reads.append((name, offset))
+            stream = read_rows(client, name, offset=offset, **kwargs)
+            if preempt_after is not None and "/tables/train/" in name:
+                both_streams.wait()
+                stream.batches = stream.batches[:preempt_after] + [None]
+            return stream
+        return read
+
+    def to_arrow(page):
+        if page.batch is None:
+            raise Preempted()
+        return page.batch
+
+    def attempt():
+        return train.read_splits(distributed.Cluster(0, 1), "", uris["train"], uris["test"],
+                                 checkpoint.Checkpoint.from_env(environ=environ))
+
+    monkeypatch.setattr(fakes.Page, "to_arrow", to_arrow)
+    # the training streams are preempted after 750 of their 2000 rows
+    monkeypatch.setattr(fakes.BigQueryReadClient, "read_rows", recorded(preempt_after=3))
+    with pytest.raises(Preempted):
+        attempt()
+
+    # the job restarts on a new machine, without the local cache
+    shutil.rmtree(tmp_path / "cache")
+    reads.clear()
+    monkeypatch.setattr(fakes.BigQueryReadClient, "read_rows", recorded())
+    df, test_df, data_id = attempt()
+
+    pd.testing.assert_frame_equal(df, frames["train"])
+    pd.testing.assert_frame_equal(test_df, frames["test"])
+    # the same sessions, every stream continues at its checkpointed row
+    assert sorted(offset for name, offset in reads) == [500, 500]
+    assert all("/tables/train/" in name for name, offset in reads)
+
+
+def test_model_checkpoint_is_keyed_by_the_training_data(trainer, monkeypatch, tmp_path):
+    checkpoint = trainer("checkpoint")
+    from sklearn.tree import DecisionTreeClassifier
+    monkeypatch.setattr(trainer("config"), "LOCAL_CACHE_DIR", str(tmp_path / "cache"))
+    environ = {"AIP_CHECKPOINT_DIR": str(tmp_path / "checkpoints")}
+    model = DecisionTreeClassifier().fit([[0.0], [1.0]], [0, 1])
+
+    checkpoint.Checkpoint.from_env(environ=environ).save_model(model, "session-a")
+    shutil.rmtree(tmp_path / "cache")
+    resumed = checkpoint.Checkpoint.from_env(environ=environ)
+
+    assert resumed.load_model("session-a").predict([[1.0]]).tolist() == [1]
+    assert resumed.load_model("session-b") is None
+    assert checkpoint.Checkpoint.from_env(environ={}) is None
+
+
+class Part:
+    def __init__(self, bucket, name: str):
+        self.bucket, self.name = bucket, name
+        self.metadata = bucket.metadata.get(name)
+
+    def upload_from_filename(self, path: str):
+        with open(path, "rb") as source:
+            self.bucket.objects[self.name] = source.read()
+        self.bucket.metadata[self.name] = self.metadata
+
+    def upload_from_file(self, source, size: int, **kwargs):
+        if self.name.endswith(self.bucket.failing_part):
+            raise ConnectionError(f"upload of {self.name} failed")
+        self.bucket.objects[self.name] = source.read(size)
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+    def compose(self, parts):
+        if self.bucket.compose_fails:
+            raise ConnectionError("compose failed")
+        self.bucket.objects[self.name] = b"".join(self.bucket.objects[part.name] for part in parts)
+
+
+class Bucket:
+    def __init__(self, failing_part: str = "never", compose_fails: bool = False):
+        self.objects = {}
+        self.metadata = {}
+        self.failing_part = failing_part
+        self.compose_fails = compose_fails
+
+    def blob(self, name: str):
+        return Part(self, name)
+
+    def get_blob(self, name: str):
+        return Part(self, name) if name in self.objects else None
+
+
+@pytest.mark.parametrize("failure", [{}, {"failing_part": "/05"}, {"compose_fails": True}])
+def test_composite_upload_deletes_its_parts(trainer, tmp_path, failure):
+    artifact_publisher = trainer("artifact_publisher")
+    payload = np.random.default_rng(0).bytes(10000)
+    (tmp_path / "model.joblib").write_bytes(payload)
+    bucket = Bucket(**failure)
+    blob = bucket.blob("models/model.joblib")
+
+    if failure:
+        with pytest.raises(ConnectionError):
+            artifact_publisher.upload_composite(blob, str(tmp_path / "model.joblib"), 1000, 4)
+        assert bucket.objects == {}
+    else:
+        artifact_publisher.upload_composite(blob, str(tmp_path / "model.joblib"), 1000, 4)
+        assert bucket.objects == {"models/model.joblib": payload}
+
+
+def test_published_content_is_found_again_by_later_runs(trainer, tmp_path, monkeypatch):
+    from google.cloud import storage
+    artifact_publisher = trainer("artifact_publisher")
+    bucket = Bucket()
+    monkeypatch.setattr(storage.blob.Blob, "from_string",
+                        staticmethod(lambda uri, client=None: bucket.blob(uri.split("/", 3)[3])))
+    paths = []
+    for name, content in (("model.joblib", b"model"), ("schema.json", b"{}")):
+        (tmp_path / name).write_bytes(content)
+        paths.append(str(tmp_path / name))
+
+    first = artifact_publisher.publish_content(None, paths, "gs://bucket/artifacts")
+    again = artifact_publisher.publish_content(None, paths, "gs://bucket/artifacts/")
+    (tmp_path / "schema.json").write_bytes(b'{"fare": {}}')
+    changed = artifact_publisher.publish_content(None, paths, "gs://bucket/artifacts")
+
+    assert first["uri"] == f"gs://bucket/artifacts/{first['sha256']}/"
+    assert first["uploaded"] == ["model.joblib", "schema.json"]
+    assert again == dict(first, uploaded=[])
+    assert changed["uri"] != first["uri"]
+    assert sorted(bucket.objects) == sorted(f"artifacts/{published['sha256']}/{name}"
+                                            for published in (first, changed)
+                                            for name in ("model.joblib", "schema.json"))
@@ -0,0 +1,135 @@
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("kfp")
+pytest.importorskip("fsspec")
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("sklearn")
+
+from test_data_ingestion import Warehouse, load, numbered_rides, read_data
+from test_local_runner import BUCKET, rides
+
+FEATURE_COLUMNS = ["trip_seconds", "trip_miles", "payment_type"]
+
+
+def train(component, fakes, datasets: dict, run: str = "run", **options):
+    """
+    Run the training component in this process, returns the model artifact
+    and the metadata it wrote
+    """
+    from kfp.v2.dsl import Model
+    training = component("training")
+    model = Model(uri=f"{BUCKET}/{run}/training/model")
+    metadata_path = fakes.mount_path(f"{BUCKET}/{run}/training/model_metadata.json", fakes.state["mount_root"])
+    # the kfp executor creates the directory of output artifacts
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    options.setdefault("feature_columns", FEATURE_COLUMNS)
+    options.setdefault("bootstrap_samples", 20)
+    training.training.python_func(credential_path=f"{BUCKET}/key.json", train_dataset=datasets["train"],
+                                  test_dataset=datasets["test"], model=model,
+                                  model_metadata_path=metadata_path, **options)
+    with open(metadata_path) as metadata_file:
+        return model, json.load(metadata_file)
+
+
+def test_partitioned_datasets_are_read_from_the_committed_parts(component, fakes, monkeypatch, tmp_path):
+    Warehouse(fakes, monkeypatch, numbered_rides(tmp_path / "rides.parquet", rows=600))
+    datasets = read_data(component, fakes, cache_root=f"{BUCKET}/ingestion-cache", watermark_column="ride_number")
+    # an ingestion run that died after writing its parts, before the manifest
+    for artifact in datasets.values():
+        with open(f"{artifact.path}/part-99991231235959.parquet", "wb") as orphan:
+            orphan.write(b"not parquet")
+
+    model, metadata = train(component, fakes, datasets)
+
+    assert metadata["model_metrics"]["RMSE"] < 1.0
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "feather", "csv"])
+def test_incremental_mode_streams_chunks_into_partial_fit(component, fakes, monkeypatch, tmp_path, output_format):
+    import joblib
+    from sklearn.linear_model import SGDRegressor
+    fakes.state["query_result"] = rides(tmp_path / "rides.parquet", rows=3000)
+    datasets = read_data(component, fakes, output_format=output_format)
+    chunks = []
+    partial_fit = SGDRegressor.partial_fit
+    monkeypatch.setattr(SGDRegressor, "partial_fit",
+                        lambda self, X, y, **kwargs: chunks.append(len(X)) or partial_fit(self, X, y, **kwargs))
+
+    model, metadata = train(component, fakes, datasets, training_mode="incremental", chunk_size=256, epochs=5)
+
+    regr = joblib.load(f"{model.path}.joblib")
+    assert type(regr[-1]).__name__ == "SGDRegressor"
+    assert max(chunks) == 256
+    assert sum(chunks) == 5 * len(load(datasets["train"]))
+    assert metadata["name"] == "SGDRegressor_model"
+    assert metadata["model_metrics"]["R2"] > 0.95
+
+
+def test_candidate_sweep_keeps_the_best_and_removes_its_workdir(component, fakes, monkeypatch, tmp_path):
+    import tempfile
+    fakes.state["query_result"] = rides(tmp_path / "rides.parquet")
+    datasets = read_data(component, fakes)
+    workdirs = []
+    mkdtemp = tempfile.mkdtemp
+    monkeypatch.setattr(tempfile, "mkdtemp", lambda **kwargs: workdirs.append(mkdtemp(**kwargs)) or workdirs[-1])
+    candidates = [
+        {"name": "shallow_tree", "estimator": "sklearn.tree.DecisionTreeRegressor", "params": {"max_depth": 1}},
+        {"name": "linear", "estimator": "sklearn.linear_model.LinearRegression"},
+        {"name": "broken", "estimator": "sklearn.linear_model.Ridge", "params": {"no_such_param": 1}},
+    ]
+
+    threads_at_fork = []
+    start = multiprocessing.process.BaseProcess.start
+    monkeypatch.setattr(multiprocessing.process.BaseProcess, "start", lambda self: threads_at_fork.append(
+        [thread.name for thread in threading.enumerate()]) or start(self))
+
+    _, metadata = train(component, fakes, datasets, candidates=candidates, max_workers=2)
+
+    # no flusher thread holds logging locks while workers are forked
+    assert len(threads_at_fork) == 3
+    assert not any("log-flusher" in names for names in threads_at_fork)
+    assert logging.getLogger("data-ingestion").handlers
+    leaderboard = metadata["leaderboard"]
+    assert [entry["name"] for entry in leaderboard] == ["linear", "shallow_tree", "broken"]
+    assert "no_such_param" in leaderboard[-1]["error"]
+    assert metadata["name"] == "linear_model"
+    assert len(workdirs) == 1 and not os.path.exists(workdirs[0])
+
+    with pytest.raises(RuntimeError, match="every candidate failed"):
+        train(component, fakes, datasets, run="failing", candidates=candidates[2:])
+    assert len(workdirs) == 2 and not os.path.exists(workdirs[1])
+
+
+def test_split_key_columns_are_not_features(component, fakes, monkeypatch, tmp_path):
+    Warehouse(fakes, monkeypatch, rides(tmp_path / "rides.parquet"))
+    split_spec = {"fractions": {"train": 0.8, "test": 0.1, "val": 0.1}, "key_columns": ["unique_key"]}
+    datasets = read_data(component, fakes, split_spec=split_spec)
+    assert "unique_key" in load(datasets["train"]).columns
+    assert datasets["train"].metadata["key_columns"] == ["unique_key"]
+
+    model, metadata = train(component, fakes, datasets, feature_columns=[])
+
+    assert metadata["model_metrics"]["RMSE"] < 1.0
+
+
+def test_default_split_spec_hashes_the_whole_row(component, fakes, monkeypatch, tmp_path):
+    import configparser
+    from conftest import REPO_ROOT
+    config = configparser.ConfigParser()
+    config.read(os.path.join(REPO_ROOT, "full_custom_training", "config", "config.ini"))
+    split_spec = json.loads(config["ML_PIPELINE"]["SPLIT_SPEC"])
+    assert not split_spec.get("key_columns")
+    Warehouse(fakes, monkeypatch, rides(tmp_path / "rides.parquet"))
+
+    datasets = read_data(component, fakes, split_spec=split_spec)
+
+    sizes = {name: len(load(artifact)) for name, artifact in datasets.items()}
+    assert sum(sizes.values()) == 600 and 0.6 < sizes["train"] / 600 < 0.8
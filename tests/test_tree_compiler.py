@@ -0,0 +1,94 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("sklearn")
+
+TRAINER = "pre_build_custom_training/traincontainer/trainer"
+
+
+@pytest.fixture
+def tree_compiler(project):
+    return project(TRAINER, "tree_compiler")
+
+
+def taxi_matrix(rows: int, seed: int = 0):
+    generator = np.random.default_rng(seed)
+    data = generator.normal(size=(rows, 5)).astype(np.float32)
+    labels = np.round(data[:, 0] * 2 + data[:, 1] ** 2 + generator.normal(size=rows) / 2).astype(np.int64)
+    return data, labels
+
+
+def with_missing(data):
+    data = data.copy()
+    data[::7, 0] = np.nan
+    data[::11, 3] = np.nan
+    return data
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+@pytest.mark.parametrize("missing_in_training", [False, True])
+def test_compiled_tree_predicts_like_sklearn(tree_compiler, order, missing_in_training):
+    from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
+    data, labels = taxi_matrix(3000)
+    if missing_in_training:
+        data = with_missing(data)
+    test = np.asarray(with_missing(taxi_matrix(1000, seed=1)[0]), order=order)
+    names = np.array(["cheap", "fair", "pricey", "steep"])[np.clip(labels, -1, 2) + 1]
+    models = [DecisionTreeClassifier(random_state=0).fit(data, labels),
+              DecisionTreeClassifier(max_depth=6, random_state=0).fit(data, names),
+              DecisionTreeRegressor(random_state=0).fit(data, data[:, 2] * 3 + labels)]
+
+    for model in models:
+        compiled = tree_compiler.CompiledTree.from_sklearn(model)
+        np.testing.assert_array_equal(compiled.apply(test)[0], model.apply(test))
+        np.testing.assert_array_equal(compiled.predict(test), model.predict(test))
+
+
+def test_compiled_ensemble_votes_like_the_voting_classifier(project, tree_compiler):
+    from sklearn.tree import DecisionTreeClassifier
+    distributed = project(TRAINER, "distributed")
+    data, labels = taxi_matrix(3000)
+    classes = np.unique(labels)
+    shards = np.array_split(np.arange(len(data)), 4)
+    trees = [DecisionTreeClassifier(max_depth=4, random_state=0).fit(data[shard],
+                                                                     np.searchsorted(classes, labels[shard]))
+             for shard in shards]
+    ensemble = distributed.voting_ensemble(trees, classes)
+    test = taxi_matrix(2000, seed=1)[0]
+
+    compiled = tree_compiler.CompiledTree.from_sklearn(ensemble)
+    assert compiled.n_trees == 4
+    np.testing.assert_array_equal(compiled.predict(test), ensemble.predict(test))
+
+
+def test_saved_tree_is_memory_mapped_on_load(tree_compiler, tmp_path):
+    from sklearn.tree import DecisionTreeClassifier
+    data, labels = taxi_matrix(2000)
+    names = np.where(labels > 0, "long", "short")
+    model = DecisionTreeClassifier(random_state=0).fit(with_missing(data), names)
+    compiled = tree_compiler.CompiledTree.from_sklearn(model)
+    path = str(tmp_path / "model.tree")
+    compiled.save(path)
+
+    loaded = tree_compiler.CompiledTree.load(path)
+    for name in tree_compiler.ARRAYS:
+        assert isinstance(getattr(loaded, name).base, np.memmap)
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(compiled, name))
+        assert getattr(loaded, name).ctypes.data % tree_compiler.ALIGNMENT == 0
+    assert loaded.classes.tolist() == ["long", "short"]
+    test = with_missing(taxi_matrix(500, seed=1)[0])
+    np.testing.assert_array_equal(loaded.predict(test), model.predict(test))
+
+    predictor = tree_compiler.TreePredictor()
+    predictor.load(str(tmp_path))
+    response = predictor.postprocess(predictor.predict(predictor.preprocess({"instances": test[:3].tolist()})))
+    assert response == {"predictions": model.predict(test[:3]).tolist()}
+
+
+def test_other_models_and_files_are_rejected(tree_compiler, tmp_path):
+    from sklearn.linear_model import LinearRegression
+    with pytest.raises(ValueError):
+        tree_compiler.CompiledTree.from_sklearn(LinearRegression().fit([[0.0], [1.0]], [0.0, 1.0]))
+    (tmp_path / "model.joblib").write_bytes(b"not a tree file")
+    with pytest.raises(ValueError):
+        tree_compiler.CompiledTree.load(str(tmp_path / "model.joblib"))
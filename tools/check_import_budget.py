@@ -0,0 +1,124 @@
+"""
+Import-time budget check for the pipeline entry points
+
+Every entry point is imported (not run) in a fresh interpreter from its own
+project directory, with the socket layer patched so that any DNS lookup or
+connection attempt is recorded and refused. The check fails when an import
+takes longer than the budget, touches the network or raises.
+
+Usage
+-----
+    python tools/check_import_budget.py
+    python tools/check_import_budget.py --budget 0.5 full_custom_training/run_pipeline.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = 1.0
+ENTRY_POINTS = [
+    "full_custom_training/run_pipeline.py",
+    "pre_build_custom_training/run_pipeline.py",
+    "pre_build_custom_training/traincontainer/trainer/train.py",
+    "bqml/bq_kfp_regression/main.py",
+    "bqml/bq_kfp_classification/pipeline_run.py",
+    "bqml/bq_kfp_automl/pipeline_run.py",
+    "bqml/bq_regression_dnn/main.py",
+    "bqml/bq_timeseries/main.py",
+    "bqml/bq_xgboost/main.py",
+    "automl/automl_tabular/pipeline_run.py",
+    "automl/automl_image_classification/pipeline_run.py",
+    "automl/automl_text/pipeline_run.py",
+    "custom_serving/server.py",
+]
+
+BOOTSTRAP = r"""
+import importlib
+import json
+import os
+import socket
+import sys
+import time
+
+attempts = []
+
+def refuse(name):
+    def blocked(*args, **kwargs):
+        attempts.append(name + repr(args[1:2] if name.startswith("socket.socket") else args[:2]))
+        raise OSError("network access during import: " + name)
+    return blocked
+
+socket.socket.connect = refuse("socket.socket.connect")
+socket.socket.connect_ex = refuse("socket.socket.connect_ex")
+socket.create_connection = refuse("socket.create_connection")
+socket.getaddrinfo = refuse("socket.getaddrinfo")
+
+sys.path.insert(0, os.getcwd())
+error = None
+start = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+except BaseException as exc:
+    error = repr(exc)
+elapsed = time.perf_counter() - start
+print("\n" + json.dumps({"elapsed": elapsed, "network": attempts, "error": error}))
+"""
+
+
+def measure(entry_point: str):
+    """
+    Import one entry point in a fresh interpreter
+
+    Parameters
+    ----------
+    entry_point : str
+        DESCRIPTION: path of the module, relative to the repository root
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: import time in seconds, refused network calls and the
+        import error if any
+
+    """
+    directory, file_name = os.path.split(os.path.join(REPO_ROOT, entry_point))
+    module = os.path.splitext(file_name)[0]
+    completed = subprocess.run([sys.executable, "-c", BOOTSTRAP, module], cwd=directory,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode or not lines:
+        return {"elapsed": 0.0, "network": [], "error": completed.stderr.strip()[-500:]}
+    return json.loads(lines[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("entry_points", nargs="*", default=ENTRY_POINTS,
+                        help="module paths relative to the repository root")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="maximum import time in seconds")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for entry_point in args.entry_points:
+        result = measure(entry_point)
+        problems = []
+        if result["error"]:
+            problems.append(f"import failed: {result['error']}")
+        if result["network"]:
+            problems.append(f"network access: {', '.join(result['network'])}")
+        if result["elapsed"] > args.budget:
+            problems.append(f"over budget ({args.budget:.2f}s)")
+        failures += bool(problems)
+        status = "FAIL" if problems else "ok"
+        print(f"{status:4} {result['elapsed']:7.3f}s  {entry_point}"
+              + "".join(f"\n       {problem}" for problem in problems))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
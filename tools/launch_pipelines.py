@@ -0,0 +1,319 @@
+"""
+Launch many Vertex AI pipelines concurrently and track them from one loop
+
+The manifest lists compiled pipeline templates (paths relative to the
+repository root) with their parameter values. Submissions run with bounded
+parallelism; every submitted job carries a launch_batch label, and a single
+poller lists the whole batch with one call per round instead of polling each
+job, backing off while nothing changes or the list call fails. A status
+and duration table is printed once every job reached a terminal state, or
+once listing failed too many times in a row, with the open jobs as UNKNOWN.
+
+Manifest
+--------
+    {
+      "project": "<GCP-project-id>",
+      "location": "us-central1",
+      "credential_path": "<optional path of a service account json key>",
+      "max_concurrency": 4,
+      "pipelines": [
+        {"name": "full-custom-training",
+         "template_path": "full_custom_training/<template>.json",
+         "parameter_values": {},
+         "enable_caching": true,
+         "service_account": ""}
+      ]
+    }
+
+Usage
+-----
+    python tools/launch_pipelines.py manifest.json
+    python tools/launch_pipelines.py manifest.json --fake
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TERMINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+POLL_INTERVAL = 10.0
+MAX_POLL_INTERVAL = 120.0
+MAX_CONCURRENCY = 4
+MAX_LIST_FAILURES = 5
+
+
+def label_value(value: str):
+    """
+    Turn a string into a valid Vertex AI label value
+
+    Parameters
+    ----------
+    value : str
+        DESCRIPTION: any string
+
+    Returns
+    -------
+    str
+        DESCRIPTION: lowercase letters, digits, "-" and "_", at most 63 chars
+
+    """
+    return re.sub(r"[^a-z0-9_-]", "-", value.lower())[:63]
+
+
+class VertexPipelineService:
+    """
+    Pipeline service backed by Vertex AI Pipelines
+
+    Parameters
+    ----------
+    project : str
+        DESCRIPTION: GCP project id
+    location : str
+        DESCRIPTION: GCP region
+    credential_path : str, optional
+        DESCRIPTION: service account json key, application default
+        credentials when empty
+
+    """
+
+    def __init__(self, project: str, location: str, credential_path: str = ""):
+        from google.cloud import aiplatform
+        credentials = None
+        if credential_path:
+            from google.oauth2 import service_account
+            credentials = service_account.Credentials.from_service_account_file(credential_path)
+        aiplatform.init(project=project, location=location, credentials=credentials)
+        self.aiplatform = aiplatform
+
+    def submit(self, entry: dict, labels: dict):
+        job = self.aiplatform.PipelineJob(
+            display_name=entry.get("display_name", entry["name"]),
+            template_path=os.path.join(REPO_ROOT, entry["template_path"]),
+            job_id=f"{label_value(entry['name'])}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}",
+            pipeline_root=entry.get("pipeline_root") or None,
+            parameter_values=entry.get("parameter_values", {}),
+            enable_caching=entry.get("enable_caching", True),
+            labels=labels,
+        )
+        job.submit(service_account=entry.get("service_account") or None)
+        return job.resource_name
+
+    def list_jobs(self, batch_id: str):
+        jobs = self.aiplatform.PipelineJob.list(filter=f'labels.launch_batch="{batch_id}"')
+        listed = []
+        for job in jobs:
+            resource = job.gca_resource
+            start, end = resource.start_time, resource.end_time
+            listed.append({
+                "resource_name": job.resource_name,
+                "state": job.state.name.replace("PIPELINE_STATE_", ""),
+                "duration": (end - start).total_seconds() if start and end else None,
+            })
+        return listed
+
+
+class FakePipelineService:
+    """
+    In-memory pipeline service for tests and dry runs: every job runs for
+    durations[name] seconds (default_duration otherwise) and then ends in
+    outcomes[name] ("SUCCEEDED" otherwise). Submit and list calls are counted
+
+    Parameters
+    ----------
+    durations : dict, optional
+        DESCRIPTION: seconds per pipeline name
+    outcomes : dict, optional
+        DESCRIPTION: terminal state per pipeline name
+    default_duration : float
+        DESCRIPTION: seconds for pipelines without an explicit duration
+
+    """
+
+    def __init__(self, durations: dict = None, outcomes: dict = None, default_duration: float = 1.0):
+        self.durations = durations or {}
+        self.outcomes = outcomes or {}
+        self.default_duration = default_duration
+        self.jobs = {}
+        self.submit_calls = 0
+        self.list_calls = 0
+
+    def submit(self, entry: dict, labels: dict):
+        self.submit_calls += 1
+        resource_name = f"fake/pipelineJobs/{label_value(entry['name'])}-{self.submit_calls}"
+        self.jobs[resource_name] = {"name": entry["name"], "labels": dict(labels),
+                                    "created": time.monotonic()}
+        return resource_name
+
+    def list_jobs(self, batch_id: str):
+        self.list_calls += 1
+        listed = []
+        for resource_name, job in self.jobs.items():
+            if job["labels"].get("launch_batch") != batch_id:
+                continue
+            duration = self.durations.get(job["name"], self.default_duration)
+            done = time.monotonic() - job["created"] >= duration
+            listed.append({
+                "resource_name": resource_name,
+                "state": self.outcomes.get(job["name"], "SUCCEEDED") if done else "RUNNING",
+                "duration": duration if done else None,
+            })
+        return listed
+
+
+async def launch(entries: list, service, max_concurrency: int = MAX_CONCURRENCY,
+                 poll_interval: float = POLL_INTERVAL, max_poll_interval: float = MAX_POLL_INTERVAL,
+                 max_list_failures: int = MAX_LIST_FAILURES):
+    """
+    Submit the pipelines with at most max_concurrency submissions in flight
+    and poll the whole batch with one list call per round until every job
+    is terminal. The poll interval doubles while no job changes state or the
+    list call fails, up to max_poll_interval, and resets on any change.
+    After max_list_failures failed list calls in a row polling stops and the
+    jobs not yet terminal are reported as UNKNOWN with the list error
+
+    Parameters
+    ----------
+    entries : list
+        DESCRIPTION: manifest pipeline entries, names must be unique
+    service : OBJ
+        DESCRIPTION: VertexPipelineService, FakePipelineService or any object
+        with submit(entry, labels) and list_jobs(batch_id)
+    max_concurrency : int
+        DESCRIPTION: submissions in flight
+    poll_interval : float
+        DESCRIPTION: initial seconds between list calls
+    max_poll_interval : float
+        DESCRIPTION: upper bound of the backoff
+    max_list_failures : int
+        DESCRIPTION: consecutive failed list calls before giving up
+
+    Returns
+    -------
+    list
+        DESCRIPTION: per pipeline name, resource_name, state, duration and
+        error, in manifest order
+
+    """
+    names = [entry["name"] for entry in entries]
+    if len(set(names)) != len(names):
+        raise ValueError("pipeline names must be unique")
+
+    loop = asyncio.get_running_loop()
+    batch_id = label_value(f"launch-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+    semaphore = asyncio.Semaphore(max_concurrency)
+    records = {entry["name"]: {"name": entry["name"], "resource_name": None, "state": "PENDING",
+                               "duration": None, "error": None} for entry in entries}
+    by_resource = {}
+    submitted_at = {}
+
+    async def submit(entry: dict):
+        labels = {"launch_batch": batch_id, "launch_entry": label_value(entry["name"])}
+        async with semaphore:
+            try:
+                resource_name = await loop.run_in_executor(None, service.submit, entry, labels)
+            except Exception as error:
+                records[entry["name"]].update(state="SUBMIT_FAILED", error=repr(error))
+                return
+        submitted_at[entry["name"]] = time.monotonic()
+        records[entry["name"]].update(resource_name=resource_name, state="SUBMITTED")
+        by_resource[resource_name] = records[entry["name"]]
+
+    submissions = asyncio.ensure_future(asyncio.gather(*(submit(entry) for entry in entries)))
+    interval = poll_interval
+    list_failures = 0
+    list_error = None
+    while True:
+        if submissions.done():
+            await asyncio.sleep(interval)
+        else:
+            await asyncio.wait([submissions], timeout=interval)
+        changed = False
+        jobs = []
+        if by_resource:
+            try:
+                jobs = await loop.run_in_executor(None, service.list_jobs, batch_id)
+                list_failures = 0
+            except Exception as error:
+                list_failures += 1
+                list_error = error
+                if list_failures >= max_list_failures:
+                    break
+        for job in jobs:
+            record = by_resource.get(job["resource_name"])
+            if record is None or record["state"] in TERMINAL_STATES or record["state"] == job["state"]:
+                continue
+            changed = True
+            record["state"] = job["state"]
+            if job["state"] in TERMINAL_STATES:
+                record["duration"] = job.get("duration") or time.monotonic() - submitted_at[record["name"]]
+        open_jobs = [record for record in records.values()
+                     if record["state"] not in TERMINAL_STATES + ("SUBMIT_FAILED", )]
+        if submissions.done() and not open_jobs:
+            break
+        interval = poll_interval if changed else min(interval * 2, max_poll_interval)
+    await submissions
+    if list_failures >= max_list_failures:
+        for record in records.values():
+            if record["state"] not in TERMINAL_STATES + ("SUBMIT_FAILED", ):
+                record.update(state="UNKNOWN", error=f"list_jobs failed: {list_error!r}")
+    return [records[name] for name in names]
+
+
+def format_table(records: list):
+    """
+    Render the launch results as a plain text table
+
+    Parameters
+    ----------
+    records : list
+        DESCRIPTION: result of launch
+
+    Returns
+    -------
+    str
+        DESCRIPTION: table with name, state, duration and job or error
+
+    """
+    rows = [("PIPELINE", "STATE", "DURATION", "JOB")]
+    for record in records:
+        duration = f"{record['duration']:.0f}s" if record["duration"] is not None else "-"
+        rows.append((record["name"], record["state"], duration,
+                     record["error"] or record["resource_name"] or "-"))
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    return "\n".join(f"{row[0]:<{widths[0]}}  {row[1]:<{widths[1]}}  {row[2]:>{widths[2]}}  {row[3]}"
+                     for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("manifest", help="json manifest of the pipelines to launch")
+    parser.add_argument("--fake", action="store_true",
+                        help="use the in-memory FakePipelineService instead of Vertex AI")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="submissions in flight, overrides the manifest")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--max-poll-interval", type=float, default=MAX_POLL_INTERVAL)
+    args = parser.parse_args(argv)
+
+    with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+    if args.fake:
+        service = FakePipelineService()
+    else:
+        service = VertexPipelineService(manifest["project"], manifest["location"],
+                                        manifest.get("credential_path", ""))
+    max_concurrency = args.max_concurrency or manifest.get("max_concurrency", MAX_CONCURRENCY)
+    records = asyncio.run(
+        launch(manifest["pipelines"], service, max_concurrency,
+               args.poll_interval, args.max_poll_interval))
+    print(format_table(records))
+    return 0 if all(record["state"] == "SUCCEEDED" for record in records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
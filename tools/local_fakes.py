@@ -0,0 +1,550 @@
+"""
+Local stand-ins for the GCP services the pipeline components reach
+
+install() runs once in every worker of local_runner.py (--fakes) before a
+component is executed and replaces, for that process:
+
+- gcsfs.GCSFileSystem (also registered with fsspec for gs://) by a local
+  file system rooted at the artifact mount, so gs://bucket/key is
+  <root>/gcs/bucket/key
+- artifact.path of kfp artifacts, which maps gs:// uris to the same mount
+  instead of the /gcs fuse mount
+- google.oauth2.service_account credentials: any key file found on the mount
+  is accepted
+- google.cloud.bigquery and bigquery_storage: every query returns the rows of
+  one local csv or parquet file (query_result). SQL is not evaluated, so
+  push-down splits (split_spec) and watermark queries need a real BigQuery
+- google.cloud.logging_v2: entries are appended to <root>/logs/cloud_logging.jsonl
+- google.cloud.aiplatform: Model.upload/list/deploy and Endpoint.create,
+  list_models and undeploy keep models and endpoints in memory, nothing is
+  served
+
+Usage
+-----
+    python tools/local_runner.py full_custom_training/pipeline.json --fakes \
+        --query-result rides.parquet
+"""
+import importlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import types
+from datetime import datetime, timedelta, timezone
+
+LOCAL_PROJECT = "local-project"
+FAKE_DATASET = "_local_fakes"
+PAGE_ROWS = 10000
+SESSION_LIFETIME = timedelta(hours=6)
+
+state = {"root": "", "mount_root": "", "query_result": ""}
+tables = {}
+models = []
+endpoints = {}
+table_ids = itertools.count()
+deployed_model_ids = itertools.count(1)
+log_lock = threading.Lock()
+
+
+def mount_path(uri: str, mount_root: str):
+    """
+    Local path of a gs:// uri, or of a bucket/key path as gcsfs takes them
+
+    """
+    for prefix in ("gs://", "gcs://"):
+        if uri.startswith(prefix):
+            uri = uri[len(prefix):]
+            break
+    else:
+        if uri.startswith("/"):
+            return uri
+    return os.path.join(mount_root, uri)
+
+
+def mount_artifacts(mount_root: str):
+    """
+    Map the local path of gs:// kfp artifacts under mount_root. kfp has no
+    setting for its /gcs mount, so the public path property of Artifact is
+    replaced; other uris keep kfp's own mapping
+
+    """
+    from kfp.v2.dsl import Artifact
+    # kept across calls, a second install maps from kfp's property again
+    kfp_path = state.setdefault("kfp_path", Artifact.path)
+    prefix = mount_root.rstrip("/") + "/"
+
+    def get_path(artifact):
+        if artifact.uri.startswith("gs://"):
+            return prefix + artifact.uri[len("gs://"):]
+        return kfp_path.fget(artifact)
+
+    def set_path(artifact, path):
+        if path.startswith(prefix):
+            artifact.uri = "gs://" + path[len(prefix):]
+        else:
+            kfp_path.fset(artifact, path)
+
+    Artifact.path = property(get_path, set_path)
+
+
+def gcs_file_system_class():
+    from fsspec.implementations.local import LocalFileSystem
+
+    class GCSFileSystem(LocalFileSystem):
+        """
+        gcsfs.GCSFileSystem on local disk: paths are gs://bucket/key or
+        bucket/key and live under the mount, listings return bucket/key
+        like gcsfs does
+
+        """
+        protocol = ("gs", "gcs")
+
+        def __init__(self, *args, **kwargs):
+            # object stores have no directories to create first
+            super().__init__(auto_mkdir=True)
+
+        @classmethod
+        def _strip_protocol(cls, path):
+            path = mount_path(str(path), state["mount_root"])
+            return path.rstrip("/") or "/"
+
+        def unstrip_protocol(self, name):
+            return "gs://" + self.bucket_path(name)
+
+        @staticmethod
+        def bucket_path(path: str):
+            return os.path.relpath(path, state["mount_root"])
+
+        def glob(self, path, **kwargs):
+            found = super().glob(path, **kwargs)
+            if isinstance(found, dict):
+                return {self.bucket_path(name): info for name, info in found.items()}
+            return [self.bucket_path(name) for name in found]
+
+    return GCSFileSystem
+
+
+class Credentials:
+    """
+    Service account credentials that authorise nothing, accepted by the fakes
+
+    """
+
+    def __init__(self, info: dict = None, scopes=None):
+        info = info or {}
+        self.project_id = info.get("project_id", LOCAL_PROJECT)
+        self.service_account_email = info.get("client_email", "local@local-project.iam.gserviceaccount.com")
+        self.scopes = scopes
+        self.token = "local-token"
+        self.valid = True
+        self.expired = False
+
+    @classmethod
+    def from_service_account_info(cls, info: dict, **kwargs):
+        return cls(info, kwargs.get("scopes"))
+
+    @classmethod
+    def from_service_account_file(cls, filename: str, **kwargs):
+        with open(filename) as key_file:
+            return cls(json.load(key_file), kwargs.get("scopes"))
+
+    def with_scopes(self, scopes):
+        return Credentials({"project_id": self.project_id}, scopes)
+
+    def refresh(self, request):
+        pass
+
+    def apply(self, headers, token=None):
+        headers["authorization"] = f"Bearer {token or self.token}"
+
+    def before_request(self, request, method, url, headers):
+        self.apply(headers)
+
+
+class TableReference:
+    def __init__(self, project: str, dataset_id: str, table_id: str):
+        self.project = project
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+
+    @property
+    def path(self):
+        return f"projects/{self.project}/datasets/{self.dataset_id}/tables/{self.table_id}"
+
+
+class SchemaField:
+    TYPES = {"i": "INTEGER", "u": "INTEGER", "f": "FLOAT", "b": "BOOLEAN", "M": "TIMESTAMP"}
+
+    def __init__(self, name: str, dtype):
+        self.name = name
+        self.field_type = self.TYPES.get(getattr(dtype, "kind", ""), "STRING")
+
+
+class Table:
+    def __init__(self, reference: TableReference, frame, modified: datetime):
+        self.reference = reference
+        self.project, self.dataset_id, self.table_id = reference.project, reference.dataset_id, reference.table_id
+        self.frame = frame
+        self.modified = modified
+        self.num_rows = len(frame)
+        self.schema = [SchemaField(name, dtype) for name, dtype in frame.dtypes.items()]
+
+
+class RowIterator:
+    def __init__(self, table: Table):
+        self.table = table
+        self.schema = table.schema
+        self.total_rows = table.num_rows
+
+    def to_dataframe(self, **kwargs):
+        return self.table.frame.copy()
+
+    def to_arrow(self, **kwargs):
+        import pyarrow as pa
+        return pa.Table.from_pandas(self.table.frame, preserve_index=False)
+
+    def __iter__(self):
+        return iter(self.table.frame.to_dict("records"))
+
+
+class ArrayQueryParameter:
+    def __init__(self, name: str, array_type: str, values: list):
+        self.name = name
+        self.array_type = array_type
+        self.values = list(values)
+
+
+class QueryJobConfig:
+    def __init__(self, dry_run: bool = False, use_query_cache: bool = True, query_parameters: list = None,
+                 **kwargs):
+        self.dry_run = dry_run
+        self.use_query_cache = use_query_cache
+        self.query_parameters = query_parameters or []
+
+
+class QueryJob:
+    def __init__(self, query: str, table: Table, dry_run: bool):
+        self.query = query
+        self.destination = None if dry_run else table.reference
+        self.referenced_tables = []
+        self.total_bytes_processed = 0 if dry_run else int(table.frame.memory_usage(deep=True).sum())
+        self.table = table
+
+    def result(self, **kwargs):
+        return RowIterator(self.table)
+
+
+class BigQueryClient:
+    """
+    bigquery.Client answering every query with the rows of query_result
+
+    """
+
+    def __init__(self, project: str = None, credentials=None, **kwargs):
+        self.project = project or getattr(credentials, "project_id", None) or LOCAL_PROJECT
+
+    def query(self, query: str, job_config=None, **kwargs):
+        import pandas as pd
+        if not state["query_result"]:
+            raise RuntimeError("the local BigQuery stand-in has no rows, pass --query-result")
+        path = state["query_result"]
+        frame = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+        reference = TableReference(self.project, FAKE_DATASET, f"anon{next(table_ids)}")
+        modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        table = tables[reference.path] = Table(reference, frame, modified)
+        return QueryJob(query, table, getattr(job_config, "dry_run", False))
+
+    def get_table(self, reference):
+        if isinstance(reference, str):
+            reference = TableReference(*reference.split("."))
+        return tables[reference.path]
+
+
+class ReadSession:
+    class TableReadOptions:
+        def __init__(self, row_restriction: str = "", selected_fields: list = None):
+            self.row_restriction = row_restriction
+            self.selected_fields = selected_fields or []
+
+    def __init__(self, table: str = "", data_format=None, read_options=None, **kwargs):
+        self.table = table
+        self.data_format = data_format
+        self.read_options = read_options or ReadSession.TableReadOptions()
+        self.name = ""
+        self.streams = []
+        self.arrow_schema = None
+        self.expire_time = None
+
+    @classmethod
+    def serialize(cls, session):
+        return pickle.dumps(session)
+
+    @classmethod
+    def deserialize(cls, payload: bytes):
+        return pickle.loads(payload)
+
+
+class Page:
+    def __init__(self, batch):
+        self.batch = batch
+
+    def to_arrow(self):
+        return self.batch
+
+
+class ReadRowsStream:
+    def __init__(self, batches: list):
+        self.batches = batches
+
+    def rows(self, session=None):
+        return types.SimpleNamespace(pages=[Page(batch) for batch in self.batches])
+
+
+class BigQueryReadClient:
+    """
+    Storage Read API over the tables of earlier fake queries, streams split
+    the rows into contiguous ranges
+
+    """
+
+    def __init__(self, credentials=None, **kwargs):
+        self.streams = {}
+
+    def create_read_session(self, parent: str = "", read_session: ReadSession = None, max_stream_count: int = 1,
+                            **kwargs):
+        import pyarrow as pa
+        options = read_session.read_options
+        if options.row_restriction:
+            raise NotImplementedError("the local BigQuery stand-in does not evaluate row restrictions")
+        frame = tables[read_session.table].frame
+        if options.selected_fields:
+            frame = frame[list(options.selected_fields)]
+        data = pa.Table.from_pandas(frame, preserve_index=False)
+        count = max(min(max_stream_count or 1, data.num_rows), 1)
+        read_session.name = f"{read_session.table}/sessions/local{next(table_ids)}"
+        read_session.expire_time = datetime.now(timezone.utc) + SESSION_LIFETIME
+        read_session.arrow_schema = types.SimpleNamespace(
+            serialized_schema=data.schema.serialize().to_pybytes())
+        bounds = [data.num_rows * index // count for index in range(count + 1)]
+        for index in range(count):
+            name = f"{read_session.name}/streams/{index}"
+            part = data.slice(bounds[index], bounds[index + 1] - bounds[index])
+            self.streams[name] = part.to_batches(max_chunksize=PAGE_ROWS)
+            read_session.streams.append(types.SimpleNamespace(name=name))
+        return read_session
+
+    def read_rows(self, name: str, offset: int = 0, **kwargs):
+        import pyarrow as pa
+        batches = self.streams[name]
+        if offset and batches:
+            batches = pa.Table.from_batches(batches).slice(offset).to_batches(max_chunksize=PAGE_ROWS)
+        return ReadRowsStream(batches)
+
+
+def write_log_entries(entries: list):
+    path = os.path.join(state["root"], "logs", "cloud_logging.jsonl")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with log_lock, open(path, "a") as log_file:
+        for entry in entries:
+            log_file.write(json.dumps(entry, default=str) + "\n")
+
+
+class LogBatch:
+    def __init__(self, log_name: str):
+        self.log_name = log_name
+        self.entries = []
+
+    def log_struct(self, info: dict, severity: str = "DEFAULT", **kwargs):
+        self.entries.append({"log": self.log_name, "severity": severity, "jsonPayload": info})
+
+    def log_text(self, text: str, severity: str = "DEFAULT", **kwargs):
+        self.entries.append({"log": self.log_name, "severity": severity, "textPayload": text})
+
+    def commit(self, **kwargs):
+        write_log_entries(self.entries)
+        self.entries = []
+
+
+class Logger:
+    def __init__(self, name: str):
+        self.name = name
+
+    def batch(self, **kwargs):
+        return LogBatch(self.name)
+
+    def log_struct(self, info: dict, **kwargs):
+        batch = self.batch()
+        batch.log_struct(info, **kwargs)
+        batch.commit()
+
+    def log_text(self, text: str, **kwargs):
+        batch = self.batch()
+        batch.log_text(text, **kwargs)
+        batch.commit()
+
+
+class LogFileHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        try:
+            write_log_entries([{"log": "python", "severity": record.levelname,
+                                "textPayload": self.format(record)}])
+        except Exception:
+            self.handleError(record)
+
+
+class LoggingClient:
+    def __init__(self, credentials=None, **kwargs):
+        self.project = getattr(credentials, "project_id", LOCAL_PROJECT)
+
+    def logger(self, name: str):
+        return Logger(name)
+
+    def get_default_handler(self, **kwargs):
+        return LogFileHandler()
+
+
+class Endpoint:
+    """
+    aiplatform.Endpoint, Endpoint(name) looks up an endpoint created earlier.
+    models holds the DeployedModel records, id, model and dedicated_resources
+
+    """
+
+    def __init__(self, endpoint_name: str, **kwargs):
+        self.__dict__ = endpoints[endpoint_name].__dict__
+
+    @classmethod
+    def create(cls, display_name: str, **kwargs):
+        endpoint = cls.__new__(cls)
+        endpoint.display_name = display_name
+        endpoint.resource_name = f"projects/{LOCAL_PROJECT}/locations/local/endpoints/{len(endpoints) + 1}"
+        endpoint.models = []
+        endpoints[endpoint.resource_name] = endpoint
+        return endpoint
+
+    def list_models(self):
+        return list(self.models)
+
+    def undeploy(self, deployed_model_id: str, **kwargs):
+        for deployed in [deployed for deployed in self.models if deployed.id == deployed_model_id]:
+            self.models.remove(deployed)
+            model = next(model for model in models if model.resource_name == deployed.model)
+            model.gca_resource.deployed_models = [
+                reference for reference in model.gca_resource.deployed_models
+                if (reference.endpoint, reference.deployed_model_id) != (self.resource_name, deployed_model_id)]
+
+
+class Model:
+    """
+    aiplatform.Model, list filters on display_name="<value>" and
+    labels.<key>="<value>" only and returns the newest model first
+
+    """
+
+    def __init__(self, display_name: str, artifact_uri: str, labels: dict):
+        self.display_name = display_name
+        self.artifact_uri = artifact_uri
+        self.labels = labels
+        self.resource_name = f"projects/{LOCAL_PROJECT}/locations/local/models/{len(models) + 1}"
+        self.gca_resource = types.SimpleNamespace(deployed_models=[])
+
+    @classmethod
+    def upload(cls, display_name: str, artifact_uri: str = "", labels: dict = None, **kwargs):
+        model = cls(display_name, artifact_uri, dict(labels or {}))
+        models.append(model)
+        return model
+
+    @classmethod
+    def list(cls, filter: str = "", **kwargs):
+        import re
+        wanted = dict(re.findall(r'labels\.(\w+)="([^"]*)"', filter))
+        display_name = re.search(r'(?<!\.)\bdisplay_name="([^"]*)"', filter)
+        return [model for model in reversed(models)
+                if all(model.labels.get(key) == value for key, value in wanted.items())
+                and (display_name is None or model.display_name == display_name.group(1))]
+
+    def deploy(self, endpoint: Endpoint = None, machine_type: str = "n1-standard-2", min_replica_count: int = 1,
+               max_replica_count: int = 1, **kwargs):
+        endpoint = endpoint or Endpoint.create(display_name=self.display_name)
+        deployed_model_id = str(next(deployed_model_ids))
+        endpoint.models.append(types.SimpleNamespace(
+            id=deployed_model_id, model=self.resource_name,
+            dedicated_resources=types.SimpleNamespace(
+                machine_spec=types.SimpleNamespace(machine_type=machine_type),
+                min_replica_count=min_replica_count, max_replica_count=max_replica_count)))
+        self.gca_resource.deployed_models.append(
+            types.SimpleNamespace(endpoint=endpoint.resource_name, deployed_model_id=deployed_model_id))
+        return endpoint
+
+
+def module(name: str, **attributes):
+    stand_in = types.ModuleType(name)
+    stand_in.__dict__.update(attributes)
+    return stand_in
+
+
+def install_module(name: str, stand_in: types.ModuleType):
+    """
+    Register a module under name, also as attribute of its parent package so
+    that `from package import name` finds it
+
+    """
+    parent_name, _, child = name.rpartition(".")
+    if parent_name:
+        try:
+            parent = importlib.import_module(parent_name)
+        except ImportError:
+            parent = module(parent_name, __path__=[])
+            install_module(parent_name, parent)
+        setattr(parent, child, stand_in)
+    sys.modules[name] = stand_in
+
+
+def install(root: str, query_result: str = ""):
+    """
+    Install every stand-in in this process
+
+    Parameters
+    ----------
+    root : str
+        DESCRIPTION: local runner root, artifacts live under root/gcs and
+        Cloud Logging entries under root/logs
+    query_result : str, optional
+        DESCRIPTION: csv or parquet file whose rows every BigQuery query
+        returns
+
+    Returns
+    -------
+    None
+
+    """
+    import fsspec
+    state["root"] = os.path.abspath(root)
+    state["mount_root"] = os.path.join(state["root"], "gcs")
+    state["query_result"] = os.path.abspath(query_result) if query_result else ""
+    mount_artifacts(state["mount_root"])
+
+    file_system = gcs_file_system_class()
+    for protocol in file_system.protocol:
+        fsspec.register_implementation(protocol, file_system, clobber=True)
+    install_module("gcsfs", module("gcsfs", GCSFileSystem=file_system))
+    install_module("google.oauth2.service_account",
+                   module("google.oauth2.service_account", Credentials=Credentials))
+    install_module("google.cloud.bigquery",
+                   module("google.cloud.bigquery", Client=BigQueryClient, QueryJobConfig=QueryJobConfig,
+                          ArrayQueryParameter=ArrayQueryParameter,
+                          TableReference=TableReference, SchemaField=SchemaField))
+    install_module("google.cloud.bigquery_storage",
+                   module("google.cloud.bigquery_storage", BigQueryReadClient=BigQueryReadClient,
+                          types=types.SimpleNamespace(
+                              ReadSession=ReadSession,
+                              DataFormat=types.SimpleNamespace(ARROW="ARROW", AVRO="AVRO"))))
+    logging_client = module("google.cloud.logging_v2.client", Client=LoggingClient)
+    install_module("google.cloud.logging_v2",
+                   module("google.cloud.logging_v2", Client=LoggingClient, client=logging_client))
+    install_module("google.cloud.logging_v2.client", logging_client)
+    install_module("google.cloud.aiplatform",
+                   module("google.cloud.aiplatform", init=lambda **kwargs: None, Model=Model, Endpoint=Endpoint))
@@ -0,0 +1,578 @@
+"""
+Run a compiled KFP v2 pipeline on the local machine
+
+The runner reads the pipeline template written by the project launchers
+(e.g. `python3 run_pipeline.py --compile-only`), walks its DAG and executes
+every python function component with kfp's own executor in a pool of worker
+processes, so independent steps run in parallel. The function source comes
+from the template itself, i.e. exactly what Vertex AI would run, without
+building or pulling a container. dsl.Condition branches are evaluated from
+their trigger policy and dsl.ParallelFor loops run one sub-DAG per item.
+
+Steps are cached by content: a step whose component source, input artifact
+contents and parameters match an earlier run reuses that run's outputs (see
+step_cache.py). Tasks compiled with caching disabled
+(task.set_caching_options(False)) and steps named with --no-cache-step
+always run; --no-cache turns the cache off.
+
+Artifacts keep the gs:// uris they would get on Vertex AI, their local paths
+(artifact.path) are mapped under <root>/gcs instead of the /gcs fuse mount.
+--fakes installs the bundled stand-ins of local_fakes.py in every worker:
+gcsfs on that same directory, credentials accepting any key file found
+there, BigQuery answering queries with the rows of --query-result and Cloud
+Logging writing to <root>/logs. Without them, anything a component reaches
+through client libraries goes wherever the environment points it; pass
+emulator settings with --env, e.g. STORAGE_EMULATOR_HOST, or install other
+stand-ins in each worker with --worker-init module:function.
+
+Usage
+-----
+    python tools/local_runner.py full_custom_training/pipeline.json --run-id nightly
+    python tools/local_runner.py full_custom_training/pipeline.json --fakes --query-result rides.parquet
+    python tools/local_runner.py bqml/bq_kfp_regression/artifacts/pipeline.json --workers 2 \
+        --env STORAGE_EMULATOR_HOST=http://localhost:4443
+"""
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import local_fakes
+from step_cache import StepCache
+
+DEFAULT_ROOT = ".local_runs"
+LOCAL_PIPELINE_ROOT = "gs://local-pipeline-root"
+TYPED_VALUES = {"STRING": "stringValue", "INT": "intValue", "DOUBLE": "doubleValue"}
+CONDITION_OPERAND = re.compile(r"inputs\.parameters\['([^']+)'\]\.(string_value|int_value|double_value)")
+OPERAND_TYPES = {"string_value": str, "int_value": int, "double_value": float}
+# dsl.PIPELINE_JOB_ID_PLACEHOLDER and dsl.PIPELINE_JOB_NAME_PLACEHOLDER, set to the run id
+JOB_PLACEHOLDERS = re.compile(r"\{\{\$\.pipeline_job_(uuid|name)\}\}")
+
+
+def load_spec(template_path: str):
+    """
+    Read a compiled pipeline template
+
+    Parameters
+    ----------
+    template_path : str
+        DESCRIPTION: pipeline json written by the kfp v2 compiler
+
+    Returns
+    -------
+    tuple
+        DESCRIPTION: pipeline spec and runtime config
+
+    """
+    with open(template_path) as template:
+        document = json.load(template)
+    if "pipelineSpec" in document:
+        return document["pipelineSpec"], document.get("runtimeConfig", {})
+    return document, {}
+
+
+def cast_value(value, parameter_type: str):
+    """
+    Convert a parameter value to the python type of its IR type
+
+    Parameters
+    ----------
+    value : OBJ
+        DESCRIPTION: raw value, e.g. the text of an output parameter file
+    parameter_type : str
+        DESCRIPTION: STRING, INT or DOUBLE
+
+    Returns
+    -------
+    OBJ
+        DESCRIPTION: str, int or float, lists and dicts are kept for STRING
+        and serialised only when handed to an executor
+
+    """
+    if parameter_type == "INT":
+        return int(value)
+    if parameter_type == "DOUBLE":
+        return float(value)
+    return value
+
+
+def typed_value(value, parameter_type: str):
+    if parameter_type == "STRING" and not isinstance(value, str):
+        value = json.dumps(value)
+    return {TYPED_VALUES[parameter_type]: cast_value(value, parameter_type)}
+
+
+def executor_function(executor: dict):
+    """
+    Function name and source of a python function component
+
+    Parameters
+    ----------
+    executor : dict
+        DESCRIPTION: deploymentSpec executor of the component
+
+    Raises
+    ------
+    ValueError
+        DESCRIPTION: Raise error for containers that are not python function
+        components, e.g. prebuilt google-cloud-pipeline-components
+
+    Returns
+    -------
+    tuple
+        DESCRIPTION: function name and module source
+
+    """
+    container = executor.get("container", {})
+    args = container.get("args", [])
+    if "--function_to_execute" not in args:
+        raise ValueError(f"{container.get('image', executor)} is not a python function component")
+    function_name = args[args.index("--function_to_execute") + 1]
+    source = next(part for part in container["command"] if f"def {function_name}(" in part)
+    return function_name, source
+
+
+def select(value, selector: str):
+    """
+    Apply a parameterExpressionSelector such as parseJson(string_value)["name"],
+    used for the fields of dsl.ParallelFor items
+
+    """
+    if isinstance(value, str):
+        value = json.loads(value)
+    for key in re.findall(r'\["([^"]*)"\]', selector):
+        value = value[key]
+    return value
+
+
+def evaluate_condition(condition: str, parameters: dict):
+    """
+    Evaluate a dsl.Condition trigger policy against the resolved inputs of
+    its task
+
+    Parameters
+    ----------
+    condition : str
+        DESCRIPTION: e.g. inputs.parameters['pipelineparam--x'].string_value == 'True'
+    parameters : dict
+        DESCRIPTION: resolved input parameters of the condition task
+
+    Returns
+    -------
+    bool
+        DESCRIPTION: True if the branch runs
+
+    """
+    expression = CONDITION_OPERAND.sub(
+        lambda match: repr(OPERAND_TYPES[match.group(2)](parameters[match.group(1)])), condition)
+    expression = expression.replace("&&", " and ").replace("||", " or ")
+    return bool(eval(expression, {"__builtins__": {}}, {}))
+
+
+def init_worker(root: str, env: dict, worker_init: str, fakes: bool, query_result: str):
+    """
+    Prepare a worker process: environment, local artifact mount, the bundled
+    stand-ins and the optional stand-in hook
+
+    """
+    os.environ.update(env)
+    if fakes:
+        local_fakes.install(root, query_result)
+    else:
+        local_fakes.mount_artifacts(os.path.join(root, "gcs"))
+    if worker_init:
+        sys.path.insert(0, os.getcwd())
+        module_name, _, function_name = worker_init.partition(":")
+        getattr(importlib.import_module(module_name), function_name)()
+
+
+def run_step(source: str, function_name: str, executor_input: dict, component: dict):
+    """
+    Execute one component in a worker process with kfp's executor
+
+    Parameters
+    ----------
+    source : str
+        DESCRIPTION: component module source from the template
+    function_name : str
+        DESCRIPTION: function to execute
+    executor_input : dict
+        DESCRIPTION: inputs and output locations, as Vertex AI passes them
+    component : dict
+        DESCRIPTION: component spec, for the output parameter types
+
+    Returns
+    -------
+    dict
+        DESCRIPTION: output parameters and artifacts of the step
+
+    """
+    from kfp.v2.components import executor
+    namespace = {"__name__": "ephemeral_component"}
+    exec(compile(source, f"<component {function_name}>", "exec"), namespace)
+    executor.Executor(executor_input=executor_input,
+                      function_to_execute=namespace[function_name]).execute()
+
+    outputs = executor_input["outputs"]
+    executor_output = {}
+    if os.path.exists(outputs["outputFile"]):
+        with open(outputs["outputFile"]) as output_file:
+            executor_output = json.load(output_file)
+    parameters = {}
+    for name, spec in component.get("outputDefinitions", {}).get("parameters", {}).items():
+        value = executor_output.get("parameters", {}).get(name)
+        if value is not None:
+            parameters[name] = next(iter(value.values()))
+            continue
+        with open(outputs["parameters"][name]["outputFile"]) as parameter_file:
+            parameters[name] = cast_value(parameter_file.read(), spec["type"])
+    artifacts = {}
+    for name, entry in outputs.get("artifacts", {}).items():
+        artifact = dict(entry["artifacts"][0])
+        produced = executor_output.get("artifacts", {}).get(name, {}).get("artifacts")
+        if produced:
+            # components may repoint the uri, e.g. select_model to the winning candidate
+            artifact["uri"] = produced[0].get("uri") or artifact["uri"]
+            artifact["metadata"] = produced[0].get("metadata", {})
+        artifacts[name] = artifact
+    return {"parameters": parameters, "artifacts": artifacts}
+
+
+def in_thread(function, *args):
+    """
+    Run function in its own thread and return a future, used for sub-DAGs
+    so that nested waits never exhaust a bounded pool
+
+    """
+    future = concurrent.futures.Future()
+
+    def target():
+        try:
+            future.set_result(function(*args))
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+class LocalRunner:
+    """
+    Execute a compiled pipeline template on the local machine
+
+    Parameters
+    ----------
+    template_path : str
+        DESCRIPTION: pipeline json written by the kfp v2 compiler
+    root : str
+        DESCRIPTION: local directory for artifacts (root/gcs) and executor
+        files (root/runs)
+    workers : int, optional
+        DESCRIPTION: worker processes, os.cpu_count() when None
+    env : dict, optional
+        DESCRIPTION: environment variables for the workers
+    worker_init : str
+        DESCRIPTION: module:function called once in every worker, e.g. to
+        install other stand-ins
+    cache : bool
+        DESCRIPTION: reuse the outputs of unchanged steps
+    no_cache_steps : tuple
+        DESCRIPTION: function or task names that always run
+    fakes : bool
+        DESCRIPTION: install the stand-ins of local_fakes.py in the workers
+    query_result : str
+        DESCRIPTION: csv or parquet file every faked BigQuery query returns
+
+    """
+
+    def __init__(self, template_path: str, root: str = DEFAULT_ROOT, workers: int = None,
+                 env: dict = None, worker_init: str = "", cache: bool = True,
+                 no_cache_steps: tuple = (), fakes: bool = False, query_result: str = ""):
+        self.spec, runtime_config = load_spec(template_path)
+        self.runtime_config = runtime_config
+        pipeline_root = runtime_config.get("gcsOutputDirectory", "")
+        self.pipeline_root = (pipeline_root if pipeline_root.startswith("gs://")
+                              else LOCAL_PIPELINE_ROOT).rstrip("/")
+        self.root = os.path.abspath(root)
+        self.workers = workers
+        self.env = env or {}
+        self.worker_init = worker_init
+        self.use_cache = cache
+        self.no_cache_steps = set(no_cache_steps)
+        self.fakes = fakes
+        self.query_result = os.path.abspath(query_result) if query_result else ""
+        self.records = []
+        self.lock = threading.Lock()
+
+    def record(self, path: list, state: str, duration: float = None, error: str = None):
+        with self.lock:
+            self.records.append({"task": "/".join(path), "state": state,
+                                 "duration": duration, "error": error})
+
+    def pipeline_parameters(self, overrides: dict):
+        definitions = self.spec["root"].get("inputDefinitions", {}).get("parameters", {})
+        parameters = {name: next(iter(value.values()))
+                      for name, value in self.runtime_config.get("parameters", {}).items()}
+        for name, value in overrides.items():
+            if name not in definitions:
+                raise ValueError(f"unknown pipeline parameter {name}")
+            parameters[name] = cast_value(value, definitions[name]["type"])
+        return parameters
+
+    def run(self, parameters: dict = None, run_id: str = ""):
+        """
+        Run the pipeline
+
+        Parameters
+        ----------
+        parameters : dict, optional
+            DESCRIPTION: pipeline parameter overrides
+        run_id : str
+            DESCRIPTION: run directory name, local-<timestamp> when empty
+
+        Returns
+        -------
+        list
+            DESCRIPTION: per task path, state (SUCCEEDED, CACHED, FAILED,
+            SKIPPED, NOT_RUN), duration and error
+
+        """
+        self.run_id = run_id or f"local-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        self.run_dir = os.path.join(self.root, "runs", self.run_id)
+        self.mount_root = os.path.join(self.root, "gcs")
+        self.records = []
+        self.error = None
+        inputs = {"parameters": self.pipeline_parameters(parameters or {}), "artifacts": {}}
+        self.cache = StepCache(self.root, self.mount_root) if self.use_cache else None
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker,
+                initargs=(self.root, self.env, self.worker_init, self.fakes,
+                          self.query_result)) as self.processes:
+            try:
+                self.run_dag(self.spec["root"]["dag"], inputs, [])
+            except Exception as error:
+                self.error = error
+        if self.cache is not None:
+            self.cache.close()
+        return self.records
+
+    def resolve_inputs(self, task: dict, inputs: dict, results: dict):
+        parameters = {}
+        for name, source in task.get("inputs", {}).get("parameters", {}).items():
+            if "runtimeValue" in source:
+                value = next(iter(source["runtimeValue"]["constantValue"].values()))
+            elif "componentInputParameter" in source:
+                value = inputs["parameters"][source["componentInputParameter"]]
+            elif "taskOutputParameter" in source:
+                output = source["taskOutputParameter"]
+                value = results[output["producerTask"]]["parameters"][output["outputParameterKey"]]
+            else:
+                raise ValueError(f"unsupported source for parameter {name}: {source}")
+            if source.get("parameterExpressionSelector"):
+                value = select(value, source["parameterExpressionSelector"])
+            if isinstance(value, str):
+                value = JOB_PLACEHOLDERS.sub(self.run_id, value)
+            parameters[name] = value
+        artifacts = {}
+        for name, source in task.get("inputs", {}).get("artifacts", {}).items():
+            if "componentInputArtifact" in source:
+                artifacts[name] = inputs["artifacts"][source["componentInputArtifact"]]
+            elif "taskOutputArtifact" in source:
+                output = source["taskOutputArtifact"]
+                artifacts[name] = results[output["producerTask"]]["artifacts"][output["outputArtifactKey"]]
+            else:
+                raise ValueError(f"unsupported source for artifact {name}: {source}")
+        return {"parameters": parameters, "artifacts": artifacts}
+
+    def executor_input(self, component: dict, task_inputs: dict, path: list):
+        task_dir = os.path.join(self.run_dir, *path)
+        os.makedirs(os.path.join(task_dir, "outputs"), exist_ok=True)
+        definitions = component.get("inputDefinitions", {})
+        parameters = {name: typed_value(task_inputs["parameters"][name], spec["type"])
+                      for name, spec in definitions.get("parameters", {}).items()
+                      if name in task_inputs["parameters"]}
+        artifacts = {name: {"artifacts": [task_inputs["artifacts"][name]]}
+                     for name in definitions.get("artifacts", {})}
+        outputs = component.get("outputDefinitions", {})
+        output_artifacts = {}
+        for name, spec in outputs.get("artifacts", {}).items():
+            uri = "/".join([self.pipeline_root, self.run_id] + path + [name])
+            os.makedirs(os.path.dirname(os.path.join(self.mount_root, uri[len("gs://"):])), exist_ok=True)
+            output_artifacts[name] = {"artifacts": [{"name": name, "type": spec["artifactType"],
+                                                     "uri": uri, "metadata": {}}]}
+        return {
+            "inputs": {"parameters": parameters, "artifacts": artifacts},
+            "outputs": {
+                "parameters": {name: {"outputFile": os.path.join(task_dir, "outputs", name)}
+                               for name in outputs.get("parameters", {})},
+                "artifacts": output_artifacts,
+                "outputFile": os.path.join(task_dir, "executor_output.json"),
+            },
+        }
+
+    def start_task(self, task: dict, task_inputs: dict, path: list):
+        component = self.spec["components"][task["componentRef"]["name"]]
+        if "dag" in component:
+            return in_thread(self.run_subdag, task, component, task_inputs, path)
+        executor = self.spec["deploymentSpec"]["executors"][component["executorLabel"]]
+        function_name, source = executor_function(executor)
+        key = None
+        if (self.cache is not None and task.get("cachingOptions", {}).get("enableCache", True)
+                and not self.no_cache_steps & {function_name, path[-1]}):
+            key = self.cache.key(executor, task_inputs["parameters"], task_inputs["artifacts"])
+            outputs = self.cache.lookup(key)
+            if outputs is not None:
+                self.record(path, "CACHED", 0.0)
+                future = concurrent.futures.Future()
+                future.set_result(outputs)
+                return future
+        started = time.monotonic()
+        future = self.processes.submit(run_step, source, function_name,
+                                       self.executor_input(component, task_inputs, path), component)
+
+        def done(future):
+            error = None if future.cancelled() else future.exception()
+            if error is None and key is not None:
+                self.cache.store(key, function_name, future.result(), self.run_id)
+            self.record(path, "FAILED" if error else "SUCCEEDED", time.monotonic() - started,
+                        repr(error) if error else None)
+
+        future.add_done_callback(done)
+        return future
+
+    def run_subdag(self, task: dict, component: dict, task_inputs: dict, path: list):
+        iterator = task.get("parameterIterator")
+        if iterator is None:
+            self.run_dag(component["dag"], task_inputs, path)
+            return {"parameters": {}, "artifacts": {}}
+        items = iterator["items"]
+        values = items["raw"] if "raw" in items else task_inputs["parameters"][items["inputParameter"]]
+        values = json.loads(values) if isinstance(values, str) else values
+        iterations = [
+            in_thread(self.run_dag, component["dag"],
+                      {"parameters": dict(task_inputs["parameters"], **{iterator["itemInput"]: item}),
+                       "artifacts": task_inputs["artifacts"]},
+                      path[:-1] + [f"{path[-1]}-{index}"])
+            for index, item in enumerate(values)
+        ]
+        for iteration in iterations:
+            iteration.result()
+        return {"parameters": {}, "artifacts": {}}
+
+    def run_dag(self, dag: dict, inputs: dict, scope: list):
+        """
+        Run the tasks of one DAG, each as soon as its dependencies finished.
+        Tasks whose condition is false, or that depend on a skipped task,
+        are skipped; after a failure nothing new is started and the first
+        error is raised once the running tasks finished
+
+        """
+        pending = dict(dag["tasks"])
+        running = {}
+        results = {}
+        failure = None
+        while pending or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for name, task in list(pending.items()):
+                    dependencies = task.get("dependentTasks", [])
+                    if any(dependency not in results for dependency in dependencies):
+                        continue
+                    del pending[name]
+                    progressed = True
+                    path = scope + [name]
+                    if failure is not None:
+                        results[name] = None
+                        self.record(path, "NOT_RUN")
+                        continue
+                    if any(results[dependency] is None for dependency in dependencies):
+                        results[name] = None
+                        self.record(path, "SKIPPED")
+                        continue
+                    task_inputs = self.resolve_inputs(task, inputs, results)
+                    condition = task.get("triggerPolicy", {}).get("condition")
+                    if condition and not evaluate_condition(condition, task_inputs["parameters"]):
+                        results[name] = None
+                        self.record(path, "SKIPPED")
+                        continue
+                    running[self.start_task(task, task_inputs, path)] = name
+            if not running:
+                if pending:
+                    raise ValueError(f"unresolvable dependencies: {sorted(pending)}")
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as error:
+                    results[name] = None
+                    failure = failure or error
+        if failure is not None:
+            raise failure
+        return results
+
+
+def format_table(records: list):
+    rows = [("TASK", "STATE", "DURATION", "ERROR")]
+    for record in records:
+        duration = f"{record['duration']:.1f}s" if record["duration"] is not None else "-"
+        rows.append((record["task"], record["state"], duration, record["error"] or ""))
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    return "\n".join(f"{row[0]:<{widths[0]}}  {row[1]:<{widths[1]}}  {row[2]:>{widths[2]}}  {row[3]}".rstrip()
+                     for row in rows)
+
+
+def key_values(pairs: list):
+    values = {}
+    for pair in pairs:
+        key, separator, value = pair.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {pair}")
+        values[key] = value
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("template", help="compiled pipeline json")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="local directory for artifacts and run files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument("--run-id", default="", help="run directory name")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="pipeline parameter override, repeatable")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment variable for the workers, repeatable")
+    parser.add_argument("--worker-init", default="", metavar="MODULE:FUNCTION",
+                        help="called once in every worker, e.g. to install local stand-ins")
+    parser.add_argument("--fakes", action="store_true",
+                        help="install the local GCS, credential, BigQuery and Cloud Logging stand-ins")
+    parser.add_argument("--query-result", default="", metavar="FILE",
+                        help="csv or parquet file every faked BigQuery query returns")
+    parser.add_argument("--no-cache", action="store_true", help="run every step")
+    parser.add_argument("--no-cache-step", action="append", default=[], metavar="NAME",
+                        help="function or task name that always runs, repeatable")
+    args = parser.parse_args(argv)
+
+    runner = LocalRunner(args.template, args.root, args.workers, key_values(args.env), args.worker_init,
+                         not args.no_cache, args.no_cache_step, args.fakes, args.query_result)
+    started = time.monotonic()
+    records = runner.run(key_values(args.param), args.run_id)
+    print(format_table(records))
+    print(f"\nrun {runner.run_id} finished in {time.monotonic() - started:.1f}s, "
+          f"artifacts under {runner.mount_root}")
+    if runner.error is not None:
+        print(f"failed: {runner.error!r}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
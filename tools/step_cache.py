@@ -0,0 +1,186 @@
+"""
+Content-addressed cache of pipeline step outputs
+
+A step is identified by the sha256 of its executor (container image, command
+and arguments, i.e. the component source and its packages), the content of
+its input artifacts and its input parameters. A local sqlite index maps that
+key to the output parameters and artifact uris of the run that produced it,
+so an unchanged step reuses the earlier outputs instead of running again.
+"""
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+INDEX_NAME = "step_cache.sqlite"
+HASH_CHUNK = 1 << 20
+
+
+def file_digest(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_files(artifact: dict, mount_root: str):
+    """
+    Local files holding the content of an artifact. Components write next to
+    the artifact path rather than at it, e.g. {path}.parquet, {path}.joblib
+    or part files under {path}/, so the file named by the file_extension
+    metadata, the path itself and every {path}.* sibling are collected, with
+    directories expanded to the files below them
+
+    Parameters
+    ----------
+    artifact : dict
+        DESCRIPTION: runtime artifact with uri and metadata
+    mount_root : str
+        DESCRIPTION: local directory the gs:// uris are mapped to
+
+    Returns
+    -------
+    list
+        DESCRIPTION: sorted file paths, empty for artifacts without local
+        content, e.g. a model uri pointing at a Vertex AI resource
+
+    """
+    uri = artifact.get("uri", "")
+    if not uri.startswith("gs://"):
+        return []
+    path = os.path.join(mount_root, uri[len("gs://"):])
+    candidates = {path} | set(glob.glob(glob.escape(path) + ".*"))
+    extension = artifact.get("metadata", {}).get("file_extension")
+    if extension:
+        candidates.add(path + extension)
+    files = set()
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            files.add(candidate)
+        elif os.path.isdir(candidate):
+            for directory, _, names in os.walk(candidate):
+                files.update(os.path.join(directory, name) for name in names)
+    return sorted(files)
+
+
+def artifact_digest(artifact: dict, mount_root: str):
+    """
+    Content hash of an artifact: the bytes and relative names of its local
+    files (see artifact_files) and its metadata, in which the artifact's own
+    uri and path are masked so that equal content written by another run
+    hashes the same. Artifacts without local content hash their uri
+
+    Parameters
+    ----------
+    artifact : dict
+        DESCRIPTION: runtime artifact with uri and metadata
+    mount_root : str
+        DESCRIPTION: local directory the gs:// uris are mapped to
+
+    Returns
+    -------
+    str
+        DESCRIPTION: sha256 hex digest
+
+    """
+    uri = artifact.get("uri", "")
+    files = artifact_files(artifact, mount_root)
+    digest = hashlib.sha256()
+    if files:
+        path = os.path.join(mount_root, uri[len("gs://"):])
+        for file_path in files:
+            digest.update(os.path.relpath(file_path, os.path.dirname(path)).encode() + b"\0")
+            digest.update(file_digest(file_path).encode())
+        metadata = json.dumps(artifact.get("metadata", {}), sort_keys=True, default=str)
+        digest.update(metadata.replace(path, "<path>").replace(uri, "<uri>").encode())
+    else:
+        digest.update(uri.encode())
+        digest.update(json.dumps(artifact.get("metadata", {}), sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class StepCache:
+    """
+    sqlite index from step keys to step outputs
+
+    Parameters
+    ----------
+    root : str
+        DESCRIPTION: directory of the index, the local runner root
+    mount_root : str
+        DESCRIPTION: local directory the gs:// artifact uris are mapped to
+
+    """
+
+    def __init__(self, root: str, mount_root: str):
+        os.makedirs(root, exist_ok=True)
+        self.mount_root = mount_root
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(root, INDEX_NAME), check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS steps (key TEXT PRIMARY KEY, step TEXT, outputs TEXT, "
+                "run_id TEXT, created REAL)")
+
+    def key(self, executor: dict, parameters: dict, artifacts: dict):
+        """
+        Cache key of a step
+
+        Parameters
+        ----------
+        executor : dict
+            DESCRIPTION: deploymentSpec executor of the component
+        parameters : dict
+            DESCRIPTION: resolved input parameters
+        artifacts : dict
+            DESCRIPTION: resolved input artifacts
+
+        Returns
+        -------
+        str
+            DESCRIPTION: sha256 hex digest
+
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps(executor, sort_keys=True).encode())
+        digest.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        for name in sorted(artifacts):
+            digest.update(name.encode() + b"\0")
+            digest.update(artifact_digest(artifacts[name], self.mount_root).encode())
+        return digest.hexdigest()
+
+    def lookup(self, key: str):
+        """
+        Outputs stored for key, None on a miss or when a file the cached run
+        wrote for its output artifacts no longer exists locally
+
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT outputs FROM steps WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return None
+        outputs = json.loads(row[0])
+        files = outputs.pop("files", None)
+        if files is None or not all(os.path.isfile(path) for path in files):
+            return None
+        return outputs
+
+    def store(self, key: str, step: str, outputs: dict, run_id: str):
+        """
+        Record the outputs of a step together with the local files of its
+        output artifacts, which lookup checks before a hit is served
+
+        """
+        files = [path for artifact in outputs["artifacts"].values()
+                 for path in artifact_files(artifact, self.mount_root)]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO steps (key, step, outputs, run_id, created) VALUES (?, ?, ?, ?, ?)",
+                (key, step, json.dumps(dict(outputs, files=files), default=str), run_id, time.time()))
+
+    def close(self):
+        self.connection.close()